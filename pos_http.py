@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP client for ERPNext, ERPDash and other outbound calls.
+
+Connections are pooled per base URL (scheme://host:port) and kept alive between calls,
+so repeated requests skip the TCP and TLS handshakes. Each pool has a bounded number of
+connections, and one timeout/retry policy applies to every caller. Every request is
+recorded in METRICS (count, latency histogram, bytes, status per host), which
+/api/db/status reports.
+
+  request()                  stdlib client returning HttpResponse (used by pos_service)
+  get() / post() / send()    requests-style calls through a pooled requests.Session
+                             (used by pos_server; needs the requests package)
+
+Env vars:
+  POS_HTTP_TIMEOUT     default timeout in seconds (default: 30)
+  POS_HTTP_RETRIES     reconnect attempts after a dropped connection (default: 1)
+  POS_HTTP_POOL_SIZE   max concurrent connections per base URL (default: 8)
+"""
+import os
+import json
+import ssl
+import threading
+import time
+import http.client
+import http.cookiejar
+import urllib.parse
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    HTTP_TIMEOUT = float(os.environ.get("POS_HTTP_TIMEOUT", "30"))
+except ValueError:
+    HTTP_TIMEOUT = 30.0
+try:
+    HTTP_RETRIES = int(os.environ.get("POS_HTTP_RETRIES", "1"))
+except ValueError:
+    HTTP_RETRIES = 1
+HTTP_RETRIES = max(0, HTTP_RETRIES)
+try:
+    HTTP_POOL_SIZE = int(os.environ.get("POS_HTTP_POOL_SIZE", "8"))
+except ValueError:
+    HTTP_POOL_SIZE = 8
+HTTP_POOL_SIZE = max(1, HTTP_POOL_SIZE)
+
+# Methods that may be re-sent after the server dropped the connection mid-request
+_IDEMPOTENT = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+_LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+# ---------- METRICS ----------
+class HttpMetrics:
+    """Thread-safe per-host request counters and latency histogram."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, host: str, status: Optional[int], elapsed: float, sent: int = 0, received: int = 0) -> None:
+        ms = elapsed * 1000.0
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None:
+                entry = self._hosts[host] = {
+                    "count": 0, "errors": 0, "bytes_sent": 0, "bytes_received": 0,
+                    "total_ms": 0.0, "max_ms": 0.0, "status": {},
+                    "latency_ms": [0] * (len(_LATENCY_BUCKETS_MS) + 1),
+                }
+            entry["count"] += 1
+            entry["bytes_sent"] += sent
+            entry["bytes_received"] += received
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            key = str(status) if status is not None else "error"
+            entry["status"][key] = entry["status"].get(key, 0) + 1
+            if status is None or status >= 500:
+                entry["errors"] += 1
+            for idx, bound in enumerate(_LATENCY_BUCKETS_MS):
+                if ms <= bound:
+                    entry["latency_ms"][idx] += 1
+                    break
+            else:
+                entry["latency_ms"][-1] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"<={b}" for b in _LATENCY_BUCKETS_MS] + [f">{_LATENCY_BUCKETS_MS[-1]}"]
+        out: Dict[str, Any] = {}
+        with self._lock:
+            for host, entry in self._hosts.items():
+                out[host] = {
+                    "count": entry["count"],
+                    "errors": entry["errors"],
+                    "bytes_sent": entry["bytes_sent"],
+                    "bytes_received": entry["bytes_received"],
+                    "avg_ms": round(entry["total_ms"] / entry["count"], 1) if entry["count"] else None,
+                    "max_ms": round(entry["max_ms"], 1),
+                    "status": dict(entry["status"]),
+                    "latency_ms": dict(zip(labels, entry["latency_ms"])),
+                }
+        return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hosts.clear()
+
+
+METRICS = HttpMetrics()
+
+
+def _split_base(url: str) -> Tuple[str, str]:
+    """Split an absolute URL into (scheme://host[:port], path?query)."""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        raise ValueError(f"Not an absolute http(s) URL: {url!r}")
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    return f"{parts.scheme}://{parts.netloc}", path
+
+
+# ---------- STDLIB CONNECTION POOL ----------
+class HttpResponse:
+    """Fully-read response from ConnectionPool.request."""
+
+    def __init__(self, url: str, status: int, reason: str, headers: Any, body: bytes):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    def json(self) -> Any:
+        return json.loads(self.body.decode("utf-8")) if self.body else {}
+
+
+class ConnectionPool:
+    """Bounded pool of keep-alive http.client connections to one base URL."""
+
+    def __init__(self, base_url: str, maxsize: int = HTTP_POOL_SIZE, verify: bool = True):
+        parts = urllib.parse.urlsplit(base_url)
+        self.base_url = base_url
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.verify = verify
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxsize)
+
+    def _connect(self, timeout: float) -> http.client.HTTPConnection:
+        if self.https:
+            ctx = ssl.create_default_context()
+            if not self.verify:
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl.CERT_NONE
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout, context=ctx)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _checkout(self, timeout: float, fresh: bool) -> http.client.HTTPConnection:
+        conn = None
+        if not fresh:
+            with self._lock:
+                if self._idle:
+                    conn = self._idle.pop()
+        if conn is None:
+            return self._connect(timeout)
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn
+
+    def _checkin(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.append(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+                retries: Optional[int] = None) -> HttpResponse:
+        """Send one request and read the whole response.
+
+        A connection the server dropped while idle is replaced and the request re-sent,
+        up to `retries` times. Non-idempotent methods (POST, PATCH) are only re-sent on a
+        reused connection, and only when sending failed or the server closed the socket
+        without answering (RemoteDisconnected); once the request may have been processed
+        (reset or error while reading the response) they are not re-sent. Timeouts are
+        never retried.
+        """
+        method = method.upper()
+        timeout = HTTP_TIMEOUT if timeout is None else timeout
+        retries = HTTP_RETRIES if retries is None else retries
+        hdrs = {"Connection": "keep-alive"}
+        hdrs.update(headers or {})
+        sent = len(body) if body else 0
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=timeout):
+            METRICS.record(self.base_url, None, time.monotonic() - started, sent)
+            raise TimeoutError(f"No free connection to {self.base_url} within {timeout}s")
+        try:
+            attempt = 0
+            while True:
+                conn = self._checkout(timeout, fresh=attempt > 0)
+                reused = conn.sock is not None
+                sending = True
+                try:
+                    conn.request(method, path, body=body, headers=hdrs)
+                    sending = False
+                    resp = conn.getresponse()
+                    data = resp.read()
+                except TimeoutError:
+                    conn.close()
+                    METRICS.record(self.base_url, None, time.monotonic() - started, sent)
+                    raise
+                except (http.client.HTTPException, OSError) as exc:
+                    conn.close()
+                    # A stale keep-alive socket fails on send or closes before any status line
+                    stale = reused and (sending or isinstance(exc, http.client.RemoteDisconnected))
+                    if attempt >= retries or (method not in _IDEMPOTENT and not stale):
+                        METRICS.record(self.base_url, None, time.monotonic() - started, sent)
+                        raise
+                    attempt += 1
+                    continue
+                if resp.will_close:
+                    conn.close()
+                else:
+                    self._checkin(conn)
+                METRICS.record(self.base_url, resp.status, time.monotonic() - started, sent, len(data))
+                return HttpResponse(self.base_url + path, resp.status, resp.reason, resp.headers, data)
+        finally:
+            self._slots.release()
+
+
+_POOLS: Dict[Tuple[str, bool], ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def pool_for(base_url: str, verify: bool = True) -> ConnectionPool:
+    """Return the shared pool for base_url (scheme://host[:port])."""
+    key = (base_url.rstrip("/").lower(), verify)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = ConnectionPool(key[0], verify=verify)
+        return pool
+
+
+def request(method: str, url: str, params: Optional[Dict[str, Any]] = None, json_body: Any = None,
+            data: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None,
+            timeout: Optional[float] = None, retries: Optional[int] = None,
+            verify: bool = True) -> HttpResponse:
+    """Send method to an absolute url over the shared pool for its host.
+
+    Does not raise on HTTP error statuses; check response.status / response.ok.
+    """
+    base, path = _split_base(url)
+    if params:
+        path += ("&" if "?" in path else "?") + urllib.parse.urlencode(params, doseq=True)
+    hdrs = dict(headers or {})
+    if json_body is not None:
+        data = json.dumps(json_body).encode("utf-8")
+        hdrs.setdefault("Content-Type", "application/json")
+    return pool_for(base, verify).request(method, path, body=data, headers=hdrs, timeout=timeout, retries=retries)
+
+
+# ---------- REQUESTS SESSIONS ----------
+_SESSIONS: Dict[str, Any] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def session_for(url: str):
+    """Return the shared requests.Session for url's base, with a bounded keep-alive pool.
+
+    Connection failures (request never sent) are retried for every method; nothing else is.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    base = _split_base(url)[0].lower()
+    with _SESSIONS_LOCK:
+        sess = _SESSIONS.get(base)
+        if sess is None:
+            sess = requests.Session()
+            # Stateless like the per-call requests it replaces: no cookies carried between calls
+            sess.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=Retry(total=HTTP_RETRIES, connect=HTTP_RETRIES, read=0, status=0,
+                                  redirect=5, raise_on_status=False),
+            )
+            sess.mount("http://", adapter)
+            sess.mount("https://", adapter)
+            _SESSIONS[base] = sess
+        return sess
+
+
+def send(method: str, url: str, **kwargs):
+    """requests.request() through the pooled session for url, with the shared timeout and metrics."""
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    try:
+        base = _split_base(url)[0].lower()
+    except ValueError:
+        import requests
+        return requests.request(method, url, **kwargs)  # let requests raise its usual error
+    sess = session_for(url)
+    started = time.monotonic()
+    try:
+        resp = sess.request(method, url, **kwargs)
+    except Exception:
+        METRICS.record(base, None, time.monotonic() - started)
+        raise
+    body = resp.request.body
+    sent = len(body) if isinstance(body, (bytes, str)) else 0
+    received = len(resp.content) if not kwargs.get("stream") else int(resp.headers.get("Content-Length") or 0)
+    METRICS.record(base, resp.status_code, time.monotonic() - started, sent, received)
+    return resp
+
+
+def get(url: str, **kwargs):
+    return send("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs):
+    return send("POST", url, **kwargs)
@@ -1,6 +1,9 @@
 from flask import Flask, render_template, request, jsonify, send_file
 from dotenv import load_dotenv
+from werkzeug.security import safe_join
 import requests
+import pos_http
+import pos_tasks
 import os
 import copy
 import sqlite3
@@ -10,6 +13,8 @@ from datetime import datetime
 from uuid import uuid4
 import threading
 import re
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 import time
 import logging
 import hmac
@@ -146,6 +151,27 @@ try:
     THUMB_MAX_BYTES = int(os.getenv('POS_THUMB_MAX_BYTES', '5000000'))
 except ValueError:
     THUMB_MAX_BYTES = 5000000
+# Thumbnails are fetched/resized on a small worker pool; a request waits at most
+# THUMB_WAIT_SECONDS before getting a 202 placeholder instead of holding a waitress thread
+try:
+    THUMB_WORKERS = int(os.getenv('POS_THUMB_WORKERS', '2'))
+except ValueError:
+    THUMB_WORKERS = 2
+THUMB_WORKERS = max(1, THUMB_WORKERS)
+try:
+    THUMB_WAIT_SECONDS = float(os.getenv('POS_THUMB_WAIT', '0.3'))
+except ValueError:
+    THUMB_WAIT_SECONDS = 0.3
+try:
+    THUMB_CACHE_MAX_BYTES = int(os.getenv('POS_THUMB_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+except ValueError:
+    THUMB_CACHE_MAX_BYTES = 200 * 1024 * 1024
+THUMB_CACHE_MAX_BYTES = max(1024 * 1024, THUMB_CACHE_MAX_BYTES)
+# Square sizes pre-built when the item pull sees a new image (the tile grid uses 220)
+THUMB_PREWARM_SIZES = [
+    int(x) for x in (os.getenv('POS_THUMB_PREWARM_SIZES', '220') or '').split(',')
+    if x.strip().isdigit()
+]
 
 # Browse cache configuration (brands/groups/recent items)
 try:
@@ -163,7 +189,26 @@ try:
 except ValueError:
     BROWSE_ITEMS_LIMIT = 240
 BROWSE_ITEMS_LIMIT = max(20, BROWSE_ITEMS_LIMIT)
-_BROWSE_CACHE: Dict[str, Tuple[float, Any]] = {}
+try:
+    BROWSE_CACHE_MAX_BYTES = int(os.getenv('POS_BROWSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+except ValueError:
+    BROWSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+BROWSE_CACHE_MAX_BYTES = max(1024 * 1024, BROWSE_CACHE_MAX_BYTES)
+try:
+    BROWSE_CACHE_MAX_ENTRIES = int(os.getenv('POS_BROWSE_CACHE_MAX_ENTRIES', '1024'))
+except ValueError:
+    BROWSE_CACHE_MAX_ENTRIES = 1024
+BROWSE_CACHE_MAX_ENTRIES = max(16, BROWSE_CACHE_MAX_ENTRIES)
+# How many recently sold templates get their size grid pre-built (0 disables)
+try:
+    ITEM_MATRIX_PREWARM = int(os.getenv('POS_ITEM_MATRIX_PREWARM', '60'))
+except ValueError:
+    ITEM_MATRIX_PREWARM = 60
+ITEM_MATRIX_PREWARM = max(0, ITEM_MATRIX_PREWARM)
+# LRU order: key -> (expires_at, value, size_bytes, tags); _BROWSE_CACHE_TAGS maps tag -> keys
+_BROWSE_CACHE: "OrderedDict[str, Tuple[float, Any, int, Tuple[str, ...]]]" = OrderedDict()
+_BROWSE_CACHE_TAGS: Dict[str, Set[str]] = {}
+_BROWSE_CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'bytes': 0}
 _BROWSE_CACHE_LOCK = threading.Lock()
 _ITEM_COLUMNS_CACHE: Optional[Set[str]] = None
 
@@ -277,6 +322,11 @@ _QUEUE_STATUS_DIR = {
 _QUEUE_DB_LOCK = threading.Lock()
 _QUEUE_DB_INITIALIZED = False
 POS_QUEUE_BATCH_LIMIT = 25
+try:
+    POS_SALES_BATCH_MAX = int(os.getenv('POS_SALES_BATCH_MAX', '500'))
+except ValueError:
+    POS_SALES_BATCH_MAX = 500
+POS_SALES_BATCH_MAX = max(1, POS_SALES_BATCH_MAX)
 
 # Idle ERP sales reconciliation
 ERP_PULL_SALES_ENABLED = os.getenv('POS_PULL_ERP_SALES', '1') == '1'
@@ -358,9 +408,27 @@ def _queue_state_dir(status: str) -> Optional[Path]:
     return _POS_QUEUE_DIR_STATES.get(dir_key)
 
 
+_QUEUE_FILE_POOL: Optional[ThreadPoolExecutor] = None
+
+
 def _write_queue_file(invoice_name: str, payload: Any, status: str) -> None:
+    """Mirror a queue entry to POS_QUEUE_DIR/<state>/ on a background writer.
+
+    A single worker keeps writes for the same receipt in the order they were made.
+    """
+    global _QUEUE_FILE_POOL
     if not invoice_name or not POS_QUEUE_DIR:
         return
+    if isinstance(payload, dict):
+        payload = dict(payload)
+    with _QUEUE_DB_LOCK:
+        if _QUEUE_FILE_POOL is None:
+            _QUEUE_FILE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix='queue-file')
+        pool = _QUEUE_FILE_POOL
+    pool.submit(_write_queue_file_now, invoice_name, payload, status)
+
+
+def _write_queue_file_now(invoice_name: str, payload: Any, status: str) -> None:
     try:
         data = payload if isinstance(payload, dict) else _json.loads(payload)
     except Exception:
@@ -386,7 +454,7 @@ def _forward_voucher_issue_remote(payload: Dict[str, Any]) -> Optional[Dict[str,
     if POS_VOUCHER_FORWARD_KEY:
         headers['X-POS-KEY'] = POS_VOUCHER_FORWARD_KEY
     try:
-        resp = requests.post(
+        resp = pos_http.post(
             POS_VOUCHER_FORWARD_URL,
             json=payload,
             headers=headers,
@@ -468,22 +536,47 @@ def _validate_pos_sale_payload(payload: Dict[str, Any]) -> Optional[str]:
 
 
 def _enqueue_pos_sale(payload: Dict[str, Any]) -> int:
-    conn = _queue_db_connect()
-    if not conn:
-        raise RuntimeError('POS queue storage unavailable')
     receipt_id = _normalize_receipt_id(payload)
     if not receipt_id:
         raise ValueError('Missing receipt id')
-    payload = dict(payload)
-    payload['invoice_name'] = receipt_id
-    payload.setdefault('sale_id', receipt_id)
-    payload_json = _json.dumps(payload, ensure_ascii=False)
+    return _enqueue_pos_sales([payload])[0]
+
+
+def _enqueue_pos_sales(payloads: List[Dict[str, Any]]) -> List[int]:
+    """Upsert validated receipts into the queue in one transaction; returns queue ids in order.
+
+    Mirror files are only rewritten for receipts that are new, changed, or not already 'received'.
+    """
+    conn = _queue_db_connect()
+    if not conn:
+        raise RuntimeError('POS queue storage unavailable')
     now = _utcnow_z()
+    entries = []
+    for payload in payloads:
+        receipt_id = _normalize_receipt_id(payload)
+        if not receipt_id:
+            raise ValueError('Missing receipt id')
+        payload = dict(payload)
+        payload['invoice_name'] = receipt_id
+        payload.setdefault('sale_id', receipt_id)
+        entries.append((receipt_id, payload.get('sale_id') or receipt_id, _json.dumps(payload, ensure_ascii=False)))
+    names = list(dict.fromkeys(entry[0] for entry in entries))
     try:
-        with conn:
-            conn.execute("""
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            before: Dict[str, Tuple[str, str]] = {}
+            ids: Dict[str, int] = {}
+            for chunk_start in range(0, len(names), 500):
+                chunk = names[chunk_start:chunk_start + 500]
+                marks = ','.join('?' * len(chunk))
+                for row in conn.execute(
+                    f"SELECT invoice_name, status, payload_json FROM pos_sales_queue WHERE invoice_name IN ({marks})",
+                    chunk,
+                ):
+                    before[row['invoice_name']] = (row['status'], row['payload_json'])
+            conn.executemany("""
             INSERT INTO pos_sales_queue (invoice_name, sale_id, payload_json, status, error, erp_docname, attempts, created_utc, updated_utc)
-            VALUES (?,?,?,?,NULL,NULL,0,?,?)
+            VALUES (?,?,?,'received',NULL,NULL,0,?,?)
             ON CONFLICT(invoice_name) DO UPDATE SET
                 payload_json=excluded.payload_json,
                 sale_id=COALESCE(NULLIF(excluded.sale_id,''), pos_sales_queue.sale_id),
@@ -491,13 +584,26 @@ def _enqueue_pos_sale(payload: Dict[str, Any]) -> int:
                 updated_utc=excluded.updated_utc,
                 error=NULL,
                 attempts=0
-            """, (receipt_id, payload.get('sale_id') or receipt_id, payload_json, 'received', now, now))
-            row = conn.execute("SELECT id FROM pos_sales_queue WHERE invoice_name=?", (receipt_id,)).fetchone()
-            queue_id = int(row['id']) if row else 0
+            """, [(name, sale_id, payload_json, now, now) for name, sale_id, payload_json in entries])
+            for chunk_start in range(0, len(names), 500):
+                chunk = names[chunk_start:chunk_start + 500]
+                marks = ','.join('?' * len(chunk))
+                for row in conn.execute(
+                    f"SELECT id, invoice_name FROM pos_sales_queue WHERE invoice_name IN ({marks})",
+                    chunk,
+                ):
+                    ids[row['invoice_name']] = int(row['id'])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
     finally:
         conn.close()
-    _write_queue_file(receipt_id, payload_json, 'received')
-    return queue_id
+    latest = {name: payload_json for name, _, payload_json in entries}
+    for name, payload_json in latest.items():
+        if before.get(name) != ('received', payload_json):
+            _write_queue_file(name, payload_json, 'received')
+    return [ids.get(name, 0) for name, _, _ in entries]
 
 
 def _record_queue_entry(queue_conn: sqlite3.Connection, main_conn: Optional[sqlite3.Connection], row: sqlite3.Row) -> bool:
@@ -552,7 +658,7 @@ def _record_queue_entry(queue_conn: sqlite3.Connection, main_conn: Optional[sqli
             ps.record_sale_with_fx(main_conn, sale_payload, fx_metadata)
         else:
             ps.record_sale(main_conn, sale_payload)
-        _browse_cache_invalidate('browse:')
+        _browse_cache_apply_catalog_changes(sale=True)
         queue_conn.execute(
             "UPDATE pos_sales_queue SET sale_id=?, status='queued', updated_utc=?, error=NULL WHERE id=?",
             (sale_id, _utcnow_z(), row['id'])
@@ -666,6 +772,12 @@ try:
 except ValueError:
     IDLE_TASK_INTERVAL = 300
 IDLE_TASK_INTERVAL = max(30, IDLE_TASK_INTERVAL)
+# The POS receipt queue drains on its own short interval, independent of ERP work
+try:
+    QUEUE_DRAIN_INTERVAL = float(os.getenv('POS_QUEUE_DRAIN_INTERVAL', '5'))
+except ValueError:
+    QUEUE_DRAIN_INTERVAL = 5.0
+QUEUE_DRAIN_INTERVAL = max(1.0, QUEUE_DRAIN_INTERVAL)
 try:
     SESSION_PING_INTERVAL = int(os.getenv('POS_SESSION_PING_INTERVAL', '60'))
 except ValueError:
@@ -677,21 +789,24 @@ except ValueError:
     SESSION_TTL_SECONDS = 300
 SESSION_TTL_SECONDS = max(SESSION_TTL_SECONDS, SESSION_PING_INTERVAL * 2, 120)
 
+try:
+    VOUCHER_VERIFY_INTERVAL = int(os.getenv('POS_VOUCHER_VERIFY_INTERVAL', '21600'))
+except ValueError:
+    VOUCHER_VERIFY_INTERVAL = 21600
+VOUCHER_VERIFY_REPAIR = os.getenv('POS_VOUCHER_VERIFY_REPAIR', '1') == '1'
+
 # Track active till sessions to gate background maintenance
 _ACTIVE_CASHIER_SESSIONS: Dict[str, Dict[str, Any]] = {}
 _SESSION_LOCK = threading.Lock()
-_IDLE_TASK_THREAD: Optional[threading.Thread] = None
-_IDLE_TASK_LOCK = threading.Lock()
-
-# Backoff state for ERPNext outbox push (avoids hammering a struggling ERPNext)
-_OUTBOX_BACKOFF_UNTIL: float = 0.0
-_OUTBOX_FAIL_STREAK: int = 0
+_TASK_SCHEDULER: Optional[pos_tasks.TaskScheduler] = None
+_TASK_SCHEDULER_LOCK = threading.Lock()
 
 # Optional SQLite service helpers
 LAYAWAY_ERP_KEY = os.getenv('LAYAWAY_ERP_KEY', '') or os.getenv('POS_RECEIPT_KEY', '')
 
 try:
     import pos_service as ps
+    setattr(ps, 'CATALOG_WAREHOUSE', POS_WAREHOUSE)
     if ERPNEXT_URL:
         setattr(ps, 'ERP_BASE', ERPNEXT_URL)
     if ERPDASH_URL:
@@ -775,138 +890,183 @@ def _has_active_cashier_sessions() -> bool:
 
 
 def _ensure_idle_worker():
-    """Start the idle maintenance worker thread if enabled."""
-    global _IDLE_TASK_THREAD
+    """Build and start the background task scheduler if enabled."""
+    global _TASK_SCHEDULER
     if not IDLE_TASKS_ENABLED or not ps:
         return
-    if _IDLE_TASK_THREAD and _IDLE_TASK_THREAD.is_alive():
-        return
-    _IDLE_TASK_THREAD = threading.Thread(target=_idle_maintenance_loop, name='idle-maintenance', daemon=True)
-    _IDLE_TASK_THREAD.start()
-    app.logger.info("Idle maintenance thread started (interval=%ss)", IDLE_TASK_INTERVAL)
+    with _TASK_SCHEDULER_LOCK:
+        if _TASK_SCHEDULER is None:
+            _TASK_SCHEDULER = _build_task_scheduler()
+        if _TASK_SCHEDULER.start():
+            app.logger.info("Background task scheduler started (%d tasks, idle interval=%ss, queue drain=%ss)",
+                            len(_TASK_SCHEDULER.snapshot()['tasks']), IDLE_TASK_INTERVAL, QUEUE_DRAIN_INTERVAL)
 
 
-def _idle_maintenance_loop():
-    """Periodically run maintenance tasks. Queue drain runs always; heavy ERP sync only when tills are idle."""
-    while True:
-        try:
-            time.sleep(IDLE_TASK_INTERVAL)
-        except Exception:
-            continue
-        if not IDLE_TASKS_ENABLED:
-            continue
-        try:
-            _run_idle_maintenance_tasks()
-        except Exception as exc:
-            app.logger.exception("Idle maintenance cycle failed: %s", exc)
+def _task_interval(name: str, default: float) -> float:
+    """Per-task interval override: POS_TASK_<NAME>_INTERVAL (seconds)."""
+    try:
+        return float(os.getenv(f'POS_TASK_{name.upper()}_INTERVAL', default))
+    except ValueError:
+        return float(default)
 
 
-def _run_idle_maintenance_tasks():
-    """Perform background work (ERP sync, queue drain, invoice ingest) when tills are idle."""
-    if not ps:
-        return
-    acquired = _IDLE_TASK_LOCK.acquire(blocking=False)
-    if not acquired:
-        return
-    conn = None
-    try:
-        conn = _db_connect() or ps.connect(POS_DB_PATH)
+def _with_task_conn(func):
+    """Wrap func(conn) so each run borrows the worker thread's pooled connection."""
+    def _run():
+        conn = _db_connect() or ps.pooled_connect(POS_DB_PATH)
         if not conn:
-            return
-        summary: List[str] = []
-        # When POS_QUEUE_ONLY=1, sale/voucher outbox entries are written but never consumed.
-        # Trim them so they don't accumulate indefinitely.
-        if POS_QUEUE_ONLY:
-            try:
-                cur = conn.execute(
-                    "DELETE FROM outbox WHERE kind IN ('sale', 'voucher_event')"
-                )
-                if cur.rowcount:
-                    conn.commit()
-                    summary.append(f"pruned {cur.rowcount} unused outbox entries")
-            except Exception as exc:
-                app.logger.warning("Idle outbox prune failed: %s", exc)
-        try:
-            pruned = _prune_old_layaways(conn)
-            if pruned:
-                summary.append(f"pruned {pruned} old layaway(s)")
-        except Exception as exc:
-            app.logger.warning("Idle layaway prune failed: %s", exc)
+            raise RuntimeError('Database not available')
         try:
-            ingested = _ingest_new_local_invoices(conn)
-            if ingested:
-                summary.append(f"ingested {ingested} invoice(s)")
-        except Exception as exc:
-            app.logger.warning("Idle invoice ingest failed: %s", exc)
-        # Heavy ERP sync tasks only run when no cashiers are active (avoid load during trading hours)
-        if not _has_active_cashier_sessions():
-            if not USE_MOCK and _has_erp_credentials():
-                try:
-                    ps.sync_cycle(conn, warehouse=POS_WAREHOUSE, price_list=POS_PRICE_LIST, loops=1)
-                    summary.append("synced ERP catalog")
-                except Exception as exc:
-                    app.logger.warning("Idle ERP sync failed: %s", exc)
-            if not USE_MOCK and _has_erp_credentials():
-                try:
-                    updated = _maybe_sync_cashiers(conn)
-                    if updated:
-                        summary.append(f"synced cashiers={updated}")
-                except Exception as exc:
-                    app.logger.warning("Idle cashier sync failed: %s", exc)
-        # Outbox push runs always but backs off when ERPNext is struggling
-        if not POS_QUEUE_ONLY and not USE_MOCK and _has_erp_credentials():
-            global _OUTBOX_BACKOFF_UNTIL, _OUTBOX_FAIL_STREAK
-            if time.time() >= _OUTBOX_BACKOFF_UNTIL:
-                try:
-                    ps.push_outbox(conn)
-                    summary.append("pushed outbox")
-                    _OUTBOX_FAIL_STREAK = 0
-                    _OUTBOX_BACKOFF_UNTIL = 0.0
-                except Exception as exc:
-                    _OUTBOX_FAIL_STREAK += 1
-                    backoff = min(_OUTBOX_FAIL_STREAK * IDLE_TASK_INTERVAL, 3600)
-                    _OUTBOX_BACKOFF_UNTIL = time.time() + backoff
-                    app.logger.warning("Idle outbox push failed (streak=%d, backoff=%ds): %s", _OUTBOX_FAIL_STREAK, backoff, exc)
-            else:
-                remaining = int(_OUTBOX_BACKOFF_UNTIL - time.time())
-                app.logger.debug("Outbox push skipped, backing off (%ds remaining)", remaining)
-        # Layaway outbox runs independently of mock mode and POS_QUEUE_ONLY — uses X-POS-KEY via ERPDASH_URL
-        if ERPDASH_URL or ERPNEXT_URL:
-            try:
-                app.logger.info("[layaway-sync] Idle loop triggering layaway outbox push (target=%s)", ERPDASH_URL or ERPNEXT_URL)
-                ps.push_layaway_outbox(conn)
-            except Exception as exc:
-                app.logger.warning("[layaway-sync] Idle layaway outbox push failed: %s", exc)
-        if not _has_active_cashier_sessions():
-            if not USE_MOCK and ERP_PULL_SALES_ENABLED and _has_erp_credentials():
-                try:
-                    pulled, matched, inserted = _reconcile_erp_sales_invoices(conn)
-                    if pulled or matched or inserted:
-                        summary.append(f"erp sales pulled={pulled} matched={matched} new={inserted}")
-                except Exception as exc:
-                    app.logger.warning("Idle ERP sales reconciliation failed: %s", exc)
-            if not USE_MOCK and ERP_PULL_VOUCHERS_ENABLED and _has_erp_credentials():
-                try:
-                    pulled, updated, inserted = _reconcile_erp_gift_vouchers(conn)
-                    if pulled or updated or inserted:
-                        summary.append(f"erp vouchers pulled={pulled} updated={updated} new={inserted}")
-                except Exception as exc:
-                    app.logger.warning("Idle ERP voucher reconciliation failed: %s", exc)
-        if summary:
-            app.logger.info("Idle maintenance completed (%s)", ", ".join(summary))
-        try:
-            queue_note = _process_pos_sales_queue(conn)
-            if queue_note:
-                app.logger.info("Idle %s", queue_note)
-        except Exception as exc:
-            app.logger.warning("Idle POS queue processing failed: %s", exc)
-    finally:
-        if conn:
+            return func(conn)
+        finally:
             try:
                 conn.close()
             except Exception:
                 pass
-        _IDLE_TASK_LOCK.release()
+    return _run
+
+
+def _erp_ready() -> bool:
+    return not USE_MOCK and _has_erp_credentials()
+
+
+def _erp_idle() -> bool:
+    """Heavy ERP work only runs when no cashiers are active (avoid load during trading hours)."""
+    return _erp_ready() and not _has_active_cashier_sessions()
+
+
+def _build_task_scheduler() -> pos_tasks.TaskScheduler:
+    """Register background work by lane.
+
+    queue:   POS receipt queue drain, every few seconds
+    local:   SQLite-only housekeeping (ingest, prune, archive, search flush, matrix prewarm, voucher check)
+    erp:     ERPNext push/pull calls that are quick per run (outbox, cashiers, customers, reconcile)
+    catalog: the item/stock/price sync_cycle, which can take minutes on a large catalog
+    """
+    sched = pos_tasks.TaskScheduler({'queue': 1, 'local': 1, 'erp': 1, 'catalog': 1}, logger=app.logger)
+
+    def add(name, func, lane, priority, budget, interval=IDLE_TASK_INTERVAL, **kwargs):
+        sched.add(pos_tasks.Task(name, _with_task_conn(func), _task_interval(name, interval),
+                                 lane=lane, priority=priority, budget=budget, **kwargs))
+
+    add('pos_queue', _process_pos_sales_queue, 'queue', 0, 30, interval=QUEUE_DRAIN_INTERVAL)
+
+    add('invoice_ingest', _task_invoice_ingest, 'local', 10, 60)
+    if POS_QUEUE_ONLY:
+        # Sale/voucher outbox entries are written but never consumed; trim them
+        add('outbox_prune', _task_outbox_prune, 'local', 30, 60)
+    add('layaway_prune', _task_layaway_prune, 'local', 40, 60)
+    add('invoice_archive', _task_invoice_archive, 'local', 40, 120)
+    add('item_search_flush', _task_item_search_flush, 'local', 45, 60)
+    add('item_matrix_prewarm', _task_item_matrix_prewarm, 'local', 50, 120)
+    if VOUCHER_VERIFY_INTERVAL > 0:
+        add('voucher_verify', _task_voucher_verify, 'local', 60, 300,
+            interval=VOUCHER_VERIFY_INTERVAL, gate=lambda: not _has_active_cashier_sessions())
+
+    if not POS_QUEUE_ONLY:
+        add('outbox_push', _task_outbox_push, 'erp', 10, 120, gate=_erp_ready)
+    # Layaway outbox runs independently of mock mode and POS_QUEUE_ONLY - uses X-POS-KEY via ERPDASH_URL
+    add('layaway_outbox', _task_layaway_outbox, 'erp', 20, 120, gate=lambda: bool(ERPDASH_URL or ERPNEXT_URL))
+    add('cashier_sync', _task_cashier_sync, 'erp', 30, 60, gate=_erp_idle)
+    # Paged and cheap, so new ERP customers show up during trading hours too
+    add('customer_sync', _task_customer_sync, 'erp', 40, 300, gate=_erp_ready)
+    if ERP_PULL_SALES_ENABLED:
+        add('erp_sales_reconcile', _task_erp_sales_reconcile, 'erp', 50, 300, gate=_erp_idle)
+    if ERP_PULL_VOUCHERS_ENABLED:
+        add('erp_voucher_reconcile', _task_erp_voucher_reconcile, 'erp', 50, 300, gate=_erp_idle)
+
+    add('catalog_sync', _task_catalog_sync, 'catalog', 20, 900, gate=_erp_idle)
+    return sched
+
+
+def _task_outbox_prune(conn: sqlite3.Connection) -> Optional[str]:
+    cur = conn.execute("DELETE FROM outbox WHERE kind IN ('sale', 'voucher_event')")
+    if cur.rowcount:
+        conn.commit()
+        return f"pruned {cur.rowcount} unused outbox entries"
+    return None
+
+
+def _task_layaway_prune(conn: sqlite3.Connection) -> Optional[str]:
+    pruned = _prune_old_layaways(conn)
+    return f"pruned {pruned} old layaway(s)" if pruned else None
+
+
+def _task_invoice_ingest(conn: sqlite3.Connection) -> Optional[str]:
+    ingested = _ingest_new_local_invoices(conn)
+    return f"ingested {ingested} invoice(s)" if ingested else None
+
+
+def _task_invoice_archive(conn: sqlite3.Connection) -> Optional[str]:
+    archived = ps.invoice_journal_archive(conn, 'invoices') if os.path.isdir('invoices') else 0
+    return f"archived {archived} invoice file(s)" if archived else None
+
+
+def _task_voucher_verify(conn: sqlite3.Connection) -> Optional[str]:
+    """Cross-check the maintained voucher balances against the ledger."""
+    report = _verify_voucher_balances(conn, repair=VOUCHER_VERIFY_REPAIR)
+    if report['drift']:
+        return f"voucher balance drift={len(report['drift'])} repaired={report['repaired']}"
+    return None
+
+
+def _task_item_matrix_prewarm(conn: sqlite3.Connection) -> Optional[str]:
+    """Rebuild size grids that sales, pulls or layaways invalidated since the last pass."""
+    warmed = _prewarm_item_matrices(conn)
+    return f"prebuilt {warmed} item matrices" if warmed else None
+
+
+def _task_item_search_flush(conn: sqlite3.Connection) -> Optional[str]:
+    """Re-index items queued by writers that do not flush the search index themselves."""
+    if not ps.item_search_mode(conn):
+        return None
+    flushed = ps.flush_item_search(conn)
+    if not flushed:
+        return None
+    conn.commit()
+    return f"re-indexed {flushed} item(s) for search"
+
+
+def _task_catalog_sync(conn: sqlite3.Connection) -> Optional[str]:
+    ps.sync_cycle(conn, warehouse=POS_WAREHOUSE, price_list=POS_PRICE_LIST, loops=1)
+    _browse_cache_apply_catalog_changes()
+    return "synced ERP catalog"
+
+
+def _task_cashier_sync(conn: sqlite3.Connection) -> Optional[str]:
+    updated = _maybe_sync_cashiers(conn)
+    return f"synced cashiers={updated}" if updated else None
+
+
+def _task_customer_sync(conn: sqlite3.Connection) -> Optional[str]:
+    pulled = ps.pull_customers_incremental(conn)
+    return f"synced customers={pulled}" if pulled else None
+
+
+def _task_outbox_push(conn: sqlite3.Connection) -> Optional[str]:
+    # Failures raise, so the scheduler backs off while ERPNext is struggling
+    ps.push_outbox(conn)
+    return None
+
+
+def _task_layaway_outbox(conn: sqlite3.Connection) -> Optional[str]:
+    app.logger.debug("[layaway-sync] pushing layaway outbox (target=%s)", ERPDASH_URL or ERPNEXT_URL)
+    ps.push_layaway_outbox(conn)
+    return None
+
+
+def _task_erp_sales_reconcile(conn: sqlite3.Connection) -> Optional[str]:
+    pulled, matched, inserted = _reconcile_erp_sales_invoices(conn)
+    if pulled or matched or inserted:
+        return f"erp sales pulled={pulled} matched={matched} new={inserted}"
+    return None
+
+
+def _task_erp_voucher_reconcile(conn: sqlite3.Connection) -> Optional[str]:
+    pulled, updated, inserted = _reconcile_erp_gift_vouchers(conn)
+    if pulled or updated or inserted:
+        return f"erp vouchers pulled={pulled} updated={updated} new={inserted}"
+    return None
 
 class CashierQueryFieldError(Exception):
     """Raised when ERPNext rejects list queries due to field permissions."""
@@ -920,7 +1080,7 @@ def _db_connect():
             return None
         if not USE_MOCK:
             _ensure_db_bootstrap()
-        return ps.connect(POS_DB_PATH)
+        return ps.pooled_connect(POS_DB_PATH)
     except Exception:
         return None
 
@@ -941,6 +1101,20 @@ def _has_item_group(conn: sqlite3.Connection) -> bool:
     return "item_group" in _item_columns(conn)
 
 
+def _browse_cache_drop(key: str) -> None:
+    """Remove one entry and its tag links. Caller holds _BROWSE_CACHE_LOCK."""
+    entry = _BROWSE_CACHE.pop(key, None)
+    if not entry:
+        return
+    _BROWSE_CACHE_STATS['bytes'] -= entry[2]
+    for tag in entry[3]:
+        keys = _BROWSE_CACHE_TAGS.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                _BROWSE_CACHE_TAGS.pop(tag, None)
+
+
 def _browse_cache_get(key: str) -> Optional[Any]:
     if not key:
         return None
@@ -948,31 +1122,129 @@ def _browse_cache_get(key: str) -> Optional[Any]:
     with _BROWSE_CACHE_LOCK:
         entry = _BROWSE_CACHE.get(key)
         if not entry:
+            _BROWSE_CACHE_STATS['misses'] += 1
             return None
-        expires_at, value = entry
-        if expires_at <= now:
-            _BROWSE_CACHE.pop(key, None)
+        if entry[0] <= now:
+            _browse_cache_drop(key)
+            _BROWSE_CACHE_STATS['misses'] += 1
             return None
-        return value
+        _BROWSE_CACHE.move_to_end(key)
+        _BROWSE_CACHE_STATS['hits'] += 1
+        return entry[1]
 
 
-def _browse_cache_set(key: str, value: Any, ttl_seconds: Optional[int] = None) -> None:
+def _browse_cache_set(key: str, value: Any, ttl_seconds: Optional[int] = None, tags: Optional[Any] = None) -> None:
+    """Store value under key. tags (e.g. 'item:<id>', 'catalog') let writers drop just the entries they affect."""
     if not key:
         return
     ttl = ttl_seconds if ttl_seconds is not None else BROWSE_CACHE_TTL
     ttl = max(5, ttl)
+    try:
+        size = len(_json.dumps(value, separators=(',', ':'), default=str))
+    except Exception:
+        size = 0
+    if size > BROWSE_CACHE_MAX_BYTES // 4:
+        return  # one oversized payload shouldn't flush the whole cache
+    tag_tuple = tuple(sorted({t for t in (tags or ()) if t}))
     with _BROWSE_CACHE_LOCK:
-        _BROWSE_CACHE[key] = (time.time() + ttl, value)
+        _browse_cache_drop(key)
+        _BROWSE_CACHE[key] = (time.time() + ttl, value, size, tag_tuple)
+        _BROWSE_CACHE_STATS['bytes'] += size
+        for tag in tag_tuple:
+            _BROWSE_CACHE_TAGS.setdefault(tag, set()).add(key)
+        while _BROWSE_CACHE and (
+            len(_BROWSE_CACHE) > BROWSE_CACHE_MAX_ENTRIES or _BROWSE_CACHE_STATS['bytes'] > BROWSE_CACHE_MAX_BYTES
+        ):
+            oldest = next(iter(_BROWSE_CACHE))
+            _browse_cache_drop(oldest)
+            _BROWSE_CACHE_STATS['evictions'] += 1
 
 
 def _browse_cache_invalidate(prefix: Optional[str] = None) -> None:
     with _BROWSE_CACHE_LOCK:
         if not prefix:
             _BROWSE_CACHE.clear()
+            _BROWSE_CACHE_TAGS.clear()
+            _BROWSE_CACHE_STATS['bytes'] = 0
+            _BROWSE_CACHE_STATS['invalidations'] += 1
             return
-        for key in list(_BROWSE_CACHE.keys()):
-            if key.startswith(prefix):
-                _BROWSE_CACHE.pop(key, None)
+        for key in [k for k in _BROWSE_CACHE if k.startswith(prefix)]:
+            _browse_cache_drop(key)
+            _BROWSE_CACHE_STATS['invalidations'] += 1
+
+
+def _browse_cache_invalidate_tags(tags: Any) -> int:
+    """Drop every entry carrying any of tags. Returns the number of entries removed."""
+    removed = 0
+    with _BROWSE_CACHE_LOCK:
+        keys: Set[str] = set()
+        for tag in tags:
+            keys.update(_BROWSE_CACHE_TAGS.get(tag, ()))
+        for key in keys:
+            _browse_cache_drop(key)
+            removed += 1
+        _BROWSE_CACHE_STATS['invalidations'] += removed
+    return removed
+
+
+def _browse_cache_stats() -> Dict[str, Any]:
+    with _BROWSE_CACHE_LOCK:
+        stats = dict(_BROWSE_CACHE_STATS)
+        stats['entries'] = len(_BROWSE_CACHE)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+    stats['max_bytes'] = BROWSE_CACHE_MAX_BYTES
+    stats['max_entries'] = BROWSE_CACHE_MAX_ENTRIES
+    return stats
+
+
+def _browse_item_tags(items: Any, *extra: str) -> List[str]:
+    """Dependency tags for a cached item list: each item/template id it shows, plus extra."""
+    tags = list(extra)
+    for it in items or ():
+        if not isinstance(it, dict):
+            continue
+        for field in ('name', 'item_code', 'template_id'):
+            value = it.get(field)
+            if value:
+                tags.append(f"item:{value}")
+    return tags
+
+
+def _browse_cache_apply_catalog_changes(sale: bool = False) -> None:
+    """Invalidate the browse entries affected by catalog writes made on this thread.
+
+    Stock/price-only changes drop just the entries showing those items; structural
+    changes (new, renamed or removed items, barcodes) also drop brand/group/list
+    entries, whose membership may have changed. Sales also reorder the recent list.
+    """
+    if not ps:
+        _browse_cache_invalidate('browse:')
+        return
+    try:
+        changes = ps.drain_catalog_changes() or {}
+    except Exception:
+        changes = {'all': True}
+    # The writers already marked these items dirty before committing; marking again now
+    # covers a scan that reloaded them in between and read the pre-commit rows. Stock-only
+    # changes (every sale) leave the map alone: it holds no stock.
+    if changes.get('rows_all'):
+        ps.BARCODE_MAP.invalidate_all()
+    elif changes.get('rows'):
+        ps.BARCODE_MAP.invalidate(changes['rows'])
+    if changes.get('all'):
+        _browse_cache_invalidate('browse:')
+        return
+    if changes.get('images'):
+        _thumb_prewarm_new_images(changes['images'])
+    tags = [f"item:{item_id}" for item_id in changes.get('items') or ()]
+    if sale:
+        tags.append('recent')
+    if changes.get('structural'):
+        tags.append('catalog')
+    if tags:
+        _browse_cache_invalidate_tags(tags)
+
 
 def _db_has_items(conn: sqlite3.Connection) -> bool:
     try:
@@ -989,10 +1261,7 @@ def _db_has_templates(conn: sqlite3.Connection) -> bool:
     except Exception:
         return False
 
-def _db_items_payload(conn: sqlite3.Connection):
-    """Return template items as tiles, with aggregated variant attribute values for search/display."""
-    # Use POS_WAREHOUSE config var in the SQL subquery for aggregated variant stock
-    q_tpl = f"""
+_CATALOG_TILE_SELECT = """
     SELECT i.item_id AS name,
            i.item_id AS item_code,
            i.name AS item_name,
@@ -1001,138 +1270,118 @@ def _db_items_payload(conn: sqlite3.Connection):
            i.custom_style_code AS custom_style_code,
            i.custom_simple_colour AS custom_simple_colour,
            i.vat_rate AS vat_rate,
-        (SELECT price_effective FROM v_item_prices p WHERE p.item_id = i.item_id) AS standard_rate,
-        -- Min/max of configured price list rates for child variants (if present in item_prices)
-        (SELECT MIN(ip.rate) FROM item_prices ip JOIN items v2 ON v2.item_id = ip.item_id WHERE v2.parent_id = i.item_id) AS min_variant_price,
-        (SELECT MAX(ip.rate) FROM item_prices ip JOIN items v2 ON v2.item_id = ip.item_id WHERE v2.parent_id = i.item_id) AS max_variant_price,
-        -- Aggregate sellable stock across variants for this template (using configured warehouse)
-        (SELECT COALESCE(SUM(s.qty),0) FROM stock s JOIN items v2 ON v2.item_id = s.item_id WHERE v2.parent_id = i.item_id AND s.warehouse='{POS_WAREHOUSE}') AS variant_stock,
-        'Each' AS stock_uom,
-        (SELECT image_url_effective FROM v_item_images img WHERE img.item_id=i.item_id) AS image
+           t.standard_rate AS standard_rate,
+           t.price_min AS min_variant_price,
+           t.price_max AS max_variant_price,
+           t.variant_stock AS variant_stock,
+           'Each' AS stock_uom,
+           t.image AS image,
+           t.attributes_json AS attributes_json,
+           t.style_codes AS style_codes,
+           t.simple_colours AS simple_colours,
+           t.barcodes_json AS barcodes_json
     FROM items i
+    JOIN catalog_tiles t ON t.template_id = i.item_id
     WHERE i.active=1 AND i.is_template=1
-    ORDER BY COALESCE(i.brand,''), i.name
-    """
-    # Preload aggregated attribute values per template from its variants
-    agg = {}
-    q_attr = """
-      SELECT t.item_id AS template_id, va.attr_name, va.value
-      FROM items v
-      JOIN items t ON t.item_id = v.parent_id
-      JOIN variant_attributes va ON va.item_id = v.item_id
-      WHERE v.active=1 AND v.is_template=0
-    """
-    for row in conn.execute(q_attr):
-        tpl = row["template_id"]
-        d = agg.setdefault(tpl, {})
-        vals = d.setdefault(row["attr_name"], set())
-        vals.add(row["value"])
-
-    # Aggregate custom fields (style code + simple colour) from variants
-    custom_agg: Dict[str, Dict[str, Set[str]]] = {}
-    q_custom = """
-      SELECT parent_id AS template_id, custom_style_code, custom_simple_colour
-      FROM items
-      WHERE parent_id IS NOT NULL
-        AND (custom_style_code IS NOT NULL OR custom_simple_colour IS NOT NULL)
-    """
-    for row in conn.execute(q_custom):
-        tpl = row["template_id"]
-        if not tpl:
-            continue
-        entry = custom_agg.setdefault(tpl, {"custom_style_code": set(), "custom_simple_colour": set()})
-        if row["custom_style_code"]:
-            entry["custom_style_code"].add(str(row["custom_style_code"]))
-        if row["custom_simple_colour"]:
-            entry["custom_simple_colour"].add(str(row["custom_simple_colour"]))
+"""
 
-    barcode_map: Dict[str, Set[str]] = {}
-    q_barcodes = """
-      SELECT v.parent_id AS template_id, b.barcode
-      FROM barcodes b
-      JOIN items v ON v.item_id = b.item_id
-      WHERE v.parent_id IS NOT NULL
-        AND b.barcode IS NOT NULL
-    """
-    for row in conn.execute(q_barcodes):
-        tpl = row["template_id"]
-        if not tpl:
-            continue
-        bc = (row["barcode"] or '').strip()
-        if not bc:
-            continue
-        barcode_map.setdefault(tpl, set()).add(bc)
 
-    out = []
-    for r in conn.execute(q_tpl):
-        attrs = {}
-        if r["name"] in agg:
-            for aname, values in agg[r["name"]].items():
-                disp = " ".join(sorted(values))
-                for key in _attribute_payload_keys(aname):
-                    attrs[key] = disp
-
-        # Determine displayed rate: prefer template's effective price; otherwise fallback to variant prices
-        template_rate = r["standard_rate"] if r["standard_rate"] is not None else None
-        min_var = r["min_variant_price"] if r["min_variant_price"] is not None else None
-        max_var = r["max_variant_price"] if r["max_variant_price"] is not None else None
-        display_rate = template_rate if template_rate is not None else (min_var if min_var is not None else None)
-
-        custom_entry = custom_agg.get(r["name"])
-        barcodes = sorted(barcode_map.get(r["name"] , set()))
-        payload = {
-            "name": r["name"],
-            "item_code": r["item_code"],
-            "item_name": r["item_name"],
-            "brand": r["brand"],
-            "item_group": r["item_group"],
-            "custom_style_code": _merge_custom_field_value(
-                r["custom_style_code"],
-                custom_entry["custom_style_code"] if custom_entry else None
-            ),
-            "custom_simple_colour": _merge_custom_field_value(
-                r["custom_simple_colour"],
-                custom_entry["custom_simple_colour"] if custom_entry else None
-            ),
-            "vat_rate": float(r["vat_rate"]) if r["vat_rate"] is not None else None,
-            "barcode": barcodes[0] if barcodes else None,
-            "standard_rate": float(display_rate) if display_rate is not None else None,
-            "stock_uom": r["stock_uom"],
-            "image": _absolute_image_url(r["image"]),
-            "attributes": attrs,
-            "barcodes": barcodes,
-            # expose variant price bounds and aggregated stock for UI use
-            "price_min": float(min_var) if min_var is not None else None,
-            "price_max": float(max_var) if max_var is not None else None,
-            "variant_stock": float(r["variant_stock"]) if r["variant_stock"] is not None else 0.0,
-        }
-        out.append(payload)
+def _tile_json(raw: Optional[str], default: Any) -> Any:
+    if not raw:
+        return default
+    try:
+        return _json.loads(raw)
+    except Exception:
+        return default
+
+
+def _catalog_tile_payload(r: sqlite3.Row, light: bool = False, reserved: float = 0.0) -> Dict[str, Any]:
+    """Shape one catalog_tiles row (joined to items) into the POS tile payload."""
+    attrs: Dict[str, str] = {}
+    if not light:
+        for aname, values in (_tile_json(r["attributes_json"], {}) or {}).items():
+            disp = " ".join(values)
+            for key in _attribute_payload_keys(aname):
+                attrs[key] = disp
+
+    # Determine displayed rate: prefer template's effective price; otherwise fallback to variant prices
+    template_rate = r["standard_rate"] if r["standard_rate"] is not None else None
+    min_var = r["min_variant_price"] if r["min_variant_price"] is not None else None
+    max_var = r["max_variant_price"] if r["max_variant_price"] is not None else None
+    display_rate = template_rate if template_rate is not None else (min_var if min_var is not None else None)
+
+    barcodes = _tile_json(r["barcodes_json"], []) or []
+    if light:
+        style_code = r["custom_style_code"]
+        simple_colour = r["custom_simple_colour"]
+    else:
+        style_code = _merge_custom_field_value(r["custom_style_code"], set(_tile_json(r["style_codes"], [])))
+        simple_colour = _merge_custom_field_value(r["custom_simple_colour"], set(_tile_json(r["simple_colours"], [])))
+    variant_stock = float(r["variant_stock"]) if r["variant_stock"] is not None else 0.0
+    return {
+        "name": r["name"],
+        "item_code": r["item_code"],
+        "item_name": r["item_name"],
+        "brand": r["brand"],
+        "item_group": r["item_group"],
+        "custom_style_code": style_code,
+        "custom_simple_colour": simple_colour,
+        "vat_rate": float(r["vat_rate"]) if r["vat_rate"] is not None else None,
+        "barcode": barcodes[0] if barcodes else None,
+        "standard_rate": float(display_rate) if display_rate is not None else None,
+        "stock_uom": r["stock_uom"],
+        "image": _absolute_image_url(r["image"]),
+        "attributes": attrs,
+        "barcodes": barcodes,
+        # expose variant price bounds and aggregated stock for UI use
+        "price_min": float(min_var) if min_var is not None else None,
+        "price_max": float(max_var) if max_var is not None else None,
+        "variant_stock": variant_stock - reserved,
+    }
+
+
+def _ensure_catalog_tiles(conn: sqlite3.Connection) -> None:
+    """Back-fill missing catalog tiles; run at startup and after a full sync, never on reads."""
+    if not ps:
+        return
+    try:
+        filled = ps.ensure_catalog_tiles(conn, POS_WAREHOUSE)
+        if filled:
+            app.logger.info('Built %d catalog tile(s)', filled)
+    except Exception:
+        app.logger.warning('Catalog tile back-fill failed', exc_info=True)
+
+
+def _db_items_payload(conn: sqlite3.Connection):
+    """Return template items as tiles from the materialized catalog_tiles table."""
+    out = [
+        _catalog_tile_payload(r)
+        for r in conn.execute(_CATALOG_TILE_SELECT + " ORDER BY COALESCE(i.brand,''), i.name")
+    ]
     if out:
         return out
     # If the catalog has no templates, fall back to active variants/items.
     return _db_variant_items_payload(conn)
 
 
-def _layaway_reserved_qty(conn: sqlite3.Connection) -> Dict[str, float]:
-    """Return {item_code: total_reserved_qty} across all active layaways."""
+def _layaway_reserved_qty(conn: sqlite3.Connection, item_ids: Optional[List[str]] = None) -> Dict[str, float]:
+    """Return {item_code: total_reserved_qty} across all active layaways (from layaway_reservations)."""
+    if not ps:
+        return {}
     try:
-        rows = conn.execute(
-            "SELECT items FROM layaways WHERE status='active' AND items IS NOT NULL"
-        ).fetchall()
+        return ps.layaway_reserved_qty(conn, item_ids)
     except Exception:
         return {}
-    reserved: Dict[str, float] = {}
-    for row in rows:
-        try:
-            for it in _json.loads(row[0]):
-                if it.get('collected'):
-                    continue
-                code = (it.get('item_code') or it.get('item_id') or '').strip()
-                if code:
-                    reserved[code] = reserved.get(code, 0.0) + float(it.get('qty') or 1)
-        except Exception:
-            continue
-    return reserved
+
+
+def _lay_sync_reservations(conn: sqlite3.Connection, *layaway_ids: str) -> None:
+    """Re-derive reservation rows for the given layaways after their items/status changed."""
+    if not ps or not layaway_ids:
+        return
+    try:
+        ps.sync_layaway_reservations(conn, layaway_ids)
+    except Exception:
+        app.logger.warning('Layaway reservation sync failed for %s', layaway_ids, exc_info=True)
 
 
 def _db_variant_items_payload(conn: sqlite3.Connection):
@@ -1229,123 +1478,26 @@ def _db_template_payload_for_ids(conn: sqlite3.Connection, ids: List[str], light
     if not ids:
         return []
     placeholders = ",".join(["?"] * len(ids))
-    q_tpl = f"""
-    SELECT i.item_id AS name,
-           i.item_id AS item_code,
-           i.name AS item_name,
-           i.brand AS brand,
-           i.item_group AS item_group,
-           i.custom_style_code AS custom_style_code,
-           i.custom_simple_colour AS custom_simple_colour,
-           i.vat_rate AS vat_rate,
-        (SELECT price_effective FROM v_item_prices p WHERE p.item_id = i.item_id) AS standard_rate,
-        (SELECT MIN(ip.rate) FROM item_prices ip JOIN items v2 ON v2.item_id = ip.item_id WHERE v2.parent_id = i.item_id) AS min_variant_price,
-        (SELECT MAX(ip.rate) FROM item_prices ip JOIN items v2 ON v2.item_id = ip.item_id WHERE v2.parent_id = i.item_id) AS max_variant_price,
-        (SELECT COALESCE(SUM(s.qty),0) FROM stock s JOIN items v2 ON v2.item_id = s.item_id WHERE v2.parent_id = i.item_id AND s.warehouse='{POS_WAREHOUSE}') AS variant_stock,
-        'Each' AS stock_uom,
-        (SELECT image_url_effective FROM v_item_images img WHERE img.item_id=i.item_id) AS image
-    FROM items i
-    WHERE i.active=1 AND i.is_template=1 AND i.item_id IN ({placeholders})
-    """
-    agg: Dict[str, Dict[str, Set[str]]] = {}
-    custom_agg: Dict[str, Dict[str, Set[str]]] = {}
-    if not light:
-        q_attr = f"""
-          SELECT t.item_id AS template_id, va.attr_name, va.value
-          FROM items v
-          JOIN items t ON t.item_id = v.parent_id
-          JOIN variant_attributes va ON va.item_id = v.item_id
-          WHERE v.active=1 AND v.is_template=0 AND t.item_id IN ({placeholders})
-        """
-        for row in conn.execute(q_attr, tuple(ids)):
-            tpl = row["template_id"]
-            d = agg.setdefault(tpl, {})
-            vals = d.setdefault(row["attr_name"], set())
-            vals.add(row["value"])
-
-        q_custom = f"""
-          SELECT parent_id AS template_id, custom_style_code, custom_simple_colour
-          FROM items
-          WHERE parent_id IN ({placeholders})
-            AND (custom_style_code IS NOT NULL OR custom_simple_colour IS NOT NULL)
-        """
-        for row in conn.execute(q_custom, tuple(ids)):
-            tpl = row["template_id"]
-            if not tpl:
-                continue
-            entry = custom_agg.setdefault(tpl, {"custom_style_code": set(), "custom_simple_colour": set()})
-            if row["custom_style_code"]:
-                entry["custom_style_code"].add(str(row["custom_style_code"]))
-            if row["custom_simple_colour"]:
-                entry["custom_simple_colour"].add(str(row["custom_simple_colour"]))
 
-    barcode_map: Dict[str, Set[str]] = {}
-    q_barcodes = f"""
-      SELECT v.parent_id AS template_id, b.barcode
-      FROM barcodes b
-      JOIN items v ON v.item_id = b.item_id
-      WHERE v.parent_id IN ({placeholders})
-        AND b.barcode IS NOT NULL
-    """
-    for row in conn.execute(q_barcodes, tuple(ids)):
-        tpl = row["template_id"]
-        if not tpl:
-            continue
-        bc = (row["barcode"] or '').strip()
-        if not bc:
-            continue
-        barcode_map.setdefault(tpl, set()).add(bc)
-
-    # Build reserved qty per template by summing variants
-    item_reserved = _layaway_reserved_qty(conn)
+    # Reserved qty per template: indexed SUM over the layaway ledger, grouped by parent
     tpl_reserved: Dict[str, float] = {}
-    if item_reserved:
-        q_vtpl = f"SELECT item_id, parent_id FROM items WHERE parent_id IN ({placeholders}) AND is_template=0"
-        for row in conn.execute(q_vtpl, tuple(ids)):
-            if row["parent_id"] and row["item_id"] in item_reserved:
-                tpl_reserved[row["parent_id"]] = tpl_reserved.get(row["parent_id"], 0.0) + item_reserved[row["item_id"]]
+    try:
+        q_reserved = f"""
+        SELECT v.parent_id AS template_id, SUM(r.qty) AS qty
+        FROM layaway_reservations r
+        JOIN items v ON v.item_id = r.item_id
+        WHERE v.parent_id IN ({placeholders}) AND v.is_template=0
+        GROUP BY v.parent_id
+        """
+        for row in conn.execute(q_reserved, tuple(ids)):
+            tpl_reserved[row["template_id"]] = float(row["qty"] or 0.0)
+    except sqlite3.OperationalError:
+        pass
 
     out = []
-    for r in conn.execute(q_tpl, tuple(ids)):
-        attrs = {}
-        if not light and r["name"] in agg:
-            for aname, values in agg[r["name"]].items():
-                disp = " ".join(sorted(values))
-                for key in _attribute_payload_keys(aname):
-                    attrs[key] = disp
-
-        template_rate = r["standard_rate"] if r["standard_rate"] is not None else None
-        min_var = r["min_variant_price"] if r["min_variant_price"] is not None else None
-        max_var = r["max_variant_price"] if r["max_variant_price"] is not None else None
-        display_rate = template_rate if template_rate is not None else (min_var if min_var is not None else None)
-
-        custom_entry = custom_agg.get(r["name"]) if not light else None
-        barcodes = sorted(barcode_map.get(r["name"], set()))
-        payload = {
-            "name": r["name"],
-            "item_code": r["item_code"],
-            "item_name": r["item_name"],
-            "brand": r["brand"],
-            "item_group": r["item_group"],
-            "custom_style_code": r["custom_style_code"] if light else _merge_custom_field_value(
-                r["custom_style_code"],
-                custom_entry["custom_style_code"] if custom_entry else None
-            ),
-            "custom_simple_colour": r["custom_simple_colour"] if light else _merge_custom_field_value(
-                r["custom_simple_colour"],
-                custom_entry["custom_simple_colour"] if custom_entry else None
-            ),
-            "vat_rate": float(r["vat_rate"]) if r["vat_rate"] is not None else None,
-            "barcode": barcodes[0] if barcodes else None,
-            "standard_rate": float(display_rate) if display_rate is not None else None,
-            "stock_uom": r["stock_uom"],
-            "image": _absolute_image_url(r["image"]),
-            "attributes": attrs,
-            "barcodes": barcodes,
-            "price_min": float(min_var) if min_var is not None else None,
-            "price_max": float(max_var) if max_var is not None else None,
-            "variant_stock": max(0.0, (float(r["variant_stock"]) if r["variant_stock"] is not None else 0.0) - tpl_reserved.get(r["name"], 0.0)),
-        }
+    for r in conn.execute(_CATALOG_TILE_SELECT + f" AND i.item_id IN ({placeholders})", tuple(ids)):
+        payload = _catalog_tile_payload(r, light=light, reserved=tpl_reserved.get(r["name"], 0.0))
+        payload["variant_stock"] = max(0.0, payload["variant_stock"])
         out.append(payload)
     return out
 
@@ -1394,7 +1546,7 @@ def _db_variant_payload_for_ids(conn: sqlite3.Connection, ids: List[str], light:
             continue
         barcode_map.setdefault(item_id, set()).add(bc)
 
-    reserved = _layaway_reserved_qty(conn)
+    reserved = _layaway_reserved_qty(conn, ids)
     out = []
     for r in conn.execute(q_items, tuple(ids)):
         barcodes = sorted(barcode_map.get(r["name"], set()))
@@ -1487,30 +1639,66 @@ def _db_group_list(conn: sqlite3.Connection, brand: Optional[str]) -> List[str]:
     return groups
 
 
+def _item_search_filter(conn: sqlite3.Connection, q: str, alias: str = "i") -> Tuple[str, List[str], List[Any], Optional[str]]:
+    """Translate a free-text query into (join_sql, clauses, params, order_by).
+
+    Uses the FTS5 item_search index (ranked by bm25) when it is available and the
+    query has an indexable term; otherwise falls back to the LIKE scan. The index is
+    queried as it stands: the sync pulls flush their own changes and the
+    item_search_flush task picks up the rest, so a search never writes.
+    """
+    match = None
+    if ps:
+        try:
+            mode = ps.item_search_mode(conn)
+            if mode:
+                match = ps.item_search_query(mode, q)
+        except Exception:
+            app.logger.debug('Item search index unavailable; using LIKE', exc_info=True)
+            match = None
+    if match:
+        expr, residual = match
+        clauses = ["item_search MATCH ?"]
+        params: List[Any] = [expr]
+        for term in residual:
+            clauses.append("(s.item_id || ' ' || s.name || ' ' || s.codes || ' ' || s.attrs || ' ' || s.barcodes) LIKE ?")
+            params.append(f"%{term}%")
+        join = f"JOIN item_search s ON s.item_id = {alias}.item_id"
+        return join, clauses, params, "bm25(item_search, 3.0, 4.0, 2.0, 1.0, 2.0)"
+    like = f"%{q}%"
+    clause = (f"({alias}.name LIKE ? OR {alias}.item_id LIKE ? OR {alias}.custom_style_code LIKE ? "
+              f"OR {alias}.custom_simple_colour LIKE ?)")
+    return "", [clause], [like, like, like, like], None
+
+
 def _db_find_item_ids(conn: sqlite3.Connection, brand: Optional[str], group: Optional[str], q: Optional[str], limit: int) -> List[str]:
     params: List[Any] = []
-    clauses = ["active=1"]
+    clauses = ["i.active=1"]
     if _db_has_templates(conn):
-        clauses.append("is_template=1")
+        clauses.append("i.is_template=1")
     else:
-        clauses.append("is_template=0")
+        clauses.append("i.is_template=0")
     if brand is not None:
         if brand:
             # Specific brand — direct equality uses the composite browse index
-            clauses.append("brand=?")
+            clauses.append("i.brand=?")
             params.append(brand)
         else:
             # "Unbranded" — match NULL or empty string
-            clauses.append("(brand IS NULL OR brand='')")
+            clauses.append("(i.brand IS NULL OR i.brand='')")
     if group and _has_item_group(conn):
-        clauses.append("COALESCE(item_group,'')=?")
+        clauses.append("COALESCE(i.item_group,'')=?")
         params.append(group)
+    join = ""
+    order = "i.brand, i.name"
     if q:
-        like = f"%{q}%"
-        clauses.append("(name LIKE ? OR item_id LIKE ? OR custom_style_code LIKE ? OR custom_simple_colour LIKE ?)")
-        params.extend([like, like, like, like])
+        join, q_clauses, q_params, rank = _item_search_filter(conn, q)
+        clauses.extend(q_clauses)
+        params.extend(q_params)
+        if rank:
+            order = f"{rank}, {order}"
     where = " AND ".join(clauses)
-    sql = f"SELECT item_id FROM items WHERE {where} ORDER BY brand, name LIMIT ?"
+    sql = f"SELECT i.item_id FROM items i {join} WHERE {where} ORDER BY {order} LIMIT ?"
     params.append(limit)
     rows = conn.execute(sql, tuple(params)).fetchall()
     return [row["item_id"] for row in rows if row and row["item_id"]]
@@ -1525,10 +1713,14 @@ def _db_variant_table_payload(conn: sqlite3.Connection, brand: Optional[str], gr
     if group and _has_item_group(conn):
         clauses.append("COALESCE(i.item_group,'')=?")
         params.append(group)
+    join = ""
+    order = "COALESCE(i.brand,''), i.name"
     if q:
-        like = f"%{q}%"
-        clauses.append("(i.name LIKE ? OR i.item_id LIKE ? OR i.custom_style_code LIKE ? OR i.custom_simple_colour LIKE ?)")
-        params.extend([like, like, like, like])
+        join, q_clauses, q_params, rank = _item_search_filter(conn, q)
+        clauses.extend(q_clauses)
+        params.extend(q_params)
+        if rank:
+            order = f"{rank}, {order}"
     where = " AND ".join(clauses)
     sql = f"""
     SELECT i.item_id AS name,
@@ -1542,6 +1734,7 @@ def _db_variant_table_payload(conn: sqlite3.Connection, brand: Optional[str], gr
            i.vat_rate AS vat_rate,
            (SELECT price_effective FROM v_item_prices p WHERE p.item_id = i.item_id) AS standard_rate,
            COALESCE((SELECT qty FROM stock s WHERE s.item_id = i.item_id AND s.warehouse='{POS_WAREHOUSE}'), 0) AS stock_qty,
+           COALESCE((SELECT SUM(lr.qty) FROM layaway_reservations lr WHERE lr.item_id = i.item_id), 0) AS reserved_qty,
            (SELECT value FROM variant_attributes va WHERE va.item_id = i.item_id
                 AND lower(va.attr_name) IN ('color','colour','colors') LIMIT 1) AS color,
             (SELECT value FROM variant_attributes va WHERE va.item_id = i.item_id
@@ -1549,13 +1742,13 @@ def _db_variant_table_payload(conn: sqlite3.Connection, brand: Optional[str], gr
            (SELECT value FROM variant_attributes va WHERE va.item_id = i.item_id
                 AND lower(va.attr_name) IN ('width','fit') LIMIT 1) AS width
     FROM items i
+    {join}
     WHERE {where}
-    ORDER BY COALESCE(i.brand,''), i.name
+    ORDER BY {order}
     LIMIT ?
     """
     params.append(limit)
     rows = conn.execute(sql, tuple(params)).fetchall()
-    reserved = _layaway_reserved_qty(conn)
     out: List[Dict[str, Any]] = []
     for r in rows:
         raw_stock = float(r["stock_qty"]) if r["stock_qty"] is not None else 0.0
@@ -1570,7 +1763,7 @@ def _db_variant_table_payload(conn: sqlite3.Connection, brand: Optional[str], gr
             "custom_simple_colour": r["custom_simple_colour"],
             "vat_rate": float(r["vat_rate"]) if r["vat_rate"] is not None else None,
             "standard_rate": float(r["standard_rate"]) if r["standard_rate"] is not None else None,
-            "stock_qty": max(0.0, raw_stock - reserved.get(r["item_code"], 0.0)),
+            "stock_qty": max(0.0, raw_stock - float(r["reserved_qty"] or 0.0)),
             "color": r["color"],
             "size": r["size"],
             "width": r["width"],
@@ -1689,6 +1882,8 @@ def _ensure_db_bootstrap():
                         "Skipping ERP bootstrap: ERPNEXT_URL/API credentials not configured (ERPNEXT_URL=%s, key=%s).",
                         ERPNEXT_URL, bool(API_KEY and API_SECRET)
                     )
+            # Tiles for templates cached before catalog_tiles existed, or under another warehouse
+            _ensure_catalog_tiles(conn)
             completed = True
         except Exception as exc:
             app.logger.warning(
@@ -1814,6 +2009,7 @@ def _initial_sync_items(conn: sqlite3.Connection):
             ps.pull_item_prices_incremental(conn, price_list=POS_PRICE_LIST, limit=500)
         except Exception as exc:
             app.logger.warning("Price list bootstrap failed: %s", exc)
+    _browse_cache_apply_catalog_changes()
     app.logger.info("Seeded %d ERPNext items locally", total)
 
 def _initial_sync_cashiers(conn: sqlite3.Connection):
@@ -1919,7 +2115,7 @@ def _cashier_get_list(fields, filters, order_field):
         payload['order_by'] = f"{order_field} asc"
     if filters:
         payload['filters'] = filters
-    resp = requests.post(
+    resp = pos_http.post(
         f"{ERPNEXT_URL}/api/method/frappe.client.get_list",
         headers=_erp_headers(),
         json=payload,
@@ -1949,7 +2145,7 @@ def _cashier_get_list(fields, filters, order_field):
 def _cashier_fetch_doc(docname):
     if not docname:
         return None
-    resp = requests.post(
+    resp = pos_http.post(
         f"{ERPNEXT_URL}/api/method/frappe.client.get",
         headers=_erp_headers(),
         json={'doctype': CASHIER_DOCTYPE, 'name': docname},
@@ -2017,16 +2213,10 @@ def _erp_headers():
 
 
 def _erp_session_get(url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 15):
-    """Use a prepared request to ensure Expect headers are stripped for ERPNext GETs."""
+    """GET from ERPNext over the shared keep-alive session, with no Expect header."""
     headers = _erp_headers()
-    session = requests.Session()
-    try:
-        req = requests.Request("GET", url, headers=headers, params=params)
-        prepped = session.prepare_request(req)
-        prepped.headers.pop('Expect', None)
-        return session.send(prepped, timeout=timeout)
-    finally:
-        session.close()
+    headers.pop('Expect', None)
+    return pos_http.get(url, headers=headers, params=params, timeout=timeout)
 
 
 def _sync_cursor_get(conn: Optional[sqlite3.Connection], key: str) -> Tuple[Optional[str], Optional[str]]:
@@ -2706,12 +2896,39 @@ def _normalize_thumb_source_url(raw: Optional[str]) -> Optional[str]:
         return url
     return None
 
-def _thumb_cache_path(url: str, width: int, height: int) -> Path:
+# Thumbnail output formats: (PIL format, mimetype, file suffix), best first
+_THUMB_FORMATS: Dict[str, Tuple[str, str, str]] = {
+    'avif': ('AVIF', 'image/avif', '.avif'),
+    'webp': ('WEBP', 'image/webp', '.webp'),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg'),
+}
+_THUMB_SAVERS: Optional[Set[str]] = None
+# Thumbnail URLs are keyed by the source image URL (ERPNext gives a changed file a new
+# URL) and static URLs by content hash, so both may be kept by browsers for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def _thumb_formats_available() -> Set[str]:
+    global _THUMB_SAVERS
+    if _THUMB_SAVERS is None:
+        Image.init()
+        _THUMB_SAVERS = {name for name, (pil, _, _) in _THUMB_FORMATS.items() if pil in Image.SAVE}
+    return _THUMB_SAVERS
+
+def _thumb_format_for(accept: Optional[str]) -> str:
+    """Pick the best thumbnail format the client accepts (AVIF, then WebP, else JPEG)."""
+    accept = (accept or '').lower()
+    available = _thumb_formats_available()
+    for name in ('avif', 'webp'):
+        if name in available and f'image/{name}' in accept:
+            return name
+    return 'jpeg'
+
+def _thumb_cache_path(url: str, width: int, height: int, fmt: str = 'jpeg') -> Path:
     key = f"{url}|{width}x{height}"
     digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
-    return THUMB_CACHE_DIR / f"{digest}.jpg"
+    return THUMB_CACHE_DIR / f"{digest}{_THUMB_FORMATS[fmt][2]}"
 
-def _build_thumbnail_bytes(raw: bytes, width: int, height: int) -> bytes:
+def _build_thumbnail_bytes(raw: bytes, width: int, height: int, fmt: str = 'jpeg') -> bytes:
     img = Image.open(BytesIO(raw))
     img.load()
     if img.mode in ("RGBA", "LA"):
@@ -2723,9 +2940,202 @@ def _build_thumbnail_bytes(raw: bytes, width: int, height: int) -> bytes:
     resample = getattr(getattr(Image, "Resampling", Image), "LANCZOS", Image.LANCZOS)
     img.thumbnail((width, height), resample)
     out = BytesIO()
-    img.save(out, format="JPEG", quality=THUMB_JPEG_QUALITY, optimize=True)
+    if fmt == 'webp':
+        img.save(out, format="WEBP", quality=THUMB_JPEG_QUALITY, method=4)
+    elif fmt == 'avif':
+        img.save(out, format="AVIF", quality=THUMB_JPEG_QUALITY)
+    else:
+        img.save(out, format="JPEG", quality=THUMB_JPEG_QUALITY, optimize=True)
     return out.getvalue()
 
+class ThumbnailError(Exception):
+    """Thumbnail source could not be used; carries the HTTP status to report."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+_THUMB_POOL: Optional[ThreadPoolExecutor] = None
+_THUMB_INFLIGHT: Dict[str, Future] = {}
+_THUMB_FAILED: Dict[str, Tuple[float, int, str]] = {}
+_THUMB_FAIL_TTL = 60.0
+_THUMB_TOUCH_INTERVAL = 3600.0
+_THUMB_CACHE_STATE: Dict[str, Any] = {'bytes': None, 'evicting': False, 'evicted': 0}
+_THUMB_LOCK = threading.Lock()
+# 1x1 transparent GIF returned (202) while a thumbnail is still being generated
+_THUMB_PLACEHOLDER = bytes.fromhex(
+    '47494638396101000100800000000000ffffff21f90401000000002c000000000100010000020144003b'
+)
+
+
+def _thumb_pool() -> ThreadPoolExecutor:
+    global _THUMB_POOL
+    with _THUMB_LOCK:
+        if _THUMB_POOL is None:
+            _THUMB_POOL = ThreadPoolExecutor(max_workers=THUMB_WORKERS, thread_name_prefix='thumb')
+        return _THUMB_POOL
+
+
+def _thumb_generate(url: str, width: int, height: int, fmt: str, cache_path: Path) -> Path:
+    if cache_path.exists():
+        return cache_path
+    resp = pos_http.get(url, timeout=THUMB_TIMEOUT)
+    if resp.status_code != 200:
+        raise ThumbnailError(502, f'Image fetch failed ({resp.status_code})')
+    data = resp.content
+    if not data:
+        raise ThumbnailError(502, 'Image fetch returned empty')
+    if len(data) > THUMB_MAX_BYTES:
+        raise ThumbnailError(413, 'Image too large')
+    thumb_bytes = _build_thumbnail_bytes(data, width, height, fmt)
+    THUMB_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f'{cache_path.name}.{uuid4().hex}.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(thumb_bytes)
+    tmp_path.replace(cache_path)
+    _thumb_cache_account(len(thumb_bytes))
+    return cache_path
+
+
+def _thumb_submit(url: str, width: int, height: int, fmt: str = 'jpeg') -> Tuple[Path, Optional[Future]]:
+    """Return (cache_path, future); future is None when the thumbnail is already on disk.
+
+    Concurrent callers for the same url/size/format share one in-flight job.
+    """
+    cache_path = _thumb_cache_path(url, width, height, fmt)
+    if cache_path.exists():
+        return cache_path, None
+    key = str(cache_path)
+    with _THUMB_LOCK:
+        fut = _THUMB_INFLIGHT.get(key)
+        failed = _THUMB_FAILED.get(key)
+        if fut is None and failed and failed[0] > time.monotonic():
+            fut = Future()
+            fut.set_exception(ThumbnailError(failed[1], failed[2]))
+            return cache_path, fut
+        created = fut is None
+    if created:
+        fut = _thumb_pool().submit(_thumb_generate, url, width, height, fmt, cache_path)
+        with _THUMB_LOCK:
+            existing = _THUMB_INFLIGHT.setdefault(key, fut)
+        if existing is fut:
+            fut.add_done_callback(lambda f, k=key: _thumb_finished(k, f))
+        else:
+            fut = existing
+    return cache_path, fut
+
+
+def _thumb_finished(key: str, fut: Future) -> None:
+    exc = fut.exception()
+    with _THUMB_LOCK:
+        _THUMB_INFLIGHT.pop(key, None)
+        if isinstance(exc, ThumbnailError):
+            _THUMB_FAILED[key] = (time.monotonic() + _THUMB_FAIL_TTL, exc.status, exc.message)
+        else:
+            _THUMB_FAILED.pop(key, None)
+    if exc is not None and not isinstance(exc, ThumbnailError):
+        app.logger.warning('Thumbnail build failed: %s', exc)
+
+
+def _thumb_touch(cache_path: Path) -> None:
+    """Refresh mtime (the LRU clock) on a cache hit, at most once per _THUMB_TOUCH_INTERVAL."""
+    try:
+        now = time.time()
+        if now - cache_path.stat().st_mtime > _THUMB_TOUCH_INTERVAL:
+            os.utime(cache_path, (now, now))
+    except OSError:
+        pass
+
+
+def _thumb_evict() -> int:
+    """Delete least-recently-used thumbnails until the cache is under 90% of its cap."""
+    entries = []
+    for p in THUMB_CACHE_DIR.iterdir() if THUMB_CACHE_DIR.is_dir() else ():
+        if p.suffix == '.tmp':
+            continue
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, p))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    if total > THUMB_CACHE_MAX_BYTES:
+        target = THUMB_CACHE_MAX_BYTES * 0.9
+        for _, size, p in sorted(entries, key=lambda e: e[0]):
+            if total <= target:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+    with _THUMB_LOCK:
+        _THUMB_CACHE_STATE['bytes'] = total
+        _THUMB_CACHE_STATE['evicted'] += removed
+    return removed
+
+
+def _thumb_cache_account(added: int) -> None:
+    with _THUMB_LOCK:
+        if _THUMB_CACHE_STATE['bytes'] is not None:
+            _THUMB_CACHE_STATE['bytes'] += added
+        over = _THUMB_CACHE_STATE['bytes'] is None or _THUMB_CACHE_STATE['bytes'] > THUMB_CACHE_MAX_BYTES
+        run = over and not _THUMB_CACHE_STATE['evicting']
+        if run:
+            _THUMB_CACHE_STATE['evicting'] = True
+    if not run:
+        return
+    try:
+        removed = _thumb_evict()
+        if removed:
+            app.logger.info('Thumbnail cache evicted %d file(s)', removed)
+    finally:
+        with _THUMB_LOCK:
+            _THUMB_CACHE_STATE['evicting'] = False
+
+
+def _thumb_prewarm(images: Any) -> int:
+    """Queue thumbnails at THUMB_PREWARM_SIZES (1x and 2x) for item image paths; returns jobs queued.
+
+    Built in the best format this server can write; the tills are all WebP-capable browsers.
+    """
+    fmt = _thumb_format_for('image/avif,image/webp')
+    queued = 0
+    for image in images or ():
+        normalized = _normalize_thumb_source_url(_absolute_image_url(image))
+        if not normalized:
+            continue
+        for size in {s * scale for s in THUMB_PREWARM_SIZES for scale in (1, 2)}:
+            size = max(16, min(size, THUMB_MAX_SIZE))
+            _, fut = _thumb_submit(normalized, size, size, fmt)
+            if fut is not None:
+                queued += 1
+    return queued
+
+
+def _thumb_prewarm_new_images(images: Any) -> None:
+    """Prewarm thumbnails for images reported by a catalog pull; never raises."""
+    try:
+        queued = _thumb_prewarm(images)
+        if queued:
+            app.logger.info('Queued %d thumbnail(s) for new item images', queued)
+    except Exception:
+        app.logger.debug('Thumbnail prewarm failed', exc_info=True)
+
+
+def _thumb_stats() -> Dict[str, Any]:
+    with _THUMB_LOCK:
+        return {
+            'in_flight': len(_THUMB_INFLIGHT),
+            'cache_bytes': _THUMB_CACHE_STATE['bytes'],
+            'cache_max_bytes': THUMB_CACHE_MAX_BYTES,
+            'evicted': _THUMB_CACHE_STATE['evicted'],
+        }
+
 def _canonical_attr_name(name: Optional[str]) -> Optional[str]:
     if name is None:
         return None
@@ -2752,17 +3162,27 @@ def _attribute_payload_keys(name: Optional[str]) -> Tuple[str, ...]:
         keys.append(original)
     return tuple(keys)
 
-def _variant_attrs_dict(conn: sqlite3.Connection, item_id: str) -> dict:
-    attrs = {}
-    if not item_id:
-        return attrs
+def _variant_attrs_map(conn: sqlite3.Connection, item_ids: List[str]) -> Dict[str, dict]:
+    """Return {item_id: {attr_key: value}} for many variants in one query (canonical + original keys)."""
+    out: Dict[str, dict] = {}
+    ids = list(dict.fromkeys(i for i in item_ids if i))
+    if not ids:
+        return out
+    placeholders = ",".join(["?"] * len(ids))
     try:
-        for ar in conn.execute("SELECT attr_name, value FROM variant_attributes WHERE item_id=?", (item_id,)):
+        for ar in conn.execute(
+            f"SELECT item_id, attr_name, value FROM variant_attributes WHERE item_id IN ({placeholders}) ORDER BY item_id, attr_name",
+            tuple(ids),
+        ):
+            attrs = out.setdefault(ar['item_id'], {})
             for key in _attribute_payload_keys(ar['attr_name']):
                 attrs[key] = ar['value']
     except Exception:
         pass
-    return attrs
+    return out
+
+def _variant_attrs_dict(conn: sqlite3.Connection, item_id: str) -> dict:
+    return _variant_attrs_map(conn, [item_id]).get(item_id, {}) if item_id else {}
 
 def _error_message_from_response(resp: requests.Response) -> str:
     try:
@@ -2785,11 +3205,57 @@ def _require_admin_token():
     return None
 
 
-# Disable caching for all responses during development to avoid stale assets
+# Static asset URLs carry a content hash (?h=...) so browsers can keep them until they change
+_STATIC_HASHES: Dict[str, Tuple[float, int, str]] = {}
+
+
+def _static_asset_hash(filename: str) -> Optional[str]:
+    path = safe_join(app.static_folder or 'static', filename)
+    try:
+        st = os.stat(path) if path else None
+    except OSError:
+        return None
+    if st is None:
+        return None
+    cached = _STATIC_HASHES.get(filename)
+    if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+        return cached[2]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:12]
+    _STATIC_HASHES[filename] = (st.st_mtime, st.st_size, digest)
+    return digest
+
+
+@app.url_defaults
+def _hash_static_urls(endpoint, values):
+    if endpoint == 'static' and values.get('filename'):
+        digest = _static_asset_hash(values['filename'])
+        if digest:
+            values['h'] = digest
+
+
+# API JSON is never cached (unless it carries an ETag, then it revalidates); static assets revalidate by ETag (304) unless the URL carries
+# their current content hash, in which case they are immutable
 @app.after_request
 def add_no_cache_headers(response):
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
+    path = request.path or ''
+    if path.startswith('/api/'):
+        # Non-JSON API responses (thumbnails, the 202 placeholder) set their own policy
+        if response.headers.get('ETag') and response.status_code in (200, 304):
+            # Versioned JSON (customer directory): cache privately, always revalidate
+            response.headers['Cache-Control'] = 'private, no-cache'
+        elif response.mimetype == 'application/json' or 'Cache-Control' not in response.headers:
+            response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+            response.headers['Pragma'] = 'no-cache'
+    elif path.startswith('/static/'):
+        filename = path[len('/static/'):]
+        digest = request.args.get('h')
+        if filename.startswith('thumbs/') or (digest and digest == _static_asset_hash(filename)):
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
     # Prefer Cache-Control over Expires; remove Expires if present
     if 'Expires' in response.headers:
         del response.headers['Expires']
@@ -2811,6 +3277,17 @@ def add_no_cache_headers(response):
     return response
 
 
+@app.teardown_request
+def _release_request_db(exc=None):
+    """Hand this worker thread's pooled DB connection back, rolling back anything left uncommitted."""
+    if not ps:
+        return
+    try:
+        ps.release_thread_connections()
+    except Exception:
+        app.logger.debug('DB pool release failed', exc_info=True)
+
+
 @app.route('/')
 def index():
     """Render the main POS interface"""
@@ -2856,7 +3333,7 @@ def get_items():
     # No hard-coded mock items. If ERPNext configured and not in mock mode, fetch from ERP.
     if not USE_MOCK and ERPNEXT_URL:
         try:
-            response = requests.get(
+            response = pos_http.get(
                 f"{ERPNEXT_URL}/api/resource/Item",
                 headers=_erp_headers(),
                 params={
@@ -2911,7 +3388,7 @@ def api_browse_recent_items():
     except Exception:
         app.logger.exception('Failed to load recent browse items')
         items = []
-    _browse_cache_set(cache_key, items)
+    _browse_cache_set(cache_key, items, tags=_browse_item_tags(items, 'recent'))
     return jsonify({'status': 'success', 'items': items})
 
 
@@ -2930,7 +3407,7 @@ def api_browse_brands():
     except Exception:
         app.logger.exception('Failed to load browse brands')
         brands = []
-    _browse_cache_set(cache_key, brands)
+    _browse_cache_set(cache_key, brands, tags=('catalog',))
     return jsonify({'status': 'success', 'brands': brands})
 
 
@@ -2951,7 +3428,7 @@ def api_browse_groups():
     except Exception:
         app.logger.exception('Failed to load browse groups')
         groups = []
-    _browse_cache_set(cache_key, groups)
+    _browse_cache_set(cache_key, groups, tags=('catalog',))
     return jsonify({'status': 'success', 'groups': groups})
 
 
@@ -2971,12 +3448,13 @@ def api_browse_items():
     except Exception:
         limit = BROWSE_ITEMS_LIMIT
     limit = max(10, min(limit, 400))
-    cache_key = None
-    if not q:
-        cache_key = f"browse:items:{brand or ''}:{group or ''}:{mode or ''}:{fields or ''}:{limit}"
-        cached = _browse_cache_get(cache_key)
-        if cached is not None:
-            return jsonify({'status': 'success', 'items': cached, 'cached': True})
+    # Searches are cached too (normalized), so popular prefixes typed at the till stay warm
+    q = ' '.join(q.split())
+    q_key = q.lower()
+    cache_key = f"browse:items:{brand or ''}:{group or ''}:{mode or ''}:{fields or ''}:{limit}:{q_key}"
+    cached = _browse_cache_get(cache_key)
+    if cached is not None:
+        return jsonify({'status': 'success', 'items': cached, 'cached': True})
     conn = _db_connect()
     if not conn:
         return jsonify({'status': 'error', 'message': 'Database not available'}), 500
@@ -2988,8 +3466,7 @@ def api_browse_items():
     except Exception:
         app.logger.exception('Failed to load browse items')
         items = []
-    if cache_key is not None:
-        _browse_cache_set(cache_key, items)
+    _browse_cache_set(cache_key, items, tags=_browse_item_tags(items, 'catalog'))
     return jsonify({'status': 'success', 'items': items})
 
 
@@ -3269,8 +3746,13 @@ def _save_invoice_file(invoice_name: str, data: dict, mode_label: str) -> None:
             'till_number': till_number,
             'till': till_number
         }
-        with open(os.path.join('invoices', f"{invoice_name}.json"), 'w', encoding='utf-8') as f:
+        # Write-then-rename: the new directory entry bumps invoices/' mtime, which is all
+        # the invoice journal checks before rescanning, and readers never see half a file
+        path = os.path.join('invoices', f"{invoice_name}.json")
+        tmp_path = f"{path}.{uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             _json.dump(record, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
     except Exception:
         pass
 
@@ -3409,7 +3891,7 @@ def _record_local_sale(invoice_name: str, data: dict) -> None:
     if not ps:
         return
     try:
-        conn = _db_connect() or ps.connect(POS_DB_PATH)
+        conn = _db_connect() or ps.pooled_connect(POS_DB_PATH)
         if not conn:
             return
         sale_payload = _build_sale_payload(data, invoice_name)
@@ -3418,7 +3900,7 @@ def _record_local_sale(invoice_name: str, data: dict) -> None:
             ps.record_sale_with_fx(conn, sale_payload, fx_metadata)
         else:
             ps.record_sale(conn, sale_payload)
-        _browse_cache_invalidate('browse:')
+        _browse_cache_apply_catalog_changes(sale=True)
     except Exception:
         pass
 
@@ -3432,28 +3914,23 @@ def _persist_local_sale(data: dict, mode_label: str) -> str:
 
 
 def _ingest_new_local_invoices(conn: Optional[sqlite3.Connection]) -> int:
-    """Replay invoices/*.json that have not yet been persisted into SQLite."""
+    """Replay invoices/*.json that have not yet been persisted into SQLite.
+
+    The invoice journal tracks which files are already recorded, so only new receipts are opened.
+    """
     if not ps or not conn:
         return 0
-    inv_dir = Path('invoices')
-    if not inv_dir.is_dir():
+    if not Path('invoices').is_dir():
         return 0
     ingested = 0
-    for inv_path in sorted(inv_dir.glob('*.json')):
+    for entry in ps.invoice_journal_pending(conn, 'invoices'):
+        inv_path = Path('invoices') / entry['file_name']
+        sale_id = entry['sale_id']
         try:
             with open(inv_path, 'r', encoding='utf-8') as f:
                 record = _json.load(f)
         except Exception:
             continue
-        sale_id = record.get('sale_id') or record.get('invoice_name') or inv_path.stem
-        if not sale_id:
-            continue
-        try:
-            exists = conn.execute('SELECT 1 FROM sales WHERE sale_id=?', (sale_id,)).fetchone()
-        except Exception:
-            exists = None
-        if exists:
-            continue
         try:
             payload = _build_sale_payload(record, sale_id)
             fx_metadata = record.get('fx_metadata')
@@ -3466,16 +3943,15 @@ def _ingest_new_local_invoices(conn: Optional[sqlite3.Connection]) -> int:
                 ps.record_sale(conn, payload)
                 app.logger.info('Recorded sale ID "%s" into database', sale_id)
 
+            ps.invoice_journal_mark_ingested(conn, entry['file_name'])
             ingested += 1
 
         except Exception:
             app.logger.exception('Failed to record sale "%s" from %s', sale_id, inv_path)
             continue
 
-
-
     if ingested:
-        _browse_cache_invalidate('browse:')
+        _browse_cache_apply_catalog_changes(sale=True)
     return ingested
 
 
@@ -3530,7 +4006,7 @@ def create_sale():
                             invoice_data['return_against'] = row['erp_docname']
                 except Exception:
                     pass  # return_against is optional; ERPNext will still accept without it
-        response = requests.post(
+        response = pos_http.post(
             f"{ERPNEXT_URL}/api/resource/Sales Invoice",
             headers=_erp_headers(),
             json=invoice_data,
@@ -3539,7 +4015,7 @@ def create_sale():
         response.raise_for_status()
         invoice = response.json().get('data', {})
 
-        submit_response = requests.post(
+        submit_response = pos_http.post(
             f"{ERPNEXT_URL}/api/method/frappe.client.submit",
             headers=_erp_headers(),
             json={
@@ -3721,55 +4197,138 @@ def api_pos_sales_ingest():
         return jsonify({'status': 'error', 'message': 'Unable to queue sale'}), 502
 
 
+@app.route('/api/pos/sales/batch', methods=['POST'])
+def api_pos_sales_ingest_batch():
+    """Receive many till receipts in one request; answers with one result per receipt.
+
+    Body: {"receipts": [ {...}, ... ]} (a bare list is accepted too). Each result is
+    {"status": "received", "queue_id", "invoice_name"} or {"status": "error", "message"}.
+    """
+    if not _valid_pos_shared_key(request.headers.get('X-POS-KEY')):
+        return jsonify({'status': 'error', 'message': 'Invalid POS key'}), 401
+    body = request.get_json(silent=True)
+    receipts = body.get('receipts') if isinstance(body, dict) else body
+    if not isinstance(receipts, list):
+        return jsonify({'status': 'error', 'message': 'receipts array is required'}), 400
+    if len(receipts) > POS_SALES_BATCH_MAX:
+        return jsonify({'status': 'error', 'message': f'At most {POS_SALES_BATCH_MAX} receipts per batch'}), 413
+    results: List[Dict[str, Any]] = []
+    valid: List[Tuple[int, Dict[str, Any]]] = []
+    for payload in receipts:
+        validation_error = _validate_pos_sale_payload(payload)
+        if validation_error:
+            results.append({'status': 'error', 'message': validation_error})
+        else:
+            results.append({'status': 'received', 'invoice_name': _normalize_receipt_id(payload)})
+            valid.append((len(results) - 1, payload))
+    if valid:
+        try:
+            queue_ids = _enqueue_pos_sales([payload for _, payload in valid])
+        except Exception:
+            app.logger.exception('Failed to enqueue batch of %d POS sales', len(valid))
+            queue_ids = None
+        for pos, (idx, _) in enumerate(valid):
+            if queue_ids is None:
+                results[idx] = {'status': 'error', 'message': 'Unable to queue sale'}
+            else:
+                results[idx]['queue_id'] = queue_ids[pos]
+    received = sum(1 for r in results if r['status'] == 'received')
+    return jsonify({'status': 'received' if received == len(results) else 'partial',
+                    'received': received, 'results': results})
+
+
+# Customer directory is served from the SQLite mirror; the idle loop keeps it current
+try:
+    CUSTOMER_PAGE_DEFAULT = int(os.getenv('POS_CUSTOMER_PAGE', '100'))
+except ValueError:
+    CUSTOMER_PAGE_DEFAULT = 100
+CUSTOMER_PAGE_DEFAULT = max(1, min(500, CUSTOMER_PAGE_DEFAULT))
+_CUSTOMER_PULL_LOCK = threading.Lock()
+
+
+def _start_customer_pull() -> bool:
+    """Fill an empty customer mirror in the background; False if a pull is already running."""
+    if USE_MOCK or not _has_erp_credentials() or not _CUSTOMER_PULL_LOCK.acquire(blocking=False):
+        return False
+
+    def _run():
+        conn = None
+        try:
+            conn = _db_connect()
+            if conn:
+                total = ps.pull_customers_incremental(conn, max_pages=1000)
+                app.logger.info("Seeded %d ERPNext customers locally", total)
+        except Exception as exc:
+            app.logger.warning("Customer bootstrap failed: %s", exc)
+        finally:
+            if conn:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            _CUSTOMER_PULL_LOCK.release()
+
+    threading.Thread(target=_run, name='customer-pull', daemon=True).start()
+    return True
+
+
 @app.route('/api/customers')
 def get_customers():
-    """Get all customers"""
+    """Search the local customer directory.
+
+    Query: q (prefix of customer name or ID), limit (1-500), offset. Responses carry an
+    ETag derived from the directory version, so an unchanged page revalidates with a 304.
+    """
     if USE_MOCK:
         return jsonify({'status': 'success', 'customers': _default_customer_list()})
+    q = (request.args.get('q') or '').strip()
+    try:
+        limit = max(1, min(500, int(request.args.get('limit', CUSTOMER_PAGE_DEFAULT))))
+    except ValueError:
+        limit = CUSTOMER_PAGE_DEFAULT
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        offset = 0
     conn = _db_connect()
+    if not conn:
+        return _fallback_customer_response(None, 'Customer directory unavailable.')
     try:
-        response = _erp_session_get(
-            f"{ERPNEXT_URL}/api/resource/Customer",
-            params={
-                'fields': '["name", "customer_name"]',
-                'filters': '[["disabled","=",0]]'
-            },
-            timeout=15
-        )
-        response.raise_for_status()
-        customers = response.json().get('data', []) or []
-        if customers:
-            _cache_customers(conn, customers)
-        else:
-            customers = _default_customer_list()
-        return jsonify({'status': 'success', 'customers': customers})
-    except requests.HTTPError as e:
-        app.logger.warning('ERPNext customer fetch failed with HTTP error: %s', e)
-        return _fallback_customer_response(conn, 'ERPNext customer list unavailable (HTTP error).')
+        etag = ps.customers_etag(conn, q, limit, offset)
+        if etag is None:
+            syncing = _start_customer_pull() or _CUSTOMER_PULL_LOCK.locked()
+            note = 'Customer directory is syncing from ERPNext.' if syncing else None
+            return _fallback_customer_response(conn, note)
+        if request.if_none_match.contains(etag):
+            resp = app.response_class(status=304)
+            resp.set_etag(etag)
+            return resp
+        customers, has_more = ps.search_customers(conn, q, limit=limit, offset=offset)
+        resp = jsonify({
+            'status': 'success',
+            'customers': customers,
+            'q': q,
+            'limit': limit,
+            'offset': offset,
+            'has_more': has_more,
+            'version': ps.customers_version(conn),
+        })
+        resp.set_etag(etag)
+        return resp
     except Exception:
-        app.logger.exception('Failed to fetch customers from ERPNext')
-        return _fallback_customer_response(conn, 'ERPNext customer list unavailable.')
+        app.logger.exception('Failed to search cached customers')
+        return _fallback_customer_response(conn, 'Customer directory unavailable.')
     finally:
-        if conn:
-            try:
-                conn.close()
-            except Exception:
-                pass
+        try:
+            conn.close()
+        except Exception:
+            pass
 
 
 def _default_customer_list():
     return [dict(item) for item in _DEFAULT_CUSTOMERS]
 
 
-def _cache_customers(conn: Optional[sqlite3.Connection], customers: List[Dict[str, Any]]):
-    if not conn or not ps:
-        return
-    try:
-        ps.upsert_customers(conn, customers)
-    except Exception:
-        app.logger.exception('Failed to cache ERPNext customers')
-
-
 def _cached_customers(conn: Optional[sqlite3.Connection]) -> List[Dict[str, str]]:
     if not conn or not ps:
         return []
@@ -3787,34 +4346,46 @@ def _fallback_customer_response(conn: Optional[sqlite3.Connection], note: Option
         payload['note'] = note
     return jsonify(payload)
 
+# Every till polls /api/sales/status; they share one snapshot per SALES_STATUS_TTL seconds
+try:
+    SALES_STATUS_TTL = float(os.getenv('POS_SALES_STATUS_TTL', '5'))
+except ValueError:
+    SALES_STATUS_TTL = 5.0
+_SALES_STATUS_SNAPSHOT: Dict[str, Any] = {'ts': 0.0, 'counts': None, 'invoices_pending': 0}
+_SALES_STATUS_LOCK = threading.Lock()
+
+
+def _sales_status_snapshot() -> Tuple[Dict[str, int], int]:
+    with _SALES_STATUS_LOCK:
+        now = time.monotonic()
+        if _SALES_STATUS_SNAPSHOT['counts'] is not None and now - _SALES_STATUS_SNAPSHOT['ts'] < SALES_STATUS_TTL:
+            return dict(_SALES_STATUS_SNAPSHOT['counts']), _SALES_STATUS_SNAPSHOT['invoices_pending']
+        counts = {'queued': 0, 'posting': 0, 'posted': 0, 'failed': 0}
+        pending = 0
+        conn = _db_connect()
+        if conn:
+            try:
+                for row in conn.execute('SELECT queue_status, COUNT(*) AS c FROM sales GROUP BY queue_status'):
+                    if row['queue_status'] in counts:
+                        counts[row['queue_status']] = int(row['c'])
+            except Exception:
+                pass
+            # Invoice folder pending (no .ok sidecar), answered from the invoice journal
+            try:
+                if os.path.isdir('invoices'):
+                    pending = ps.invoice_journal_unacked(conn, 'invoices')
+            except Exception:
+                pass
+        _SALES_STATUS_SNAPSHOT.update(ts=now, counts=counts, invoices_pending=pending)
+        return dict(counts), pending
+
+
 @app.route('/api/sales/status')
 def api_sales_status():
     """Return counts of local sales by queue_status and a quick scan of invoice acks.
     Response: { status, counts: {queued, posting, posted, failed}, invoices_pending }
     """
-    counts = {'queued': 0, 'posting': 0, 'posted': 0, 'failed': 0}
-    try:
-        conn = _db_connect()
-        if conn:
-            for st in counts.keys():
-                row = conn.execute('SELECT COUNT(*) AS c FROM sales WHERE queue_status=?', (st,)).fetchone()
-                counts[st] = int(row['c']) if row and 'c' in row.keys() else 0
-    except Exception:
-        pass
-    # Invoice folder pending (no .ok sidecar)
-    pending = 0
-    try:
-        inv_dir = 'invoices'
-        if os.path.isdir(inv_dir):
-            for name in os.listdir(inv_dir):
-                if not name.endswith('.json'):
-                    continue
-                base = name[:-5]
-                ok_path = os.path.join(inv_dir, base + '.json.ok')
-                if not os.path.exists(ok_path):
-                    pending += 1
-    except Exception:
-        pass
+    counts, pending = _sales_status_snapshot()
     return jsonify({'status': 'success', 'counts': counts, 'invoices_pending': pending})
 
 
@@ -3854,7 +4425,7 @@ def api_web_orders():
             return jsonify(orders=_apply_printed(copy.deepcopy(_web_orders_cache['orders']))), 200
 
         try:
-            r = requests.get(
+            r = pos_http.get(
                 f'{ERPDASH_URL}/api/website/orders/rich',
                 timeout=10,
             )
@@ -3896,7 +4467,7 @@ def api_web_order_printed(order_id):
     """Mark a web order as printed (picking note produced at till)."""
     if ERPDASH_URL:
         try:
-            requests.post(f'{ERPDASH_URL}/api/web-orders/{quote(order_id, safe="")}/mark-printed', timeout=5)
+            pos_http.post(f'{ERPDASH_URL}/api/web-orders/{quote(order_id, safe="")}/mark-printed', timeout=5)
         except Exception:
             pass
     return jsonify(ok=True), 200
@@ -3915,7 +4486,7 @@ def api_web_order_print_picking(order_id):
     order = None
     if ERPDASH_URL:
         try:
-            r = requests.get(f'{ERPDASH_URL}/api/website/orders/rich', timeout=10)
+            r = pos_http.get(f'{ERPDASH_URL}/api/website/orders/rich', timeout=10)
             if r.ok:
                 for o in r.json().get('orders') or []:
                     if o.get('name') == order_id:
@@ -3928,7 +4499,7 @@ def api_web_order_print_picking(order_id):
     if receipt_url and order:
         try:
             picking_url = receipt_url.rstrip('/').rsplit('/print', 1)[0] + '/print-picking-note'
-            requests.post(picking_url, json={
+            pos_http.post(picking_url, json={
                 'order_number':  order.get('shopify_order_number') or order_id,
                 'customer_name': order.get('customer', ''),
                 'date':          order.get('date', ''),
@@ -3939,7 +4510,7 @@ def api_web_order_print_picking(order_id):
 
     if ERPDASH_URL:
         try:
-            requests.post(f'{ERPDASH_URL}/api/web-orders/{quote(order_id, safe="")}/mark-printed', timeout=5)
+            pos_http.post(f'{ERPDASH_URL}/api/web-orders/{quote(order_id, safe="")}/mark-printed', timeout=5)
         except Exception:
             pass
 
@@ -3986,18 +4557,99 @@ def api_scan_acks():
     return jsonify({'status': 'success', 'updated': updated})
 
 
+_JSON_DIR_COUNTS: Dict[str, Tuple[int, int]] = {}
+
+
+def _count_json_files(path: Path) -> int:
+    """Count *.json in path, re-listing only when the directory's mtime has changed."""
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return 0
+    key = str(path)
+    cached = _JSON_DIR_COUNTS.get(key)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        count = sum(1 for name in os.listdir(path) if name.endswith('.json'))
+    except Exception:
+        return 0
+    _JSON_DIR_COUNTS[key] = (mtime, count)
+    return count
+
+
+def _verify_voucher_balances(conn: sqlite3.Connection, repair: bool = False) -> Dict[str, Any]:
+    report = ps.verify_voucher_balances(conn, repair=repair)
+    if report['repaired']:
+        conn.commit()
+    for entry in report['drift'][:20]:
+        app.logger.warning(
+            'Voucher %s balance drift: stored=%.2f ledger=%.2f',
+            entry['voucher_code'], entry['stored'], entry['ledger'],
+        )
+    return report
+
+
+@app.route('/api/admin/vouchers/verify', methods=['GET', 'POST'])
+def api_admin_verify_vouchers():
+    """Recompute voucher balances from the ledger and report drift.
+
+    GET only reports; POST (admin token required) also overwrites the stored balances.
+    """
+    repair = request.method == 'POST'
+    if repair:
+        auth_err = _require_admin_token()
+        if auth_err: return auth_err
+    if not ps:
+        return jsonify({'status': 'error', 'message': 'Voucher service unavailable'}), 500
+    conn = _db_connect()
+    if not conn:
+        return jsonify({'status': 'error', 'message': 'Database not available'}), 500
+    try:
+        report = _verify_voucher_balances(conn, repair=repair)
+    except Exception as exc:
+        app.logger.exception('Voucher balance verification failed')
+        return jsonify({'status': 'error', 'message': str(exc)}), 500
+    return jsonify({'status': 'success', **report})
+
+
+@app.route('/api/admin/tasks', methods=['GET'])
+def api_admin_tasks():
+    """Background task scheduler state: per-task interval, budget, last run duration and outcome."""
+    sched = _TASK_SCHEDULER
+    if sched is None:
+        return jsonify({'status': 'success', 'enabled': IDLE_TASKS_ENABLED, 'running': False, 'lanes': {}, 'tasks': []})
+    return jsonify({'status': 'success', 'enabled': IDLE_TASKS_ENABLED, **sched.snapshot()})
+
+
+@app.route('/api/admin/tasks/<name>/run', methods=['POST'])
+def api_admin_run_task(name):
+    """Make a background task due now (its idle/ERP gate still applies)."""
+    sched = _TASK_SCHEDULER
+    if sched is None:
+        return jsonify({'status': 'error', 'message': 'Task scheduler not running'}), 503
+    if not sched.trigger(name):
+        return jsonify({'status': 'error', 'message': f'Unknown task: {name}'}), 404
+    return jsonify({'status': 'success', 'task': name})
+
+
 @app.route('/api/admin/invoice-queue', methods=['GET'])
 def api_invoice_queue_stats():
     """Return counts of invoices in the till-agent directories and the POS key status."""
     inv_base = Path('invoices')
-    def count_json(path: Path) -> int:
-        try:
-            return sum(1 for f in path.glob('*.json')) if path.is_dir() else 0
-        except Exception:
-            return 0
+    count_json = _count_json_files
+    pending = None
+    try:
+        conn = _db_connect()
+        if conn and inv_base.is_dir():
+            ps.invoice_journal_sync(conn, str(inv_base))
+            row = conn.execute("SELECT COUNT(*) FROM invoice_journal WHERE location='live'").fetchone()
+            pending = int(row[0]) if row else 0
+    except Exception:
+        pending = None
 
     stats = {
-        'pending':  count_json(inv_base),
+        'pending':  pending if pending is not None else count_json(inv_base),
         'failed':   count_json(inv_base / 'post_failed'),
         'sent':     count_json(inv_base / 'posted_remote'),
         'queue_pending':  count_json(POS_QUEUE_DIR / 'pending'),
@@ -4059,53 +4711,60 @@ def api_trapped_sales():
     if not conn:
         return jsonify({'status': 'error', 'message': 'DB unavailable'}), 500
 
+    # Three set-based passes (headers, lines with item check, payments), joined here
     rows = conn.execute("""
         SELECT s.sale_id, s.created_utc, s.cashier, s.customer_id, s.total, s.queue_status,
-               (SELECT ob.last_error FROM outbox ob WHERE ob.ref_id = s.sale_id
-                ORDER BY ob.id DESC LIMIT 1) AS last_error
+               ob.last_error
         FROM sales s
+        LEFT JOIN (
+            SELECT o.ref_id, o.last_error FROM outbox o
+            WHERE o.id IN (SELECT MAX(id) FROM outbox GROUP BY ref_id)
+        ) ob ON ob.ref_id = s.sale_id
         WHERE s.queue_status != 'posted'
         ORDER BY s.created_utc ASC
     """).fetchall()
+    lines_by_sale: Dict[str, List[Dict[str, Any]]] = {}
+    for ln in conn.execute("""
+        SELECT l.sale_id, l.item_id, l.item_name, l.qty, l.rate, l.line_total, l.attributes,
+               (i.item_id IS NOT NULL) AS in_local_db
+        FROM sales s
+        JOIN sale_lines l ON l.sale_id = s.sale_id
+        LEFT JOIN items i ON i.item_id = l.item_id
+        WHERE s.queue_status != 'posted'
+        ORDER BY l.sale_id, l.line_no
+    """):
+        lines_by_sale.setdefault(ln['sale_id'], []).append({
+            'item_id': ln['item_id'],
+            'item_name': ln['item_name'],
+            'qty': ln['qty'],
+            'rate': ln['rate'],
+            'line_total': ln['line_total'],
+            'attributes': ln['attributes'],
+            'in_local_db': bool(ln['in_local_db']),
+        })
+    payments_by_sale: Dict[str, List[Dict[str, Any]]] = {}
+    for p in conn.execute("""
+        SELECT p.sale_id, p.method, p.amount_gbp
+        FROM sales s
+        JOIN payments p ON p.sale_id = s.sale_id
+        WHERE s.queue_status != 'posted'
+        ORDER BY p.sale_id, p.seq
+    """):
+        payments_by_sale.setdefault(p['sale_id'], []).append({'method': p['method'], 'amount_gbp': p['amount_gbp']})
 
     sales = []
     for r in rows:
         sale = dict(r)
-
-        # Lines with local-DB item existence check
-        line_rows = conn.execute(
-            "SELECT item_id, item_name, qty, rate, line_total, attributes FROM sale_lines WHERE sale_id=? ORDER BY line_no",
-            (r['sale_id'],)
-        ).fetchall()
-        lines = []
-        for ln in line_rows:
-            exists = conn.execute("SELECT 1 FROM items WHERE item_id=?", (ln['item_id'],)).fetchone()
-            lines.append({
-                'item_id': ln['item_id'],
-                'item_name': ln['item_name'],
-                'qty': ln['qty'],
-                'rate': ln['rate'],
-                'line_total': ln['line_total'],
-                'attributes': ln['attributes'],
-                'in_local_db': bool(exists),
-            })
+        lines = lines_by_sale.get(r['sale_id'], [])
         sale['lines'] = lines
-
-        # Payments
-        pay_rows = conn.execute(
-            "SELECT method, amount_gbp FROM payments WHERE sale_id=? ORDER BY seq",
-            (r['sale_id'],)
-        ).fetchall()
-        sale['payments'] = [dict(p) for p in pay_rows]
+        sale['payments'] = payments_by_sale.get(r['sale_id'], [])
 
         # Quick diagnosis summary
         missing = [ln['item_id'] for ln in lines if not ln['in_local_db']]
         if missing:
             sale['diagnosis'] = f"Item(s) not in local DB: {', '.join(missing)}"
-        elif sale['last_error']:
-            sale['diagnosis'] = None  # let last_error speak for itself
         else:
-            sale['diagnosis'] = None
+            sale['diagnosis'] = None  # let last_error speak for itself
 
         sales.append(sale)
 
@@ -4200,12 +4859,28 @@ def api_trapped_sales_retry():
             "SELECT id FROM outbox WHERE ref_id=? AND kind='sale' ORDER BY id DESC LIMIT 1", (sale_id,)
         ).fetchone()
     ob_id = ob_row['id'] if ob_row else None
+    # Lease the row so the idle dispatcher / sync_worker cannot post it at the same time
+    if ob_id and not ps.claim_outbox_entry(conn, ob_id):
+        return jsonify({'status': 'error', 'message': 'Sale is already being posted — try again shortly'}), 409
 
     conn.execute("UPDATE sales SET queue_status='posting' WHERE sale_id=?", (sale_id,))
     conn.commit()
     try:
-        resp = ps.post_sale_to_erpnext(payload)
-        docname = resp.get('name') or resp.get('docname') or 'OK'
+        # Skips the invoice if an earlier attempt already created it (only vouchers left)
+        result = ps.send_outbox_sale(payload, ps.outbox_progress(conn, ob_id) if ob_id else None)
+    except Exception as exc:
+        err = str(exc)
+        progress = getattr(exc, 'progress', None)
+        conn.execute(
+            "UPDATE sales SET queue_status='failed', erp_docname=COALESCE(?, erp_docname) WHERE sale_id=?",
+            ((progress or {}).get('sale_docname'), sale_id)
+        )
+        if ob_id:
+            ps.outbox_record_failure(conn, ob_id, err, progress)
+        conn.commit()
+        return jsonify({'status': 'success', 'posted': False, 'error': err})
+    docname = result.get('docname') or 'OK'
+    try:
         conn.execute(
             "UPDATE sales SET queue_status='posted', erp_docname=COALESCE(?,erp_docname,'OK') WHERE sale_id=?",
             (docname, sale_id)
@@ -4213,16 +4888,16 @@ def api_trapped_sales_retry():
         if ob_id:
             conn.execute("DELETE FROM outbox WHERE id=?", (ob_id,))
         conn.commit()
-        return jsonify({'status': 'success', 'posted': True, 'erp_docname': docname})
     except Exception as exc:
-        err = str(exc)
-        conn.execute("UPDATE sales SET queue_status='failed' WHERE sale_id=?", (sale_id,))
+        # The invoice exists in ERPNext: keep that on the outbox row so no retry posts it again
+        conn.rollback()
+        app.logger.exception('Recording posted sale %s failed', sale_id)
         if ob_id:
-            conn.execute(
-                "UPDATE outbox SET attempts=attempts+1, last_error=? WHERE id=?", (err, ob_id)
-            )
-        conn.commit()
-        return jsonify({'status': 'success', 'posted': False, 'error': err})
+            ps.outbox_record_failure(conn, ob_id, f'Recording result failed: {exc}', result.get('progress'))
+            conn.commit()
+        return jsonify({'status': 'error', 'posted': True, 'erp_docname': docname,
+                        'message': f'Posted, but recording the result failed: {exc}'}), 500
+    return jsonify({'status': 'success', 'posted': True, 'erp_docname': docname})
 
 
 @app.route('/api/admin/trapped-sales/delete', methods=['POST'])
@@ -4311,7 +4986,7 @@ def api_db_seed_demo():
     if not ps:
         return jsonify({'status':'error','message':'pos_service not available'}), 500
     try:
-        conn = _db_connect() or ps.connect(POS_DB_PATH)
+        conn = _db_connect() or ps.pooled_connect(POS_DB_PATH)
         # ensure schema
         try:
             conn.execute('SELECT 1 FROM items LIMIT 1')
@@ -4330,7 +5005,7 @@ def api_db_ensure_demo():
     if not ps:
         return jsonify({'status':'error','message':'pos_service not available'}), 500
     try:
-        conn = _db_connect() or ps.connect(POS_DB_PATH)
+        conn = _db_connect() or ps.pooled_connect(POS_DB_PATH)
         # If no tables, init
         try:
             conn.execute('SELECT 1 FROM items LIMIT 1')
@@ -4364,7 +5039,12 @@ def api_db_status():
         }.items():
             row = conn.execute(sql).fetchone()
             counts[name] = int(row['c']) if row and 'c' in row.keys() else 0
-        return jsonify({'status':'success','present': True, 'counts': counts, 'db_path': POS_DB_PATH})
+        pool = ps.get_pool(POS_DB_PATH).snapshot()
+        return jsonify({'status':'success','present': True, 'counts': counts, 'db_path': POS_DB_PATH, 'pool': pool,
+                        'browse_cache': _browse_cache_stats(),
+                        'barcode_scans': _scan_latency_stats(),
+                        'http': pos_http.METRICS.snapshot(),
+                        'thumbnails': _thumb_stats()})
     except Exception as e:
         return jsonify({'status':'error','message': str(e)}), 500
 
@@ -4382,7 +5062,7 @@ def api_db_sync_items():
         try:
             # Connect to DB inside the worker thread to avoid cross-thread SQLite use
             try:
-                conn = _db_connect() or ps.connect(POS_DB_PATH)
+                conn = _db_connect() or ps.pooled_connect(POS_DB_PATH)
             except Exception as e:
                 app.logger.exception('Failed to connect to DB inside sync worker: %s', e)
                 return
@@ -4393,7 +5073,7 @@ def api_db_sync_items():
                 pass
             # Run a few loops to fetch items, attributes, barcodes, bins and prices
             ps.sync_cycle(conn, warehouse=POS_WAREHOUSE, price_list=POS_PRICE_LIST, loops=3)
-            _browse_cache_invalidate('browse:')
+            _browse_cache_apply_catalog_changes()
             app.logger.info('ERPNext incremental sync completed')
         except Exception as exc:
             app.logger.exception('ERP sync failed: %s', exc)
@@ -4414,6 +5094,8 @@ def api_db_full_sync_items():
         return jsonify({'status':'error','message':'ERPNext not configured'}), 400
     if not ps or not hasattr(ps, 'full_sync_from_erp'):
         return jsonify({'status':'error','message':'pos_service not available or missing full sync implementation'}), 500
+    # An interrupted full sync resumes from its checkpoint unless ?fresh=1 is passed
+    fresh = (request.args.get('fresh') or '').strip().lower() in ('1', 'true', 'yes')
     def _run_sync():
         conn = None
         try:
@@ -4428,25 +5110,40 @@ def api_db_full_sync_items():
                 status="running",
                 stage="starting",
                 totals={"items": 0, "attr_defs": 0, "barcodes": 0, "bins": 0, "prices": 0},
+                rates={},
                 last_pulled=0,
                 last_update=_utcnow_z(),
                 fast_mode=fast_mode
             )
-            def _progress(stage, pulled, total):
+            def _progress(stage, pulled, total, rate=None):
+                # Bin/Item Price/Item Barcode report from parallel threads; update under the lock
                 stage_key = stage
                 if stage == "attributes":
                     stage_key = "attr_defs"
-                totals_snapshot = _get_full_sync_status().get("totals") or {}
-                totals_snapshot[stage_key] = total
-                _set_full_sync_status(
-                    status="running",
-                    stage=stage,
-                    last_pulled=pulled,
-                    totals=totals_snapshot,
-                    last_update=_utcnow_z()
-                )
-            totals = ps.full_sync_from_erp(conn, warehouse=POS_WAREHOUSE, price_list=POS_PRICE_LIST, progress_cb=_progress)
+                with _FULL_SYNC_LOCK:
+                    totals_snapshot = dict(_FULL_SYNC_STATUS.get("totals") or {})
+                    totals_snapshot[stage_key] = total
+                    rates_snapshot = dict(_FULL_SYNC_STATUS.get("rates") or {})
+                    if rate is not None:
+                        rates_snapshot[stage_key] = rate
+                    _FULL_SYNC_STATUS.update(
+                        status="running",
+                        stage=stage,
+                        last_pulled=pulled,
+                        totals=totals_snapshot,
+                        rates=rates_snapshot,
+                        last_update=_utcnow_z()
+                    )
+            totals = ps.full_sync_from_erp(conn, warehouse=POS_WAREHOUSE, price_list=POS_PRICE_LIST,
+                                           progress_cb=_progress, resume=not fresh)
+            changes = ps.drain_catalog_changes() or {}
+            ps.BARCODE_MAP.invalidate_all()
+            ps.invalidate_item_matrix(conn)
+            conn.commit()
+            _ensure_catalog_tiles(conn)
             _browse_cache_invalidate('browse:')
+            if changes.get('images'):
+                _thumb_prewarm_new_images(changes['images'])
             app.logger.info(
                 'ERPNext full sync completed (items=%s, attrs=%s, barcodes=%s, bins=%s, prices=%s)',
                 totals.get('items'), totals.get('attr_defs'), totals.get('barcodes'), totals.get('bins'), totals.get('prices')
@@ -4473,7 +5170,7 @@ def api_db_sync_cashiers():
     def _run_sync():
         conn = None
         try:
-            conn = _db_connect() or ps.connect(POS_DB_PATH)
+            conn = _db_connect() or ps.pooled_connect(POS_DB_PATH)
             if not conn:
                 return
             updated = _maybe_sync_cashiers(conn, force=True)
@@ -4510,41 +5207,32 @@ def api_thumb():
         height = THUMB_DEFAULT_SIZE
     width = max(16, min(width, THUMB_MAX_SIZE))
     height = max(16, min(height, THUMB_MAX_SIZE))
-    THUMB_CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    cache_path = _thumb_cache_path(normalized, width, height)
-    if cache_path.exists():
-        return send_file(cache_path, mimetype='image/jpeg')
-    try:
-        resp = requests.get(normalized, timeout=THUMB_TIMEOUT)
-        if resp.status_code != 200:
-            return jsonify({'status': 'error', 'message': f'Image fetch failed ({resp.status_code})'}), 502
-        data = resp.content
-        if not data:
-            return jsonify({'status': 'error', 'message': 'Image fetch returned empty'}), 502
-        if len(data) > THUMB_MAX_BYTES:
-            return jsonify({'status': 'error', 'message': 'Image too large'}), 413
-        thumb_bytes = _build_thumbnail_bytes(data, width, height)
-        tmp_path = cache_path.with_suffix('.tmp')
-        with open(tmp_path, 'wb') as f:
-            f.write(thumb_bytes)
+    fmt = _thumb_format_for(request.headers.get('Accept'))
+    cache_path, fut = _thumb_submit(normalized, width, height, fmt)
+    if fut is not None:
         try:
-            tmp_path.replace(cache_path)
+            fut.result(timeout=THUMB_WAIT_SECONDS)
+        except FutureTimeout:
+            # Still generating: answer now rather than hold this worker thread
+            pending = send_file(BytesIO(_THUMB_PLACEHOLDER), mimetype='image/gif')
+            pending.status_code = 202
+            pending.headers['Retry-After'] = '1'
+            pending.headers['Cache-Control'] = 'no-store'
+            return pending
+        except ThumbnailError as exc:
+            return jsonify({'status': 'error', 'message': exc.message}), exc.status
         except Exception:
-            cache_path = tmp_path
-        return send_file(cache_path, mimetype='image/jpeg')
-    except Exception as exc:
-        app.logger.warning('Thumbnail build failed: %s', exc)
-        return jsonify({'status': 'error', 'message': 'Thumbnail build failed'}), 500
-
-@app.route('/api/item_matrix')
-def item_matrix():
-    """Return a variant matrix for a template item from SQLite (sizes as columns; colors/widths as rows)."""
-    template_id = request.args.get('item')
-    if not template_id:
-        return jsonify({'status': 'error', 'message': 'Missing item parameter'}), 400
-    conn = _db_connect()
-    if not conn:
-        return jsonify({'status': 'error', 'message': 'Database not available'}), 500
+            return jsonify({'status': 'error', 'message': 'Thumbnail build failed'}), 500
+    else:
+        _thumb_touch(cache_path)
+    # send_file answers If-None-Match/If-Modified-Since with 304
+    resp = send_file(cache_path, mimetype=_THUMB_FORMATS[fmt][1])
+    resp.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    resp.headers['Vary'] = 'Accept'
+    return resp
+
+def _build_item_matrix(conn: sqlite3.Connection, template_id: str) -> Optional[Dict[str, Any]]:
+    """Build the {data, template} matrix payload for a template (None when it isn't one)."""
     tpl = conn.execute(
         """
         SELECT i.item_id,
@@ -4560,7 +5248,7 @@ def item_matrix():
         (template_id,)
     ).fetchone()
     if not tpl:
-        return jsonify({'status': 'error', 'message': 'Template not found'}), 404
+        return None
     variants = {}
     colors=set(); widths=set(); sizes=set()
     style_codes: Dict[str, str] = {}
@@ -4574,7 +5262,8 @@ def item_matrix():
                v.image_url,
                v.custom_style_code,
                COALESCE(v.price, p.price) AS rate,
-               COALESCE(s.qty, 0) AS qty
+               COALESCE(s.qty, 0) AS qty,
+               COALESCE((SELECT SUM(lr.qty) FROM layaway_reservations lr WHERE lr.item_id = v.item_id), 0) AS reserved_qty
         FROM items v
         LEFT JOIN items p ON p.item_id = v.parent_id
         LEFT JOIN stock s ON s.item_id = v.item_id AND s.warehouse = ?
@@ -4582,7 +5271,6 @@ def item_matrix():
         """,
         (POS_WAREHOUSE, template_id)
     ).fetchall()
-    reserved = _layaway_reserved_qty(conn)
     attr_map = {}
     if rows:
         ids = tuple(r["item_id"] for r in rows)
@@ -4610,7 +5298,7 @@ def item_matrix():
         style_code = (r["custom_style_code"] or '').strip() if r["custom_style_code"] else ''
         if style_code:
             style_codes.setdefault(color, style_code)
-        avail_qty = max(0.0, float(r['qty']) - reserved.get(r['item_id'], 0.0))
+        avail_qty = max(0.0, float(r['qty']) - float(r['reserved_qty'] or 0.0))
         variants[key] = {
             'item_id': r['item_id'],
             'item_name': r['name'],
@@ -4649,7 +5337,72 @@ def item_matrix():
         'standard_rate': float(tpl['standard_rate']) if tpl['standard_rate'] is not None else None,
         'image': _absolute_image_url(tpl['image_url']),
     }
-    return jsonify({'status': 'success', 'data': data, 'template': template_payload})
+    return {'data': data, 'template': template_payload}
+
+
+def _item_matrix_payload(conn: sqlite3.Connection, template_id: str) -> Optional[Dict[str, Any]]:
+    """Serve the matrix from item_matrix_cache, building and storing it on a miss."""
+    if not ps:
+        return _build_item_matrix(conn, template_id)
+    try:
+        cached = ps.item_matrix_cache_get(conn, template_id, POS_WAREHOUSE)
+    except sqlite3.OperationalError:
+        return _build_item_matrix(conn, template_id)
+    if cached is not None:
+        return cached
+    try:
+        built = ps.item_matrix_cache_build(conn, [template_id], _build_item_matrix, POS_WAREHOUSE)
+    except sqlite3.OperationalError:
+        app.logger.debug('Item matrix cache read failed for %s', template_id, exc_info=True)
+        return _build_item_matrix(conn, template_id)
+    return built.get(template_id)
+
+
+def _prewarm_item_matrices(conn: sqlite3.Connection, items: Optional[List[Dict[str, Any]]] = None) -> int:
+    """Pre-build cached matrices for the top recently sold templates; returns how many were built."""
+    if not ps or ITEM_MATRIX_PREWARM <= 0 or not _db_has_templates(conn):
+        return 0
+    if items is None:
+        items = _db_recent_items_payload(conn, ITEM_MATRIX_PREWARM)
+    ids = [rec.get('item_code') or rec.get('name') for rec in items[:ITEM_MATRIX_PREWARM]]
+    missing = ps.item_matrix_uncached(conn, ids, POS_WAREHOUSE)
+    if not missing:
+        return 0
+    return len(ps.item_matrix_cache_build(conn, missing, _build_item_matrix, POS_WAREHOUSE))
+
+
+@app.route('/api/item_matrix')
+def item_matrix():
+    """Return a variant matrix for a template item (sizes as columns; colors/widths as rows).
+
+    Served from the per-template item_matrix_cache blob; a miss is built from a plain
+    read and cached unless a writer invalidated it meanwhile.
+    """
+    template_id = request.args.get('item')
+    if not template_id:
+        return jsonify({'status': 'error', 'message': 'Missing item parameter'}), 400
+    conn = _db_connect()
+    if not conn:
+        return jsonify({'status': 'error', 'message': 'Database not available'}), 500
+    payload = _item_matrix_payload(conn, template_id)
+    if not payload:
+        return jsonify({'status': 'error', 'message': 'Template not found'}), 404
+    return jsonify({'status': 'success', 'data': payload['data'], 'template': payload['template']})
+
+
+_SCAN_LATENCY_MS: deque = deque(maxlen=2048)
+
+
+def _scan_latency_stats() -> Dict[str, Any]:
+    samples = sorted(_SCAN_LATENCY_MS)
+    if not samples:
+        return {'count': 0, 'p50_ms': None, 'p99_ms': None}
+    def pct(p: float) -> float:
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))], 3)
+    out: Dict[str, Any] = {'count': len(samples), 'p50_ms': pct(0.50), 'p99_ms': pct(0.99)}
+    if ps:
+        out['map'] = ps.BARCODE_MAP.stats()
+    return out
 
 
 @app.route('/api/lookup-barcode')
@@ -4664,47 +5417,16 @@ def api_lookup_barcode():
     conn = _db_connect()
     if not conn:
         return jsonify({'status': 'error', 'message': 'Database not available'}), 500
-    row = conn.execute(
-        """
-        SELECT i.item_id,
-               i.name,
-               i.brand,
-               i.item_group,
-               i.parent_id,
-               i.vat_rate,
-               i.custom_style_code,
-               (SELECT price_effective FROM v_item_prices p WHERE p.item_id = i.item_id) AS rate,
-               COALESCE((SELECT qty FROM stock s WHERE s.item_id=i.item_id AND s.warehouse='Shop'), 0) AS qty
-        FROM barcodes b
-        JOIN items i ON i.item_id = b.item_id
-        WHERE b.barcode = ? AND i.active=1
-        """,
-        (code,)
-    ).fetchone()
-    # If no barcode row found, fall back to matching the code against item_id/name
-    if not row:
-        try:
-            row = conn.execute(
-                """
-                SELECT i.item_id,
-                       i.name,
-                       i.brand,
-                       i.item_group,
-                       i.parent_id,
-                       i.vat_rate,
-                       i.custom_style_code,
-                       (SELECT price_effective FROM v_item_prices p WHERE p.item_id = i.item_id) AS rate,
-                       COALESCE((SELECT qty FROM stock s WHERE s.item_id=i.item_id AND s.warehouse='Shop'), 0) AS qty
-                FROM items i
-                WHERE (i.item_id = ? OR i.name = ?) AND i.active=1
-                """,
-                (code, code)
-            ).fetchone()
-        except Exception:
-            row = None
+    started = time.perf_counter()
+    # In-memory barcode map (item_id and name matches fall back to one SQL probe)
+    row = ps.resolve_barcode(conn, code, POS_WAREHOUSE)
+    _SCAN_LATENCY_MS.append((time.perf_counter() - started) * 1000.0)
     if not row:
         return jsonify({'status': 'error', 'message': 'Not found'}), 404
-    attrs = _variant_attrs_dict(conn, row['item_id'])
+    attrs = {}
+    for attr_name, value in row['attributes']:
+        for key in _attribute_payload_keys(attr_name):
+            attrs[key] = value
     style_code = (row['custom_style_code'] or '').strip() if row['custom_style_code'] else ''
     brand = row['brand'] if row['brand'] else None
     item_group = row['item_group'] if row['item_group'] else None
@@ -4727,11 +5449,11 @@ def api_lookup_barcode():
 @app.route('/api/variant-info')
 def api_variant_info():
     """Return basic variant info for a list of item_ids: name and attributes.
-    Query param: ids=ID1,ID2,...
-    Response: { status, variants: { <id>: { item_id, name, brand, attributes } } }
+    Query params: ids=ID1,ID2,...; include=items to also return cart-ready item payloads
+    Response: { status, variants: { <id>: { item_id, name, brand, attributes } }, items?: [...] }
     """
     ids_raw = request.args.get('ids') or ''
-    ids = [s for s in (ids_raw.split(',') if ids_raw else []) if s]
+    ids = list(dict.fromkeys(s for s in (ids_raw.split(',') if ids_raw else []) if s))
     if not ids:
         return jsonify({'status': 'error', 'message': 'Missing ids'}), 400
     conn = _db_connect()
@@ -4757,14 +5479,19 @@ def api_variant_info():
             'image_url': _absolute_image_url(r['image_url']) if r['image_url'] else None,
             'attributes': {}
         }
-    # Attach attributes (normalized key names)
+    # Attach attributes (normalized key names) from one batched query
+    attr_map = _variant_attrs_map(conn, ids)
     for vid in ids:
         if vid not in out:
             out[vid] = {'item_id': vid, 'name': '', 'brand': None, 'attributes': {}}
-        attrs = _variant_attrs_dict(conn, vid)
+        attrs = attr_map.get(vid)
         if attrs:
             out[vid]['attributes'].update(attrs)
-    return jsonify({'status': 'success', 'variants': out})
+    resp: Dict[str, Any] = {'status': 'success', 'variants': out}
+    include = {s.strip() for s in (request.args.get('include') or '').split(',') if s.strip()}
+    if 'items' in include:
+        resp['items'] = _db_variant_payload_for_ids(conn, ids)
+    return jsonify(resp)
 
 
 # --- Receipt/Sale lookup (for returns) ---
@@ -4797,35 +5524,27 @@ def api_get_sale(sale_id: str):
             }
             return jsonify({'status': 'success', 'sale': out})
         # Fallback: scan invoices/ for a record whose invoice_name matches sid (e.g., when filename differs)
-        inv_dir = 'invoices'
-        if os.path.isdir(inv_dir):
-            for name in os.listdir(inv_dir):
-                if not name.endswith('.json'):
-                    continue
-                try:
-                    with open(os.path.join(inv_dir, name), 'r', encoding='utf-8') as f:
-                        rec = _json.load(f)
-                    inv_name = (rec.get('invoice_name') or '').strip()
-                    if inv_name and inv_name == sid:
-                        items = []
-                        for it in rec.get('items') or []:
-                            items.append({
-                                'item_code': it.get('item_code') or it.get('code') or it.get('name'),
-                                'item_name': it.get('item_name') or it.get('name') or (it.get('item_code') or ''),
-                                'qty': it.get('qty') or 1,
-                                'rate': it.get('rate') or it.get('price') or 0,
-                                'vat_rate': it.get('vat_rate')
-                            })
-                        out = {
-                            'id': inv_name,
-                            'customer': rec.get('customer') or '',
-                            'items': items,
-                            'total': rec.get('total')
-                        }
-                        return jsonify({'status': 'success', 'sale': out})
-                except Exception:
-                    # ignore unreadable entries
-                    continue
+        # (also covers receipts rolled into invoices/archive/)
+        conn = _db_connect()
+        rec = ps.invoice_journal_load(conn, sid, 'invoices') if conn and os.path.isdir('invoices') else None
+        inv_name = ((rec or {}).get('invoice_name') or '').strip()
+        if inv_name and inv_name == sid:
+            items = []
+            for it in rec.get('items') or []:
+                items.append({
+                    'item_code': it.get('item_code') or it.get('code') or it.get('name'),
+                    'item_name': it.get('item_name') or it.get('name') or (it.get('item_code') or ''),
+                    'qty': it.get('qty') or 1,
+                    'rate': it.get('rate') or it.get('price') or 0,
+                    'vat_rate': it.get('vat_rate')
+                })
+            out = {
+                'id': inv_name,
+                'customer': rec.get('customer') or '',
+                'items': items,
+                'total': rec.get('total')
+            }
+            return jsonify({'status': 'success', 'sale': out})
     except Exception:
         pass
     # 2) SQLite sales table via pos_service, if available
@@ -5241,17 +5960,34 @@ def _warm_browse_cache():
         if not conn:
             return
         try:
+            # Bootstrap back-fills tiles in ERP mode; this covers mock/demo databases
+            _ensure_catalog_tiles(conn)
             # Warm recent items (the slowest cold query)
             cache_key = f"browse:recent:{BROWSE_RECENT_LIMIT}"
-            if _browse_cache_get(cache_key) is None:
+            items = _browse_cache_get(cache_key)
+            if items is None:
                 items = _db_recent_items_payload(conn, BROWSE_RECENT_LIMIT)
-                _browse_cache_set(cache_key, items)
+                _browse_cache_set(cache_key, items, tags=_browse_item_tags(items, 'recent'))
                 app.logger.info('Browse cache warmed: %d recent items', len(items))
+            # Pre-build size grids for the best sellers so opening their tiles is one row read
+            n = _prewarm_item_matrices(conn, items if len(items) >= ITEM_MATRIX_PREWARM else None)
+            if n:
+                app.logger.info('Item matrix cache warmed: %d templates', n)
             # Warm brand list
             if _browse_cache_get("browse:brands") is None:
                 brands = _db_brand_list(conn)
-                _browse_cache_set("browse:brands", brands)
+                _browse_cache_set("browse:brands", brands, tags=('catalog',))
                 app.logger.info('Browse cache warmed: %d brands', len(brands))
+            # Build the barcode map so the first scan of the day is a dict hit
+            if ps:
+                n = ps.BARCODE_MAP.ensure_loaded(conn)
+                app.logger.info('Barcode map loaded: %d items', n)
+            # Drain the search-index queue so the first typed search isn't the one paying for it
+            if ps and ps.item_search_mode(conn):
+                n = ps.flush_item_search(conn)
+                conn.commit()
+                if n:
+                    app.logger.info('Item search index refreshed: %d items', n)
         except Exception:
             app.logger.debug('Browse cache warm-up failed', exc_info=True)
         finally:
@@ -5336,45 +6072,24 @@ def api_invoices_by_date():
     except Exception:
         pass
 
-    # From local invoices/*.json
+    # From local invoices/*.json, via the invoice journal index
     try:
-        inv_dir = 'invoices'
-        if os.path.isdir(inv_dir):
-            for name in os.listdir(inv_dir):
-                if not name.endswith('.json'):
-                    continue
-                fpath = os.path.join(inv_dir, name)
-                try:
-                    with open(fpath, 'r', encoding='utf-8') as f:
-                        rec = _json.load(f)
-                except Exception:
-                    continue
-                created = (rec.get('created_at') or '').strip()
-                if not created:
-                    continue
-                # Compare date portion only
-                if not created.startswith(qdate):
-                    # Accept ISO without T (local) or with time; fallback parse
-                    try:
-                        dt = datetime.fromisoformat(created.replace('Z',''))
-                        if dt.strftime('%Y-%m-%d') != qdate:
-                            continue
-                    except Exception:
-                        continue
-                inv_id = (rec.get('invoice_name') or '').strip() or name[:-5]
+        conn = _db_connect()
+        if conn and os.path.isdir('invoices'):
+            for rec in ps.invoice_journal_day(conn, qdate, 'invoices'):
+                inv_id = rec['invoice_name'] or rec['file_name'][:-5]
                 if inv_id in seen_ids:
                     continue
-                ok_sidecar = fpath + '.ok'
-                status = 'posted' if os.path.exists(ok_sidecar) else ('posted' if (rec.get('mode') == 'erpnext') else 'queued')
+                status = 'posted' if (rec['acked'] or rec['mode'] == 'erpnext') else 'queued'
                 out.append({
                     'id': inv_id,
-                    'created_at': created,
-                    'customer': rec.get('customer') or '',
-                    'cashier': (((rec.get('cashier') or {}).get('code','') + ' ' + (rec.get('cashier') or {}).get('name','')).strip()),
-                    'total': float(rec.get('total') or 0),
+                    'created_at': rec['created_at'],
+                    'customer': rec['customer'] or '',
+                    'cashier': rec['cashier'] or '',
+                    'total': float(rec['total'] or 0),
                     'source': 'file',
                     'status': status,
-                    'erp_docname': inv_id if rec.get('mode') == 'erpnext' else None,
+                    'erp_docname': inv_id if rec['mode'] == 'erpnext' else None,
                 })
     except Exception:
         pass
@@ -5460,18 +6175,10 @@ def api_invoice_detail(inv_id: str):
             with open(path, 'r', encoding='utf-8') as f:
                 rec = _json.load(f)
         else:
-            # scan for invoice_name match
-            if os.path.isdir(inv_dir):
-                for name in os.listdir(inv_dir):
-                    if not name.endswith('.json'): continue
-                    try:
-                        with open(os.path.join(inv_dir, name), 'r', encoding='utf-8') as f:
-                            r = _json.load(f)
-                        if (r.get('invoice_name') or '') == sid:
-                            rec = r
-                            break
-                    except Exception:
-                        continue
+            # invoice_name match (or an archived receipt) via the invoice journal
+            conn = _db_connect()
+            if conn and os.path.isdir(inv_dir):
+                rec = ps.invoice_journal_load(conn, sid, inv_dir)
         if rec:
             data_items = []
             ids = []
@@ -5549,7 +6256,7 @@ def _schedule_layaway_sync() -> None:
     app.logger.info("[layaway-sync] Scheduling background push to %s", lay_url)
     def _do():
         try:
-            c = _db_connect() or ps.connect(POS_DB_PATH)
+            c = _db_connect() or ps.pooled_connect(POS_DB_PATH)
             if c:
                 ps.push_layaway_outbox(c)
                 c.close()
@@ -5650,6 +6357,7 @@ def _prune_old_layaways(conn: sqlite3.Connection) -> int:
     conn.execute(f"DELETE FROM layaway_audit    WHERE layaway_id IN ({placeholders})", old_ids)
     conn.execute(f"DELETE FROM layaway_payments WHERE layaway_id IN ({placeholders})", old_ids)
     conn.execute(f"DELETE FROM outbox WHERE kind LIKE 'layaway_%' AND ref_id IN ({placeholders})", old_ids)
+    conn.execute(f"DELETE FROM layaway_reservations WHERE layaway_id IN ({placeholders})", old_ids)
     conn.execute(f"DELETE FROM layaways WHERE layaway_id IN ({placeholders})", old_ids)
     conn.commit()
     return len(old_ids)
@@ -5826,6 +6534,7 @@ def api_layaway_create():
             """, (payment_id, layaway_id, now, pay_amount, pay_method, cashier_code or ''))
 
         _lay_audit(conn, layaway_id, 'created', {'total': total, 'paid': pay_amount, 'items': len(items)}, cashier_code)
+        _lay_sync_reservations(conn, layaway_id)
 
         # Queue ERPNext SO creation
         conn.execute("""
@@ -5956,6 +6665,7 @@ def api_layaway_payment(ref: str):
                 INSERT INTO outbox (kind, ref_id, created_utc, payload_json)
                 VALUES ('layaway_complete', ?, ?, ?)
             """, (ref, now, complete_payload))
+            _lay_sync_reservations(conn, ref)
 
         conn.commit()
         _schedule_layaway_sync()
@@ -6000,6 +6710,7 @@ def api_layaway_complete(ref: str):
             (pos_receipt_id, ref)
         )
         _lay_audit(conn, ref, 'completed', {'pos_receipt_id': pos_receipt_id}, cashier_code)
+        _lay_sync_reservations(conn, ref)
         complete_payload = _json.dumps({'pos_receipt_id': pos_receipt_id}, separators=(',', ':'))
         conn.execute("""
             INSERT INTO outbox (kind, ref_id, created_utc, payload_json)
@@ -6037,6 +6748,7 @@ def api_layaway_cancel(ref: str):
         now = _utcnow_z()
         conn.execute("UPDATE layaways SET status='cancelled', sync_status='pending' WHERE layaway_id=?", (ref,))
         _lay_audit(conn, ref, 'cancelled', {'paid': float(row['paid'])}, cashier_code)
+        _lay_sync_reservations(conn, ref)
         conn.execute("""
             INSERT INTO outbox (kind, ref_id, created_utc, payload_json)
             VALUES ('layaway_cancel', ?, ?, '{}')
@@ -6151,6 +6863,7 @@ def api_layaway_collect_item(ref: str):
             "UPDATE layaways SET items=?, paid=?, total=? WHERE layaway_id=?",
             (_json.dumps(items), new_paid, new_total, ref),
         )
+        _lay_sync_reservations(conn, ref)
 
         _lay_audit(conn, ref, 'item_collected', {
             'item_code': item_code,
@@ -6218,6 +6931,7 @@ def api_layaway_update_items(ref: str):
             "UPDATE layaways SET items=?, total=?, sync_status='pending' WHERE layaway_id=?",
             (_json.dumps(new_items, separators=(',', ':')), new_total, ref)
         )
+        _lay_sync_reservations(conn, ref)
         _lay_audit(conn, ref, 'item_removed', {'old_total': old_total, 'new_total': new_total, 'items_count': len(new_items)}, cashier_code)
 
         # Queue SO amendment
@@ -6239,7 +6953,7 @@ def api_layaway_sync():
     """Manually drain the layaway outbox. Returns pending count before and after."""
     if not ps:
         return jsonify({'status': 'error', 'message': 'pos_service not loaded'}), 503
-    conn = _db_connect() or ps.connect(POS_DB_PATH)
+    conn = _db_connect() or ps.pooled_connect(POS_DB_PATH)
     if not conn:
         return jsonify({'status': 'error', 'message': 'DB unavailable'}), 503
     try:
@@ -6261,7 +6975,7 @@ def api_layaway_pull_from_erp():
     """
     if not ps:
         return jsonify({'status': 'error', 'message': 'pos_service not loaded'}), 503
-    conn = _db_connect() or ps.connect(POS_DB_PATH)
+    conn = _db_connect() or ps.pooled_connect(POS_DB_PATH)
     if not conn:
         return jsonify({'status': 'error', 'message': 'DB unavailable'}), 503
     try:
@@ -6329,6 +7043,7 @@ def api_layaway_pull_from_erp():
                                 p.get('pe_name') or '',
                             ),
                         )
+                    _lay_sync_reservations(conn, ref)
                     conn.commit()
                     added += 1
                 else:
@@ -6383,6 +7098,8 @@ def api_layaway_pull_from_erp():
                                         pe_name,
                                     ),
                                 )
+                        if status_update:
+                            _lay_sync_reservations(conn, ref)
                         conn.commit()
                         updated += 1
                     else:
@@ -6403,6 +7120,7 @@ def api_layaway_pull_from_erp():
                         "UPDATE layaways SET status='cancelled', sync_status='synced' WHERE layaway_id=?",
                         (row['layaway_id'],)
                     )
+                    _lay_sync_reservations(conn, row['layaway_id'])
                     updated += 1
             conn.commit()
 
@@ -6426,7 +7144,7 @@ def api_layaway_debug():
     """Diagnostic: show layaway outbox state and configured URLs."""
     lay_url = ERPDASH_URL or ERPNEXT_URL or ''
     lay_key_set = bool(LAYAWAY_ERP_KEY)
-    conn = _db_connect() or (ps.connect(POS_DB_PATH) if ps else None)
+    conn = _db_connect() or (ps.pooled_connect(POS_DB_PATH) if ps else None)
     pending = []
     if conn:
         rows = conn.execute(
@@ -1,18 +1,26 @@
 
 #!/usr/bin/env python3
 # POS scaffold: SQLite + JSON queue + ERPNext sync + NDJSON backups
-import os, sys, json, uuid, sqlite3, time, argparse, datetime as dt, ssl, threading
+import os, sys, json, uuid, sqlite3, time, argparse, datetime as dt, threading, hashlib, io, queue, random, gzip, zlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Set, Tuple
-import urllib.request
+import urllib.parse
 import urllib.error
 
+import pos_http
+
 DB_PATH = os.environ.get("POS_DB_PATH", "pos.db")
 BACKUP_DIR = os.environ.get("POS_BACKUP_DIR", "pos_backup")
 try:
     ITEM_PULL_PAGE_LIMIT = int(os.environ.get("POS_ITEM_PULL_LIMIT", "500"))
 except ValueError:
     ITEM_PULL_PAGE_LIMIT = 500
+try:
+    CUSTOMER_PULL_PAGE_LIMIT = int(os.environ.get("POS_CUSTOMER_PULL_LIMIT", "500"))
+except ValueError:
+    CUSTOMER_PULL_PAGE_LIMIT = 500
+CUSTOMER_PULL_PAGE_LIMIT = max(1, CUSTOMER_PULL_PAGE_LIMIT)
 _BARCODE_PULL_FORBIDDEN = False
 _BIN_PULL_FORBIDDEN = False
 
@@ -41,15 +49,35 @@ UNFETCHABLE_ITEM_DOCS: Set[str] = set()
 _FULL_SYNC_FAST = False
 UNFETCHABLE_ATTRIBUTE_DOCS: Set[str] = set()
 
+# Item doc hydration during pulls: bounded concurrent fetches over keep-alive connections,
+# or (when the API user may list them) batched child-table queries instead of per-item docs.
+try:
+    ERP_FETCH_WORKERS = max(1, int(os.environ.get("POS_ERP_FETCH_WORKERS", "8")))
+except ValueError:
+    ERP_FETCH_WORKERS = 8
+ERP_BATCH_CHILD_TABLES = os.environ.get("POS_ERP_BATCH_CHILD_TABLES", "1") != "0"
+_CHILD_TABLE_FORBIDDEN: Set[str] = set()
+# Item-level VAT custom fields read by _extract_item_vat_rate; which of them this ERPNext
+# site has is learned from one full Item doc (None until then)
+_ITEM_VAT_FIELDS = ("vat_rate", "tax_rate")
+_ITEM_VAT_FIELDS_PRESENT: Optional[List[str]] = None
+
 def iso_now() -> str:
     return dt.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
-def connect(db_path: str = DB_PATH) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path, timeout=30)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    conn.execute("PRAGMA foreign_keys=ON;")
+# Schema checks (ALTERs, view rebuilds) only need to run once per database per process
+_SCHEMA_CHECKED: Set[str] = set()
+_SCHEMA_CHECK_LOCK = threading.Lock()
+
+def _schema_key(db_path: str) -> Optional[str]:
+    if not db_path or db_path == ":memory:" or str(db_path).startswith("file::memory:"):
+        return None
+    try:
+        return os.path.realpath(db_path)
+    except Exception:
+        return str(db_path)
+
+def _run_schema_checks(conn: sqlite3.Connection):
     try:
         _ensure_item_extras(conn)
     except Exception:
@@ -62,16 +90,247 @@ def connect(db_path: str = DB_PATH) -> sqlite3.Connection:
         _ensure_voucher_event_table(conn)
     except Exception:
         pass
+    try:
+        _ensure_voucher_balance_column(conn)
+    except Exception:
+        pass
     try:
         _ensure_voucher_balance_view(conn)
     except Exception:
         pass
+    try:
+        _ensure_catalog_tiles_table(conn)
+    except Exception:
+        pass
+    try:
+        _ensure_item_search_table(conn)
+    except Exception:
+        pass
+    try:
+        _ensure_layaway_reservations_table(conn)
+    except Exception:
+        pass
+    try:
+        _ensure_item_matrix_cache_table(conn)
+    except Exception:
+        pass
+    try:
+        _ensure_outbox_lease_columns(conn)
+    except Exception:
+        pass
+    try:
+        _ensure_invoice_journal_table(conn)
+    except Exception:
+        pass
+
+def _ensure_schema_once(conn: sqlite3.Connection, db_path: str):
+    key = _schema_key(db_path)
+    if key is None:
+        _run_schema_checks(conn)
+        return
+    if key in _SCHEMA_CHECKED:
+        return
+    with _SCHEMA_CHECK_LOCK:
+        if key in _SCHEMA_CHECKED:
+            return
+        _run_schema_checks(conn)
+        # A fresh file has no tables yet; keep checking until init_db has run.
+        try:
+            has_items = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='items'"
+            ).fetchone()
+        except Exception:
+            has_items = None
+        if has_items:
+            _SCHEMA_CHECKED.add(key)
+
+def _open_connection(db_path: str, factory=sqlite3.Connection, check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30, factory=factory, check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA foreign_keys=ON;")
+    _ensure_schema_once(conn, db_path)
     return conn
 
+def connect(db_path: str = DB_PATH) -> sqlite3.Connection:
+    return _open_connection(db_path)
+
 def init_db(conn: sqlite3.Connection, schema_path: str):
     with open(schema_path, "r", encoding="utf-8") as f:
         conn.executescript(f.read())
     conn.commit()
+    _run_schema_checks(conn)
+
+# ---------- CONNECTION POOL ----------
+# Long-lived processes (pos_server under waitress, sync_worker) reuse one connection
+# per thread instead of reconnecting for every request.
+try:
+    DB_POOL_SIZE = max(1, int(os.environ.get("POS_DB_POOL_SIZE", "16")))
+except ValueError:
+    DB_POOL_SIZE = 16
+try:
+    DB_POOL_HEALTH_INTERVAL = float(os.environ.get("POS_DB_POOL_HEALTH_INTERVAL", "30"))
+except ValueError:
+    DB_POOL_HEALTH_INTERVAL = 30.0
+
+class _PooledConnection(sqlite3.Connection):
+    """Connection handed out by ConnectionPool; close() returns it to the pool."""
+    _pool: Optional["ConnectionPool"] = None
+    _depth: int = 0
+    _last_used: float = 0.0
+
+    def close(self):
+        pool = self._pool
+        if pool is None:
+            return super().close()
+        pool._release(self)
+
+    def _really_close(self):
+        self._pool = None
+        try:
+            super().close()
+        except Exception:
+            pass
+
+class ConnectionPool:
+    """Bounded per-thread SQLite connection pool.
+
+    Each thread gets its own connection (SQLite connections must not be shared
+    across threads mid-transaction). Nested acquire/close pairs on one thread are
+    reference counted; when the outermost user closes, any uncommitted work is
+    rolled back so a forgetful handler cannot hold the write lock. Connections of
+    finished threads are reclaimed whenever a new one is opened; once max_size
+    live threads hold connections, further callers get a plain, unpooled one.
+    """
+
+    def __init__(self, db_path: str, max_size: int = DB_POOL_SIZE, health_interval: float = DB_POOL_HEALTH_INTERVAL):
+        self.db_path = db_path
+        self.max_size = max(1, int(max_size))
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._conns: Dict[int, Tuple[threading.Thread, _PooledConnection]] = {}
+        self.stats = {"opened": 0, "reused": 0, "overflow": 0, "discarded": 0}
+
+    def _new_conn(self) -> _PooledConnection:
+        conn = _open_connection(self.db_path, factory=_PooledConnection, check_same_thread=False)
+        conn._pool = self
+        conn._depth = 0
+        conn._last_used = time.time()
+        return conn
+
+    def _healthy(self, conn: _PooledConnection) -> bool:
+        if self.health_interval and (time.time() - conn._last_used) < self.health_interval:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except Exception:
+            return False
+
+    def _reap_dead_locked(self):
+        for ident, (thread, conn) in list(self._conns.items()):
+            if not thread.is_alive():
+                self._conns.pop(ident, None)
+                conn._really_close()
+                self.stats["discarded"] += 1
+
+    def acquire(self) -> sqlite3.Connection:
+        current = threading.current_thread()
+        ident = threading.get_ident()
+        with self._lock:
+            entry = self._conns.get(ident)
+            if entry and entry[0] is not current:
+                # Thread ids are recycled; drop a connection left by a dead thread.
+                self._conns.pop(ident, None)
+                entry[1]._really_close()
+                entry = None
+        conn = entry[1] if entry else None
+        if conn is not None and conn._depth == 0 and not self._healthy(conn):
+            with self._lock:
+                self._conns.pop(ident, None)
+                self.stats["discarded"] += 1
+            conn._really_close()
+            conn = None
+        if conn is None:
+            with self._lock:
+                self._reap_dead_locked()
+                full = len(self._conns) >= self.max_size
+            if full:
+                with self._lock:
+                    self.stats["overflow"] += 1
+                return _open_connection(self.db_path)
+            conn = self._new_conn()
+            with self._lock:
+                self._conns[ident] = (current, conn)
+                self.stats["opened"] += 1
+        else:
+            with self._lock:
+                self.stats["reused"] += 1
+        conn._depth += 1
+        conn._last_used = time.time()
+        return conn
+
+    def _release(self, conn: _PooledConnection):
+        conn._depth = max(0, conn._depth - 1)
+        conn._last_used = time.time()
+        if conn._depth == 0:
+            self._reset(conn)
+
+    def _reset(self, conn: _PooledConnection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            pass
+
+    def release_thread(self):
+        """Force the calling thread's connection back to idle (end of a request)."""
+        entry = self._conns.get(threading.get_ident())
+        if not entry or entry[0] is not threading.current_thread():
+            return
+        conn = entry[1]
+        conn._depth = 0
+        self._reset(conn)
+
+    def close_all(self):
+        with self._lock:
+            conns = [c for _, c in self._conns.values()]
+            self._conns.clear()
+        for conn in conns:
+            conn._really_close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self.stats)
+            out["size"] = len(self._conns)
+            out["max_size"] = self.max_size
+        return out
+
+_POOLS: Dict[str, ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(db_path: str = DB_PATH) -> ConnectionPool:
+    key = _schema_key(db_path) or db_path
+    pool = _POOLS.get(key)
+    if pool is None:
+        with _POOLS_LOCK:
+            pool = _POOLS.get(key)
+            if pool is None:
+                pool = ConnectionPool(db_path)
+                _POOLS[key] = pool
+    return pool
+
+def pooled_connect(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """Return this thread's pooled connection; close() hands it back instead of closing."""
+    if _schema_key(db_path) is None:
+        return connect(db_path)
+    return get_pool(db_path).acquire()
+
+def release_thread_connections():
+    """Reset every pooled connection owned by the calling thread."""
+    for pool in list(_POOLS.values()):
+        pool.release_thread()
 
 def _ensure_item_extras(conn: sqlite3.Connection):
     """Add new optional columns on items table if they are missing."""
@@ -118,9 +377,21 @@ def _ensure_customer_table(conn: sqlite3.Connection):
       email TEXT,
       phone TEXT,
       disabled INTEGER NOT NULL DEFAULT 0,
-      modified_utc TEXT
+      modified_utc TEXT,
+      change_seq INTEGER NOT NULL DEFAULT 0
     )
     """)
+    cols = {row[1] for row in conn.execute("PRAGMA table_info(customers)").fetchall()}
+    if "change_seq" not in cols:
+        conn.execute("ALTER TABLE customers ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+        # Rows cached before the counter existed count as the first change
+        conn.execute("UPDATE customers SET change_seq=1")
+        conn.commit()
+    # Case-insensitive prefix search (range scans) and the directory version counter
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customers_name_nocase ON customers(customer_name COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customers_id_nocase ON customers(name COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customers_modified ON customers(modified_utc)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_customers_change_seq ON customers(change_seq)")
 
 def _ensure_voucher_event_table(conn: sqlite3.Connection):
     """Ensure voucher_events exists for issue/redeem event tracking."""
@@ -143,35 +414,102 @@ def _ensure_voucher_event_table(conn: sqlite3.Connection):
     CREATE INDEX IF NOT EXISTS idx_voucher_events_status ON voucher_events(queue_status, created_utc)
     """)
 
+_VOUCHER_BALANCE_TRIGGERS_SQL = (
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_voucher_ledger_ins AFTER INSERT ON voucher_ledger
+    WHEN NEW.type <> 'issue'
+    BEGIN
+        UPDATE vouchers SET balance = balance + NEW.amount WHERE voucher_code = NEW.voucher_code;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_voucher_ledger_del AFTER DELETE ON voucher_ledger
+    WHEN OLD.type <> 'issue'
+    BEGIN
+        UPDATE vouchers SET balance = balance - OLD.amount WHERE voucher_code = OLD.voucher_code;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_voucher_ledger_upd AFTER UPDATE OF voucher_code, type, amount ON voucher_ledger
+    BEGIN
+        UPDATE vouchers SET balance = balance - CASE WHEN OLD.type = 'issue' THEN 0 ELSE OLD.amount END
+        WHERE voucher_code = OLD.voucher_code;
+        UPDATE vouchers SET balance = balance + CASE WHEN NEW.type = 'issue' THEN 0 ELSE NEW.amount END
+        WHERE voucher_code = NEW.voucher_code;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_vouchers_ins AFTER INSERT ON vouchers
+    BEGIN
+        UPDATE vouchers SET balance = NEW.initial_value + COALESCE(
+            (SELECT SUM(amount) FROM voucher_ledger WHERE voucher_code = NEW.voucher_code AND type <> 'issue'), 0)
+        WHERE voucher_code = NEW.voucher_code;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_vouchers_initial AFTER UPDATE OF initial_value ON vouchers
+    BEGIN
+        UPDATE vouchers SET balance = balance + NEW.initial_value - OLD.initial_value
+        WHERE voucher_code = NEW.voucher_code;
+    END
+    """,
+)
+
+def _ensure_voucher_balance_column(conn: sqlite3.Connection):
+    """Add vouchers.balance (kept current by triggers on voucher_ledger) and back-fill it."""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(vouchers)")}
+    added = "balance" not in cols
+    if added:
+        conn.execute("ALTER TABLE vouchers ADD COLUMN balance NUMERIC NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_voucher_ledger_code ON voucher_ledger(voucher_code)")
+    for ddl in _VOUCHER_BALANCE_TRIGGERS_SQL:
+        conn.execute(ddl)
+    if added:
+        verify_voucher_balances(conn, repair=True)
+    conn.commit()
+
 def _ensure_voucher_balance_view(conn: sqlite3.Connection):
-    """Ensure balance view ignores issue ledger rows to avoid double-counting."""
+    """Keep v_voucher_balance for older readers; it now reads the maintained vouchers.balance."""
     conn.execute("DROP VIEW IF EXISTS v_voucher_balance")
     conn.execute(
         """
         CREATE VIEW v_voucher_balance AS
-        SELECT
-            v.voucher_code,
-            v.active,
-            v.issued_utc,
-            v.initial_value
-            + COALESCE(
-                SUM(
-                    CASE
-                        WHEN l.type = 'issue' THEN 0
-                        ELSE l.amount
-                    END
-                ),
-                0
-            ) AS balance
-        FROM vouchers v
-        LEFT JOIN voucher_ledger l ON l.voucher_code = v.voucher_code
-        GROUP BY v.voucher_code
+        SELECT voucher_code, active, issued_utc, balance
+        FROM vouchers
         """
     )
 
+def verify_voucher_balances(conn: sqlite3.Connection, repair: bool = False) -> Dict[str, Any]:
+    """Recompute every voucher balance from the ledger in one pass and report drift.
+
+    Returns {"checked", "drift": [{"voucher_code", "stored", "ledger"}], "repaired"}.
+    With repair=True the stored balances are overwritten with the ledger figures;
+    the caller commits.
+    """
+    rows = conn.execute("""
+        SELECT v.voucher_code, v.balance AS stored, v.initial_value + COALESCE(s.total, 0) AS ledger
+        FROM vouchers v
+        LEFT JOIN (
+            SELECT voucher_code, SUM(amount) AS total FROM voucher_ledger
+            WHERE type <> 'issue' GROUP BY voucher_code
+        ) s ON s.voucher_code = v.voucher_code
+    """).fetchall()
+    drift = [
+        {"voucher_code": r[0], "stored": float(r[1] or 0), "ledger": float(r[2] or 0)}
+        for r in rows
+        if abs(float(r[1] or 0) - float(r[2] or 0)) > 0.005
+    ]
+    repaired = 0
+    if repair and drift:
+        conn.executemany(
+            "UPDATE vouchers SET balance=? WHERE voucher_code=?",
+            [(d["ledger"], d["voucher_code"]) for d in drift],
+        )
+        repaired = len(drift)
+    return {"checked": len(rows), "drift": drift, "repaired": repaired}
+
 # ---------- UPSERT HELPERS ----------
-def upsert_item(conn: sqlite3.Connection, item: Dict[str, Any]):
-    sql = """
+_UPSERT_ITEM_SQL = """
     INSERT INTO items (item_id, parent_id, name, brand, item_group, custom_style_code, custom_simple_colour, vat_rate, attributes, price, image_url, is_template, active, modified_utc)
     VALUES (:item_id, :parent_id, :name, :brand, :item_group, :custom_style_code, :custom_simple_colour, :vat_rate, :attributes, :price, :image_url, :is_template, :active, :modified_utc)
     ON CONFLICT(item_id) DO UPDATE SET
@@ -189,7 +527,9 @@ def upsert_item(conn: sqlite3.Connection, item: Dict[str, Any]):
       active=excluded.active,
       modified_utc=excluded.modified_utc;
     """
-    conn.execute(sql, item)
+
+def upsert_item(conn: sqlite3.Connection, item: Dict[str, Any]):
+    conn.execute(_UPSERT_ITEM_SQL, item)
 
 def _serialize_item_attributes(attributes: Any) -> Optional[str]:
     if not attributes:
@@ -211,12 +551,15 @@ def _normalize_customer_disabled(value: Any) -> int:
     return 0
 
 
-def upsert_customers(conn: sqlite3.Connection, customers: List[Dict[str, Any]]) -> int:
-    """Cache or refresh ERPNext Customer entries in the local DB."""
+def upsert_customers(conn: sqlite3.Connection, customers: List[Dict[str, Any]], commit: bool = True) -> int:
+    """Cache or refresh ERPNext Customer entries in the local DB.
+
+    Every written row gets the next change_seq, which customers_version() reports.
+    """
     if not customers:
         return 0
     now = iso_now()
-    stored = 0
+    rows = []
     for row in customers:
         name = (row.get("name") or row.get("customer_id") or "").strip()
         if not name:
@@ -226,20 +569,25 @@ def upsert_customers(conn: sqlite3.Connection, customers: List[Dict[str, Any]])
         phone = (row.get("mobile_no") or row.get("phone") or row.get("mobile") or "").strip()
         disabled = _normalize_customer_disabled(row.get("disabled"))
         modified = row.get("modified") or row.get("modified_utc") or now
-        conn.execute("""
-            INSERT INTO customers (name, customer_name, email, phone, disabled, modified_utc)
-            VALUES (?,?,?,?,?,?)
+        rows.append([name, customer_name or name, email or None, phone or None, disabled, modified])
+    if rows:
+        seq = customers_version(conn) + 1
+        for row in rows:
+            row.append(seq)
+        conn.executemany("""
+            INSERT INTO customers (name, customer_name, email, phone, disabled, modified_utc, change_seq)
+            VALUES (?,?,?,?,?,?,?)
             ON CONFLICT(name) DO UPDATE SET
                 customer_name=COALESCE(NULLIF(excluded.customer_name,''), customers.customer_name),
                 email=COALESCE(NULLIF(excluded.email,''), customers.email),
                 phone=COALESCE(NULLIF(excluded.phone,''), customers.phone),
                 disabled=excluded.disabled,
-                modified_utc=excluded.modified_utc
-        """, (name, customer_name or name, email or None, phone or None, disabled, modified))
-        stored += 1
-    if stored:
-        conn.commit()
-    return stored
+                modified_utc=excluded.modified_utc,
+                change_seq=excluded.change_seq
+        """, rows)
+        if commit:
+            conn.commit()
+    return len(rows)
 
 
 def fetch_customers(conn: sqlite3.Connection, include_disabled: bool = False) -> List[Dict[str, str]]:
@@ -253,107 +601,262 @@ def fetch_customers(conn: sqlite3.Connection, include_disabled: bool = False) ->
     return result
 
 
-def ensure_item_for_sale_line(conn: sqlite3.Connection, line: Dict[str, Any]):
+def search_customers(
+    conn: sqlite3.Connection,
+    query: str = "",
+    limit: int = 50,
+    offset: int = 0,
+    include_disabled: bool = False,
+) -> Tuple[List[Dict[str, str]], bool]:
+    """Case-insensitive prefix search on customer_name or name; returns (page, has_more)."""
+    clauses: List[str] = []
+    params: List[Any] = []
+    if not include_disabled:
+        clauses.append("disabled=0")
+    q = (query or "").strip()
+    if q:
+        # Range predicates instead of LIKE so both NOCASE indexes can serve the prefix
+        hi = q + "\uffff"
+        clauses.append(
+            "((customer_name >= ? COLLATE NOCASE AND customer_name < ? COLLATE NOCASE)"
+            " OR (name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE))"
+        )
+        params.extend([q, hi, q, hi])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = conn.execute(
+        f"SELECT name, customer_name FROM customers {where} "
+        "ORDER BY customer_name COLLATE NOCASE, name LIMIT ? OFFSET ?",
+        params + [int(limit) + 1, max(0, int(offset))],
+    ).fetchall()
+    has_more = len(rows) > limit
+    result = [
+        {"name": row["name"], "customer_name": row["customer_name"] or row["name"]}
+        for row in rows[:limit]
+    ]
+    return result, has_more
+
+
+def customers_version(conn: sqlite3.Connection) -> int:
+    """Change counter of the customers cache (an index lookup); 0 means the cache is empty.
+
+    Bumped by every upsert_customers() call, so renames and disables change it even when
+    ERP's modified stamp sorts below an older locally written one.
+    """
+    row = conn.execute("SELECT MAX(change_seq) FROM customers").fetchone()
+    return int(row[0] or 0)
+
+def customers_etag(conn: sqlite3.Connection, query: str = "", limit: int = 50, offset: int = 0) -> Optional[str]:
+    """ETag for one /api/customers page; None while the cache is empty."""
+    version = customers_version(conn)
+    if not version:
+        return None
+    key = f"{version}|{(query or '').strip()}|{int(limit)}|{max(0, int(offset))}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+_SALE_ITEM_UPSERT_SQL = """
+    INSERT INTO items (item_id, parent_id, name, brand, item_group, custom_style_code, custom_simple_colour, vat_rate, attributes, price, image_url, is_template, active, modified_utc)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(item_id) DO UPDATE SET
+        name=COALESCE(NULLIF(excluded.name,''), items.name),
+        brand=COALESCE(excluded.brand, items.brand),
+        item_group=COALESCE(excluded.item_group, items.item_group),
+        custom_style_code=COALESCE(excluded.custom_style_code, items.custom_style_code),
+        custom_simple_colour=COALESCE(excluded.custom_simple_colour, items.custom_simple_colour),
+        vat_rate=COALESCE(excluded.vat_rate, items.vat_rate),
+        attributes=COALESCE(NULLIF(excluded.attributes,''), items.attributes),
+        modified_utc=excluded.modified_utc,
+        active=1
+"""
+
+def _sale_item_row(line: Dict[str, Any], now: str) -> Optional[tuple]:
     item_id = (line.get("item_id") or "").strip()
     if not item_id:
-        return
+        return None
     name = (line.get("item_name") or "").strip() or item_id
-    brand = line.get("brand")
     attributes = _serialize_item_attributes(line.get("attributes"))
-    now = iso_now()
-    conn.execute("""
-        INSERT INTO items (item_id, parent_id, name, brand, item_group, custom_style_code, custom_simple_colour, vat_rate, attributes, price, image_url, is_template, active, modified_utc)
-        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        ON CONFLICT(item_id) DO UPDATE SET
-            name=COALESCE(NULLIF(excluded.name,''), items.name),
-            brand=COALESCE(excluded.brand, items.brand),
-            item_group=COALESCE(excluded.item_group, items.item_group),
-            custom_style_code=COALESCE(excluded.custom_style_code, items.custom_style_code),
-            custom_simple_colour=COALESCE(excluded.custom_simple_colour, items.custom_simple_colour),
-            vat_rate=COALESCE(excluded.vat_rate, items.vat_rate),
-            attributes=COALESCE(NULLIF(excluded.attributes,''), items.attributes),
-            modified_utc=excluded.modified_utc,
-            active=1
-    """, (item_id, None, name, brand, None, None, None, None, attributes, None, None, 0, 1, now))
+    return (item_id, None, name, line.get("brand"), None, None, None, None, attributes, None, None, 0, 1, now)
 
-def upsert_barcode(conn: sqlite3.Connection, barcode: str, item_id: str):
-    sql = """
+def ensure_item_for_sale_line(conn: sqlite3.Connection, line: Dict[str, Any]):
+    row = _sale_item_row(line, iso_now())
+    if row:
+        conn.execute(_SALE_ITEM_UPSERT_SQL, row)
+
+def ensure_items_for_sale_lines(conn: sqlite3.Connection, lines: List[Dict[str, Any]]):
+    """Create (or reactivate) the items a basket sells, with one lookup for the whole basket.
+
+    Items that already exist and are active are left untouched.
+    """
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for line in lines:
+        item_id = (line.get("item_id") or "").strip()
+        if item_id:
+            by_id[item_id] = line
+    if not by_id:
+        return
+    active: Set[str] = set()
+    for chunk in _chunked(list(by_id)):
+        placeholders = ",".join("?" * len(chunk))
+        active.update(r[0] for r in conn.execute(
+            f"SELECT item_id FROM items WHERE item_id IN ({placeholders}) AND active=1", chunk
+        ))
+    if len(active) < len(by_id):
+        now = iso_now()
+        conn.executemany(_SALE_ITEM_UPSERT_SQL, [
+            _sale_item_row(line, now) for item_id, line in by_id.items() if item_id not in active
+        ])
+
+_UPSERT_BARCODE_SQL = """
     INSERT INTO barcodes (barcode, item_id) VALUES (?,?)
     ON CONFLICT(barcode) DO UPDATE SET item_id=excluded.item_id;
     """
-    conn.execute(sql, (barcode, item_id))
+_BARCODE_PLACEHOLDER_SQL = "INSERT OR IGNORE INTO barcodes (barcode, item_id) VALUES (?,?)"
+_ITEM_STUB_SQL = """
+    INSERT OR IGNORE INTO items (item_id, parent_id, name, is_template, active, modified_utc)
+    VALUES (?, NULL, ?, 0, 0, ?)
+    """
+_ATTRIBUTE_DEFINITION_SQL = "INSERT OR IGNORE INTO attributes (attr_name, label) VALUES (?,?)"
+_TEMPLATE_ATTRIBUTE_SQL = """
+    INSERT INTO template_attributes (template_id, attr_name, required, sort_order)
+    VALUES (?,?,?,?)
+    ON CONFLICT(template_id, attr_name) DO UPDATE SET
+        required=excluded.required,
+        sort_order=COALESCE(NULLIF(excluded.sort_order,0), template_attributes.sort_order)
+    """
 
-def _ingest_child_barcodes(conn: sqlite3.Connection, child_rows: Any, item_id: str):
+def upsert_barcode(conn: sqlite3.Connection, barcode: str, item_id: str):
+    conn.execute(_UPSERT_BARCODE_SQL, (barcode, item_id))
+    BARCODE_MAP.invalidate([item_id])
+
+def _barcode_text(entry: Any) -> Optional[str]:
+    if not entry:
+        return None
+    bc = entry.get("barcode") if isinstance(entry, dict) else entry
+    if not bc:
+        return None
+    try:
+        return str(bc).strip() or None
+    except Exception:
+        return None
+
+def _ingest_child_barcodes(conn: sqlite3.Connection, child_rows: Any, item_id: str, batch: Optional["CatalogBatch"] = None):
     if not conn or not item_id or not child_rows:
         return
     rows = child_rows if isinstance(child_rows, list) else [child_rows]
     for entry in rows:
-        if not entry:
-            continue
-        if isinstance(entry, dict):
-            bc = entry.get("barcode")
-        else:
-            bc = entry
-        if not bc:
-            continue
-        try:
-            bc_txt = str(bc).strip()
-        except Exception:
-            bc_txt = None
+        bc_txt = _barcode_text(entry)
         if not bc_txt:
             continue
-        upsert_barcode(conn, bc_txt, item_id)
+        if batch is not None:
+            batch.barcode(bc_txt, item_id)
+        else:
+            upsert_barcode(conn, bc_txt, item_id)
 
 def ensure_barcode_placeholder(conn: sqlite3.Connection, barcode: Optional[str], item_id: str):
     """Insert a fallback barcode (item_code) if none exists, without overwriting real barcodes."""
     if not barcode or not item_id:
         return
-    conn.execute("""
-        INSERT OR IGNORE INTO barcodes (barcode, item_id) VALUES (?,?)
-    """, (barcode, item_id))
+    conn.execute(_BARCODE_PLACEHOLDER_SQL, (barcode, item_id))
 
 def ensure_item_stub(conn: sqlite3.Connection, item_id: Optional[str]):
     """Guarantee that a minimal items row exists so FK inserts (stock, barcodes) never fail."""
     if not item_id:
         return
-    conn.execute("""
-        INSERT OR IGNORE INTO items (item_id, parent_id, name, is_template, active, modified_utc)
-        VALUES (?, NULL, ?, 0, 0, ?)
-    """, (item_id, item_id, iso_now()))
+    conn.execute(_ITEM_STUB_SQL, (item_id, item_id, iso_now()))
 
 def ensure_attribute_definition(conn: sqlite3.Connection, attr_name: str, label: Optional[str] = None):
     """Ensure the attribute definition row exists so FK constraints pass."""
     if not attr_name:
         return
-    lbl = label or attr_name
-    conn.execute("""
-        INSERT OR IGNORE INTO attributes (attr_name, label) VALUES (?,?)
-    """, (attr_name, lbl))
+    conn.execute(_ATTRIBUTE_DEFINITION_SQL, (attr_name, label or attr_name))
 
 def ensure_template_attribute(conn: sqlite3.Connection, template_id: str, attr_name: str, required: bool = True, sort_order: Optional[int] = None):
     if not template_id or not attr_name:
         return
     req = 1 if required else 0
     sort = sort_order if sort_order is not None else 0
-    conn.execute("""
-        INSERT INTO template_attributes (template_id, attr_name, required, sort_order)
-        VALUES (?,?,?,?)
-        ON CONFLICT(template_id, attr_name) DO UPDATE SET
-            required=excluded.required,
-            sort_order=COALESCE(NULLIF(excluded.sort_order,0), template_attributes.sort_order)
-    """, (template_id, attr_name, req, sort))
+    conn.execute(_TEMPLATE_ATTRIBUTE_SQL, (template_id, attr_name, req, sort))
+
+class CatalogBatch:
+    """Collect one sync page's catalog writes and flush them with executemany.
+
+    Rows are grouped per statement and flushed in the order each statement was first
+    queued, so FK parents (items, stubs, attribute definitions) always land before the
+    rows that reference them. The ensure_* helpers dedupe in Python rather than issuing
+    an INSERT OR IGNORE per row. flush() never commits; the caller owns the transaction.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self._rows: Dict[str, List[Any]] = {}
+        self._seen: Dict[str, Set[Any]] = {}
+
+    def add(self, sql: str, params: Any):
+        self._rows.setdefault(sql, []).append(params)
+
+    def add_once(self, sql: str, params: Tuple[Any, ...], key: Any = None):
+        """Queue params unless the same key was already queued in this batch."""
+        seen = self._seen.setdefault(sql, set())
+        key = params if key is None else key
+        if key in seen:
+            return
+        seen.add(key)
+        self.add(sql, params)
+
+    def item(self, item: Dict[str, Any]):
+        self.add(_UPSERT_ITEM_SQL, item)
+
+    def barcode(self, barcode: str, item_id: str):
+        if barcode and item_id:
+            self.add(_UPSERT_BARCODE_SQL, (barcode, item_id))
+            BARCODE_MAP.invalidate([item_id])
+
+    def barcode_placeholder(self, barcode: Optional[str], item_id: str):
+        if barcode and item_id:
+            self.add_once(_BARCODE_PLACEHOLDER_SQL, (barcode, item_id), key=barcode)
+
+    def item_stub(self, item_id: Optional[str]):
+        if item_id:
+            self.add_once(_ITEM_STUB_SQL, (item_id, item_id, iso_now()), key=item_id)
+
+    def attribute_definition(self, attr_name: str, label: Optional[str] = None):
+        if attr_name:
+            self.add_once(_ATTRIBUTE_DEFINITION_SQL, (attr_name, label or attr_name), key=attr_name)
+
+    def template_attribute(self, template_id: str, attr_name: str, required: bool = True, sort_order: Optional[int] = None):
+        if template_id and attr_name:
+            sort = sort_order if sort_order is not None else 0
+            self.add_once(_TEMPLATE_ATTRIBUTE_SQL, (template_id, attr_name, 1 if required else 0, sort))
+
+    def flush(self) -> int:
+        written = 0
+        for sql, rows in self._rows.items():
+            if rows:
+                self.conn.executemany(sql, rows)
+                written += len(rows)
+        self._rows.clear()
+        return written
+
+def _load_sync_keys(conn: sqlite3.Connection, keys: Any, table: str = "sync_keys") -> str:
+    """Fill a TEMP key table (k, ts) for set-based joins and return its qualified name."""
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} (k TEXT PRIMARY KEY, ts TEXT)")
+    conn.execute(f"DELETE FROM temp.{table}")
+    rows = [k if isinstance(k, tuple) else (k, None) for k in keys]
+    conn.executemany(f"INSERT OR REPLACE INTO temp.{table} (k, ts) VALUES (?,?)", rows)
+    return f"temp.{table}"
 
 def _hydrate_attribute_options(conn: sqlite3.Connection, docnames: List[str]):
     """Fetch Item Attribute docs to populate attribute definitions + options."""
     if not docnames:
         return
     seen = set()
+    batch = CatalogBatch(conn)
     for name in docnames:
         if not name or name in seen:
             continue
         seen.add(name)
         if name in UNFETCHABLE_ATTRIBUTE_DOCS:
-            ensure_attribute_definition(conn, name, name)
+            batch.attribute_definition(name, name)
             continue
         try:
             doc = _erp_get_doc("Item Attribute", name)
@@ -361,7 +864,7 @@ def _hydrate_attribute_options(conn: sqlite3.Connection, docnames: List[str]):
             status = getattr(exc, "code", None)
             if status in (403, 404):
                 UNFETCHABLE_ATTRIBUTE_DOCS.add(name)
-                ensure_attribute_definition(conn, name, name)
+                batch.attribute_definition(name, name)
                 continue
             print(f"Failed to fetch attribute {name}: {exc}", file=sys.stderr)
             continue
@@ -369,18 +872,19 @@ def _hydrate_attribute_options(conn: sqlite3.Connection, docnames: List[str]):
             print(f"Failed to fetch attribute {name}: {exc}", file=sys.stderr)
             continue
         attr_name = doc.get("attribute_name") or doc.get("name")
-        ensure_attribute_definition(conn, attr_name, doc.get("attribute_name") or doc.get("name"))
+        batch.attribute_definition(attr_name, doc.get("attribute_name") or doc.get("name"))
         values = doc.get("item_attribute_values") or doc.get("values") or []
-        conn.execute("DELETE FROM attribute_options WHERE attr_name=?", (attr_name,))
+        batch.add("DELETE FROM attribute_options WHERE attr_name=?", (attr_name,))
         for idx, val in enumerate(values):
             option = val.get("attribute_value") or val.get("abbr") or val.get("value")
             if option in (None, ""):
                 continue
             sort = val.get("idx") or val.get("sort_order") or idx
-            conn.execute("""
+            batch.add("""
                 INSERT OR REPLACE INTO attribute_options (attr_name, option, sort_order)
                 VALUES (?,?,?)
             """, (attr_name, str(option), int(sort)))
+    batch.flush()
 
 def upsert_stock(conn: sqlite3.Connection, item_id: str, qty: float, warehouse: str = "Shop"):
     ensure_item_stub(conn, item_id)
@@ -390,9 +894,840 @@ def upsert_stock(conn: sqlite3.Connection, item_id: str, qty: float, warehouse:
     """
     conn.execute(sql, (item_id, warehouse, qty))
 
+# ---------- CATALOG TILES ----------
+# Denormalized per-template aggregates (price bounds, variant stock, image, attribute
+# values, barcodes) so the POS tile grid is a single indexed scan instead of a set of
+# correlated subqueries per template. Maintained incrementally by the sync pulls and
+# record_sale; ensure_catalog_tiles() back-fills anything missing at startup and after
+# a full sync or demo seed (never while serving reads).
+CATALOG_WAREHOUSE = os.environ.get("POS_WAREHOUSE", "Shop")
+_SQL_CHUNK = 500
+# Per-thread record of which items the tile maintenance touched, so the web layer can
+# drop just the affected cache entries after a sale or pull (see drain_catalog_changes).
+_CATALOG_CHANGES = threading.local()
+_CATALOG_CHANGE_LIMIT = 5000
+
+def _ensure_catalog_tiles_table(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_tiles (
+      template_id     TEXT PRIMARY KEY,
+      warehouse       TEXT NOT NULL,
+      standard_rate   NUMERIC,
+      price_min       NUMERIC,
+      price_max       NUMERIC,
+      variant_stock   NUMERIC NOT NULL DEFAULT 0,
+      image           TEXT,
+      attributes_json TEXT,
+      style_codes     TEXT,
+      simple_colours  TEXT,
+      barcodes_json   TEXT,
+      updated_utc     TEXT
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_items_parent ON items(parent_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_barcodes_item ON barcodes(item_id)")
+
+def _chunked(values: List[Any], size: int = _SQL_CHUNK):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def _templates_for_items(conn: sqlite3.Connection, item_ids: Any) -> Set[str]:
+    """Map item ids (variants or templates) to the template ids whose tiles they feed."""
+    ids = [i for i in {str(x) for x in (item_ids or []) if x}]
+    out: Set[str] = set()
+    for chunk in _chunked(ids):
+        placeholders = ",".join("?" * len(chunk))
+        for row in conn.execute(
+            f"SELECT item_id, parent_id, is_template FROM items WHERE item_id IN ({placeholders})",
+            chunk,
+        ):
+            if row["parent_id"]:
+                out.add(row["parent_id"])
+            elif row["is_template"]:
+                out.add(row["item_id"])
+    return out
+
+def refresh_catalog_tiles(conn: sqlite3.Connection, template_ids: Optional[Any] = None, warehouse: Optional[str] = None) -> int:
+    """Recompute catalog_tiles for the given templates (every template when None). Caller commits."""
+    wh = warehouse or CATALOG_WAREHOUSE
+    if template_ids is None:
+        ids = [r["item_id"] for r in conn.execute("SELECT item_id FROM items WHERE is_template=1")]
+        conn.execute("DELETE FROM catalog_tiles WHERE template_id NOT IN (SELECT item_id FROM items WHERE is_template=1)")
+    else:
+        ids = [i for i in {str(x) for x in template_ids if x}]
+    if not ids:
+        return 0
+    now = iso_now()
+    written = 0
+    for chunk in _chunked(ids):
+        placeholders = ",".join("?" * len(chunk))
+        attrs: Dict[str, Dict[str, Set[str]]] = {}
+        for row in conn.execute(f"""
+            SELECT v.parent_id AS template_id, va.attr_name, va.value
+            FROM items v
+            JOIN variant_attributes va ON va.item_id = v.item_id
+            WHERE v.active=1 AND v.is_template=0 AND v.parent_id IN ({placeholders})
+        """, chunk):
+            attrs.setdefault(row["template_id"], {}).setdefault(row["attr_name"], set()).add(row["value"])
+        customs: Dict[str, Tuple[Set[str], Set[str]]] = {}
+        for row in conn.execute(f"""
+            SELECT parent_id AS template_id, custom_style_code, custom_simple_colour
+            FROM items
+            WHERE parent_id IN ({placeholders})
+              AND (custom_style_code IS NOT NULL OR custom_simple_colour IS NOT NULL)
+        """, chunk):
+            styles, colours = customs.setdefault(row["template_id"], (set(), set()))
+            if row["custom_style_code"]:
+                styles.add(str(row["custom_style_code"]))
+            if row["custom_simple_colour"]:
+                colours.add(str(row["custom_simple_colour"]))
+        barcodes: Dict[str, Set[str]] = {}
+        for row in conn.execute(f"""
+            SELECT v.parent_id AS template_id, b.barcode
+            FROM barcodes b
+            JOIN items v ON v.item_id = b.item_id
+            WHERE v.parent_id IN ({placeholders}) AND b.barcode IS NOT NULL
+        """, chunk):
+            bc = (row["barcode"] or "").strip()
+            if bc:
+                barcodes.setdefault(row["template_id"], set()).add(bc)
+        rows = []
+        for r in conn.execute(f"""
+            SELECT t.item_id AS template_id,
+                   (SELECT price_effective FROM v_item_prices p WHERE p.item_id = t.item_id) AS standard_rate,
+                   (SELECT MIN(ip.rate) FROM item_prices ip JOIN items v ON v.item_id = ip.item_id WHERE v.parent_id = t.item_id) AS price_min,
+                   (SELECT MAX(ip.rate) FROM item_prices ip JOIN items v ON v.item_id = ip.item_id WHERE v.parent_id = t.item_id) AS price_max,
+                   (SELECT COALESCE(SUM(s.qty),0) FROM stock s JOIN items v ON v.item_id = s.item_id WHERE v.parent_id = t.item_id AND s.warehouse = ?) AS variant_stock,
+                   (SELECT image_url_effective FROM v_item_images img WHERE img.item_id = t.item_id) AS image
+            FROM items t
+            WHERE t.is_template=1 AND t.item_id IN ({placeholders})
+        """, [wh] + chunk):
+            tid = r["template_id"]
+            styles, colours = customs.get(tid, (set(), set()))
+            rows.append((
+                tid, wh, r["standard_rate"], r["price_min"], r["price_max"], r["variant_stock"] or 0, r["image"],
+                json.dumps({k: sorted(v) for k, v in attrs.get(tid, {}).items()}, separators=(",", ":")),
+                json.dumps(sorted(styles), separators=(",", ":")),
+                json.dumps(sorted(colours), separators=(",", ":")),
+                json.dumps(sorted(barcodes.get(tid, set())), separators=(",", ":")),
+                now,
+            ))
+        if rows:
+            conn.executemany("""
+                INSERT OR REPLACE INTO catalog_tiles
+                  (template_id, warehouse, standard_rate, price_min, price_max, variant_stock, image,
+                   attributes_json, style_codes, simple_colours, barcodes_json, updated_utc)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+            """, rows)
+            written += len(rows)
+    return written
+
+def _note_catalog_change(item_ids: Any, structural: bool = False, images: Any = (), stock_only: bool = False) -> None:
+    journal = getattr(_CATALOG_CHANGES, "journal", None)
+    if journal is None:
+        journal = _CATALOG_CHANGES.journal = {"items": set(), "structural": False, "all": False, "images": set(),
+                                              "rows": set(), "rows_all": False}
+    journal["structural"] = journal["structural"] or structural
+    if len(journal["images"]) < _CATALOG_CHANGE_LIMIT:
+        journal["images"].update(str(x) for x in images if x)
+    if not stock_only and not journal["rows_all"]:
+        journal["rows"].update(str(x) for x in item_ids if x)
+        if len(journal["rows"]) > _CATALOG_CHANGE_LIMIT:
+            journal["rows_all"] = True
+            journal["rows"] = set()
+    if journal["all"]:
+        return
+    journal["items"].update(str(x) for x in item_ids if x)
+    if len(journal["items"]) > _CATALOG_CHANGE_LIMIT:
+        # Nobody is draining this thread; stop tracking ids and report "everything"
+        journal["all"] = True
+        journal["items"] = set()
+
+def drain_catalog_changes() -> Optional[Dict[str, Any]]:
+    """Return and reset the catalog changes recorded on this thread.
+
+    None when nothing changed; otherwise {"items": set of item/template ids,
+    "structural": True if membership/names/barcodes may have changed (not just
+    stock or price), "all": True if tracking overflowed, "images": new or changed
+    item image paths seen by the item pull, "rows": the ids whose barcode map rows
+    (name, barcodes, price) may have changed, i.e. not stock-only, "rows_all": True
+    if that set overflowed}.
+    """
+    journal = getattr(_CATALOG_CHANGES, "journal", None)
+    _CATALOG_CHANGES.journal = None
+    if not journal or not (journal["items"] or journal["all"] or journal["images"]):
+        return None
+    return journal
+
+def _merge_catalog_changes(changes: Dict[str, Any]) -> None:
+    """Fold a journal drained on another thread into this thread's journal."""
+    _note_catalog_change(changes.get("rows") or (), structural=bool(changes.get("structural")),
+                         images=changes.get("images") or ())
+    journal = _CATALOG_CHANGES.journal
+    if changes.get("rows_all"):
+        journal["rows_all"] = True
+        journal["rows"] = set()
+    if changes.get("all"):
+        journal["all"] = True
+        journal["items"] = set()
+        return
+    _note_catalog_change(changes.get("items") or (), stock_only=True)
+
+def refresh_catalog_tiles_for_items(conn: sqlite3.Connection, item_ids: Any, structural: bool = True) -> int:
+    item_ids = [x for x in item_ids if x]
+    tpl_ids = _templates_for_items(conn, item_ids)
+    _note_catalog_change(list(item_ids) + list(tpl_ids), structural=structural)
+    BARCODE_MAP.invalidate(item_ids)
+    invalidate_item_matrix(conn, tpl_ids)
+    return refresh_catalog_tiles(conn, tpl_ids)
+
+def refresh_catalog_tile_stock(conn: sqlite3.Connection, item_ids: Any, warehouse: Optional[str] = None) -> None:
+    """Re-sum variant stock on the tiles fed by item_ids (stock-only changes: bins, sales)."""
+    wh = warehouse or CATALOG_WAREHOUSE
+    item_ids = [x for x in item_ids if x]
+    tpl_ids = list(_templates_for_items(conn, item_ids))
+    _note_catalog_change(item_ids + tpl_ids, stock_only=True)
+    invalidate_item_matrix(conn, tpl_ids)
+    for chunk in _chunked(tpl_ids):
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(f"""
+            UPDATE catalog_tiles
+            SET variant_stock = (
+                  SELECT COALESCE(SUM(s.qty),0) FROM stock s JOIN items v ON v.item_id = s.item_id
+                  WHERE v.parent_id = catalog_tiles.template_id AND s.warehouse = catalog_tiles.warehouse
+                ),
+                updated_utc = ?
+            WHERE warehouse = ? AND template_id IN ({placeholders})
+        """, [iso_now(), wh] + chunk)
+
+def _missing_catalog_tiles(conn: sqlite3.Connection, wh: str) -> List[str]:
+    if conn.execute("SELECT 1 FROM catalog_tiles WHERE warehouse <> ? LIMIT 1", (wh,)).fetchone():
+        conn.execute("DELETE FROM catalog_tiles WHERE warehouse <> ?", (wh,))
+    return [r["item_id"] for r in conn.execute("""
+        SELECT i.item_id FROM items i
+        LEFT JOIN catalog_tiles t ON t.template_id = i.item_id
+        WHERE i.is_template=1 AND i.active=1 AND t.template_id IS NULL
+    """)]
+
+def ensure_catalog_tiles(conn: sqlite3.Connection, warehouse: Optional[str] = None) -> int:
+    """Back-fill tiles for templates that have none (first run, or a warehouse change)."""
+    wh = warehouse or CATALOG_WAREHOUSE
+    try:
+        missing = _missing_catalog_tiles(conn, wh)
+    except sqlite3.OperationalError:
+        _ensure_catalog_tiles_table(conn)
+        missing = _missing_catalog_tiles(conn, wh)
+    if missing:
+        refresh_catalog_tiles(conn, missing, warehouse=wh)
+    if conn.in_transaction:
+        conn.commit()
+    return len(missing)
+
+# ---------- ITEM SEARCH (FTS5) ----------
+# One document per item: its own name/code/style/colour plus variant attribute values
+# and barcodes (a template's document aggregates all of its variants). Triggers on
+# items/variant_attributes/barcodes queue changed ids in item_search_dirty, so every
+# upsert keeps the index current; flush_item_search() re-indexes the queued ids.
+_ITEM_SEARCH_MODE: Dict[str, Optional[str]] = {}
+_SEARCH_MIN_TRIGRAM = 3
+
+def _search_rowid(item_id: str) -> int:
+    """Stable 64-bit FTS rowid for an item_id (items has no integer key to reuse)."""
+    digest = hashlib.blake2b(item_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+def _ensure_item_search_table(conn: sqlite3.Connection):
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name='item_search'").fetchone()
+    if not exists:
+        created = False
+        for tokenize in ("tokenize='trigram'", "tokenize='unicode61', prefix='1 2 3'"):
+            try:
+                conn.execute(f"""
+                CREATE VIRTUAL TABLE item_search USING fts5(
+                  item_id, name, codes, attrs, barcodes, {tokenize}
+                )""")
+                created = True
+                break
+            except sqlite3.OperationalError:
+                continue
+        if not created:
+            return  # SQLite built without FTS5: searches fall back to LIKE
+    conn.execute("CREATE TABLE IF NOT EXISTS item_search_dirty (item_id TEXT PRIMARY KEY)")
+    # Triggers use ON CONFLICT DO NOTHING rather than INSERT OR IGNORE: when the firing
+    # statement is itself an UPSERT, its ABORT policy overrides the trigger's OR IGNORE.
+    # Drop and recreate so databases with the earlier trigger bodies pick up the fix.
+    for name in ("trg_item_search_ins", "trg_item_search_upd", "trg_item_search_del") + tuple(
+        f"trg_item_search_{t}_{op}" for t in ("variant_attributes", "barcodes") for op in ("ins", "upd", "del")
+    ):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_item_search_ins AFTER INSERT ON items BEGIN
+      INSERT INTO item_search_dirty (item_id) VALUES (new.item_id) ON CONFLICT(item_id) DO NOTHING;
+    END""")
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_item_search_upd AFTER UPDATE ON items
+    WHEN old.name IS NOT new.name OR old.parent_id IS NOT new.parent_id
+      OR old.custom_style_code IS NOT new.custom_style_code
+      OR old.custom_simple_colour IS NOT new.custom_simple_colour
+      OR old.active IS NOT new.active OR old.is_template IS NOT new.is_template
+    BEGIN
+      INSERT INTO item_search_dirty (item_id) VALUES (new.item_id) ON CONFLICT(item_id) DO NOTHING;
+      INSERT INTO item_search_dirty (item_id) SELECT old.parent_id WHERE old.parent_id IS NOT NULL ON CONFLICT(item_id) DO NOTHING;
+    END""")
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_item_search_del AFTER DELETE ON items BEGIN
+      INSERT INTO item_search_dirty (item_id) VALUES (old.item_id) ON CONFLICT(item_id) DO NOTHING;
+    END""")
+    for table, ident in (("variant_attributes", "item_id"), ("barcodes", "item_id")):
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_item_search_{table}_ins AFTER INSERT ON {table} BEGIN
+          INSERT INTO item_search_dirty (item_id) VALUES (new.{ident}) ON CONFLICT(item_id) DO NOTHING;
+        END""")
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_item_search_{table}_upd AFTER UPDATE ON {table} BEGIN
+          INSERT INTO item_search_dirty (item_id) VALUES (new.{ident}) ON CONFLICT(item_id) DO NOTHING;
+          INSERT INTO item_search_dirty (item_id) VALUES (old.{ident}) ON CONFLICT(item_id) DO NOTHING;
+        END""")
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_item_search_{table}_del AFTER DELETE ON {table} BEGIN
+          INSERT INTO item_search_dirty (item_id) VALUES (old.{ident}) ON CONFLICT(item_id) DO NOTHING;
+        END""")
+    if not exists:
+        # Fresh index: queue the whole catalog for the first flush
+        conn.execute("INSERT OR IGNORE INTO item_search_dirty (item_id) SELECT item_id FROM items")
+        conn.commit()
+
+def item_search_mode(conn: sqlite3.Connection) -> Optional[str]:
+    """'trigram', 'prefix', or None when the FTS index is unavailable."""
+    try:
+        key = conn.execute("PRAGMA database_list").fetchone()["file"] or ":memory:"
+    except Exception:
+        key = ":memory:"
+    if key in _ITEM_SEARCH_MODE and key != ":memory:":
+        return _ITEM_SEARCH_MODE[key]
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name='item_search'").fetchone()
+    if not row or not row["sql"]:
+        return None
+    mode = "trigram" if "trigram" in row["sql"] else "prefix"
+    _ITEM_SEARCH_MODE[key] = mode
+    return mode
+
+def flush_item_search(conn: sqlite3.Connection, limit: Optional[int] = None) -> int:
+    """Re-index items queued by the search triggers (plus the templates they feed). Caller commits."""
+    if not item_search_mode(conn):
+        return 0
+    sql = "SELECT item_id FROM item_search_dirty"
+    params: Tuple[Any, ...] = ()
+    if limit:
+        sql += " LIMIT ?"
+        params = (int(limit),)
+    dirty = [r["item_id"] for r in conn.execute(sql, params)]
+    if not dirty:
+        return 0
+    ids = set(dirty) | _templates_for_items(conn, dirty)
+    reindex_item_search(conn, ids)
+    for chunk in _chunked(dirty):
+        conn.execute(f"DELETE FROM item_search_dirty WHERE item_id IN ({','.join('?' * len(chunk))})", chunk)
+    return len(ids)
+
+
+def reindex_item_search(conn: sqlite3.Connection, item_ids: Any) -> None:
+    ids = [i for i in {str(x) for x in item_ids if x}]
+    for chunk in _chunked(ids):
+        placeholders = ",".join("?" * len(chunk))
+        conn.executemany("DELETE FROM item_search WHERE rowid=?", [(_search_rowid(i),) for i in chunk])
+        docs: Dict[str, Dict[str, Any]] = {}
+        for r in conn.execute(f"""
+            SELECT item_id, name, custom_style_code, custom_simple_colour, is_template
+            FROM items WHERE active=1 AND item_id IN ({placeholders})
+        """, chunk):
+            docs[r["item_id"]] = {
+                "name": r["name"] or "",
+                "codes": {c for c in (r["custom_style_code"], r["custom_simple_colour"]) if c},
+                "attrs": set(),
+                "barcodes": set(),
+                "is_template": r["is_template"],
+            }
+        if not docs:
+            continue
+        tpl_ids = [i for i, d in docs.items() if d["is_template"]]
+        # Own attributes/barcodes, then fold each active variant into its template's document
+        sources = [(f"""
+            SELECT va.item_id AS owner, va.value FROM variant_attributes va
+            WHERE va.item_id IN ({placeholders})""", chunk, "attrs"), (f"""
+            SELECT b.item_id AS owner, b.barcode AS value FROM barcodes b
+            WHERE b.item_id IN ({placeholders})""", chunk, "barcodes")]
+        if tpl_ids:
+            tpl_ph = ",".join("?" * len(tpl_ids))
+            sources += [(f"""
+                SELECT v.parent_id AS owner, va.value FROM items v
+                JOIN variant_attributes va ON va.item_id = v.item_id
+                WHERE v.active=1 AND v.parent_id IN ({tpl_ph})""", tpl_ids, "attrs"), (f"""
+                SELECT v.parent_id AS owner, b.barcode AS value FROM items v
+                JOIN barcodes b ON b.item_id = v.item_id
+                WHERE v.active=1 AND v.parent_id IN ({tpl_ph})""", tpl_ids, "barcodes"), (f"""
+                SELECT parent_id AS owner, custom_style_code AS value FROM items
+                WHERE active=1 AND parent_id IN ({tpl_ph}) AND custom_style_code IS NOT NULL
+                UNION
+                SELECT parent_id AS owner, custom_simple_colour AS value FROM items
+                WHERE active=1 AND parent_id IN ({tpl_ph}) AND custom_simple_colour IS NOT NULL""", tpl_ids + tpl_ids, "codes")]
+        for sql, params, field in sources:
+            for r in conn.execute(sql, params):
+                doc = docs.get(r["owner"])
+                if doc is not None and r["value"]:
+                    doc[field].add(str(r["value"]))
+        conn.executemany(
+            "INSERT INTO item_search (rowid, item_id, name, codes, attrs, barcodes) VALUES (?,?,?,?,?,?)",
+            [
+                (_search_rowid(item_id), item_id, d["name"], " ".join(sorted(d["codes"])),
+                 " ".join(sorted(d["attrs"])), " ".join(sorted(d["barcodes"])))
+                for item_id, d in docs.items()
+            ],
+        )
+
+def item_search_query(mode: Optional[str], q: str) -> Optional[Tuple[str, List[str]]]:
+    """Build an FTS5 MATCH expression for q.
+
+    Returns (match, residual_terms) where residual_terms are too short for the
+    trigram index and must be applied as LIKE filters, or None when q has no
+    indexable term (caller falls back to LIKE).
+    """
+    terms = [t for t in (q or "").split() if t]
+    if not mode or not terms:
+        return None
+    parts: List[str] = []
+    residual: List[str] = []
+    for term in terms:
+        quoted = '"' + term.replace('"', '""') + '"'
+        if mode == "trigram":
+            if len(term) < _SEARCH_MIN_TRIGRAM:
+                residual.append(term)
+            else:
+                parts.append(quoted)
+        else:
+            parts.append(quoted + " *")
+    if not parts:
+        return None
+    return " AND ".join(parts), residual
+
+# ---------- BARCODE HOT MAP ----------
+# The till's scan path resolves barcodes from memory: every active item is kept once as a
+# pre-joined tuple (name, brand, group, parent, VAT, style code, effective price, attributes,
+# barcodes) and barcodes / item ids map to its offset. Catalog writers mark items dirty and
+# the next lookup reloads just those rows, so a scan is a dict hit plus one stock read.
+_BM_ITEM, _BM_NAME, _BM_BRAND, _BM_GROUP, _BM_PARENT, _BM_VAT, _BM_STYLE, _BM_RATE, _BM_ATTRS, _BM_CODES = range(10)
+_BARCODE_MAP_DIRTY_LIMIT = 5000
+
+class BarcodeMap:
+    """barcode -> offset into a list of pre-joined item rows; see resolve_barcode().
+
+    The (rows, by_barcode, by_item) triple is published as one snapshot and never
+    changed in place: rebuilds and patches build new containers under the lock and swap
+    the reference, so a lookup that read the snapshot once always sees a matching set.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snap: Tuple[List[Optional[Tuple[Any, ...]]], Dict[str, int], Dict[str, int]] = ([], {}, {})
+        self._dirty: Set[str] = set()
+        self._stale = True
+        self._db: Optional[str] = None
+
+    def invalidate(self, item_ids: Any):
+        with self._lock:
+            if self._stale:
+                return
+            self._dirty.update(str(x) for x in item_ids if x)
+            if len(self._dirty) > _BARCODE_MAP_DIRTY_LIMIT:
+                self._stale = True
+                self._dirty = set()
+
+    def invalidate_all(self):
+        with self._lock:
+            self._stale = True
+            self._dirty = set()
+
+    def stats(self) -> Dict[str, Any]:
+        _rows, by_barcode, by_item = self._snap
+        return {"items": len(by_item), "barcodes": len(by_barcode),
+                "dirty": len(self._dirty), "loaded": not self._stale}
+
+    def _load_rows(self, conn: sqlite3.Connection, ids: Optional[List[str]] = None) -> Tuple[List[sqlite3.Row], Dict[str, List[Tuple[str, str]]], Dict[str, List[str]]]:
+        base = """
+            SELECT i.item_id, i.name, i.brand, i.item_group, i.parent_id, i.vat_rate, i.custom_style_code,
+                   p.price_effective AS rate
+            FROM items i LEFT JOIN v_item_prices p ON p.item_id = i.item_id
+            WHERE i.active=1
+        """
+        items: List[sqlite3.Row] = []
+        attrs: Dict[str, List[Tuple[str, str]]] = {}
+        codes: Dict[str, List[str]] = {}
+        if ids is None:
+            items = conn.execute(base).fetchall()
+            attr_rows = conn.execute("SELECT item_id, attr_name, value FROM variant_attributes")
+            code_rows = conn.execute("SELECT barcode, item_id FROM barcodes")
+        else:
+            # Dirty ids may be templates (e.g. a template price change), so take their variants too
+            for chunk in _chunked(ids):
+                ph = ",".join("?" * len(chunk))
+                items.extend(conn.execute(f"{base} AND (i.item_id IN ({ph}) OR i.parent_id IN ({ph}))", chunk + chunk))
+            loaded = [r["item_id"] for r in items]
+            attr_rows, code_rows = [], []
+            for chunk in _chunked(loaded):
+                ph = ",".join("?" * len(chunk))
+                attr_rows.extend(conn.execute(f"SELECT item_id, attr_name, value FROM variant_attributes WHERE item_id IN ({ph})", chunk))
+                code_rows.extend(conn.execute(f"SELECT barcode, item_id FROM barcodes WHERE item_id IN ({ph})", chunk))
+        for r in attr_rows:
+            attrs.setdefault(r["item_id"], []).append((r["attr_name"], r["value"]))
+        for r in code_rows:
+            codes.setdefault(r["item_id"], []).append(r["barcode"])
+        return items, attrs, codes
+
+    @staticmethod
+    def _pack(r: sqlite3.Row, attrs: Dict[str, List[Tuple[str, str]]], codes: Dict[str, List[str]]) -> Tuple[Any, ...]:
+        item_id = r["item_id"]
+        return (item_id, r["name"], r["brand"], r["item_group"], r["parent_id"], r["vat_rate"],
+                r["custom_style_code"], r["rate"], tuple(attrs.get(item_id, ())), tuple(codes.get(item_id, ())))
+
+    def _rebuild(self, conn: sqlite3.Connection):
+        items, attrs, codes = self._load_rows(conn)
+        rows = [self._pack(r, attrs, codes) for r in items]
+        by_item = {row[_BM_ITEM]: idx for idx, row in enumerate(rows)}
+        by_barcode: Dict[str, int] = {}
+        for idx, row in enumerate(rows):
+            for code in row[_BM_CODES]:
+                by_barcode[code] = idx
+        self._snap = (rows, by_barcode, by_item)
+        self._stale = False
+        self._db = _db_file(conn)
+
+    def _patch(self, conn: sqlite3.Connection, ids: List[str]):
+        """Copy-on-write update of ids; call with the lock held."""
+        items, attrs, codes = self._load_rows(conn, ids)
+        fresh = {r["item_id"]: self._pack(r, attrs, codes) for r in items}
+        cur_rows, cur_by_barcode, cur_by_item = self._snap
+        rows, by_barcode, by_item = list(cur_rows), dict(cur_by_barcode), dict(cur_by_item)
+        for item_id in set(ids) | set(fresh):
+            old = by_item.get(item_id)
+            if old is not None:
+                for code in rows[old][_BM_CODES]:
+                    if by_barcode.get(code) == old:
+                        del by_barcode[code]
+            row = fresh.get(item_id)
+            if row is None:
+                # Deactivated or deleted
+                if old is not None:
+                    rows[old] = None
+                    del by_item[item_id]
+                continue
+            if old is None:
+                old = len(rows)
+                rows.append(row)
+                by_item[item_id] = old
+            else:
+                rows[old] = row
+            for code in row[_BM_CODES]:
+                by_barcode[code] = old
+        self._snap = (rows, by_barcode, by_item)
+
+    def _sync(self, conn: sqlite3.Connection):
+        with self._lock:
+            if self._stale or self._db != _db_file(conn):
+                self._dirty = set()
+                self._rebuild(conn)
+            elif self._dirty:
+                ids, self._dirty = list(self._dirty), set()
+                self._patch(conn, ids)
+
+    def ensure_loaded(self, conn: sqlite3.Connection) -> int:
+        self._sync(conn)
+        return len(self._snap[2])
+
+    def lookup(self, conn: sqlite3.Connection, code: str) -> Optional[Tuple[Any, ...]]:
+        """Row for a barcode or item_id; a miss falls back to one SQL probe (also matching name)."""
+        if self._stale or self._dirty:
+            self._sync(conn)
+        rows, by_barcode, by_item = self._snap
+        idx = by_barcode.get(code)
+        if idx is None:
+            idx = by_item.get(code)
+        if idx is not None:
+            return rows[idx]
+        hit = conn.execute("""
+            SELECT item_id FROM (
+              SELECT b.item_id, 0 AS pri FROM barcodes b JOIN items i ON i.item_id = b.item_id AND i.active=1
+              WHERE b.barcode = :c
+              UNION ALL SELECT item_id, 1 FROM items WHERE item_id = :c AND active=1
+              UNION ALL SELECT item_id, 2 FROM items WHERE name = :c AND active=1
+            ) ORDER BY pri LIMIT 1
+        """, {"c": code}).fetchone()
+        if not hit:
+            return None
+        with self._lock:
+            self._patch(conn, [hit["item_id"]])
+            rows, _by_barcode, by_item = self._snap
+        idx = by_item.get(hit["item_id"])
+        return rows[idx] if idx is not None else None
+
+BARCODE_MAP = BarcodeMap()
+
+def resolve_barcode(conn: sqlite3.Connection, code: str, warehouse: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Resolve a scanned code (barcode, item_id or name) to a sellable item with live stock."""
+    row = BARCODE_MAP.lookup(conn, code)
+    if row is None:
+        return None
+    stock = conn.execute(
+        "SELECT qty FROM stock WHERE item_id=? AND warehouse=?",
+        (row[_BM_ITEM], warehouse or CATALOG_WAREHOUSE)
+    ).fetchone()
+    return {
+        "item_id": row[_BM_ITEM],
+        "name": row[_BM_NAME],
+        "brand": row[_BM_BRAND],
+        "item_group": row[_BM_GROUP],
+        "parent_id": row[_BM_PARENT],
+        "vat_rate": row[_BM_VAT],
+        "custom_style_code": row[_BM_STYLE],
+        "rate": row[_BM_RATE],
+        "attributes": list(row[_BM_ATTRS]),
+        "qty": stock["qty"] if stock and stock["qty"] is not None else 0,
+    }
+
+# ---------- ITEM MATRIX CACHE ----------
+# The size grid behind a template tile, stored as one zlib-compressed JSON blob per
+# template so opening it is a single primary-key read. The web layer builds the payload
+# (it owns the attribute naming rules); this module stores it and drops it whenever a
+# variant, price, stock row or layaway reservation feeding the template changes.
+# Every drop bumps item_matrix_cache_gen, so a build that read before the drop
+# committed can tell its payload is stale and skip the write.
+def _ensure_item_matrix_cache_table(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS item_matrix_cache (
+          template_id  TEXT PRIMARY KEY,
+          warehouse    TEXT NOT NULL,
+          payload      BLOB NOT NULL,
+          updated_utc  TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS item_matrix_cache_gen (
+          id   INTEGER PRIMARY KEY CHECK (id = 1),
+          gen  INTEGER NOT NULL
+        )
+    """)
+
+def _item_matrix_generation(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT gen FROM item_matrix_cache_gen WHERE id=1").fetchone()
+    return int(row[0]) if row else 0
+
+def item_matrix_cache_get(conn: sqlite3.Connection, template_id: str, warehouse: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Return the cached matrix payload for template_id, or None on a miss."""
+    row = conn.execute(
+        "SELECT payload FROM item_matrix_cache WHERE template_id=? AND warehouse=?",
+        (template_id, warehouse or CATALOG_WAREHOUSE),
+    ).fetchone()
+    if not row:
+        return None
+    try:
+        return json.loads(zlib.decompress(row["payload"]))
+    except (zlib.error, ValueError):
+        return None
+
+def item_matrix_cache_put(conn: sqlite3.Connection, template_id: str, payload: Dict[str, Any],
+                          warehouse: Optional[str] = None, generation: Optional[int] = None) -> bool:
+    """Store a matrix payload. Caller commits.
+
+    With generation, the row is only written if no invalidation has been committed
+    since that generation was read (see item_matrix_cache_build). Returns whether
+    the row was written.
+    """
+    blob = zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    params = [template_id, warehouse or CATALOG_WAREHOUSE, sqlite3.Binary(blob), iso_now()]
+    if generation is None:
+        cur = conn.execute(
+            "INSERT OR REPLACE INTO item_matrix_cache (template_id, warehouse, payload, updated_utc) VALUES (?,?,?,?)",
+            params,
+        )
+    else:
+        cur = conn.execute("""
+            INSERT OR REPLACE INTO item_matrix_cache (template_id, warehouse, payload, updated_utc)
+            SELECT ?,?,?,? WHERE COALESCE((SELECT gen FROM item_matrix_cache_gen WHERE id=1), 0) = ?
+        """, params + [generation])
+    return cur.rowcount > 0
+
+def item_matrix_cache_build(conn: sqlite3.Connection, template_ids: Any, builder, warehouse: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Build and cache matrices for template_ids with builder(conn, template_id) -> payload|None.
+
+    The payloads are built inside a plain read transaction, so a cache miss never
+    waits for the write lock. They are then stored only if no writer has invalidated
+    the cache since that snapshot; otherwise they are returned but not cached, and
+    the next request or prewarm pass builds them again. Returns {template_id: payload}.
+    """
+    ids = [str(x) for x in dict.fromkeys(template_ids or []) if x]
+    out: Dict[str, Dict[str, Any]] = {}
+    if not ids:
+        return out
+    own_txn = not conn.in_transaction
+    if own_txn:
+        # Deferred: the generation and the builder's reads share one WAL snapshot
+        conn.execute("BEGIN")
+    try:
+        generation = _item_matrix_generation(conn)
+        for tid in ids:
+            payload = builder(conn, tid)
+            if payload is not None:
+                out[tid] = payload
+    finally:
+        if own_txn:
+            conn.rollback()
+    if not out:
+        return out
+    try:
+        for tid, payload in out.items():
+            if not item_matrix_cache_put(conn, tid, payload, warehouse, generation):
+                break
+        if own_txn:
+            conn.commit()
+    except sqlite3.OperationalError:
+        # Write lock busy past the timeout: serve the payload uncached
+        if own_txn:
+            conn.rollback()
+    except Exception:
+        if own_txn:
+            conn.rollback()
+        raise
+    return out
+
+def item_matrix_uncached(conn: sqlite3.Connection, template_ids: Any, warehouse: Optional[str] = None) -> List[str]:
+    """Return the template_ids (in order) that have no cached matrix for warehouse."""
+    ids = [str(x) for x in dict.fromkeys(template_ids or []) if x]
+    cached: Set[str] = set()
+    for chunk in _chunked(ids):
+        placeholders = ",".join("?" * len(chunk))
+        cached.update(r["template_id"] for r in conn.execute(
+            f"SELECT template_id FROM item_matrix_cache WHERE warehouse=? AND template_id IN ({placeholders})",
+            [warehouse or CATALOG_WAREHOUSE] + chunk,
+        ))
+    return [tid for tid in ids if tid not in cached]
+
+def invalidate_item_matrix(conn: sqlite3.Connection, template_ids: Optional[Any] = None) -> None:
+    """Drop cached matrices for template_ids (all of them when None). Caller commits."""
+    try:
+        conn.execute("""
+            INSERT INTO item_matrix_cache_gen (id, gen) VALUES (1, 1)
+            ON CONFLICT(id) DO UPDATE SET gen = gen + 1
+        """)
+        if template_ids is None:
+            conn.execute("DELETE FROM item_matrix_cache")
+            return
+        for chunk in _chunked([str(x) for x in template_ids if x]):
+            placeholders = ",".join("?" * len(chunk))
+            conn.execute(f"DELETE FROM item_matrix_cache WHERE template_id IN ({placeholders})", chunk)
+    except sqlite3.OperationalError:
+        pass  # cache table not created yet; nothing to drop
+
+# ---------- LAYAWAY RESERVATIONS ----------
+def _ensure_layaway_reservations_table(conn: sqlite3.Connection):
+    """Normalized (layaway, item, qty) ledger of stock held by active layaways."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS layaway_reservations (
+          layaway_id  TEXT NOT NULL,
+          item_id     TEXT NOT NULL,
+          qty         REAL NOT NULL,
+          PRIMARY KEY (layaway_id, item_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_lay_res_item ON layaway_reservations(item_id, qty)")
+    has_layaways = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='layaways'"
+    ).fetchone()
+    if not has_layaways:
+        return
+    # Back-fill databases that had active layaways before the ledger existed
+    if conn.execute("SELECT 1 FROM layaway_reservations LIMIT 1").fetchone():
+        return
+    if conn.execute("SELECT 1 FROM layaways WHERE status='active' LIMIT 1").fetchone():
+        sync_layaway_reservations(conn)
+        conn.commit()
+
+def _layaway_item_qtys(items_json: Optional[str]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    try:
+        items = json.loads(items_json or "[]")
+    except Exception:
+        return out
+    for it in items if isinstance(items, list) else []:
+        if not isinstance(it, dict) or it.get("collected"):
+            continue
+        code = (it.get("item_code") or it.get("item_id") or "").strip()
+        if not code:
+            continue
+        try:
+            qty = float(it.get("qty") or 1)
+        except (TypeError, ValueError):
+            qty = 1.0
+        out[code] = out.get(code, 0.0) + qty
+    return out
+
+def sync_layaway_reservations(conn: sqlite3.Connection, layaway_ids: Optional[Any] = None) -> int:
+    """Rebuild reservation rows from layaways.items (all layaways when ids is None). Caller commits.
+
+    Only active layaways reserve stock; rows for any other status are removed.
+    """
+    touched: Set[str] = set()
+    if layaway_ids is None:
+        conn.execute("DELETE FROM layaway_reservations")
+        invalidate_item_matrix(conn)
+        rows = conn.execute(
+            "SELECT layaway_id, items FROM layaways WHERE status='active' AND items IS NOT NULL"
+        ).fetchall()
+    else:
+        ids = [str(x) for x in layaway_ids if x]
+        rows = []
+        for chunk in _chunked(ids):
+            placeholders = ",".join("?" * len(chunk))
+            touched.update(r["item_id"] for r in conn.execute(
+                f"SELECT item_id FROM layaway_reservations WHERE layaway_id IN ({placeholders})", chunk
+            ))
+            conn.execute(f"DELETE FROM layaway_reservations WHERE layaway_id IN ({placeholders})", chunk)
+            rows.extend(conn.execute(
+                f"SELECT layaway_id, items FROM layaways WHERE status='active' AND items IS NOT NULL AND layaway_id IN ({placeholders})",
+                chunk,
+            ).fetchall())
+    params = [
+        (r["layaway_id"], code, qty)
+        for r in rows
+        for code, qty in _layaway_item_qtys(r["items"]).items()
+    ]
+    if params:
+        conn.executemany(
+            "INSERT OR REPLACE INTO layaway_reservations (layaway_id, item_id, qty) VALUES (?,?,?)",
+            params,
+        )
+    if layaway_ids is not None:
+        touched.update(code for _, code, _ in params)
+        invalidate_item_matrix(conn, _templates_for_items(conn, touched))
+    return len(params)
+
+def layaway_reserved_qty(conn: sqlite3.Connection, item_ids: Optional[Any] = None) -> Dict[str, float]:
+    """Return {item_id: qty reserved by active layaways}, optionally limited to item_ids."""
+    if item_ids is None:
+        rows = conn.execute(
+            "SELECT item_id, SUM(qty) AS qty FROM layaway_reservations GROUP BY item_id"
+        ).fetchall()
+    else:
+        rows = []
+        for chunk in _chunked([str(x) for x in item_ids if x]):
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(conn.execute(
+                f"SELECT item_id, SUM(qty) AS qty FROM layaway_reservations WHERE item_id IN ({placeholders}) GROUP BY item_id",
+                chunk,
+            ).fetchall())
+    return {r["item_id"]: float(r["qty"] or 0.0) for r in rows}
+
 # ---------- VOUCHERS ----------
 def voucher_balance(conn: sqlite3.Connection, code: str) -> Optional[float]:
-    row = conn.execute("SELECT balance, active FROM v_voucher_balance WHERE voucher_code = ?", (code,)).fetchone()
+    row = conn.execute("SELECT balance, active FROM vouchers WHERE voucher_code = ?", (code,)).fetchone()
     if not row: return None
     if row["active"] != 1: return 0.0
     return float(row["balance"])
@@ -424,6 +1759,7 @@ def _queue_voucher_event(
     balance_after = payload.get("balance_after")
     currency = (payload.get("currency") or "GBP") if payload.get("currency") else "GBP"
     sale_id = payload.get("sale_id")
+    payload_json = json.dumps(payload, separators=(",",":"))
     conn.execute("""
         INSERT INTO voucher_events (event_id, voucher_code, created_utc, kind, amount, balance_after, currency, sale_id, payload_json, queue_status)
         VALUES (?,?,?,?,?,?,?,?,?,?)
@@ -436,12 +1772,12 @@ def _queue_voucher_event(
         float(balance_after) if balance_after is not None else None,
         str(currency),
         sale_id,
-        json.dumps(payload, separators=(",",":")),
+        payload_json,
         "queued"
     ))
     conn.execute("""
         INSERT INTO outbox (kind, ref_id, created_utc, payload_json) VALUES ('voucher_event', ?, ?, ?)
-    """, (event_id, created, json.dumps(payload, separators=(",",":"))))
+    """, (event_id, created, payload_json))
     return payload
 
 def _normalize_issue_utc(raw: Optional[str]) -> str:
@@ -485,7 +1821,7 @@ def voucher_details(conn: sqlite3.Connection, code: str) -> Optional[Dict[str, A
     if not code:
         return None
     head = conn.execute(
-        "SELECT voucher_code, issued_utc, initial_value, active, meta_json FROM vouchers WHERE voucher_code=?",
+        "SELECT voucher_code, issued_utc, initial_value, active, meta_json, balance FROM vouchers WHERE voucher_code=?",
         (code,)
     ).fetchone()
     if not head:
@@ -496,12 +1832,8 @@ def voucher_details(conn: sqlite3.Connection, code: str) -> Optional[Dict[str, A
             meta = json.loads(head["meta_json"])
         except Exception:
             meta = {}
-    bal_row = conn.execute(
-        "SELECT balance, active FROM v_voucher_balance WHERE voucher_code=?",
-        (code,)
-    ).fetchone()
-    balance = float(bal_row["balance"]) if bal_row and bal_row["balance"] is not None else 0.0
-    active = int(bal_row["active"]) if bal_row and "active" in bal_row.keys() else int(head["active"])
+    balance = float(head["balance"]) if head["balance"] is not None else 0.0
+    active = int(head["active"])
     return {
         "voucher_code": head["voucher_code"],
         "issued_utc": head["issued_utc"],
@@ -514,7 +1846,7 @@ def voucher_details(conn: sqlite3.Connection, code: str) -> Optional[Dict[str, A
 
 def voucher_adjust_balance(conn: sqlite3.Connection, code: str, target_balance: float, note: str = "ERP sync") -> float:
     row = conn.execute(
-        "SELECT balance FROM v_voucher_balance WHERE voucher_code=?",
+        "SELECT balance FROM vouchers WHERE voucher_code=?",
         (code,)
     ).fetchone()
     current = float(row["balance"]) if row and row["balance"] is not None else 0.0
@@ -757,6 +2089,40 @@ def record_sale(conn: sqlite3.Connection, sale: Dict[str, Any]) -> str:
         "till_number": till_number,
     }
 
+    # Serialized once: the same document goes to sales.payload_json and the outbox
+    payload_json = json.dumps(payload, separators=(",",":"))
+
+    # Row tuples are built before BEGIN IMMEDIATE so the write lock is held only for the SQL
+    line_rows = []
+    stock_rows = []
+    for idx, l in enumerate(lines, start=1):
+        qty = float(l["qty"])
+        rate = float(l["rate"])
+        line_rows.append((sale_id, idx, l["item_id"], l.get("item_name",""), l.get("brand"),
+                          json.dumps(l.get("attributes") or {}), qty, rate, qty*rate, l.get("barcode_used")))
+        stock_rows.append((l["item_id"], warehouse, 0, qty))
+
+    # Payments (store optional meta_json for extra metadata like EUR conversion details)
+    payment_rows = []
+    for idx, p in enumerate(payments, start=1):
+        meta_json = None
+        try:
+            meta = p.get('meta') if isinstance(p, dict) else None
+            if meta is not None:
+                meta_json = json.dumps(meta, separators=(",",":"))
+        except Exception:
+            meta_json = None
+
+        # Support both old format (amount) and new format (amount_gbp / amount_eur)
+        amount_gbp = p.get('amount_gbp') or p.get('amount', 0)
+        amount_eur = p.get('amount_eur')
+        currency = (p.get('currency') or 'GBP').upper()
+        eur_rate = p.get('eur_rate')
+        payment_rows.append((sale_id, idx, p["method"], currency, float(amount_gbp),
+                             float(amount_eur) if amount_eur else None,
+                             float(eur_rate) if eur_rate else None,
+                             p.get("ref"), meta_json))
+
     try:
         begin_sale_txn(conn)
 
@@ -767,48 +2133,32 @@ def record_sale(conn: sqlite3.Connection, sale: Dict[str, Any]) -> str:
         """, (
             sale_id, created, sale.get("cashier"), sale.get("customer_id"),
             subtotal, tax, discount, total, pay_status,
-            json.dumps(payload, separators=(",",":")),
+            payload_json,
             sale.get("return_against_receipt_id") or None,
         ))
 
         # Lines
-        for idx, l in enumerate(lines, start=1):
-            ensure_item_for_sale_line(conn, l)
-            conn.execute("""
-                INSERT INTO sale_lines (sale_id, line_no, item_id, item_name, brand, attributes, qty, rate, line_total, barcode_used)
-                VALUES (?,?,?,?,?,?,?,?,?,?)
-            """, (sale_id, idx, l["item_id"], l.get("item_name",""), l.get("brand"), json.dumps(l.get("attributes") or {}),
-                  float(l["qty"]), float(l["rate"]), float(l["qty"])*float(l["rate"]), l.get("barcode_used")))
+        ensure_items_for_sale_lines(conn, lines)
+        conn.executemany("""
+            INSERT INTO sale_lines (sale_id, line_no, item_id, item_name, brand, attributes, qty, rate, line_total, barcode_used)
+            VALUES (?,?,?,?,?,?,?,?,?,?)
+        """, line_rows)
+
+        # Decrement local stock
+        conn.executemany("""
+            INSERT INTO stock (item_id, warehouse, qty) VALUES (?,?,?)
+            ON CONFLICT(item_id, warehouse) DO UPDATE SET qty = MAX(0, stock.qty - ?)
+        """, stock_rows)
 
-            # Decrement local stock
-            conn.execute("""
-                INSERT INTO stock (item_id, warehouse, qty) VALUES (?,?,?)
-                ON CONFLICT(item_id, warehouse) DO UPDATE SET qty = MAX(0, stock.qty - ?)
-            """, (l["item_id"], warehouse, 0, float(l["qty"])))
+        try:
+            refresh_catalog_tile_stock(conn, [l["item_id"] for l in lines], warehouse)
+        except sqlite3.OperationalError:
+            pass  # catalog_tiles not created yet; ensure_catalog_tiles back-fills later
 
-        # Payments (store optional meta_json for extra metadata like EUR conversion details)
-        for idx, p in enumerate(payments, start=1):
-            meta_json = None
-            try:
-                meta = p.get('meta') if isinstance(p, dict) else None
-                if meta is not None:
-                    meta_json = json.dumps(meta, separators=(",",":"))
-            except Exception:
-                meta_json = None
-            
-            # Support both old format (amount) and new format (amount_gbp / amount_eur)
-            amount_gbp = p.get('amount_gbp') or p.get('amount', 0)
-            amount_eur = p.get('amount_eur')
-            currency = (p.get('currency') or 'GBP').upper()
-            eur_rate = p.get('eur_rate')
-            
-            conn.execute("""
-                INSERT INTO payments (sale_id, seq, method, currency, amount_gbp, amount_eur, eur_rate, ref, meta_json)
-                VALUES (?,?,?,?,?,?,?,?,?)
-            """, (sale_id, idx, p["method"], currency, float(amount_gbp), 
-                  float(amount_eur) if amount_eur else None, 
-                  float(eur_rate) if eur_rate else None,
-                  p.get("ref"), meta_json))
+        conn.executemany("""
+            INSERT INTO payments (sale_id, seq, method, currency, amount_gbp, amount_eur, eur_rate, ref, meta_json)
+            VALUES (?,?,?,?,?,?,?,?,?)
+        """, payment_rows)
 
         # Voucher redemption
         for v in sale.get("voucher_redeem", []):
@@ -817,9 +2167,8 @@ def record_sale(conn: sqlite3.Connection, sale: Dict[str, Any]) -> str:
             if bal is None or bal < amt - 1e-6:
                 raise ValueError(f"Voucher {code} insufficient balance or not found")
             voucher_ledger_add(conn, code, -amt, "redeem", sale_id=sale_id, note="POS redemption")
-            remaining_after = voucher_balance(conn, code)
             event_payload = {
-                "balance_after": remaining_after if remaining_after is not None else max(0.0, (bal or 0.0) - amt),
+                "balance_after": bal - amt,
                 "currency": (sale.get("currency_used") or "GBP").upper(),
                 "sale_id": sale_id,
                 "cashier": sale.get("cashier"),
@@ -831,7 +2180,7 @@ def record_sale(conn: sqlite3.Connection, sale: Dict[str, Any]) -> str:
         # Outbox enqueue (idempotent ref_id = sale_id)
         conn.execute("""
             INSERT INTO outbox (kind, ref_id, created_utc, payload_json) VALUES ('sale', ?, ?, ?)
-        """, (sale_id, created, json.dumps(payload, separators=(",",":"))))
+        """, (sale_id, created, payload_json))
 
         commit_sale_txn(conn)
         return sale_id
@@ -844,16 +2193,8 @@ def _erp_request(path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     if not ERP_BASE:
         # Dry-run: pretend success
         return {"ok": True, "dry_run": True}
-    url = ERP_BASE.rstrip("/") + path
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST", headers={
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Authorization": f"token {ERP_API_KEY}:{ERP_API_SECRET}" if ERP_API_KEY and ERP_API_SECRET else "",
-    })
     try:
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            return json.loads(resp.read().decode("utf-8"))
+        return _erp_keepalive_request("POST", path, payload)
     except urllib.error.HTTPError as e:
         body = ""
         try:
@@ -865,21 +2206,7 @@ def _erp_request(path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
 def _erp_resource_request(path: str, payload: Optional[Dict[str, Any]], method: str = "POST") -> Dict[str, Any]:
     if not ERP_BASE:
         return {"ok": True, "dry_run": True, "data": payload or {}}
-    url = ERP_BASE.rstrip("/") + path
-    data = None
-    if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Expect": "",
-    }
-    if ERP_API_KEY and ERP_API_SECRET:
-        headers["Authorization"] = f"token {ERP_API_KEY}:{ERP_API_SECRET}"
-    req = urllib.request.Request(url, data=data, method=method, headers=headers)
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        body = resp.read().decode("utf-8")
-        return json.loads(body)
+    return _erp_keepalive_request(method, path, payload)
 
 def _erp_post_resource(doctype: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     import urllib.parse
@@ -993,79 +2320,318 @@ def post_sale_to_erpnext(payload: Dict[str, Any]) -> Dict[str, Any]:
     path = "/api/method/" + (ERP_INGEST_METHOD or "pos_ingest")
     return _erp_request(path, payload)
 
-def push_outbox(conn: sqlite3.Connection, limit: int = 20):
-    rows = conn.execute("""
-        SELECT id, kind, ref_id, payload_json FROM outbox
-        ORDER BY id ASC LIMIT ?
-    """, (limit,)).fetchall()
-    for r in rows:
-        oid = r["id"]
-        kind = r["kind"]
-        ref = r["ref_id"]
-        payload = json.loads(r["payload_json"])
-        if kind == "sale":
-            try:
-                conn.execute("UPDATE sales SET queue_status='posting' WHERE sale_id=?", (ref,))
-                conn.commit()
-                resp = post_sale_to_erpnext(payload)
-                sale_docname = resp.get("name") or resp.get("docname") or resp.get("sales_invoice")
-                try:
-                    _apply_voucher_redemptions_to_erp(payload.get("voucher_redeem", []), sale_docname, payload)
-                except Exception as voucher_exc:
-                    raise RuntimeError(f"Voucher sync failed: {voucher_exc}") from voucher_exc
-                conn.execute(
-                    "UPDATE sales SET queue_status='posted', erp_docname=COALESCE(?, erp_docname,'OK') WHERE sale_id=?",
-                    (sale_docname, ref)
-                )
-                conn.execute("DELETE FROM outbox WHERE id=?", (oid,))
-                conn.commit()
-                print(f"Posted sale {ref}: {resp}")
-            except Exception as e:
-                conn.execute("UPDATE sales SET queue_status='failed' WHERE sale_id=?", (ref,))
-                conn.execute("UPDATE outbox SET attempts=attempts+1, last_error=? WHERE id=?", (str(e), oid))
-                conn.commit()
-                print(f"Failed posting sale {ref}: {e}", file=sys.stderr)
-        elif kind == "voucher_event":
-            try:
-                conn.execute("UPDATE voucher_events SET queue_status='posting' WHERE event_id=?", (ref,))
-                conn.commit()
-                resp = _post_voucher_event(payload)
-                docname = resp.get("name") or resp.get("docname") or resp.get("reference")
-                conn.execute(
-                    "UPDATE voucher_events SET queue_status='posted', erp_docname=COALESCE(?, erp_docname,'OK') WHERE event_id=?",
-                    (docname, ref)
-                )
-                conn.execute("DELETE FROM outbox WHERE id=?", (oid,))
-                conn.commit()
-                print(f"Posted voucher event {ref}: {docname or 'OK'}")
-            except Exception as e:
-                conn.execute("UPDATE voucher_events SET queue_status='failed' WHERE event_id=?", (ref,))
-                conn.execute("UPDATE outbox SET attempts=attempts+1, last_error=? WHERE id=?", (str(e), oid))
-                conn.commit()
-                print(f"Failed posting voucher event {ref}: {e}", file=sys.stderr)
-        elif kind == "voucher":
+# Outbox dispatch: rows are claimed with a lease (so the idle loop, sync_worker and manual
+# retries never post the same row twice), each kind posts on its own worker lane over
+# keep-alive connections, and failed rows wait out a jittered exponential backoff.
+try:
+    OUTBOX_LEASE_SECONDS = max(30, int(os.environ.get("POS_OUTBOX_LEASE_SECONDS", "300")))
+except ValueError:
+    OUTBOX_LEASE_SECONDS = 300
+try:
+    OUTBOX_BACKOFF_BASE = max(1.0, float(os.environ.get("POS_OUTBOX_BACKOFF_BASE", "5")))
+except ValueError:
+    OUTBOX_BACKOFF_BASE = 5.0
+try:
+    OUTBOX_BACKOFF_MAX = max(OUTBOX_BACKOFF_BASE, float(os.environ.get("POS_OUTBOX_BACKOFF_MAX", "1800")))
+except ValueError:
+    OUTBOX_BACKOFF_MAX = 1800.0
+
+def _outbox_lane_workers(spec: Optional[str]) -> Dict[str, int]:
+    """Parse POS_OUTBOX_LANES, e.g. 'sale=4,voucher=1,voucher_event=2'."""
+    lanes = {"sale": 4, "voucher": 1, "voucher_event": 2}
+    for part in (spec or "").split(","):
+        kind, _, count = part.partition("=")
+        kind = kind.strip()
+        if kind not in lanes:
+            continue
+        try:
+            lanes[kind] = max(1, int(count))
+        except ValueError:
+            continue
+    return lanes
+
+OUTBOX_LANES = _outbox_lane_workers(os.environ.get("POS_OUTBOX_LANES"))
+_OUTBOX_POOLS: Dict[str, ThreadPoolExecutor] = {}
+_OUTBOX_POOLS_LOCK = threading.Lock()
+
+def _ensure_outbox_lease_columns(conn: sqlite3.Connection):
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(outbox)").fetchall()}
+    if not existing:
+        return
+    alters = []
+    if "lease_owner" not in existing:
+        alters.append("ALTER TABLE outbox ADD COLUMN lease_owner TEXT")
+    if "lease_until" not in existing:
+        alters.append("ALTER TABLE outbox ADD COLUMN lease_until TEXT")
+    if "next_attempt_utc" not in existing:
+        alters.append("ALTER TABLE outbox ADD COLUMN next_attempt_utc TEXT")
+    if "progress_json" not in existing:
+        alters.append("ALTER TABLE outbox ADD COLUMN progress_json TEXT")
+    for sql in alters:
+        conn.execute(sql)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_ref ON outbox(kind, ref_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_lease ON outbox(lease_owner)")
+    conn.commit()
+
+def _utc_after(seconds: float) -> str:
+    return (dt.datetime.utcnow() + dt.timedelta(seconds=seconds)).replace(microsecond=0).isoformat() + "Z"
+
+def _outbox_backoff_seconds(attempts: int) -> float:
+    """Delay before retry number `attempts` (1-based), with jitter to spread a backlog out."""
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** min(max(attempts - 1, 0), 20)))
+    return delay * random.uniform(0.5, 1.0)
+
+def _outbox_pool(kind: str) -> ThreadPoolExecutor:
+    # Long-lived per lane so each worker keeps its keep-alive connection between passes
+    with _OUTBOX_POOLS_LOCK:
+        pool = _OUTBOX_POOLS.get(kind)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=OUTBOX_LANES.get(kind, 1), thread_name_prefix=f"outbox-{kind}")
+            _OUTBOX_POOLS[kind] = pool
+        return pool
+
+_OUTBOX_READY = "({a}.lease_until IS NULL OR {a}.lease_until < :now) AND ({a}.next_attempt_utc IS NULL OR {a}.next_attempt_utc <= :now)"
+# A voucher event waits for its sale and its voucher issue, and for any earlier event on the
+# same voucher, so ERPNext always sees a voucher's history in order. A sale that redeems a
+# voucher waits for that voucher's earlier issue row, or the redemption would find no doc.
+_OUTBOX_BLOCKED = {
+    "sale": """
+        EXISTS (
+          SELECT 1 FROM json_each(o.payload_json, '$.voucher_redeem') v
+          JOIN outbox b ON b.kind='voucher' AND b.id < o.id
+                       AND b.ref_id = json_extract(v.value, '$.code')
+        )""",
+    "voucher_event": """
+        EXISTS (
+          SELECT 1 FROM outbox b
+          WHERE (b.kind='sale' AND b.ref_id = json_extract(o.payload_json, '$.sale_id'))
+             OR (b.kind='voucher' AND b.ref_id = json_extract(o.payload_json, '$.voucher_code'))
+             OR (b.kind='voucher_event' AND b.id < o.id
+                 AND json_extract(b.payload_json, '$.voucher_code') = json_extract(o.payload_json, '$.voucher_code'))
+        )""",
+}
+
+def _outbox_claim(conn: sqlite3.Connection, kind: str, owner: str, limit: int) -> List[sqlite3.Row]:
+    """Lease up to `limit` ready rows of one kind to `owner`; the UPDATE is atomic across processes."""
+    blocked = _OUTBOX_BLOCKED.get(kind)
+    sql = f"""
+        UPDATE outbox SET lease_owner=:owner, lease_until=:until
+        WHERE id IN (
+          SELECT o.id FROM outbox o
+          WHERE o.kind=:kind AND {_OUTBOX_READY.format(a='o')}
+          {f"AND NOT {blocked}" if blocked else ""}
+          ORDER BY o.id LIMIT :limit
+        )
+    """
+    conn.execute(sql, {"owner": owner, "until": _utc_after(OUTBOX_LEASE_SECONDS), "kind": kind,
+                       "now": iso_now(), "limit": limit})
+    return conn.execute(
+        "SELECT id, kind, ref_id, payload_json, attempts, progress_json FROM outbox WHERE lease_owner=? AND kind=? ORDER BY id",
+        (owner, kind)
+    ).fetchall()
+
+def claim_outbox_entry(conn: sqlite3.Connection, outbox_id: int) -> Optional[str]:
+    """Lease a single outbox row for an out-of-band post (manual retry).
+
+    Returns the lease owner token, or None when a dispatcher currently holds the row.
+    """
+    owner = f"manual:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    cur = conn.execute(
+        "UPDATE outbox SET lease_owner=:owner, lease_until=:until WHERE id=:id AND (lease_until IS NULL OR lease_until < :now)",
+        {"owner": owner, "until": _utc_after(OUTBOX_LEASE_SECONDS), "id": outbox_id, "now": iso_now()}
+    )
+    conn.commit()
+    return owner if cur.rowcount else None
+
+def outbox_record_failure(conn: sqlite3.Connection, outbox_id: int, error: str,
+                          progress: Optional[Dict[str, Any]] = None):
+    """Count a failed attempt, release the lease and schedule the next try.
+
+    `progress` records the steps that already reached ERPNext, so the retry skips them.
+    """
+    row = conn.execute("SELECT attempts FROM outbox WHERE id=?", (outbox_id,)).fetchone()
+    attempts = (row["attempts"] if row else 0) + 1
+    conn.execute(
+        "UPDATE outbox SET attempts=?, last_error=?, next_attempt_utc=?, lease_owner=NULL, lease_until=NULL,"
+        " progress_json=COALESCE(?, progress_json) WHERE id=?",
+        (attempts, error, _utc_after(_outbox_backoff_seconds(attempts)),
+         json.dumps(progress, separators=(",", ":")) if progress else None, outbox_id)
+    )
+
+def outbox_progress(conn: sqlite3.Connection, outbox_id: int) -> Dict[str, Any]:
+    row = conn.execute("SELECT progress_json FROM outbox WHERE id=?", (outbox_id,)).fetchone()
+    try:
+        return json.loads(row["progress_json"]) if row and row["progress_json"] else {}
+    except ValueError:
+        return {}
+
+class OutboxStepError(RuntimeError):
+    """A multi-step post failed part way; `progress` lists the steps that succeeded."""
+
+    def __init__(self, message: str, progress: Dict[str, Any]):
+        super().__init__(message)
+        self.progress = progress
+
+def send_outbox_sale(payload: Dict[str, Any], progress: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Post a sale's Sales Invoice, then apply its voucher redemptions one by one.
+
+    Steps recorded in `progress` (sale_docname, vouchers_applied) are not repeated, so a
+    retry after a voucher failure never creates a second Sales Invoice.
+    """
+    progress = dict(progress or {})
+    resp: Dict[str, Any] = {}
+    if progress.get("sale_posted"):
+        sale_docname = progress.get("sale_docname")
+    else:
+        resp = post_sale_to_erpnext(payload)
+        sale_docname = resp.get("name") or resp.get("docname") or resp.get("sales_invoice")
+        progress.update(sale_posted=True, sale_docname=sale_docname)
+    applied = list(progress.get("vouchers_applied") or [])
+    for idx, entry in enumerate(payload.get("voucher_redeem") or []):
+        if idx in applied:
+            continue
+        try:
+            _apply_voucher_redemptions_to_erp([entry], sale_docname, payload)
+        except Exception as voucher_exc:
+            raise OutboxStepError(f"Voucher sync failed: {voucher_exc}", progress) from voucher_exc
+        applied.append(idx)
+        progress["vouchers_applied"] = applied
+    return {"docname": sale_docname, "resp": resp or {"name": sale_docname}, "progress": progress}
+
+def _outbox_send(kind: str, payload: Dict[str, Any], progress: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Network half of a dispatch (runs on a lane worker); no SQLite access here.
+
+    The result's "progress" is what to keep if writing the result back fails, so the
+    retry finishes the bookkeeping without posting again.
+    """
+    if kind == "sale":
+        return send_outbox_sale(payload, progress)
+    if progress and progress.get("posted"):
+        docname = progress.get("docname")
+    elif kind == "voucher_event":
+        resp = _post_voucher_event(payload)
+        docname = resp.get("name") or resp.get("docname") or resp.get("reference")
+    else:
+        docname = _post_voucher_issue_to_erp(payload.get("voucher") or {}).get("name")
+    return {"docname": docname, "progress": {"posted": True, "docname": docname}}
+
+def _outbox_apply_success(conn: sqlite3.Connection, row: sqlite3.Row, payload: Dict[str, Any], result: Dict[str, Any]):
+    oid, kind, ref = row["id"], row["kind"], row["ref_id"]
+    docname = result.get("docname")
+    if kind == "sale":
+        conn.execute(
+            "UPDATE sales SET queue_status='posted', erp_docname=COALESCE(?, erp_docname,'OK') WHERE sale_id=?",
+            (docname, ref)
+        )
+        print(f"Posted sale {ref}: {result.get('resp')}")
+    elif kind == "voucher_event":
+        conn.execute(
+            "UPDATE voucher_events SET queue_status='posted', erp_docname=COALESCE(?, erp_docname,'OK') WHERE event_id=?",
+            (docname, ref)
+        )
+        print(f"Posted voucher event {ref}: {docname or 'OK'}")
+    else:
+        head = voucher_details(conn, ref)
+        meta = head["meta"] if head else {}
+        if meta is None:
+            meta = {}
+        if docname:
+            meta["erp_name"] = docname
+        if payload.get("voucher", {}).get("status"):
+            meta["status"] = payload["voucher"]["status"]
+        conn.execute(
+            "UPDATE vouchers SET meta_json=? WHERE voucher_code=?",
+            (json.dumps(meta, separators=(",",":")), ref)
+        )
+        print(f"Posted voucher {ref}: {docname or 'OK'}")
+    conn.execute("DELETE FROM outbox WHERE id=?", (oid,))
+
+def _outbox_apply_failure(conn: sqlite3.Connection, row: sqlite3.Row, exc: Exception):
+    kind, ref = row["kind"], row["ref_id"]
+    progress = exc.progress if isinstance(exc, OutboxStepError) else None
+    if kind == "sale":
+        conn.execute(
+            "UPDATE sales SET queue_status='failed', erp_docname=COALESCE(?, erp_docname) WHERE sale_id=?",
+            ((progress or {}).get("sale_docname"), ref)
+        )
+        print(f"Failed posting sale {ref}: {exc}", file=sys.stderr)
+    elif kind == "voucher_event":
+        conn.execute("UPDATE voucher_events SET queue_status='failed' WHERE event_id=?", (ref,))
+        print(f"Failed posting voucher event {ref}: {exc}", file=sys.stderr)
+    else:
+        print(f"Failed posting voucher {ref}: {exc}", file=sys.stderr)
+    outbox_record_failure(conn, row["id"], str(exc), progress)
+
+def _outbox_keep_progress(conn: sqlite3.Connection, row: sqlite3.Row, error: str,
+                          progress: Optional[Dict[str, Any]]) -> None:
+    """Last resort after a write-back failed: release the row but keep what reached ERPNext."""
+    try:
+        outbox_record_failure(conn, row["id"], error, progress)
+        conn.commit()
+    except Exception as exc:
+        conn.rollback()
+        print(f"Failed saving outbox progress for {row['kind']} {row['ref_id']}: {exc}", file=sys.stderr)
+
+def push_outbox(conn: sqlite3.Connection, limit: int = 20) -> Dict[str, int]:
+    """Claim up to `limit` ready rows per kind and post them concurrently on per-kind lanes.
+
+    Results are written back from this thread as posts complete, one commit each, so
+    worker threads never touch SQLite and one failed write-back cannot undo the others.
+    """
+    owner = f"{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex[:8]}"
+    claimed: List[sqlite3.Row] = []
+    for kind in OUTBOX_LANES:
+        claimed.extend(_outbox_claim(conn, kind, owner, limit))
+    if not claimed:
+        conn.commit()
+        return {"posted": 0, "failed": 0}
+    conn.execute(
+        "UPDATE sales SET queue_status='posting' WHERE sale_id IN (SELECT ref_id FROM outbox WHERE lease_owner=? AND kind='sale')",
+        (owner,)
+    )
+    conn.execute(
+        "UPDATE voucher_events SET queue_status='posting' WHERE event_id IN (SELECT ref_id FROM outbox WHERE lease_owner=? AND kind='voucher_event')",
+        (owner,)
+    )
+    conn.commit()
+    pending = {}
+    for row in claimed:
+        payload = json.loads(row["payload_json"])
+        progress = json.loads(row["progress_json"]) if row["progress_json"] else None
+        fut = _outbox_pool(row["kind"]).submit(_outbox_send, row["kind"], payload, progress)
+        pending[fut] = (row, payload)
+    posted = failed = 0
+    while pending:
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for fut in done:
+            row, payload = pending.pop(fut)
+            result: Optional[Dict[str, Any]] = None
+            error: Optional[Exception] = None
             try:
-                result = _post_voucher_issue_to_erp(payload.get("voucher") or {})
-                erp_name = result.get("name")
-                head = voucher_details(conn, ref)
-                meta = head["meta"] if head else {}
-                if meta is None:
-                    meta = {}
-                if erp_name:
-                    meta["erp_name"] = erp_name
-                if payload.get("voucher", {}).get("status"):
-                    meta["status"] = payload["voucher"]["status"]
-                conn.execute(
-                    "UPDATE vouchers SET meta_json=? WHERE voucher_code=?",
-                    (json.dumps(meta, separators=(",",":")), ref)
-                )
-                conn.execute("DELETE FROM outbox WHERE id=?", (oid,))
-                conn.commit()
-                print(f"Posted voucher {ref}: {erp_name or 'OK'}")
-            except Exception as e:
-                conn.execute("UPDATE outbox SET attempts=attempts+1, last_error=? WHERE id=?", (str(e), oid))
+                result = fut.result()
+            except Exception as exc:
+                error = exc
+            try:
+                if error is None:
+                    _outbox_apply_success(conn, row, payload, result)
+                else:
+                    _outbox_apply_failure(conn, row, error)
                 conn.commit()
-                print(f"Failed posting voucher {ref}: {e}", file=sys.stderr)
+            except Exception as exc:
+                conn.rollback()
+                print(f"Failed recording outbox {row['kind']} {row['ref_id']}: {exc}", file=sys.stderr)
+                if error is None:
+                    progress = result.get("progress")
+                else:
+                    progress = error.progress if isinstance(error, OutboxStepError) else None
+                _outbox_keep_progress(conn, row, f"Recording result failed: {exc}", progress)
+                failed += 1
+                continue
+            if error is None:
+                posted += 1
+            else:
+                failed += 1
+    return {"posted": posted, "failed": failed}
 
 # ---------- BACKUPS ----------
 def ensure_dir(p: str):
@@ -1107,6 +2673,259 @@ def backup_ndjson(conn: sqlite3.Connection, day: Optional[str] = None):
 
     print(f"Backed up to {sales_path}, {ledger_path}, and {events_path}")
 
+# ---------- INVOICE JOURNAL ----------
+# Index of the receipt files in invoices/ (one row per file) so the idle ingest, day views
+# and pending counts query SQLite instead of opening every JSON file. A sync only lists the
+# directory when its mtime moved and only opens files that are new or rewritten. Settled
+# receipts older than POS_INVOICE_ARCHIVE_DAYS are rolled into monthly gzip NDJSON segments
+# under invoices/archive/ and stay reachable through the journal.
+try:
+    INVOICE_ARCHIVE_DAYS = max(0, int(os.environ.get("POS_INVOICE_ARCHIVE_DAYS", "30")))
+except ValueError:
+    INVOICE_ARCHIVE_DAYS = 30
+_INVOICE_DIR_STATE: Dict[str, int] = {}
+_INVOICE_JOURNAL_LOCK = threading.Lock()
+
+def _ensure_invoice_journal_table(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS invoice_journal (
+      file_name    TEXT PRIMARY KEY,
+      sale_id      TEXT,
+      invoice_name TEXT,
+      day          TEXT,
+      created_at   TEXT,
+      mtime        REAL,
+      mode         TEXT,
+      customer     TEXT,
+      cashier      TEXT,
+      total        NUMERIC,
+      acked        INTEGER NOT NULL DEFAULT 0,
+      ingested     INTEGER NOT NULL DEFAULT 0,
+      location     TEXT NOT NULL DEFAULT 'live'
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoice_journal_day ON invoice_journal(day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoice_journal_sale ON invoice_journal(sale_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoice_journal_pending ON invoice_journal(file_name) WHERE ingested=0")
+
+def _invoice_day(created: str) -> Optional[str]:
+    if len(created) >= 10 and created[4] == "-" and created[7] == "-":
+        return created[:10]
+    try:
+        return dt.datetime.fromisoformat(created.replace("Z", "")).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+def _invoice_journal_row(path: Path, mtime: float, acked: bool) -> Tuple[Any, ...]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            rec = json.load(f)
+    except Exception:
+        rec = None
+    if not isinstance(rec, dict):
+        # Unreadable (or still being written): indexed without a sale_id so ingest skips it
+        return (path.name, None, None, None, None, mtime, None, None, None, None, 1 if acked else 0)
+    created = (rec.get("created_at") or "").strip()
+    cashier = rec.get("cashier") or {}
+    if isinstance(cashier, dict):
+        cashier_txt = (cashier.get("code", "") + " " + cashier.get("name", "")).strip()
+    else:
+        cashier_txt = str(cashier)
+    try:
+        total = float(rec.get("total") or 0)
+    except (TypeError, ValueError):
+        total = 0.0
+    return (
+        path.name,
+        rec.get("sale_id") or rec.get("invoice_name") or path.stem,
+        (rec.get("invoice_name") or "").strip() or path.stem,
+        _invoice_day(created) if created else None,
+        created or None,
+        mtime,
+        rec.get("mode"),
+        rec.get("customer") or "",
+        cashier_txt,
+        total,
+        1 if acked else 0,
+    )
+
+def invoice_journal_sync(conn: sqlite3.Connection, inv_dir: str = "invoices", force: bool = False) -> int:
+    """Bring the journal in line with inv_dir; returns how many files were (re)indexed."""
+    base = Path(inv_dir)
+    try:
+        dir_mtime = base.stat().st_mtime_ns
+    except OSError:
+        return 0
+    key = f"{_db_file(conn)}|{os.path.realpath(inv_dir)}"
+    with _INVOICE_JOURNAL_LOCK:
+        if not force and _INVOICE_DIR_STATE.get(key) == dir_mtime:
+            return 0
+        known = {
+            row["file_name"]: (row["mtime"], row["acked"])
+            for row in conn.execute("SELECT file_name, mtime, acked FROM invoice_journal WHERE location='live'")
+        }
+        on_disk: Dict[str, float] = {}
+        acks: Set[str] = set()
+        with os.scandir(base) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.endswith(".json.ok"):
+                    acks.add(name[:-3])
+                    continue
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    if entry.is_file():
+                        on_disk[name] = entry.stat().st_mtime
+                except OSError:
+                    continue
+        fresh = [n for n, m in on_disk.items() if n not in known or known[n][0] != m]
+        rows = [_invoice_journal_row(base / n, on_disk[n], n in acks) for n in fresh]
+        conn.executemany("""
+            INSERT INTO invoice_journal (file_name, sale_id, invoice_name, day, created_at, mtime, mode, customer, cashier, total, acked)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?)
+            ON CONFLICT(file_name) DO UPDATE SET
+              sale_id=excluded.sale_id, invoice_name=excluded.invoice_name, day=excluded.day,
+              created_at=excluded.created_at, mtime=excluded.mtime, mode=excluded.mode,
+              customer=excluded.customer, cashier=excluded.cashier, total=excluded.total,
+              acked=MAX(invoice_journal.acked, excluded.acked), location='live'
+        """, rows)
+        gone = [(n,) for n in known if n not in on_disk]
+        conn.executemany("UPDATE invoice_journal SET location='gone' WHERE file_name=?", gone)
+        new_acks = [(n,) for n in acks if n in known and not known[n][1]]
+        conn.executemany("UPDATE invoice_journal SET acked=1 WHERE file_name=?", new_acks)
+        conn.commit()
+        # A file caught mid-write is re-read on the next pass (its later writes don't touch the dir mtime)
+        if all(row[1] is not None for row in rows):
+            _INVOICE_DIR_STATE[key] = dir_mtime
+        return len(rows)
+
+def invoice_journal_pending(conn: sqlite3.Connection, inv_dir: str = "invoices") -> List[sqlite3.Row]:
+    """Journal rows for live receipt files that are not yet recorded in sales."""
+    invoice_journal_sync(conn, inv_dir)
+    conn.execute("""
+        UPDATE invoice_journal SET ingested=1
+        WHERE ingested=0 AND sale_id IN (SELECT sale_id FROM sales)
+    """)
+    conn.commit()
+    return conn.execute("""
+        SELECT file_name, sale_id FROM invoice_journal
+        WHERE ingested=0 AND location='live' AND sale_id IS NOT NULL
+        ORDER BY file_name
+    """).fetchall()
+
+def invoice_journal_mark_ingested(conn: sqlite3.Connection, file_name: str):
+    conn.execute("UPDATE invoice_journal SET ingested=1 WHERE file_name=?", (file_name,))
+    conn.commit()
+
+def invoice_journal_day(conn: sqlite3.Connection, day: str, inv_dir: str = "invoices") -> List[sqlite3.Row]:
+    """Receipts (live files and archived ones) created on day, oldest first."""
+    invoice_journal_sync(conn, inv_dir)
+    return conn.execute("""
+        SELECT file_name, sale_id, invoice_name, created_at, mode, customer, cashier, total, acked, location
+        FROM invoice_journal WHERE day=? AND location<>'gone' ORDER BY created_at
+    """, (day,)).fetchall()
+
+def invoice_journal_unacked(conn: sqlite3.Connection, inv_dir: str = "invoices") -> int:
+    """Count live receipt files that have never had a .json.ok sidecar."""
+    invoice_journal_sync(conn, inv_dir)
+    row = conn.execute("SELECT COUNT(*) FROM invoice_journal WHERE location='live' AND acked=0").fetchone()
+    return int(row[0]) if row else 0
+
+def invoice_journal_load(conn: sqlite3.Connection, sale_id: str, inv_dir: str = "invoices") -> Optional[Dict[str, Any]]:
+    """Return the receipt record for sale_id (or invoice_name) from its file or archive segment."""
+    invoice_journal_sync(conn, inv_dir)
+    row = conn.execute("""
+        SELECT file_name, location FROM invoice_journal
+        WHERE (sale_id=? OR invoice_name=?) AND location<>'gone'
+        ORDER BY location='live' DESC LIMIT 1
+    """, (sale_id, sale_id)).fetchone()
+    if not row:
+        return None
+    base = Path(inv_dir)
+    try:
+        if row["location"] == "live":
+            with open(base / row["file_name"], "r", encoding="utf-8") as f:
+                return json.load(f)
+        found = None
+        with gzip.open(base / row["location"], "rt", encoding="utf-8") as seg:
+            for line in seg:
+                entry = json.loads(line)
+                if entry.get("file") == row["file_name"]:
+                    found = entry.get("record")
+        return found
+    except Exception:
+        return None
+
+def invoice_journal_archive(conn: sqlite3.Connection, inv_dir: str = "invoices", older_than_days: Optional[int] = None, limit: int = 2000) -> int:
+    """Roll settled receipt files older than the cutoff into archive/YYYY-MM.ndjson.gz.
+
+    Only receipts already recorded in sales and posted to ERPNext (or sold in ERPNext mode)
+    are moved, so nothing the till agent or ingest still needs leaves invoices/.
+    """
+    days = INVOICE_ARCHIVE_DAYS if older_than_days is None else older_than_days
+    if days <= 0:
+        return 0
+    invoice_journal_sync(conn, inv_dir)
+    cutoff = (dt.date.today() - dt.timedelta(days=days)).isoformat()
+    rows = conn.execute("""
+        SELECT j.file_name, j.day FROM invoice_journal j
+        JOIN sales s ON s.sale_id = j.sale_id
+        WHERE j.location='live' AND j.ingested=1 AND j.day < ?
+          AND (s.queue_status='posted' OR j.mode='erpnext')
+        ORDER BY j.day, j.file_name LIMIT ?
+    """, (cutoff, limit)).fetchall()
+    if not rows:
+        return 0
+    base = Path(inv_dir)
+    segments: Dict[str, List[str]] = {}
+    for row in rows:
+        segments.setdefault(f"archive/{row['day'][:7]}.ndjson.gz", []).append(row["file_name"])
+    moved: List[Tuple[str, str]] = []
+    for segment, names in segments.items():
+        (base / segment).parent.mkdir(parents=True, exist_ok=True)
+        # A run that crashed after appending left its files behind; don't append them twice
+        archived = _invoice_archive_names(base / segment)
+        moved.extend((segment, name) for name in names if name in archived)
+        names = [name for name in names if name not in archived]
+        if not names:
+            continue
+        # Appending adds a gzip member; readers see one continuous stream
+        with gzip.open(base / segment, "at", encoding="utf-8") as seg:
+            for name in names:
+                try:
+                    with open(base / name, "r", encoding="utf-8") as f:
+                        rec = json.load(f)
+                except Exception:
+                    continue
+                seg.write(json.dumps({"file": name, "record": rec}, separators=(",", ":")) + "\n")
+                moved.append((segment, name))
+    # Record the new location before removing anything, so a crash leaves at worst a
+    # stray copy in invoices/ (re-indexed as live and skipped above next time)
+    conn.executemany("UPDATE invoice_journal SET location=? WHERE file_name=?", moved)
+    conn.commit()
+    for segment, name in moved:
+        try:
+            (base / name).unlink()
+        except FileNotFoundError:
+            pass
+    return len(moved)
+
+def _invoice_archive_names(path: Path) -> Set[str]:
+    """File names already stored in an archive segment (empty if it does not exist yet)."""
+    names: Set[str] = set()
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as seg:
+            for line in seg:
+                try:
+                    names.add(json.loads(line).get("file"))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    except (OSError, EOFError):
+        pass  # a member cut short by a crash; keep the names read before it
+    return names
+
 # ---------- DEMO & CLI ----------
 def demo_seed(conn: sqlite3.Connection):
     """Seed a richer demo catalog matching mock examples + one boot template.
@@ -1223,6 +3042,7 @@ def demo_seed(conn: sqlite3.Connection):
     # Demo cashier(s)
     conn.execute("INSERT OR REPLACE INTO cashiers (code, name, active, meta) VALUES (?,?,1,?)", ("19", "Josh", json.dumps({"note":"demo user"})))
     conn.commit()
+    ensure_catalog_tiles(conn)
     print("Demo seed inserted: athletic, casual, dress, kids, and boot variants.")
 
 def demo_sale(conn: sqlite3.Connection):
@@ -1246,29 +3066,21 @@ def _cursor_get(conn: sqlite3.Connection, doctype: str):
     row = conn.execute("SELECT last_modified, last_name FROM sync_cursors WHERE doctype=?", (doctype,)).fetchone()
     return (row["last_modified"], row["last_name"]) if row else (None, None)
 
-def _cursor_set(conn: sqlite3.Connection, doctype: str, last_modified: str, last_name: str):
+def _cursor_set(conn: sqlite3.Connection, doctype: str, last_modified: str, last_name: str, commit: bool = True):
     conn.execute("""
         INSERT INTO sync_cursors (doctype, last_modified, last_name) VALUES (?,?,?)
         ON CONFLICT(doctype) DO UPDATE SET last_modified=excluded.last_modified, last_name=excluded.last_name
     """, (doctype, last_modified, last_name))
-    conn.commit()
+    if commit:
+        conn.commit()
 
 def _erp_get(url_path: str, params: Dict[str, Any]) -> Dict[str, Any]:
     """Basic GET helper with token auth. Returns dict; on dry-run returns empty list."""
     if not ERP_BASE:
         return {"data": []}
-    import urllib.parse, urllib.request, json
-    base = ERP_BASE.rstrip("/")
-    path = url_path or ""
     # Encode spaces/control chars but keep path separators
-    path_encoded = urllib.parse.quote(path, safe="/:")
-    url = base + path_encoded + "?" + urllib.parse.urlencode(params, doseq=True)
-    req = urllib.request.Request(url, method="GET", headers={
-        "Accept": "application/json",
-        "Authorization": f"token {ERP_API_KEY}:{ERP_API_SECRET}" if ERP_API_KEY and ERP_API_SECRET else ""
-    })
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        return json.loads(resp.read().decode("utf-8"))
+    path_encoded = urllib.parse.quote(url_path or "", safe="/:")
+    return _erp_keepalive_request("GET", path_encoded + "?" + urllib.parse.urlencode(params, doseq=True))
 
 
 def _describe_http_error(exc: urllib.error.HTTPError) -> str:
@@ -1291,24 +3103,199 @@ def _erp_get_doc(doctype: str, name: str) -> Dict[str, Any]:
     """Fetch a single document (e.g., Item/SKU)"""
     if not ERP_BASE:
         return {}
-    import urllib.parse, urllib.request, json
-    base = ERP_BASE.rstrip("/")
     path = "/api/resource/{}/{}".format(
         urllib.parse.quote(doctype, safe=""),
         urllib.parse.quote(name, safe="")
     )
-    url = base + path
-    req = urllib.request.Request(url, method="GET", headers={
+    data = _erp_keepalive_get(path)
+    return data.get("data") or data
+
+def _http_fetch(method: str, url: str, payload: Optional[Dict[str, Any]] = None,
+                headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+                verify: bool = True) -> "pos_http.HttpResponse":
+    """Send through the shared keep-alive pool, following redirects; raises HTTPError like urlopen."""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    hdrs = dict(headers or {})
+    if data is not None:
+        hdrs["Content-Type"] = "application/json"
+    for _ in range(5):
+        resp = pos_http.request(method, url, data=data, headers=hdrs, timeout=timeout, verify=verify)
+        location = resp.headers.get("Location") if resp.status in (301, 302, 303, 307, 308) else None
+        if not location:
+            break
+        url = urllib.parse.urljoin(url, location)
+        if resp.status in (301, 302, 303) and method not in ("GET", "HEAD"):
+            method, data = "GET", None
+            hdrs.pop("Content-Type", None)
+    if resp.status >= 400:
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(resp.body))
+    return resp
+
+def _erp_keepalive_get(path: str) -> Dict[str, Any]:
+    """GET path (already quoted) over the shared keep-alive pool; raises HTTPError like urlopen."""
+    return _erp_keepalive_request("GET", path)
+
+def _erp_keepalive_request(method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Send method/path (already quoted, relative to ERP_BASE) over the shared keep-alive pool.
+
+    pos_http re-sends after a dropped idle socket (POST/PUT only when the server never
+    saw the request) and records the call in pos_http.METRICS.
+    """
+    headers = {
         "Accept": "application/json",
         "Authorization": f"token {ERP_API_KEY}:{ERP_API_SECRET}" if ERP_API_KEY and ERP_API_SECRET else ""
-    })
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        data = json.loads(resp.read().decode("utf-8"))
-    return data.get("data") or data
+    }
+    return _http_fetch(method, ERP_BASE.rstrip("/") + path, payload, headers).json()
 
-def pull_items_incremental(conn: sqlite3.Connection, limit: int = ITEM_PULL_PAGE_LIMIT):
-    """Pull Item (templates + variants) changed since cursor. Upsert into items; barcodes handled separately."""
-    last_mod, last_name = _cursor_get(conn, "Item")
+_ERP_FETCH_POOL: Optional[ThreadPoolExecutor] = None
+_ERP_FETCH_POOL_LOCK = threading.Lock()
+
+def _erp_fetch_pool() -> ThreadPoolExecutor:
+    # Long-lived so each worker keeps its keep-alive connection across pages and cycles
+    global _ERP_FETCH_POOL
+    with _ERP_FETCH_POOL_LOCK:
+        if _ERP_FETCH_POOL is None:
+            _ERP_FETCH_POOL = ThreadPoolExecutor(max_workers=ERP_FETCH_WORKERS, thread_name_prefix="erp-doc")
+        return _ERP_FETCH_POOL
+
+class ItemDocCache:
+    """Item docs for one pull cycle, shared by the attribute and tax hydration passes.
+
+    prefetch() fetches missing docs concurrently; get() returns a cached doc (fetching
+    inline on a miss) and re-raises the original error for docs that failed, so callers
+    keep their 403/404 handling.
+    """
+
+    def __init__(self):
+        self._docs: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._errors: Dict[str, Exception] = {}
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._docs or item_id in self._errors
+
+    def put(self, item_id: str, doc: Optional[Dict[str, Any]]):
+        self._docs[item_id] = doc
+        self._errors.pop(item_id, None)
+
+    @staticmethod
+    def _fetch(item_id: str):
+        try:
+            return item_id, _erp_get_doc("Item", item_id), None
+        except Exception as exc:
+            return item_id, None, exc
+
+    def prefetch(self, item_ids: Any):
+        todo = [i for i in dict.fromkeys(item_ids) if i and i not in self and i not in UNFETCHABLE_ITEM_DOCS]
+        if not todo:
+            return
+        if len(todo) == 1 or ERP_FETCH_WORKERS <= 1:
+            results = [self._fetch(i) for i in todo]
+        else:
+            results = list(_erp_fetch_pool().map(self._fetch, todo))
+        for item_id, doc, exc in results:
+            if exc is None:
+                self._docs[item_id] = doc
+            else:
+                self._errors[item_id] = exc
+
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        if item_id not in self:
+            self.prefetch([item_id])
+        if item_id in self._errors:
+            raise self._errors[item_id]
+        return self._docs.get(item_id)
+
+def _erp_child_rows(doctype: str, parent_ids: List[str], parent_doctype: str = "Item") -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """Child-table rows for many parents via `parent in [...]` list queries; None when not permitted."""
+    if not ERP_BATCH_CHILD_TABLES or doctype in _CHILD_TABLE_FORBIDDEN:
+        return None
+    out: Dict[str, List[Dict[str, Any]]] = {p: [] for p in parent_ids}
+    for chunk in _chunked(parent_ids, 100):
+        params = {
+            "fields": json.dumps(["*"]),
+            "filters": json.dumps([["parent", "in", chunk]]),
+            "parent": parent_doctype,
+            "limit_page_length": 0,
+        }
+        try:
+            data = _erp_get(f"/api/resource/{doctype}", params).get("data", [])
+        except urllib.error.HTTPError as exc:
+            if exc.code in (403, 404, 417):
+                _CHILD_TABLE_FORBIDDEN.add(doctype)
+            print(f"Batched {doctype} query unavailable ({exc}); falling back to Item docs", file=sys.stderr)
+            return None
+        except Exception as exc:
+            print(f"Batched {doctype} query failed: {exc}; falling back to Item docs", file=sys.stderr)
+            return None
+        for row in data:
+            out.setdefault(row.get("parent"), []).append(row)
+    for rows in out.values():
+        rows.sort(key=lambda r: r.get("idx") or 0)
+    return out
+
+def _item_vat_field_values(docs: ItemDocCache, ids: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Item-level vat_rate/tax_rate values for ids via list queries; None when they cannot be read.
+
+    The first call fetches one full Item doc to learn which of the custom fields exist, so
+    list queries never name a column the site lacks.
+    """
+    global _ITEM_VAT_FIELDS_PRESENT
+    if _ITEM_VAT_FIELDS_PRESENT is None:
+        try:
+            sample = docs.get(ids[0])
+        except Exception:
+            return None
+        if sample is None:
+            return None
+        _ITEM_VAT_FIELDS_PRESENT = [f for f in _ITEM_VAT_FIELDS if f in sample]
+    out: Dict[str, Dict[str, Any]] = {i: {} for i in ids}
+    if not _ITEM_VAT_FIELDS_PRESENT:
+        return out
+    for chunk in _chunked(ids, 100):
+        params = {
+            "fields": json.dumps(["name"] + _ITEM_VAT_FIELDS_PRESENT),
+            "filters": json.dumps([["name", "in", chunk]]),
+            "limit_page_length": 0,
+        }
+        try:
+            data = _erp_get("/api/resource/Item", params).get("data", [])
+        except Exception as exc:
+            print(f"Batched Item VAT field query failed: {exc}; falling back to Item docs", file=sys.stderr)
+            return None
+        for row in data:
+            if row.get("name") in out:
+                out[row["name"]] = {f: row.get(f) for f in _ITEM_VAT_FIELDS_PRESENT}
+    return out
+
+def _prime_item_docs(docs: ItemDocCache, item_ids: List[str]):
+    """Fill docs for item_ids: batched list queries when allowed, else concurrent doc GETs.
+
+    Batched docs carry attributes/taxes/barcodes plus the Item-level vat_rate/tax_rate
+    fields, which is all the hydration passes read.
+    """
+    ids = [i for i in dict.fromkeys(item_ids) if i and i not in docs]
+    if not ids:
+        return
+    attrs = _erp_child_rows("Item Variant Attribute", ids)
+    taxes = _erp_child_rows("Item Tax", ids) if attrs is not None else None
+    barcodes = _erp_child_rows("Item Barcode", ids) if taxes is not None else None
+    vat = _item_vat_field_values(docs, ids) if barcodes is not None else None
+    if vat is not None:
+        for item_id in ids:
+            if item_id in docs:
+                continue  # full doc already fetched (VAT field probe)
+            doc = {
+                "name": item_id,
+                "attributes": attrs.get(item_id, []),
+                "taxes": taxes.get(item_id, []),
+                "barcodes": barcodes.get(item_id, []),
+            }
+            doc.update(vat.get(item_id, {}))
+            docs.put(item_id, doc)
+        return
+    docs.prefetch(ids)
+
+def _item_page_params(last_mod: Optional[str], limit: int) -> Dict[str, Any]:
     filters = []
     if last_mod:
         filters = [["modified",">=",last_mod]]
@@ -1316,27 +3303,34 @@ def pull_items_incremental(conn: sqlite3.Connection, limit: int = ITEM_PULL_PAGE
         "name","item_code","item_name","brand","item_group","custom_style_code","custom_simple_colour",
         "has_variants","variant_of","disabled","image","standard_rate","stock_uom","modified","barcodes"
     ]
-    params = {"fields": json.dumps(fields), "filters": json.dumps(filters), "limit_page_length": limit, "order_by": "modified asc, name asc"}
-    data = _erp_get("/api/resource/Item", params).get("data", [])
+    return {"fields": json.dumps(fields), "filters": json.dumps(filters), "limit_page_length": limit, "order_by": "modified asc, name asc"}
+
+def pull_items_incremental(conn: sqlite3.Connection, limit: int = ITEM_PULL_PAGE_LIMIT):
+    """Pull Item (templates + variants) changed since cursor. Upsert into items; barcodes handled separately."""
+    last_mod, last_name = _cursor_get(conn, "Item")
+    data = _erp_get("/api/resource/Item", _item_page_params(last_mod, limit)).get("data", [])
+    return _apply_items_page(conn, data)
+
+def _apply_items_page(conn: sqlite3.Connection, data: List[Dict[str, Any]]) -> int:
     if not data:
         return 0
     variants_to_hydrate: List[tuple[str, Optional[str]]] = []
     item_rows: List[Dict[str, Any]] = []
-    prefetched_item_docs: Dict[str, Optional[Dict[str, Any]]] = {}
+    docs = ItemDocCache()
+    batch = CatalogBatch(conn)
 
     def _fetch_item_doc_cached(item_id: str) -> Optional[Dict[str, Any]]:
         if not item_id:
             return None
-        if item_id in prefetched_item_docs:
-            return prefetched_item_docs[item_id]
-        doc = None
         try:
-            doc = _erp_get_doc("Item", item_id)
+            return docs.get(item_id)
         except Exception as exc:
             print(f"Failed to refetch Item {item_id} for metadata fallback: {exc}", file=sys.stderr)
-        prefetched_item_docs[item_id] = doc
-        return doc
+        return None
 
+    if not _FULL_SYNC_FAST:
+        # Rows missing variant_of need the full doc; fetch those concurrently up front
+        docs.prefetch([d.get("name") for d in data if "variant_of" not in d])
     for d in data:
         parent = d.get("variant_of")
         if "variant_of" not in d and not _FULL_SYNC_FAST:
@@ -1368,31 +3362,45 @@ def pull_items_incremental(conn: sqlite3.Connection, limit: int = ITEM_PULL_PAGE
             "active": 0 if d.get("disabled") else 1,
             "modified_utc": d.get("modified")
         }
-        upsert_item(conn, itm)
+        batch.item(itm)
         item_rows.append({"item_id": d["name"], "parent_id": parent})
-        ensure_barcode_placeholder(conn, d.get("item_code") or d.get("name"), d["name"])
+        batch.barcode_placeholder(d.get("item_code") or d.get("name"), d["name"])
         if parent:
             variants_to_hydrate.append((d["name"], parent))
-        _ingest_child_barcodes(conn, d.get("barcodes"), d["name"])
+        _ingest_child_barcodes(conn, d.get("barcodes"), d["name"], batch=batch)
+    # Images that are new or changed on this page, so the web layer can pre-build thumbnails
+    images = {d["name"]: d.get("image") for d in data if d.get("image")}
+    known: Dict[str, Optional[str]] = {}
+    for chunk in _chunked(list(images)):
+        placeholders = ",".join("?" * len(chunk))
+        known.update((r["item_id"], r["image_url"]) for r in conn.execute(
+            f"SELECT item_id, image_url FROM items WHERE item_id IN ({placeholders})", chunk
+        ))
+    _note_catalog_change((), images=[img for iid, img in images.items() if known.get(iid) != img])
+    batch.flush()
+    if item_rows and not _FULL_SYNC_FAST:
+        _prime_item_docs(docs, [r["item_id"] for r in item_rows])
     if variants_to_hydrate and not _FULL_SYNC_FAST:
-        _hydrate_variant_attributes(conn, variants_to_hydrate, prefetched_docs=prefetched_item_docs)
+        _hydrate_variant_attributes(conn, variants_to_hydrate, docs=docs)
     # Propagate item_group and brand from template to variants that have NULL values.
     # ERPNext often omits these fields on variant items in the list API response.
     if variants_to_hydrate:
-        parent_ids = list({p for _, p in variants_to_hydrate if p})
+        parent_ids = {p for _, p in variants_to_hydrate if p}
         if parent_ids:
-            placeholders = ",".join("?" * len(parent_ids))
+            keys = _load_sync_keys(conn, parent_ids)
             conn.execute(f"""
                 UPDATE items SET
                     item_group = COALESCE(NULLIF(item_group,''), (SELECT NULLIF(item_group,'') FROM items p WHERE p.item_id = items.parent_id)),
                     brand       = COALESCE(NULLIF(brand,''),      (SELECT NULLIF(brand,'')      FROM items p WHERE p.item_id = items.parent_id))
-                WHERE parent_id IN ({placeholders})
+                WHERE parent_id IN (SELECT k FROM {keys})
                   AND (item_group IS NULL OR item_group = '' OR brand IS NULL OR brand = '')
-            """, parent_ids)
+            """)
             conn.commit()
     if item_rows and not _FULL_SYNC_FAST:
-        _hydrate_item_tax_rates(conn, item_rows)
-    _cursor_set(conn, "Item", data[-1]["modified"], data[-1]["name"])
+        _hydrate_item_tax_rates(conn, item_rows, docs=docs)
+    refresh_catalog_tiles_for_items(conn, [r["item_id"] for r in item_rows])
+    flush_item_search(conn)
+    _cursor_set(conn, "Item", data[-1]["modified"], data[-1]["name"], commit=False)
     conn.commit()
     return len(data)
 
@@ -1429,9 +3437,12 @@ def _infer_variant_attributes_from_name(item_id: str) -> Optional[List[Dict[str,
 def _hydrate_variant_attributes(
     conn: sqlite3.Connection,
     variant_rows: List[Tuple[str, Optional[str]]],
-    prefetched_docs: Optional[Dict[str, Optional[Dict[str, Any]]]] = None
+    docs: Optional[ItemDocCache] = None
 ):
-    """Fetch attributes for variants by hitting each Item doc (no child table permission required)."""
+    """Fetch attributes for variants from each Item doc (no child table permission required).
+
+    docs, when given, is the cycle's shared ItemDocCache (already primed by the caller).
+    """
     if not variant_rows:
         return
     def _fallback_variant_attr_rows(item_id: str) -> Optional[List[Dict[str, Any]]]:
@@ -1454,20 +3465,18 @@ def _hydrate_variant_attributes(
         return None
     seen: Set[str] = set()
     touched_templates: Set[str] = set()
+    batch = CatalogBatch(conn)
     for item_id, parent_id in variant_rows:
         if not item_id or item_id in seen:
             continue
         seen.add(item_id)
         attr_rows: Optional[List[Dict[str, Any]]] = None
-        doc_from_cache = prefetched_docs.get(item_id) if prefetched_docs else None
-        doc: Optional[Dict[str, Any]] = doc_from_cache
-        if doc is None and item_id in UNFETCHABLE_ITEM_DOCS:
+        doc: Optional[Dict[str, Any]] = None
+        if item_id in UNFETCHABLE_ITEM_DOCS and not (docs is not None and item_id in docs):
             attr_rows = _infer_variant_attributes_from_name(item_id)
-        elif doc is None:
+        else:
             try:
-                doc = _erp_get_doc("Item", item_id)
-                if prefetched_docs is not None:
-                    prefetched_docs[item_id] = doc
+                doc = docs.get(item_id) if docs is not None else _erp_get_doc("Item", item_id)
             except Exception as exc:
                 http_status = getattr(exc, "code", None) if isinstance(exc, urllib.error.HTTPError) else None
                 if isinstance(exc, urllib.error.HTTPError):
@@ -1491,46 +3500,42 @@ def _hydrate_variant_attributes(
                         continue
         if doc:
             # Persist any barcode field present on the Item doc (single field or child table).
-            if doc.get("barcode"):
-                try:
-                    primary = str(doc.get("barcode")).strip()
-                except Exception:
-                    primary = None
-                if primary:
-                    upsert_barcode(conn, primary, item_id)
-            _ingest_child_barcodes(conn, doc.get("barcodes"), item_id)
+            primary = _barcode_text(doc.get("barcode"))
+            if primary:
+                batch.barcode(primary, item_id)
+            _ingest_child_barcodes(conn, doc.get("barcodes"), item_id, batch=batch)
             if attr_rows is None:
                 attr_rows = doc.get("attributes") or doc.get("variant_attributes") or doc.get("attributes_json") or []
         if attr_rows is None:
             attr_rows = []
-        conn.execute("DELETE FROM variant_attributes WHERE item_id=?", (item_id,))
+        batch.add("DELETE FROM variant_attributes WHERE item_id=?", (item_id,))
         attr_map: Dict[str, str] = {}
         for row in attr_rows:
             attr_name = row.get("attribute") or row.get("attribute_name") or row.get("attribute_id")
             value = row.get("attribute_value") or row.get("value")
             if not attr_name or value in (None, ""):
                 continue
-            ensure_attribute_definition(conn, attr_name, row.get("attribute") or row.get("attribute_name"))
-            conn.execute("""
+            batch.attribute_definition(attr_name, row.get("attribute") or row.get("attribute_name"))
+            batch.add("""
                 INSERT OR REPLACE INTO variant_attributes (item_id, attr_name, value)
                 VALUES (?,?,?)
             """, (item_id, attr_name, str(value)))
             attr_map[attr_name] = str(value)
             if parent_id:
-                ensure_template_attribute(
-                    conn,
+                batch.template_attribute(
                     parent_id,
                     attr_name,
                     bool(row.get("reqd", 1)),
                     row.get("idx") or row.get("sort_order")
                 )
         if attr_map:
-            conn.execute(
+            batch.add(
                 "UPDATE items SET attributes=? WHERE item_id=?",
                 (json.dumps(attr_map, separators=(',', ':')), item_id)
             )
         if parent_id:
             touched_templates.add(parent_id)
+    batch.flush()
     if touched_templates:
         _refresh_template_attribute_cache(conn, touched_templates)
     conn.commit()
@@ -1572,11 +3577,13 @@ def _extract_item_vat_rate(doc: Dict[str, Any]) -> Optional[float]:
             pass
     return None
 
-def _hydrate_item_tax_rates(conn: sqlite3.Connection, item_rows: List[Dict[str, Any]]):
-    """Fetch VAT/tax rates for items and store on items.vat_rate."""
+def _hydrate_item_tax_rates(conn: sqlite3.Connection, item_rows: List[Dict[str, Any]], docs: Optional[ItemDocCache] = None):
+    """Fetch VAT/tax rates for items and store on items.vat_rate (reusing docs from the attribute pass)."""
     if not item_rows:
         return
     seen: Set[str] = set()
+    assigned: Dict[str, float] = {}
+    batch = CatalogBatch(conn)
     for row in item_rows:
         item_id = row.get("item_id") or row.get("name")
         if not item_id or item_id in seen:
@@ -1584,11 +3591,11 @@ def _hydrate_item_tax_rates(conn: sqlite3.Connection, item_rows: List[Dict[str,
         seen.add(item_id)
         parent_id = row.get("parent_id")
         vat_rate = None
-        if item_id in UNFETCHABLE_ITEM_DOCS:
+        if item_id in UNFETCHABLE_ITEM_DOCS and not (docs is not None and item_id in docs):
             vat_rate = None
         else:
             try:
-                doc = _erp_get_doc("Item", item_id)
+                doc = docs.get(item_id) if docs is not None else _erp_get_doc("Item", item_id)
                 vat_rate = _extract_item_vat_rate(doc)
             except urllib.error.HTTPError as exc:
                 status = getattr(exc, "code", None)
@@ -1603,24 +3610,27 @@ def _hydrate_item_tax_rates(conn: sqlite3.Connection, item_rows: List[Dict[str,
         # If ERPNext returned no tax data, try inheriting from parent template,
         # then fall back to POS_DEFAULT_VAT_RATE (if configured).
         if vat_rate is None and parent_id:
-            try:
-                row_parent = conn.execute(
-                    "SELECT vat_rate FROM items WHERE item_id=?", (parent_id,)
-                ).fetchone()
-                if row_parent and row_parent["vat_rate"] is not None:
-                    vat_rate = float(row_parent["vat_rate"])
-            except Exception:
-                pass
+            if parent_id in assigned:
+                vat_rate = assigned[parent_id]
+            else:
+                try:
+                    row_parent = conn.execute(
+                        "SELECT vat_rate FROM items WHERE item_id=?", (parent_id,)
+                    ).fetchone()
+                    if row_parent and row_parent["vat_rate"] is not None:
+                        vat_rate = float(row_parent["vat_rate"])
+                except Exception:
+                    pass
         if vat_rate is None:
             vat_rate = _DEFAULT_VAT_RATE
-        try:
-            if vat_rate is not None:
-                conn.execute(
-                    "UPDATE items SET vat_rate=? WHERE item_id=? AND (vat_rate IS NULL OR vat_rate != ?)",
-                    (vat_rate, item_id, vat_rate),
-                )
-        except Exception:
-            continue
+        if vat_rate is not None:
+            # Pending rates are kept so variants later in the page inherit them before the flush
+            assigned[item_id] = vat_rate
+            batch.add(
+                "UPDATE items SET vat_rate=? WHERE item_id=? AND (vat_rate IS NULL OR vat_rate != ?)",
+                (vat_rate, item_id, vat_rate),
+            )
+    batch.flush()
     conn.commit()
 
 def _refresh_template_attribute_cache(conn: sqlite3.Connection, template_ids: Set[str]):
@@ -1661,17 +3671,18 @@ def pull_item_attributes(conn: sqlite3.Connection, limit: int = 200):
     if not data:
         return 0
     docnames: List[str] = []
+    batch = CatalogBatch(conn)
     for row in data:
         attr_name = row.get("attribute_name") or row.get("name")
-        ensure_attribute_definition(conn, attr_name, row.get("attribute_name") or row.get("name"))
+        batch.attribute_definition(attr_name, row.get("attribute_name") or row.get("name"))
         docnames.append(row.get("name") or attr_name)
+    batch.flush()
     _hydrate_attribute_options(conn, docnames)
     _cursor_set(conn, "Item Attribute", data[-1]["modified"], data[-1]["name"])
     conn.commit()
     return len(data)
 
-def pull_bins_incremental(conn: sqlite3.Connection, warehouse: str, limit: int = 500):
-    """Pull Bin (stock snapshot) changed since cursor for a specific warehouse; write to stock_snapshot."""
+def _ensure_stock_snapshot_table(conn: sqlite3.Connection):
     conn.execute("""
     CREATE TABLE IF NOT EXISTS stock_snapshot (
       item_id     TEXT NOT NULL,
@@ -1680,7 +3691,14 @@ def pull_bins_incremental(conn: sqlite3.Connection, warehouse: str, limit: int =
       asof_utc    TEXT NOT NULL,
       PRIMARY KEY (item_id, warehouse)
     )""")
+
+def pull_bins_incremental(conn: sqlite3.Connection, warehouse: str, limit: int = 500):
+    """Pull Bin (stock snapshot) changed since cursor for a specific warehouse; write to stock_snapshot."""
+    _ensure_stock_snapshot_table(conn)
     last_mod, last_name = _cursor_get(conn, f"Bin:{warehouse}")
+    return _apply_bins_page(conn, warehouse, _fetch_bins_page(warehouse, last_mod, limit))
+
+def _fetch_bins_page(warehouse: str, last_mod: Optional[str], limit: int) -> List[Dict[str, Any]]:
     filters = [["warehouse","=",warehouse]]
     if last_mod:
         filters.append(["modified",">=",last_mod])
@@ -1692,39 +3710,83 @@ def pull_bins_incremental(conn: sqlite3.Connection, warehouse: str, limit: int =
     }
     global _BIN_PULL_FORBIDDEN
     try:
-        data = _erp_get("/api/resource/Bin", params).get("data", [])
+        return _erp_get("/api/resource/Bin", params).get("data", [])
     except urllib.error.HTTPError as exc:
         if exc.code == 403:
             if not _BIN_PULL_FORBIDDEN:
                 print("Bin pull forbidden (HTTP 403); skipping Bin sync", file=sys.stderr)
             _BIN_PULL_FORBIDDEN = True
-            return 0
+            return []
         raise
+
+def _apply_bins_page(conn: sqlite3.Connection, warehouse: str, data: List[Dict[str, Any]]) -> int:
     if not data:
         return 0
     asof = iso_now()
+    touched: List[str] = []
+    batch = CatalogBatch(conn)
     for b in data:
         item_code = b.get("item_code")
         if not item_code:
             continue
-        ensure_item_stub(conn, item_code)
+        touched.append(item_code)
+        batch.item_stub(item_code)
         sellable = float(b.get("projected_qty") if b.get("projected_qty") is not None else (b.get("actual_qty",0) - b.get("reserved_qty",0)))
-        conn.execute("""
+        batch.add("""
         INSERT INTO stock_snapshot (item_id, warehouse, qty_base, asof_utc)
         VALUES (?,?,?,?)
         ON CONFLICT(item_id, warehouse) DO UPDATE SET qty_base=excluded.qty_base, asof_utc=excluded.asof_utc
         """, (item_code, warehouse, sellable, asof))
-        conn.execute("""
+        batch.add("""
         INSERT INTO stock (item_id, warehouse, qty)
         VALUES (?,?,?)
         ON CONFLICT(item_id, warehouse) DO UPDATE SET qty=excluded.qty
         """, (item_code, warehouse, sellable))
-    _cursor_set(conn, f"Bin:{warehouse}", data[-1]["modified"], data[-1]["name"])
+    batch.flush()
+    refresh_catalog_tile_stock(conn, touched, warehouse)
+    _cursor_set(conn, f"Bin:{warehouse}", data[-1]["modified"], data[-1]["name"], commit=False)
     conn.commit()
     return len(data)
 
-def pull_item_prices_incremental(conn: sqlite3.Connection, price_list: str, limit: int = 500):
-    """Optional: maintain a prices table per list; not required if you store price on items."""
+_CUSTOMER_PULL_FIELDS = ["name", "customer_name", "email_id", "mobile_no", "disabled", "modified"]
+
+def pull_customers_incremental(conn: sqlite3.Connection, limit: int = CUSTOMER_PULL_PAGE_LIMIT, max_pages: int = 20) -> int:
+    """Pull Customers changed since cursor (disabled ones too) into the customers table."""
+    _ensure_customer_table(conn)
+    pulled = 0
+    for _ in range(max_pages):
+        last_mod, last_name = _cursor_get(conn, "Customer")
+        data = _fetch_customers_page(last_mod, last_name, limit)
+        if not data:
+            break
+        upsert_customers(conn, data, commit=False)
+        _cursor_set(conn, "Customer", data[-1]["modified"], data[-1]["name"], commit=False)
+        conn.commit()
+        pulled += len(data)
+        if len(data) < limit:
+            break
+    return pulled
+
+def _fetch_customers_page(last_mod: Optional[str], last_name: Optional[str], limit: int) -> List[Dict[str, Any]]:
+    """Keyset page after (last_mod, last_name), so bulk imports sharing one modified stamp still advance."""
+    def _get(filters: List[Any], order_by: str, page: int) -> List[Dict[str, Any]]:
+        params = {
+            "fields": json.dumps(_CUSTOMER_PULL_FIELDS),
+            "filters": json.dumps(filters),
+            "limit_page_length": page,
+            "order_by": order_by,
+        }
+        return _erp_get("/api/resource/Customer", params).get("data", []) or []
+
+    rows: List[Dict[str, Any]] = []
+    if last_mod and last_name:
+        rows = _get([["modified", "=", last_mod], ["name", ">", last_name]], "name asc", limit)
+    if len(rows) < limit:
+        filters = [["modified", ">", last_mod]] if last_mod else []
+        rows += _get(filters, "modified asc, name asc", limit - len(rows))
+    return rows
+
+def _ensure_item_prices_table(conn: sqlite3.Connection):
     conn.execute("""
     CREATE TABLE IF NOT EXISTS item_prices (
       item_id     TEXT NOT NULL,
@@ -1735,7 +3797,14 @@ def pull_item_prices_incremental(conn: sqlite3.Connection, price_list: str, limi
       modified_utc TEXT,
       PRIMARY KEY (item_id, price_list)
     )""")
+
+def pull_item_prices_incremental(conn: sqlite3.Connection, price_list: str, limit: int = 500):
+    """Optional: maintain a prices table per list; not required if you store price on items."""
+    _ensure_item_prices_table(conn)
     last_mod, last_name = _cursor_get(conn, f"Item Price:{price_list}")
+    return _apply_prices_page(conn, price_list, _fetch_prices_page(price_list, last_mod, limit))
+
+def _fetch_prices_page(price_list: str, last_mod: Optional[str], limit: int) -> List[Dict[str, Any]]:
     filters = [["price_list","=",price_list],["selling","=",1]]
     if last_mod:
         filters.append(["modified",">=",last_mod])
@@ -1745,17 +3814,19 @@ def pull_item_prices_incremental(conn: sqlite3.Connection, price_list: str, limi
         "limit_page_length": limit,
         "order_by": "modified asc, name asc"
     }
-    data = _erp_get("/api/resource/Item Price", params).get("data", [])
+    return _erp_get("/api/resource/Item Price", params).get("data", [])
+
+def _apply_prices_page(conn: sqlite3.Connection, price_list: str, data: List[Dict[str, Any]]) -> int:
     if not data:
         return 0
-    for p in data:
-        conn.execute("""
-        INSERT INTO item_prices (item_id, price_list, rate, valid_from, valid_to, modified_utc)
-        VALUES (?,?,?,?,?,?)
-        ON CONFLICT(item_id, price_list) DO UPDATE SET rate=excluded.rate, valid_from=excluded.valid_from, valid_to=excluded.valid_to, modified_utc=excluded.modified_utc
-        """, (p["item_code"], p["price_list"], float(p["price_list_rate"]), p.get("valid_from"), p.get("valid_upto"), p.get("modified")))
-    _cursor_set(conn, f"Item Price:{price_list}", data[-1]["modified"], data[-1]["name"])
+    conn.executemany("""
+    INSERT INTO item_prices (item_id, price_list, rate, valid_from, valid_to, modified_utc)
+    VALUES (?,?,?,?,?,?)
+    ON CONFLICT(item_id, price_list) DO UPDATE SET rate=excluded.rate, valid_from=excluded.valid_from, valid_to=excluded.valid_to, modified_utc=excluded.modified_utc
+    """, [(p["item_code"], p["price_list"], float(p["price_list_rate"]), p.get("valid_from"), p.get("valid_upto"), p.get("modified")) for p in data])
+    _cursor_set(conn, f"Item Price:{price_list}", data[-1]["modified"], data[-1]["name"], commit=False)
     _apply_price_list_rates(conn, price_list)
+    refresh_catalog_tiles_for_items(conn, [p["item_code"] for p in data], structural=False)
     conn.commit()
     return len(data)
 
@@ -1789,6 +3860,7 @@ def _pull_item_barcodes_via_item_docs(conn: sqlite3.Connection, limit: int = 200
     data = _erp_get("/api/resource/Item", params).get("data", [])
     if not data:
         return 0
+    batch = CatalogBatch(conn)
     for row in data:
         item_id = row.get("name")
         if not item_id:
@@ -1807,15 +3879,13 @@ def _pull_item_barcodes_via_item_docs(conn: sqlite3.Connection, limit: int = 200
         except Exception as exc:
             print(f"Failed to fetch Item doc for {item_id}: {exc}", file=sys.stderr)
             continue
-        primary = doc.get("barcode")
-        if primary is not None:
-            try:
-                primary_txt = str(primary).strip()
-            except Exception:
-                primary_txt = None
-            if primary_txt:
-                upsert_barcode(conn, primary_txt, item_id)
-        _ingest_child_barcodes(conn, doc.get("barcodes"), item_id)
+        primary_txt = _barcode_text(doc.get("barcode"))
+        if primary_txt:
+            batch.barcode(primary_txt, item_id)
+        _ingest_child_barcodes(conn, doc.get("barcodes"), item_id, batch=batch)
+    batch.flush()
+    refresh_catalog_tiles_for_items(conn, [row.get("name") for row in data])
+    flush_item_search(conn)
     last = data[-1]
     _cursor_set(conn, cursor_key, last.get("modified") or iso_now(), last.get("name") or "")
     conn.commit()
@@ -1828,17 +3898,8 @@ def pull_item_barcodes_incremental(conn: sqlite3.Connection, limit: int = 500):
     if _BARCODE_PULL_FORBIDDEN:
         return _pull_item_barcodes_via_item_docs(conn, limit=limit)
     last_mod, last_name = _cursor_get(conn, "Item Barcode")
-    filters = []
-    if last_mod:
-        filters.append(["modified",">=",last_mod])
-    params = {
-        "fields": json.dumps(["name","parent","barcode","modified"]),
-        "filters": json.dumps(filters),
-        "limit_page_length": limit,
-        "order_by": "modified asc, name asc"
-    }
     try:
-        data = _erp_get("/api/resource/Item Barcode", params).get("data", [])
+        data = _fetch_barcodes_page(last_mod, limit)
     except urllib.error.HTTPError as exc:
         if exc.code in (403, 417):
             if not _BARCODE_PULL_FORBIDDEN:
@@ -1847,12 +3908,27 @@ def pull_item_barcodes_incremental(conn: sqlite3.Connection, limit: int = 500):
             _BARCODE_PULL_FORBIDDEN = True
             return _pull_item_barcodes_via_item_docs(conn, limit=limit)
         raise
+    return _apply_barcodes_page(conn, data)
+
+def _fetch_barcodes_page(last_mod: Optional[str], limit: int) -> List[Dict[str, Any]]:
+    filters = []
+    if last_mod:
+        filters.append(["modified",">=",last_mod])
+    params = {
+        "fields": json.dumps(["name","parent","barcode","modified"]),
+        "filters": json.dumps(filters),
+        "limit_page_length": limit,
+        "order_by": "modified asc, name asc"
+    }
+    return _erp_get("/api/resource/Item Barcode", params).get("data", [])
+
+def _apply_barcodes_page(conn: sqlite3.Connection, data: List[Dict[str, Any]]) -> int:
     if not data:
         return 0
-    for r in data:
-        if r.get("barcode") and r.get("parent"):
-            upsert_barcode(conn, r["barcode"], r["parent"])
-    _cursor_set(conn, "Item Barcode", data[-1]["modified"], data[-1]["name"])
+    conn.executemany(_UPSERT_BARCODE_SQL, [(r["barcode"], r["parent"]) for r in data if r.get("barcode") and r.get("parent")])
+    refresh_catalog_tiles_for_items(conn, [r.get("parent") for r in data])
+    flush_item_search(conn)
+    _cursor_set(conn, "Item Barcode", data[-1]["modified"], data[-1]["name"], commit=False)
     conn.commit()
     return len(data)
 
@@ -1883,27 +3959,27 @@ def pull_deleted_items(conn: sqlite3.Connection, limit: int = 500) -> int:
         return 0
     if not data:
         return 0
-    marked = 0
+    deletions: Dict[str, str] = {}
     for row in data:
         deleted_name = (row.get("deleted_name") or "").strip()
-        if not deleted_name:
-            continue
-        deletion_ts = row.get("creation") or ""
-        # Guard: if the local item's modified_utc is newer than the deletion
-        # timestamp, the same item_id was re-created in ERPNext after being
-        # deleted (e.g. re-import with the same code). Skip — the local row
-        # already represents the new item.
-        local = conn.execute(
-            "SELECT modified_utc FROM items WHERE item_id=?", (deleted_name,)
-        ).fetchone()
-        if local and local["modified_utc"] and local["modified_utc"] >= deletion_ts:
-            continue
-        result = conn.execute(
-            "UPDATE items SET active=0 WHERE item_id=? AND active=1",
-            (deleted_name,)
-        )
-        if result.rowcount:
-            marked += 1
+        if deleted_name:
+            deletions[deleted_name] = max(deletions.get(deleted_name, ""), row.get("creation") or "")
+    keys = _load_sync_keys(conn, list(deletions.items()))
+    # Guard: if the local item's modified_utc is newer than the deletion
+    # timestamp, the same item_id was re-created in ERPNext after being
+    # deleted (e.g. re-import with the same code). Skip — the local row
+    # already represents the new item.
+    guard = f"""
+        FROM items i JOIN {keys} d ON d.k = i.item_id
+        WHERE i.active=1 AND NOT (COALESCE(i.modified_utc,'') <> '' AND i.modified_utc >= d.ts)
+    """
+    deactivated = [r["item_id"] for r in conn.execute(f"SELECT i.item_id {guard}")]
+    if deactivated:
+        conn.execute(f"UPDATE items SET active=0 WHERE item_id IN (SELECT i.item_id {guard})")
+    marked = len(deactivated)
+    if deactivated:
+        refresh_catalog_tiles_for_items(conn, deactivated)
+        flush_item_search(conn)
     conn.commit()
     _cursor_set(conn, "DeletedDocument:Item", data[-1]["creation"], data[-1]["name"])
     if marked:
@@ -1948,13 +4024,16 @@ def reconcile_items_against_erp(conn: sqlite3.Connection, page_size: int = 1000)
         print("[sync] reconcile_items_against_erp: ERP returned 0 items — aborting to avoid mass deactivation", file=sys.stderr)
         return 0
 
-    local_rows = conn.execute("SELECT item_id FROM items WHERE active=1").fetchall()
-    to_deactivate = [r["item_id"] for r in local_rows if r["item_id"] not in erp_names]
+    keys = _load_sync_keys(conn, erp_names)
+    missing = f"FROM items WHERE active=1 AND item_id NOT IN (SELECT k FROM {keys})"
+    to_deactivate = [r["item_id"] for r in conn.execute(f"SELECT item_id {missing}")]
     if not to_deactivate:
+        conn.commit()
         return 0
 
-    for item_id in to_deactivate:
-        conn.execute("UPDATE items SET active=0 WHERE item_id=?", (item_id,))
+    conn.execute(f"UPDATE items SET active=0 WHERE item_id IN (SELECT item_id {missing})")
+    refresh_catalog_tiles_for_items(conn, to_deactivate)
+    flush_item_search(conn)
     conn.commit()
     print(f"[sync] reconcile_items_against_erp: deactivated {len(to_deactivate)} item(s) not found in ERPNext")
     return len(to_deactivate)
@@ -1982,6 +4061,77 @@ def _clear_sync_cursors(conn: sqlite3.Connection, keys: List[str]) -> None:
     conn.execute(f"DELETE FROM sync_cursors WHERE doctype IN ({placeholders})", keys)
     conn.commit()
 
+# ---------- FULL SYNC PIPELINE ----------
+def _ensure_sync_checkpoint_table(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sync_checkpoints (
+      name         TEXT PRIMARY KEY,
+      state_json   TEXT NOT NULL,
+      updated_utc  TEXT NOT NULL
+    )""")
+
+def _checkpoint_load(conn: sqlite3.Connection, name: str) -> Optional[Dict[str, Any]]:
+    row = conn.execute("SELECT state_json FROM sync_checkpoints WHERE name=?", (name,)).fetchone()
+    if not row:
+        return None
+    try:
+        state = json.loads(row["state_json"])
+    except Exception:
+        return None
+    return state if isinstance(state, dict) else None
+
+def _checkpoint_save(conn: sqlite3.Connection, name: str, state: Dict[str, Any]):
+    conn.execute("""
+        INSERT INTO sync_checkpoints (name, state_json, updated_utc) VALUES (?,?,?)
+        ON CONFLICT(name) DO UPDATE SET state_json=excluded.state_json, updated_utc=excluded.updated_utc
+    """, (name, json.dumps(state, separators=(",", ":")), iso_now()))
+    conn.commit()
+
+def _db_file(conn: sqlite3.Connection) -> Optional[str]:
+    row = conn.execute("PRAGMA database_list").fetchone()
+    return (row[2] if row else "") or None
+
+def _pipelined_pages(fetch_page: Any, last_mod: Optional[str], limit: int, max_loops: int):
+    """Yield cursor pages from fetch_page(last_mod, limit), fetching the next page while the caller writes this one."""
+    pages: "queue.Queue[Tuple[str, Any]]" = queue.Queue(maxsize=2)
+    stop = threading.Event()
+
+    def _put(item: Tuple[str, Any]) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _producer():
+        cursor = last_mod
+        try:
+            for _ in range(max_loops):
+                data = fetch_page(cursor, limit)
+                if not _put(("page", data)):
+                    return
+                if len(data) < limit or not data[-1].get("modified"):
+                    break
+                cursor = data[-1]["modified"]
+        except BaseException as exc:
+            _put(("error", exc))
+            return
+        _put(("done", None))
+
+    threading.Thread(target=_producer, name="erp-prefetch", daemon=True).start()
+    try:
+        while True:
+            kind, payload = pages.get()
+            if kind == "error":
+                raise payload
+            if kind == "done":
+                return
+            yield payload
+    finally:
+        stop.set()
+
 def full_sync_from_erp(
     conn: sqlite3.Connection,
     warehouse: str = "Shop",
@@ -1993,88 +4143,157 @@ def full_sync_from_erp(
     price_limit: int = 500,
     max_loops: int = 10000,
     progress_cb: Optional[Any] = None,
+    resume: bool = True,
 ) -> Dict[str, int]:
-    """Reset cursors and perform a full pull until no more ERPNext rows remain."""
+    """Reset cursors and perform a full pull until no more ERPNext rows remain.
+
+    Each paged stage prefetches its next cursor page while the current one is written.
+    Items and attributes run first (everything else references them), then Bin, Item
+    Price and Item Barcode run concurrently on their own connections, then reconcile.
+    Completed stages are checkpointed in sync_checkpoints; an interrupted sync resumes
+    from the checkpoint and the stage cursors instead of starting over (resume=False
+    forces a fresh run). progress_cb(stage, pulled, total, rows_per_sec) is called per page.
+    """
     global _BARCODE_PULL_FORBIDDEN, _BIN_PULL_FORBIDDEN, _FULL_SYNC_FAST
     fast_mode = os.getenv("POS_FULL_SYNC_FAST", "0") == "1"
     _BARCODE_PULL_FORBIDDEN = False
     _BIN_PULL_FORBIDDEN = False
     _FULL_SYNC_FAST = fast_mode
-    UNFETCHABLE_ITEM_DOCS.clear()
-    cursor_keys = ["Item", "Item Attribute", "Item Barcode", "Item Barcode (Item Doc)"]
-    if warehouse:
-        cursor_keys.append(f"Bin:{warehouse}")
-    if price_list:
-        cursor_keys.append(f"Item Price:{price_list}")
-    _clear_sync_cursors(conn, cursor_keys)
+    _ensure_sync_checkpoint_table(conn)
+    _ensure_stock_snapshot_table(conn)
+    _ensure_item_prices_table(conn)
+    checkpoint = f"full_sync:{warehouse or ''}:{price_list or ''}"
+    state = _checkpoint_load(conn, checkpoint) if resume else None
+    resumed = bool(state)
+    if state:
+        print(f"Full sync resuming from checkpoint ({', '.join(state.get('done') or []) or 'no stages'} done)")
+    else:
+        UNFETCHABLE_ITEM_DOCS.clear()
+        cursor_keys = ["Item", "Item Attribute", "Item Barcode", "Item Barcode (Item Doc)"]
+        if warehouse:
+            cursor_keys.append(f"Bin:{warehouse}")
+        if price_list:
+            cursor_keys.append(f"Item Price:{price_list}")
+        _clear_sync_cursors(conn, cursor_keys)
+        state = {"started_utc": iso_now(), "done": [], "totals": {}}
+        _checkpoint_save(conn, checkpoint, state)
+    done: List[str] = list(state.get("done") or [])
 
     totals = {"items": 0, "attr_defs": 0, "barcodes": 0, "bins": 0, "prices": 0}
+    totals.update({k: int(v) for k, v in (state.get("totals") or {}).items() if k in totals})
+    stage_keys = {"items": "items", "attributes": "attr_defs", "barcodes": "barcodes", "bins": "bins", "prices": "prices"}
+    started: Dict[str, float] = {}
+    lock = threading.Lock()
+
     def _progress(stage: str, pulled: int, total: int) -> None:
+        elapsed = time.monotonic() - started.setdefault(stage, time.monotonic())
+        rate = round(total / elapsed, 1) if elapsed > 0 else 0.0
+        if stage in stage_keys:
+            with lock:
+                totals[stage_keys[stage]] = total
         if progress_cb:
-            progress_cb(stage, pulled, total)
-        print(f"Full sync {stage}: pulled {pulled}, total {total}")
-    try:
-        loops = 0
-        while True:
-            loops += 1
-            if loops > max_loops:
-                break
-            pulled = pull_items_incremental(conn, limit=item_limit)
-            totals["items"] += pulled
-            _progress("items", pulled, totals["items"])
-            if pulled < item_limit:
-                break
-
-        loops = 0
-        while True:
-            loops += 1
-            if loops > max_loops:
-                break
-            pulled = pull_item_attributes(conn, limit=attr_limit)
-            totals["attr_defs"] += pulled
-            _progress("attributes", pulled, totals["attr_defs"])
-            if pulled < attr_limit:
-                break
-
-        loops = 0
-        while True:
-            loops += 1
-            if loops > max_loops:
-                break
-            pulled = pull_item_barcodes_incremental(conn, limit=barcode_limit)
-            totals["barcodes"] += pulled
-            _progress("barcodes", pulled, totals["barcodes"])
-            if pulled < barcode_limit:
+            progress_cb(stage, pulled, total, rate)
+        print(f"Full sync {stage}: pulled {pulled}, total {total} ({rate}/s)")
+
+    def _paged(c: sqlite3.Connection, stage: str, cursor_key: str, fetch_page: Any, apply_page: Any, limit: int) -> int:
+        started[stage] = time.monotonic()
+        last_mod, _ = _cursor_get(c, cursor_key)
+        total = 0
+        for data in _pipelined_pages(fetch_page, last_mod, limit, max_loops):
+            pulled = apply_page(c, data)
+            total += pulled
+            _progress(stage, pulled, total)
+        return total
+
+    def _looped(stage: str, pull: Any, limit: int) -> int:
+        started[stage] = time.monotonic()
+        total = 0
+        for _ in range(max_loops):
+            pulled = pull()
+            total += pulled
+            _progress(stage, pulled, total)
+            if pulled < limit:
                 break
+        return total
 
-        loops = 0
-        while True:
-            loops += 1
-            if loops > max_loops:
-                break
-            pulled = pull_bins_incremental(conn, warehouse=warehouse, limit=bin_limit)
-            totals["bins"] += pulled
-            _progress("bins", pulled, totals["bins"])
-            if pulled < bin_limit:
-                break
+    def _barcodes(c: sqlite3.Connection) -> int:
+        global _BARCODE_PULL_FORBIDDEN
+        if not _BARCODE_PULL_FORBIDDEN:
+            try:
+                return _paged(c, "barcodes", "Item Barcode", _fetch_barcodes_page, _apply_barcodes_page, barcode_limit)
+            except urllib.error.HTTPError as exc:
+                if exc.code not in (403, 417):
+                    raise
+                print(f"Item Barcode pull forbidden (HTTP {exc.code}); falling back to Item doc barcode sync", file=sys.stderr)
+                _BARCODE_PULL_FORBIDDEN = True
+        return _looped("barcodes", lambda: _pull_item_barcodes_via_item_docs(c, limit=barcode_limit), barcode_limit)
+
+    def _finish(stage: str) -> None:
+        done.append(stage)
+        with lock:
+            snapshot = dict(totals)
+        _checkpoint_save(conn, checkpoint, {"started_utc": state.get("started_utc"), "done": done, "totals": snapshot})
 
-        if price_list:
-            loops = 0
-            while True:
-                loops += 1
-                if loops > max_loops:
-                    break
-                pulled = pull_item_prices_incremental(conn, price_list=price_list, limit=price_limit)
-                totals["prices"] += pulled
-                _progress("prices", pulled, totals["prices"])
-                if pulled < price_limit:
-                    break
+    try:
+        if "items" not in done:
+            _paged(conn, "items", "Item", lambda cur, lim: _erp_get("/api/resource/Item", _item_page_params(cur, lim)).get("data", []),
+                   _apply_items_page, item_limit)
+            _finish("items")
+        if "attributes" not in done:
+            _looped("attributes", lambda: pull_item_attributes(conn, limit=attr_limit), attr_limit)
+            _finish("attributes")
+
+        jobs: List[Tuple[str, Any]] = []
+        if "barcodes" not in done:
+            jobs.append(("barcodes", _barcodes))
+        if "bins" not in done:
+            jobs.append(("bins", lambda c: _paged(c, "bins", f"Bin:{warehouse}",
+                                                  lambda cur, lim: _fetch_bins_page(warehouse, cur, lim),
+                                                  lambda c2, data: _apply_bins_page(c2, warehouse, data), bin_limit)))
+        if price_list and "prices" not in done:
+            jobs.append(("prices", lambda c: _paged(c, "prices", f"Item Price:{price_list}",
+                                                    lambda cur, lim: _fetch_prices_page(price_list, cur, lim),
+                                                    lambda c2, data: _apply_prices_page(c2, price_list, data), price_limit)))
+        db_file = _db_file(conn)
+        if len(jobs) > 1 and db_file:
+            def _run_job(job: Any) -> int:
+                job_conn = connect(db_file)
+                try:
+                    return job(job_conn)
+                finally:
+                    job_conn.close()
+                    # Hand this pool thread's catalog changes back to the caller's journal
+                    changes = drain_catalog_changes()
+                    if changes:
+                        with lock:
+                            pool_changes.append(changes)
+            pool_changes: List[Dict[str, Any]] = []
+            failure: Optional[BaseException] = None
+            with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="full-sync") as pool:
+                futures = [(stage, pool.submit(_run_job, job)) for stage, job in jobs]
+                for stage, fut in futures:
+                    try:
+                        fut.result()
+                        _finish(stage)
+                    except BaseException as exc:
+                        failure = failure or exc
+            for changes in pool_changes:
+                _merge_catalog_changes(changes)
+            if failure:
+                raise failure
+        else:
+            for stage, job in jobs:
+                job(conn)
+                _finish(stage)
 
         # After all upserts: reconcile local items against the full ERPNext item list
         # to deactivate anything that was hard-deleted since the last full sync.
         n_reconciled = reconcile_items_against_erp(conn)
         totals["reconciled"] = n_reconciled
         _progress("reconcile", n_reconciled, n_reconciled)
+        conn.execute("DELETE FROM sync_checkpoints WHERE name=?", (checkpoint,))
+        conn.commit()
+        totals["resumed"] = int(resumed)
         return totals
     finally:
         _FULL_SYNC_FAST = False
@@ -2165,18 +4384,12 @@ def fetch_currency_rate(base: str = "GBP", target: str = "EUR") -> Optional[floa
     if base == target:
         return 1.0
 
-    # Create SSL context that handles certificate verification issues
-    # (useful for corporate proxies, custom CAs, etc.)
-    ssl_context = ssl.create_default_context()
-    ssl_context.check_hostname = False
-    ssl_context.verify_mode = ssl.CERT_NONE
-
+    # Certificate verification is off (useful for corporate proxies, custom CAs, etc.)
     # 1) Try exchangerate.host (free API - now requires API key, so we skip this)
     # Keeping code for reference but it will fail and fall through to ECB
     try:
         url = f"https://api.exchangerate.host/latest?base={urllib.parse.quote(base)}&symbols={urllib.parse.quote(target)}"
-        with urllib.request.urlopen(url, timeout=8, context=ssl_context) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
+        data = _http_fetch("GET", url, timeout=8, verify=False).json()
         # Expected shape: { 'motd':..., 'success': True, 'base': 'GBP', 'rates': {'EUR': 1.18}, ... }
         rates = data.get("rates") or {}
         rate = rates.get(target)
@@ -2188,8 +4401,7 @@ def fetch_currency_rate(base: str = "GBP", target: str = "EUR") -> Optional[floa
     # 2) Fallback: ECB daily XML (base EUR)
     try:
         ecb_url = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-daily.xml"
-        with urllib.request.urlopen(ecb_url, timeout=8, context=ssl_context) as resp:
-            xml = resp.read()
+        xml = _http_fetch("GET", ecb_url, timeout=8, verify=False).body
         import xml.etree.ElementTree as ET
         root = ET.fromstring(xml)
         # Find Cube elements like: <Cube currency='USD' rate='1.1234' />
@@ -2494,15 +4706,8 @@ def _lay_request(path: str, payload: Optional[Dict[str, Any]] = None, method: st
     base = _lay_base()
     if not base:
         return {"ok": True, "dry_run": True}
-    url = base + path
-    data = json.dumps(payload).encode("utf-8") if payload is not None else None
-    req = urllib.request.Request(url, data=data, method=method, headers=_lay_headers())
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
     try:
-        with urllib.request.urlopen(req, timeout=90, context=ctx) as resp:
-            return json.loads(resp.read().decode("utf-8"))
+        return _http_fetch(method, base + path, payload, _lay_headers(), timeout=90, verify=False).json()
     except urllib.error.HTTPError as exc:
         body = ""
         try:
@@ -2828,6 +5033,8 @@ def _do_push_layaway_outbox(conn: sqlite3.Connection, limit: int) -> None:
                 )
                 pending[ref] = []  # All entries for this ref are gone
                 blocked_refs.add(ref)
+            if action in ("mark_completed", "mark_cancelled"):
+                sync_layaway_reservations(conn, [ref])
             conn.commit()
             pending[ref] = [(pid, pk) for pid, pk in pending.get(ref, []) if pid != oid]
         else:
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Background task scheduler for pos_server.
+
+Each Task has its own interval, time budget, priority, concurrency limit and backoff
+state, and runs in a named lane: a fixed set of long-lived worker threads shared by
+related tasks (so each worker keeps its pooled SQLite connection between runs). A slow
+ERPNext call therefore only holds up its own lane, so the POS queue can keep draining
+every few seconds while a catalog sync runs in another.
+
+  Task            one unit of work: func() returns an optional note for the log
+  TaskScheduler   dispatcher thread + lanes; snapshot() feeds /api/admin/tasks
+
+Python threads cannot be interrupted, so the budget is soft: a run that exceeds it
+is logged and reported as an overrun, and the task is not started again until that
+run returns.
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# A gated task that was skipped is re-checked after at most this many seconds
+GATE_RECHECK_SECONDS = 30.0
+# Longest the dispatcher sleeps between due-checks
+_MAX_TICK_SECONDS = 5.0
+
+
+# ---------- TASK ----------
+class Task:
+    """A recurring background job and its run state."""
+
+    def __init__(self, name: str, func: Callable[[], Optional[str]], interval: float,
+                 lane: str = "default", priority: int = 50, budget: float = 60.0,
+                 concurrency: int = 1, backoff_max: float = 3600.0,
+                 gate: Optional[Callable[[], bool]] = None, initial_delay: float = 0.0):
+        self.name = name
+        self.func = func
+        self.interval = max(1.0, float(interval))
+        self.lane = lane
+        self.priority = priority
+        self.budget = max(0.1, float(budget))
+        self.concurrency = max(1, int(concurrency))
+        self.backoff_max = max(self.interval, float(backoff_max))
+        self.gate = gate
+        self.next_due = time.monotonic() + max(0.0, initial_delay)
+        self.running = 0
+        self.runs = 0
+        self.failures = 0
+        self.fail_streak = 0
+        self.overruns = 0
+        self.skips = 0
+        self.last_started: Optional[float] = None
+        self.last_finished: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_outcome: Optional[str] = None
+        self.last_note: Optional[str] = None
+        self.last_error: Optional[str] = None
+        # dispatch time of each in-flight run -> budget warning already logged
+        self._in_flight: Dict[float, bool] = {}
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        wall = time.time() - now
+        running_for = now - min(self._in_flight) if self._in_flight else None
+        return {
+            "name": self.name,
+            "lane": self.lane,
+            "priority": self.priority,
+            "interval_s": self.interval,
+            "budget_s": self.budget,
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "running_for_s": round(running_for, 3) if running_for is not None else None,
+            "runs": self.runs,
+            "failures": self.failures,
+            "fail_streak": self.fail_streak,
+            "overruns": self.overruns,
+            "skips": self.skips,
+            "last_started": _iso(self.last_started + wall) if self.last_started is not None else None,
+            "last_finished": _iso(self.last_finished + wall) if self.last_finished is not None else None,
+            "last_duration_s": round(self.last_duration, 3) if self.last_duration is not None else None,
+            "last_outcome": self.last_outcome,
+            "last_note": self.last_note,
+            "last_error": self.last_error,
+            "next_due_in_s": round(max(0.0, self.next_due - now), 1),
+        }
+
+
+def _iso(ts: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+
+
+# ---------- SCHEDULER ----------
+class TaskScheduler:
+    """Runs registered Tasks in priority order across bounded lanes."""
+
+    def __init__(self, lanes: Dict[str, int], logger: Optional[logging.Logger] = None):
+        self._lanes = {name: max(1, int(size)) for name, size in lanes.items()}
+        self._busy: Dict[str, int] = {name: 0 for name in self._lanes}
+        self._queues: Dict[str, "queue.Queue"] = {name: queue.Queue() for name in self._lanes}
+        self._workers: Dict[str, List[threading.Thread]] = {name: [] for name in self._lanes}
+        self._tasks: Dict[str, Task] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._log = logger or logging.getLogger(__name__)
+
+    def add(self, task: Task) -> Task:
+        with self._lock:
+            if task.lane not in self._lanes:
+                self._lanes[task.lane] = 1
+                self._busy[task.lane] = 0
+                self._queues[task.lane] = queue.Queue()
+                self._workers[task.lane] = []
+            self._tasks[task.name] = task
+            if self.is_running():
+                self._start_workers_locked()
+        self._wake.set()
+        return task
+
+    def start(self) -> bool:
+        """Start the dispatcher and lane workers; False if already running."""
+        with self._lock:
+            if self.is_running():
+                return False
+            self._start_workers_locked()
+            self._thread = threading.Thread(target=self._dispatch_loop, name="task-scheduler", daemon=True)
+            self._thread.start()
+        return True
+
+    def _start_workers_locked(self) -> None:
+        for lane, size in self._lanes.items():
+            workers = self._workers[lane] = [w for w in self._workers[lane] if w.is_alive()]
+            while len(workers) < size:
+                worker = threading.Thread(target=self._worker_loop, args=(lane,),
+                                          name=f"task-{lane}-{len(workers) + 1}", daemon=True)
+                worker.start()
+                workers.append(worker)
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def trigger(self, name: str) -> bool:
+        """Make a task due now (its gate still applies); False if unknown."""
+        with self._lock:
+            task = self._tasks.get(name)
+            if task is None:
+                return False
+            task.next_due = time.monotonic()
+        self._wake.set()
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            tasks = sorted(self._tasks.values(), key=lambda t: (t.lane, t.priority, t.name))
+            return {
+                "running": self.is_running(),
+                "lanes": {name: {"size": size, "busy": self._busy.get(name, 0)}
+                          for name, size in self._lanes.items()},
+                "tasks": [task.to_dict(now) for task in tasks],
+            }
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            try:
+                wait = self._dispatch_due()
+            except Exception:
+                self._log.exception("Task dispatch failed")
+                wait = _MAX_TICK_SECONDS
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def _dispatch_due(self) -> float:
+        """Start every due task that has a free lane slot; returns seconds until the next check."""
+        now = time.monotonic()
+        with self._lock:
+            due = sorted((t for t in self._tasks.values() if t.next_due <= now),
+                         key=lambda t: (t.priority, t.next_due))
+            for task in self._tasks.values():
+                if task._in_flight:
+                    self._warn_overrun_locked(task, now)
+            for task in due:
+                if task.running >= task.concurrency:
+                    continue
+                if self._busy[task.lane] >= self._lanes[task.lane]:
+                    continue
+                task.running += 1
+                task._in_flight[now] = False
+                self._busy[task.lane] += 1
+                # Next slot is booked at start so a long run does not queue catch-up runs
+                task.next_due = now + task.interval
+                self._queues[task.lane].put((task, now))
+            # Tasks waiting on a busy lane are picked up when a run finishes (it sets _wake)
+            pending = [t.next_due for t in self._tasks.values()
+                       if t.running < t.concurrency and self._busy[t.lane] < self._lanes[t.lane]]
+        wait = min(pending) - time.monotonic() if pending else _MAX_TICK_SECONDS
+        return max(0.05, min(_MAX_TICK_SECONDS, wait))
+
+    def _warn_overrun_locked(self, task: Task, now: float) -> None:
+        for dispatched, warned in task._in_flight.items():
+            if not warned and now - dispatched > task.budget:
+                task._in_flight[dispatched] = True
+                self._log.warning("Task %s still running after %.0fs (budget %.0fs)",
+                                  task.name, now - dispatched, task.budget)
+
+    def _worker_loop(self, lane: str) -> None:
+        jobs = self._queues[lane]
+        while True:
+            task, dispatched = jobs.get()
+            try:
+                self._run(task, dispatched)
+            except Exception:
+                self._log.exception("Task %s bookkeeping failed", task.name)
+
+    def _run(self, task: Task, dispatched: float) -> None:
+        started = time.monotonic()
+        outcome, note, error = "ok", None, None
+        try:
+            if task.gate is not None and not task.gate():
+                outcome = "skipped"
+            else:
+                note = task.func()
+        except Exception as exc:
+            outcome, error = "error", f"{type(exc).__name__}: {exc}"
+        finished = time.monotonic()
+        elapsed = finished - started
+        with self._lock:
+            task.running -= 1
+            task._in_flight.pop(dispatched, None)
+            self._busy[task.lane] -= 1
+            if outcome == "skipped":
+                task.skips += 1
+                task.next_due = min(task.next_due, finished + GATE_RECHECK_SECONDS)
+            else:
+                task.runs += 1
+                task.last_started = started
+                task.last_finished = finished
+                task.last_duration = elapsed
+                task.last_note = note
+                if outcome == "error":
+                    task.failures += 1
+                    task.fail_streak += 1
+                    task.last_error = error
+                    delay = min(task.backoff_max, task.interval * (2 ** (task.fail_streak - 1)))
+                    task.next_due = finished + delay
+                else:
+                    task.fail_streak = 0
+                    task.last_error = None
+                    if elapsed > task.budget:
+                        task.overruns += 1
+                        outcome = "overrun"
+                task.last_outcome = outcome
+        self._wake.set()
+        if outcome == "error":
+            self._log.warning("Task %s failed after %.1fs (streak=%d, next in %.0fs): %s",
+                              task.name, elapsed, task.fail_streak, task.next_due - finished, error)
+        elif outcome == "overrun":
+            self._log.warning("Task %s took %.1fs (budget %.0fs)%s", task.name, elapsed, task.budget,
+                              f": {note}" if note else "")
+        elif note:
+            self._log.info("Task %s: %s", task.name, note)
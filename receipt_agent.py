@@ -8,15 +8,20 @@ Two modes:
   2. Direct serial/COM port:
        RECEIPT_SERIAL_PORT=COM3 RECEIPT_SERIAL_BAUD=38400 python receipt_agent.py
 
-Then POST JSON to /print with `text` and optional `hex` sequences.
+Then POST JSON to /print with `text` and optional `hex` sequences. Jobs are queued
+for a spooler thread that keeps the port open; the request answers 202 with a job id
+at once, and /jobs/<job_id> reports done or failed (pass "wait": <seconds> to block).
 """
 
 import io
 import logging
 import os
+import queue
 import re
+import threading
+import uuid
 import urllib.request
-from contextlib import contextmanager
+from collections import OrderedDict
 from datetime import datetime
 import re as _re
 from typing import Iterable, Sequence
@@ -96,15 +101,60 @@ def _escpos_barcode_code39_hex(value: str, height: int = 80, width: int = 2, hri
     return cmds
 
 
+RASTER_BAND_ROWS = max(1, min(int(os.environ.get("RECEIPT_RASTER_BAND_ROWS", "128")), 0xFFFF))
+RASTER_CACHE_SIZE = max(0, int(os.environ.get("RECEIPT_RASTER_CACHE_SIZE", "64")))
+
+# mode "1" packs 1=white; ESC/POS raster wants 1=black dot
+_INVERT_BITS = bytes(0xFF ^ b for b in range(256))
+_RASTER_CACHE: "OrderedDict[tuple, bytes]" = OrderedDict()
+_RASTER_CACHE_LOCK = threading.Lock()
+
+
+def _escpos_raster_bands(img, band_rows: int = RASTER_BAND_ROWS) -> tuple[bytes, ...]:
+    """Encode a PIL image as GS v 0 raster commands, one per band of band_rows lines.
+
+    Splitting tall images into bands keeps each command small, so the printer
+    prints the first band while the rest is still arriving (the spooler sends a job
+    in WRITE_CHUNK slices rather than one write).
+    """
+    img = img.convert("1")
+    w, h = img.size
+    width_bytes = (w + 7) // 8
+    if w % 8:
+        # Pad to whole bytes with white so the padding bits print as no dot
+        padded = _PILImage.new("1", (width_bytes * 8, h), 1)
+        padded.paste(img, (0, 0))
+        img = padded
+    raster = img.tobytes().translate(_INVERT_BITS)
+    xL = width_bytes & 0xFF
+    xH = (width_bytes >> 8) & 0xFF
+    bands = []
+    for top in range(0, h, band_rows):
+        rows = min(band_rows, h - top)
+        # GS v 0 — raster bit image: 1D 76 30 m xL xH yL yH [data]
+        header = bytes([0x1D, 0x76, 0x30, 0x00, xL, xH, rows & 0xFF, (rows >> 8) & 0xFF])
+        bands.append(header + raster[top * width_bytes:(top + rows) * width_bytes])
+    return tuple(bands)
+
+
 def _escpos_image_bytes(image_url: str, max_width: int = 120) -> bytes:
     """Download image_url and return ESC/POS GS v 0 raster bitmap bytes.
 
     Resizes to max_width dots wide (capped square), converts to 1-bit with
-    Floyd-Steinberg dithering so it looks reasonable on thermal paper.
+    Floyd-Steinberg dithering so it looks reasonable on thermal paper, and
+    emits one GS v 0 command per band (see _escpos_raster_bands).
+    Results are cached by (image_url, max_width), so logos and repeated
+    product images are only fetched and rasterized once.
     Returns empty bytes if PIL is unavailable or anything goes wrong.
     """
     if not _PIL_AVAILABLE or not image_url:
         return b""
+    key = (image_url, max_width)
+    with _RASTER_CACHE_LOCK:
+        cached = _RASTER_CACHE.get(key)
+        if cached is not None:
+            _RASTER_CACHE.move_to_end(key)
+            return cached
     try:
         req = urllib.request.Request(image_url, headers={"User-Agent": "ERPPos/1.0"})
         with urllib.request.urlopen(req, timeout=5) as resp:
@@ -121,33 +171,19 @@ def _escpos_image_bytes(image_url: str, max_width: int = 120) -> bytes:
         if h > max_width:
             w = max(1, int(w * max_width / h))
             img = img.resize((w, max_width), _PILImage.LANCZOS)
-            w, h = img.size
 
         # 1-bit with Floyd-Steinberg dithering (Pillow default for convert("1"))
-        img = img.convert("1")
-
-        # Pack pixels into ESC/POS raster format (MSB first, 1=black dot)
-        width_bytes = (w + 7) // 8
-        px = img.load()
-        raster = bytearray()
-        for y in range(h):
-            for bx in range(width_bytes):
-                byte = 0
-                for bit in range(8):
-                    x = bx * 8 + bit
-                    if x < w and not px[x, y]:   # 0 / False = black
-                        byte |= (0x80 >> bit)
-                raster.append(byte)
-
-        # GS v 0 — raster bit image: 1D 76 30 m xL xH yL yH [data]
-        xL = width_bytes & 0xFF
-        xH = (width_bytes >> 8) & 0xFF
-        yL = h & 0xFF
-        yH = (h >> 8) & 0xFF
-        return bytes([0x1D, 0x76, 0x30, 0x00, xL, xH, yL, yH]) + bytes(raster)
+        data = b"".join(_escpos_raster_bands(img))
     except Exception as exc:
         logging.debug("[picking-note] image convert failed (%s): %s", image_url, exc)
         return b""
+    if RASTER_CACHE_SIZE:
+        with _RASTER_CACHE_LOCK:
+            _RASTER_CACHE[key] = data
+            _RASTER_CACHE.move_to_end(key)
+            while len(_RASTER_CACHE) > RASTER_CACHE_SIZE:
+                _RASTER_CACHE.popitem(last=False)
+    return data
 
 
 def _format_amount_label(amount: object, currency: str | None = "GBP") -> str:
@@ -213,35 +249,187 @@ PORT = int(os.environ.get("RECEIPT_AGENT_PORT", "5001"))
 PRINTER_NAME = os.environ.get("RECEIPT_PRINTER_NAME", "").strip()
 
 
-class _Win32Printer:
-    """Thin wrapper around a win32print job that exposes .write() like Serial."""
-    def __init__(self, handle):
-        self._h = handle
+PRINT_QUEUE_MAX = max(1, int(os.environ.get("RECEIPT_QUEUE_MAX", "50")))
+PRINT_JOB_HISTORY = max(1, int(os.environ.get("RECEIPT_JOB_HISTORY", "200")))
+WRITE_TIMEOUT = max(1.0, float(os.environ.get("RECEIPT_WRITE_TIMEOUT", "30")))
+# Bytes per serial write; WRITE_TIMEOUT then bounds each slice, not a whole image job
+WRITE_CHUNK = max(64, int(os.environ.get("RECEIPT_WRITE_CHUNK", "4096")))
+# Seconds a print request blocks for its result unless the caller passes `wait`;
+# 0 (the default) answers 202 straight away and the till polls /jobs/<job_id>
+PRINT_WAIT_DEFAULT = max(0.0, float(os.environ.get("RECEIPT_WAIT_DEFAULT", "0")))
+
+
+class _JobBuffer:
+    """Collects a job's ESC/POS bytes so the spooler can send them as one job."""
+    def __init__(self):
+        self.data = bytearray()
 
     def write(self, data: bytes) -> None:
-        import win32print
-        win32print.WritePrinter(self._h, data)
+        self.data += data
 
 
-@contextmanager
-def _open_printer():
-    """Open either a Windows printer (by name) or a serial port."""
-    if PRINTER_NAME:
-        import win32print
-        hprinter = win32print.OpenPrinter(PRINTER_NAME)
-        try:
-            win32print.StartDocPrinter(hprinter, 1, ("Receipt", None, "RAW"))
+class _PrinterPort:
+    """Printer handle kept open between jobs (serial port or Windows printer).
+
+    The handle is dropped on any error and reopened for the next attempt.
+    """
+    def __init__(self):
+        self._serial = None
+        self._hprinter = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._serial is not None or self._hprinter is not None
+
+    def send(self, data: bytes, title: str = "Receipt") -> None:
+        if PRINTER_NAME:
+            import win32print
+            if self._hprinter is None:
+                self._hprinter = win32print.OpenPrinter(PRINTER_NAME)
+            hprinter = self._hprinter
+            win32print.StartDocPrinter(hprinter, 1, (title, None, "RAW"))
             try:
                 win32print.StartPagePrinter(hprinter)
-                yield _Win32Printer(hprinter)
+                win32print.WritePrinter(hprinter, bytes(data))
                 win32print.EndPagePrinter(hprinter)
             finally:
                 win32print.EndDocPrinter(hprinter)
-        finally:
-            win32print.ClosePrinter(hprinter)
-    else:
-        with Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser:
-            yield ser
+        else:
+            if self._serial is None:
+                self._serial = Serial(SERIAL_PORT, BAUD_RATE, timeout=1, write_timeout=WRITE_TIMEOUT)
+            view = memoryview(data)
+            for start in range(0, len(view), WRITE_CHUNK):
+                self._serial.write(view[start:start + WRITE_CHUNK])
+            self._serial.flush()
+
+    def close(self) -> None:
+        serial_port, self._serial = self._serial, None
+        hprinter, self._hprinter = self._hprinter, None
+        try:
+            if serial_port is not None:
+                serial_port.close()
+            if hprinter is not None:
+                import win32print
+                win32print.ClosePrinter(hprinter)
+        except Exception:
+            logging.debug("Printer close failed", exc_info=True)
+
+
+# ---------- PRINT SPOOLER ----------
+_PORT = _PrinterPort()
+_QUEUE: "queue.Queue[dict]" = queue.Queue(maxsize=PRINT_QUEUE_MAX)
+_JOBS: "OrderedDict[str, dict]" = OrderedDict()
+_JOBS_LOCK = threading.Lock()
+_SPOOLER_LOCK = threading.Lock()
+_spooler_thread = None
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _job_public(job: dict) -> dict:
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+def _run_job(job: dict) -> None:
+    """Send one job, reconnecting once if a handle kept from an earlier job has gone stale."""
+    attempt = 0
+    while True:
+        attempt += 1
+        reused = _PORT.is_open
+        try:
+            _PORT.send(job["_data"], title=job["kind"].title())
+            return
+        except Exception:
+            _PORT.close()
+            if attempt > 1 or not reused:
+                raise
+            logging.warning("Printer connection lost; reconnecting for job %s", job["id"])
+
+
+def _spooler_loop() -> None:
+    while True:
+        job = _QUEUE.get()
+        with _JOBS_LOCK:
+            job["status"] = "printing"
+            job["started"] = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        try:
+            _run_job(job)
+        except Exception as exc:
+            logging.exception("Printer error (job %s)", job["id"])
+            status, error = "failed", str(exc)
+        else:
+            logging.info("Printed %s job %s (%d bytes)", job["kind"], job["id"], job["bytes"])
+            status, error = "done", None
+        with _JOBS_LOCK:
+            job["status"] = status
+            job["error"] = error
+            job["finished"] = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+            job.pop("_data", None)
+        job["_done"].set()
+        _QUEUE.task_done()
+
+
+def _ensure_spooler() -> None:
+    global _spooler_thread
+    with _SPOOLER_LOCK:
+        if _spooler_thread is None or not _spooler_thread.is_alive():
+            _spooler_thread = threading.Thread(target=_spooler_loop, name="print-spooler", daemon=True)
+            _spooler_thread.start()
+
+
+def _submit_job(kind: str, buffer: _JobBuffer) -> dict:
+    """Queue a rendered job for the spooler; raises QueueFullError when the queue is full."""
+    _ensure_spooler()
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "kind": kind,
+        "status": "queued",
+        "bytes": len(buffer.data),
+        "created": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "started": None,
+        "finished": None,
+        "error": None,
+        "_data": bytes(buffer.data),
+        "_done": threading.Event(),
+    }
+    with _JOBS_LOCK:
+        try:
+            _QUEUE.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError(f"Print queue full ({PRINT_QUEUE_MAX} jobs)") from None
+        _JOBS[job["id"]] = job
+        while len(_JOBS) > PRINT_JOB_HISTORY:
+            oldest = next(iter(_JOBS.values()))
+            if oldest["status"] in ("queued", "printing"):
+                break
+            _JOBS.popitem(last=False)
+    return job
+
+
+def _job_response(kind: str, buffer: _JobBuffer, payload, **extra):
+    """Queue buffer and answer 202 with the job id to poll at /jobs/<job_id>.
+
+    A caller that passes `wait` (seconds; default PRINT_WAIT_DEFAULT, normally 0) is
+    held until the job finishes instead: 200 on success, 500 with the error on
+    failure (printer offline, paper out), or 202 if it is still queued by then.
+    """
+    try:
+        job = _submit_job(kind, buffer)
+    except QueueFullError as exc:
+        logging.warning("%s rejected: %s", kind, exc)
+        return jsonify(ok=False, error=str(exc)), 503
+    wait = payload.get("wait", PRINT_WAIT_DEFAULT)
+    try:
+        wait = float(wait if wait is not None else PRINT_WAIT_DEFAULT)
+    except (TypeError, ValueError):
+        wait = PRINT_WAIT_DEFAULT
+    if wait > 0 and job["_done"].wait(min(wait, 120.0)):
+        if job["status"] == "failed":
+            return jsonify(ok=False, error=job["error"], job_id=job["id"], status=job["status"]), 500
+        return jsonify(ok=True, job_id=job["id"], status=job["status"], **extra), 200
+    return jsonify(ok=True, job_id=job["id"], status=job["status"], **extra), 202
 
 
 def _sequence_to_bytes(sequence: Sequence[str]) -> Iterable[bytes]:
@@ -270,8 +458,7 @@ def _write_text(ser: Serial, text: str) -> None:
 def _write_custom_hex(ser: Serial, hex_commands: Sequence[str]) -> None:
     if not hex_commands:
         return
-    for data in _sequence_to_bytes(hex_commands):
-        ser.write(data)
+    ser.write(b"".join(_sequence_to_bytes(hex_commands)))
 
 
 def _write_cut(ser: Serial) -> None:
@@ -279,17 +466,6 @@ def _write_cut(ser: Serial) -> None:
     ser.write(b"\x1D\x56\x00")
 
 
-def _with_printer(func):
-    def wrapper(*args, **kwargs):
-        try:
-            with _open_printer() as printer:
-                return func(printer, *args, **kwargs)
-        except Exception:
-            logging.exception("Printer error")
-            raise
-    return wrapper
-
-
 @app.route("/print", methods=["POST", "OPTIONS"])
 def print_receipt():
     if request.method == "OPTIONS":
@@ -308,8 +484,7 @@ def print_receipt():
     if hex_commands:
         logging.info("Printing extra hex commands: %s", hex_commands)
 
-    @_with_printer
-    def _send(printer) -> None:
+    def _render(printer) -> None:
         _write_text(printer, text)
         _write_custom_hex(printer, hex_commands)
         if extra_line_feeds > 0:
@@ -317,16 +492,15 @@ def print_receipt():
         if cut:
             _write_cut(printer)
 
+    buffer = _JobBuffer()
     try:
-        _send()
+        _render(buffer)
     except ValueError as exc:
         logging.warning("Bad hex payload: %s", exc)
         return jsonify(ok=False, error=str(exc)), 400
-    except Exception as exc:
-        return jsonify(ok=False, error=str(exc)), 500
 
-    logging.info("Printed receipt; text length=%d hex commands=%d", len(text), len(hex_commands))
-    return jsonify(ok=True)
+    logging.info("Queued receipt; text length=%d hex commands=%d", len(text), len(hex_commands))
+    return _job_response("receipt", buffer, payload)
 
 
 @app.route("/print-voucher", methods=["POST", "OPTIONS"])
@@ -415,8 +589,7 @@ def print_voucher():
     extra_line_feeds = int(payload.get("line_feeds", LINE_FEEDS))
     cut = payload.get("cut", CUT_AFTER_PRINT)
 
-    @_with_printer
-    def _send(printer) -> None:
+    def _render(printer) -> None:
         _write_text(printer, text)
         _write_custom_hex(printer, hex_commands)
         if extra_line_feeds > 0:
@@ -424,14 +597,13 @@ def print_voucher():
         if cut:
             _write_cut(printer)
 
+    buffer = _JobBuffer()
     try:
-        _send()
+        _render(buffer)
     except ValueError as exc:
         return jsonify(ok=False, error=str(exc)), 400
-    except Exception as exc:
-        return jsonify(ok=False, error=str(exc)), 500
 
-    return jsonify(ok=True, voucher_code=safe_code)
+    return _job_response("voucher", buffer, payload, voucher_code=safe_code)
 
 
 
@@ -458,8 +630,7 @@ def print_picking_note():
     date = payload.get("date", "")
     logging.info("[picking-note] order=%s customer=%s items=%d", order_number, customer_name, len(items))
 
-    @_with_printer
-    def _send(printer) -> None:
+    def _render(printer) -> None:
         ESC = "\x1b"
         GS  = "\x1d"
         center   = f"{ESC}\x61\x01"   # ESC a 1 — centre align
@@ -522,13 +693,31 @@ def print_picking_note():
         printer.write(b"\n" * 4)
         _write_cut(printer)
 
+    buffer = _JobBuffer()
     try:
-        _send()
+        _render(buffer)
     except Exception as exc:
         logging.warning("[picking-note] print failed: %s", exc)
         return jsonify(ok=False, error=str(exc)), 500
 
-    return jsonify(ok=True)
+    return _job_response("picking-note", buffer, payload)
+
+
+@app.get("/jobs")
+def list_jobs():
+    with _JOBS_LOCK:
+        jobs = [_job_public(job) for job in reversed(_JOBS.values())]
+    return jsonify(ok=True, queued=_QUEUE.qsize(), queue_max=PRINT_QUEUE_MAX, jobs=jobs)
+
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id: str):
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+        data = _job_public(job) if job else None
+    if data is None:
+        return jsonify(ok=False, error="Unknown job"), 404
+    return jsonify(ok=True, job=data)
 
 
 @app.get("/health")
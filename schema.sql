@@ -110,6 +110,40 @@ SELECT
 FROM items v
 LEFT JOIN items t ON t.item_id = v.parent_id;
 
+CREATE INDEX IF NOT EXISTS idx_items_parent ON items(parent_id);
+CREATE INDEX IF NOT EXISTS idx_barcodes_item ON barcodes(item_id);
+
+-- Materialized template tiles for the POS grid (maintained by pos_service sync + sales)
+CREATE TABLE IF NOT EXISTS catalog_tiles (
+  template_id     TEXT PRIMARY KEY,
+  warehouse       TEXT NOT NULL,
+  standard_rate   NUMERIC,                -- template effective price
+  price_min       NUMERIC,                -- min/max variant price list rate
+  price_max       NUMERIC,
+  variant_stock   NUMERIC NOT NULL DEFAULT 0,
+  image           TEXT,                   -- effective image url
+  attributes_json TEXT,                   -- {"Size":["7","8"],"Color":["Black"]}
+  style_codes     TEXT,                   -- JSON list of variant custom_style_code
+  simple_colours  TEXT,                   -- JSON list of variant custom_simple_colour
+  barcodes_json   TEXT,                   -- JSON list of variant barcodes
+  updated_utc     TEXT
+);
+
+-- Per-template size grid (/api/item_matrix), zlib-compressed JSON; dropped when a
+-- variant, price, stock row or layaway reservation of the template changes
+CREATE TABLE IF NOT EXISTS item_matrix_cache (
+  template_id     TEXT PRIMARY KEY,
+  warehouse       TEXT NOT NULL,
+  payload         BLOB NOT NULL,
+  updated_utc     TEXT
+);
+
+-- Bumped by every invalidation so a matrix built from an older snapshot is not stored
+CREATE TABLE IF NOT EXISTS item_matrix_cache_gen (
+  id              INTEGER PRIMARY KEY CHECK (id = 1),
+  gen             INTEGER NOT NULL
+);
+
 -- Sales: header, lines, payments
 CREATE TABLE IF NOT EXISTS sales (
   sale_id        TEXT PRIMARY KEY,        -- UUID v4
@@ -125,7 +159,8 @@ CREATE TABLE IF NOT EXISTS sales (
   pay_status     TEXT NOT NULL,           -- 'paid'|'partially_paid'|'refunded'
   queue_status   TEXT NOT NULL,           -- 'queued'|'posting'|'posted'|'failed'
   erp_docname    TEXT,
-  payload_json   TEXT NOT NULL
+  payload_json   TEXT NOT NULL,
+  return_against_id TEXT                  -- original sale_id for returns
 );
 
 -- FX rounding metadata (if EUR conversion was chosen)
@@ -179,7 +214,8 @@ CREATE TABLE IF NOT EXISTS vouchers (
   issued_utc     TEXT NOT NULL,
   initial_value  NUMERIC NOT NULL,
   active         INTEGER NOT NULL DEFAULT 1,
-  meta_json      TEXT
+  meta_json      TEXT,
+  balance        NUMERIC NOT NULL DEFAULT 0  -- initial_value + non-issue ledger rows, kept by triggers
 );
 
 CREATE TABLE IF NOT EXISTS voucher_ledger (
@@ -191,23 +227,61 @@ CREATE TABLE IF NOT EXISTS voucher_ledger (
   sale_id        TEXT,
   note           TEXT
 );
+CREATE INDEX IF NOT EXISTS idx_voucher_ledger_code ON voucher_ledger(voucher_code);
+
+CREATE TABLE IF NOT EXISTS voucher_events (
+  event_id      TEXT PRIMARY KEY,
+  voucher_code  TEXT NOT NULL REFERENCES vouchers(voucher_code),
+  created_utc   TEXT NOT NULL,
+  kind          TEXT NOT NULL,       -- 'issue'|'redeem'
+  amount        NUMERIC NOT NULL,
+  balance_after NUMERIC,
+  currency      TEXT DEFAULT 'GBP',
+  sale_id       TEXT,
+  payload_json  TEXT NOT NULL,
+  queue_status  TEXT NOT NULL DEFAULT 'queued',
+  erp_docname   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_voucher_events_status ON voucher_events(queue_status, created_utc);
+
+-- vouchers.balance is maintained by these triggers; 'issue' rows are already in initial_value
+CREATE TRIGGER IF NOT EXISTS trg_voucher_ledger_ins AFTER INSERT ON voucher_ledger
+WHEN NEW.type <> 'issue'
+BEGIN
+  UPDATE vouchers SET balance = balance + NEW.amount WHERE voucher_code = NEW.voucher_code;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_voucher_ledger_del AFTER DELETE ON voucher_ledger
+WHEN OLD.type <> 'issue'
+BEGIN
+  UPDATE vouchers SET balance = balance - OLD.amount WHERE voucher_code = OLD.voucher_code;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_voucher_ledger_upd AFTER UPDATE OF voucher_code, type, amount ON voucher_ledger
+BEGIN
+  UPDATE vouchers SET balance = balance - CASE WHEN OLD.type = 'issue' THEN 0 ELSE OLD.amount END
+  WHERE voucher_code = OLD.voucher_code;
+  UPDATE vouchers SET balance = balance + CASE WHEN NEW.type = 'issue' THEN 0 ELSE NEW.amount END
+  WHERE voucher_code = NEW.voucher_code;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_vouchers_ins AFTER INSERT ON vouchers
+BEGIN
+  UPDATE vouchers SET balance = NEW.initial_value + COALESCE(
+    (SELECT SUM(amount) FROM voucher_ledger WHERE voucher_code = NEW.voucher_code AND type <> 'issue'), 0)
+  WHERE voucher_code = NEW.voucher_code;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_vouchers_initial AFTER UPDATE OF initial_value ON vouchers
+BEGIN
+  UPDATE vouchers SET balance = balance + NEW.initial_value - OLD.initial_value
+  WHERE voucher_code = NEW.voucher_code;
+END;
 
 DROP VIEW IF EXISTS v_voucher_balance;
 CREATE VIEW v_voucher_balance AS
-SELECT
-  v.voucher_code,
-  v.active,
-  v.issued_utc,
-  v.initial_value
-  + COALESCE(
-      SUM(
-        CASE WHEN l.type = 'issue' THEN 0 ELSE l.amount END
-      ),
-      0
-    ) AS balance
-FROM vouchers v
-LEFT JOIN voucher_ledger l ON l.voucher_code = v.voucher_code
-GROUP BY v.voucher_code;
+SELECT voucher_code, active, issued_utc, balance
+FROM vouchers;
 
 -- Outbox for ERPNext posting and other sync ops
 CREATE TABLE IF NOT EXISTS outbox (
@@ -217,9 +291,15 @@ CREATE TABLE IF NOT EXISTS outbox (
   created_utc   TEXT NOT NULL,
   payload_json  TEXT NOT NULL,
   attempts      INTEGER NOT NULL DEFAULT 0,
-  last_error    TEXT
+  last_error    TEXT,
+  lease_owner   TEXT,                  -- dispatcher currently posting this row
+  lease_until   TEXT,                  -- lease expiry (UTC ISO); expired leases are reclaimable
+  next_attempt_utc TEXT,               -- backoff: not retried before this time
+  progress_json TEXT                   -- steps already done in ERPNext (e.g. invoice posted)
 );
 CREATE INDEX IF NOT EXISTS idx_outbox_ready ON outbox(kind, attempts, created_utc);
+CREATE INDEX IF NOT EXISTS idx_outbox_ref ON outbox(kind, ref_id);
+CREATE INDEX IF NOT EXISTS idx_outbox_lease ON outbox(lease_owner);
 
 -- Cashiers/users
 CREATE TABLE IF NOT EXISTS cashiers (
@@ -235,8 +315,13 @@ CREATE TABLE IF NOT EXISTS customers (
   email          TEXT,
   phone          TEXT,
   disabled       INTEGER NOT NULL DEFAULT 0,
-  modified_utc   TEXT
+  modified_utc   TEXT,
+  change_seq     INTEGER NOT NULL DEFAULT 0   -- bumped on every write; /api/customers ETag
 );
+CREATE INDEX IF NOT EXISTS idx_customers_change_seq ON customers(change_seq);
+CREATE INDEX IF NOT EXISTS idx_customers_name_nocase ON customers(customer_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_customers_id_nocase ON customers(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_customers_modified ON customers(modified_utc);
 
 -- Optional: home screen cache for tiles
 CREATE TABLE IF NOT EXISTS home_tiles (
@@ -263,6 +348,33 @@ CREATE TABLE IF NOT EXISTS sync_cursors (
   last_name     TEXT               -- tiebreaker (docname) to handle equal modified times
 );
 
+-- Progress of an in-flight full sync (completed stages + totals) so an interrupted run resumes
+CREATE TABLE IF NOT EXISTS sync_checkpoints (
+  name         TEXT PRIMARY KEY,   -- e.g., 'full_sync:Shop:Standard Selling'
+  state_json   TEXT NOT NULL,      -- {"started_utc", "done": [stages], "totals": {...}}
+  updated_utc  TEXT NOT NULL
+);
+
+-- Index of receipt files in invoices/ so ingest and day views never re-read the folder
+CREATE TABLE IF NOT EXISTS invoice_journal (
+  file_name    TEXT PRIMARY KEY,   -- e.g., 'T1-000123.json'
+  sale_id      TEXT,               -- NULL when the file could not be parsed
+  invoice_name TEXT,
+  day          TEXT,               -- YYYY-MM-DD of created_at
+  created_at   TEXT,
+  mtime        REAL,
+  mode         TEXT,
+  customer     TEXT,
+  cashier      TEXT,
+  total        NUMERIC,
+  acked        INTEGER NOT NULL DEFAULT 0,   -- a .json.ok sidecar has been seen
+  ingested     INTEGER NOT NULL DEFAULT 0,   -- recorded in sales
+  location     TEXT NOT NULL DEFAULT 'live'  -- 'live' | 'gone' | 'archive/YYYY-MM.ndjson.gz'
+);
+CREATE INDEX IF NOT EXISTS idx_invoice_journal_day ON invoice_journal(day);
+CREATE INDEX IF NOT EXISTS idx_invoice_journal_sale ON invoice_journal(sale_id);
+CREATE INDEX IF NOT EXISTS idx_invoice_journal_pending ON invoice_journal(file_name) WHERE ingested=0;
+
 -- ── Layaway ──────────────────────────────────────────────────────────────────
 
 CREATE TABLE IF NOT EXISTS layaways (
@@ -305,3 +417,13 @@ CREATE INDEX IF NOT EXISTS idx_layaways_status   ON layaways(status, expires_at)
 CREATE INDEX IF NOT EXISTS idx_layaways_cashier  ON layaways(created_by);
 CREATE INDEX IF NOT EXISTS idx_lay_payments_lay  ON layaway_payments(layaway_id);
 CREATE INDEX IF NOT EXISTS idx_lay_audit_lay     ON layaway_audit(layaway_id);
+
+-- Stock held by active layaways, one row per (layaway, item); maintained by the layaway endpoints
+CREATE TABLE IF NOT EXISTS layaway_reservations (
+  layaway_id    TEXT NOT NULL,
+  item_id       TEXT NOT NULL,
+  qty           REAL NOT NULL,                           -- uncollected qty still reserved
+  PRIMARY KEY (layaway_id, item_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_lay_res_item      ON layaway_reservations(item_id, qty);
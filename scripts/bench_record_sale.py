@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: commit latency of pos_service.record_sale.
+
+Builds a throwaway database from schema.sql with a seeded catalog, then records
+sales of a 30-line basket paid partly by two gift vouchers and reports
+per-sale latency (median / p95 / max).
+
+Run: py scripts\\bench_record_sale.py --sales 200 --lines 30 --vouchers 2
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pos_service as ps  # noqa: E402
+
+
+def seed(conn, catalog: int, voucher_codes: list) -> None:
+    now = ps.iso_now()
+    conn.executemany(
+        "INSERT INTO items (item_id, parent_id, name, brand, is_template, active, modified_utc) VALUES (?,?,?,?,0,1,?)",
+        [(f"SKU-{i:05d}", None, f"Item {i}", "Brand", now) for i in range(catalog)],
+    )
+    conn.executemany(
+        "INSERT INTO stock (item_id, warehouse, qty) VALUES (?,?,?)",
+        [(f"SKU-{i:05d}", "Shop", 1000) for i in range(catalog)],
+    )
+    for code in voucher_codes:
+        ps.upsert_voucher_head(conn, code, now, 1_000_000, 1, {"source": "bench"})
+        ps.voucher_ledger_add(conn, code, 1_000_000, "issue", note="bench seed")
+    conn.commit()
+
+
+def basket(n: int, args, voucher_codes: list) -> dict:
+    lines = []
+    for i in range(args.lines):
+        idx = (n * args.lines + i) % args.catalog
+        lines.append({
+            "item_id": f"SKU-{idx:05d}",
+            "item_name": f"Item {idx}",
+            "brand": "Brand",
+            "attributes": {"Size": "8"},
+            "qty": 1,
+            "rate": 10.0,
+            "barcode_used": None,
+        })
+    total = 10.0 * args.lines
+    redeem = [{"code": code, "amount": 5.0} for code in voucher_codes]
+    card = total - sum(v["amount"] for v in redeem)
+    return {
+        "cashier": "bench",
+        "customer_id": None,
+        "warehouse": "Shop",
+        "lines": lines,
+        "payments": [{"method": "Card", "amount": card, "ref": f"T{n}"}],
+        "voucher_redeem": redeem,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sales", type=int, default=200)
+    ap.add_argument("--lines", type=int, default=30)
+    ap.add_argument("--vouchers", type=int, default=2)
+    ap.add_argument("--catalog", type=int, default=5000, help="items seeded in the catalog")
+    args = ap.parse_args()
+
+    voucher_codes = [f"GV-{n:03d}" for n in range(args.vouchers)]
+    with tempfile.TemporaryDirectory(prefix="bench_sale_") as tmpdir:
+        conn = ps.connect(os.path.join(tmpdir, "bench.db"))
+        try:
+            ps.init_db(conn, os.path.join(ROOT, "schema.sql"))
+            seed(conn, args.catalog, voucher_codes)
+
+            sales = [basket(n, args, voucher_codes) for n in range(args.sales)]
+            ps.record_sale(conn, basket(args.sales, args, voucher_codes))  # warm-up: statement cache, page cache
+
+            timings = []
+            for sale in sales:
+                started = time.perf_counter()
+                ps.record_sale(conn, sale)
+                timings.append((time.perf_counter() - started) * 1000.0)
+        finally:
+            conn.close()
+
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"record_sale: {args.sales} sales x {args.lines} lines, {args.vouchers} vouchers")
+    print(f"  median {statistics.median(timings):.2f} ms  p95 {p95:.2f} ms  max {timings[-1]:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
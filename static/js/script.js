@@ -1143,16 +1143,39 @@ const receiptAgentClient = (() => {
         'Accept': 'application/json'
       },
       cache: 'no-store',
-      body: JSON.stringify(payload)
+      // Never hold the request open on serial I/O; the job is polled below
+      body: JSON.stringify({ wait: 0, ...payload })
     });
     if(!response.ok){
       const text = await response.text().catch(()=> '');
       throw new Error(`Receipt agent ${response.status}: ${text}`);
     }
     const data = await response.json().catch(()=> null);
+    if(response.status === 202 && data?.job_id){
+      return waitForJob(target, data.job_id);
+    }
     return data?.ok !== false;
   }
 
+  // Agent answered 202 (job queued): poll it so printer errors still reach the till
+  async function waitForJob(target, jobId, timeoutMs = 60000){
+    const url = new URL(target, window.location.href);
+    url.pathname = url.pathname.replace(/\/[^/]*\/?$/, `/jobs/${encodeURIComponent(jobId)}`);
+    const deadline = Date.now() + timeoutMs;
+    let delay = 100;
+    while(Date.now() < deadline){
+      await new Promise(resolve => setTimeout(resolve, delay));
+      delay = Math.min(delay * 2, 1000);
+      const res = await fetch(url.toString(), { headers: { 'Accept': 'application/json' }, cache: 'no-store' });
+      const body = await res.json().catch(()=> null);
+      const status = body?.job?.status;
+      if(status === 'done') return true;
+      if(status === 'failed') throw new Error(`Receipt agent: ${body.job.error || 'print failed'}`);
+      if(!res.ok) throw new Error(`Receipt agent ${res.status}: ${body?.error || 'job lookup failed'}`);
+    }
+    throw new Error('Receipt agent: print job did not finish in time');
+  }
+
   return {
     isReady: () => !!endpoint,
     async print(info, opts = {}) {
@@ -1249,8 +1272,16 @@ async function sendTextToReceiptAgent(text, opts = {}) {
   }
 }
 
+// Last printer/agent error, shown in the cashier's "failed to print" alerts
+let lastReceiptAgentError = '';
+
+function receiptAgentErrorSuffix(){
+  return lastReceiptAgentError ? `\n\n${lastReceiptAgentError}` : '';
+}
+
 async function tryReceiptAgentPrint(info, opts = {}){
   if(!info || !receiptAgentClient || !receiptAgentClient.isReady()) return false;
+  lastReceiptAgentError = '';
   try{
     const receiptOpts = Object.assign({}, opts);
     if(!Object.prototype.hasOwnProperty.call(receiptOpts, 'cut')){
@@ -1273,6 +1304,7 @@ async function tryReceiptAgentPrint(info, opts = {}){
     return true;
   }catch(err){
     warn('Local receipt agent print failed', err);
+    lastReceiptAgentError = (err && err.message) || String(err);
     return false;
   }
 }
@@ -1286,7 +1318,7 @@ function scheduleAutoReceiptPrint(info){
   setTimeout(async ()=>{
     const ok = await ensureReceiptPrinted(info, { gift:false });
     if(!ok){
-      alert('Unable to print receipt. Please ensure the local receipt agent is running and try again.');
+      alert('Unable to print receipt. Please ensure the local receipt agent is running and try again.' + receiptAgentErrorSuffix());
     }
   }, 75);
 }
@@ -1312,12 +1344,12 @@ function handleReceiptPrintRequest(info, wantsGift){
       }
       const standardOk = await ensureReceiptPrinted(target, { gift:false });
       if(!giftOk || !standardOk){
-        alert('Gift or standard receipt failed to print. Please retry with the local receipt agent.');
+        alert('Gift or standard receipt failed to print. Please retry with the local receipt agent.' + receiptAgentErrorSuffix());
       }
     }else{
       const ok = await ensureReceiptPrinted(target, { gift:false });
       if(!ok){
-        alert('Receipt failed to print. Please retry with the local receipt agent.');
+        alert('Receipt failed to print. Please retry with the local receipt agent.' + receiptAgentErrorSuffix());
       }
     }
     // Always reprint any voucher slips associated with this receipt
@@ -2280,8 +2312,21 @@ function thumbUrl(url, width=160, height=160){
   if(!url){
     return '';
   }
-  return `/api/thumb?url=${encodeURIComponent(url)}&w=${width}&h=${height}`;
-}
+  // Ask for 2x pixels on high-density screens; the server keeps both sizes
+  const scale = (window.devicePixelRatio || 1) > 1.25 ? 2 : 1;
+  return `/api/thumb?url=${encodeURIComponent(url)}&w=${width * scale}&h=${height * scale}`;
+}
+
+// /api/thumb answers 202 with a 1x1 placeholder while a thumbnail is still being built;
+// reload those <img> elements a few times until the real image arrives.
+document.addEventListener('load', (ev)=>{
+  const img = ev.target;
+  if(!img || img.tagName !== 'IMG' || img.naturalWidth !== 1 || !img.src.includes('/api/thumb?')) return;
+  const tries = Number(img.dataset.thumbRetry || 0);
+  if(tries >= 5) return;
+  img.dataset.thumbRetry = String(tries + 1);
+  setTimeout(()=>{ img.src = img.src.replace(/&_r=\d+$/, '') + `&_r=${tries + 1}`; }, 800 * (tries + 1));
+}, true);
 
 function addToCart(item) {
   // Always open product overlay to choose a specific variant to ensure consistent IDs
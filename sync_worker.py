@@ -11,6 +11,10 @@ Env vars:
   SYNC_MODE        'push' | 'pull-ack' (default: 'pull-ack' when ERP is not configured)
   SYNC_INTERVAL    seconds between loops (default: 10)
   INVOICES_DIR     path to invoices directory (default: invoices)
+  POS_OUTBOX_LANES concurrent posts per kind in push mode (default: sale=4,voucher=1,voucher_event=2)
+
+Outbox rows are leased while posting, so running this worker alongside the POS server's
+idle loop never posts a row twice.
 
 Run:
   python sync_worker.py
@@ -33,7 +37,7 @@ INVOICES_DIR = os.environ.get('INVOICES_DIR', 'invoices')
 
 def connect_db() -> sqlite3.Connection:
     if ps:
-        return ps.connect(POS_DB_PATH)
+        return ps.pooled_connect(POS_DB_PATH)
     conn = sqlite3.connect(POS_DB_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
     return conn
@@ -88,13 +92,17 @@ def loop_pull_ack(conn: sqlite3.Connection):
 def main():
     mode = (SYNC_MODE or '').strip().lower() or 'pull-ack'
     print(f'[sync] starting worker in mode={mode}, interval={SYNC_INTERVAL}s, db={POS_DB_PATH}')
-    conn = connect_db()
     try:
         while True:
-            if mode == 'push':
-                loop_push(conn)
-            else:
-                loop_pull_ack(conn)
+            # Pooled: each pass reuses the same connection after a cheap health check
+            conn = connect_db()
+            try:
+                if mode == 'push':
+                    loop_push(conn)
+                else:
+                    loop_pull_ack(conn)
+            finally:
+                conn.close()
             time.sleep(SYNC_INTERVAL)
     except KeyboardInterrupt:
         print('[sync] exiting on Ctrl+C')
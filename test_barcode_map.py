@@ -0,0 +1,126 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import pos_service as ps
+
+
+class BarcodeMapConcurrencyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="barcode_map_")
+        self.db_path = os.path.join(self.tmpdir, "pos.db")
+        conn = ps.connect(self.db_path)
+        ps.init_db(conn, "schema.sql")
+        now = ps.iso_now()
+        conn.executemany(
+            "INSERT INTO items (item_id, name, is_template, active, modified_utc) VALUES (?,?,0,1,?)",
+            [(f"SKU-{i:04d}", f"Item {i}", now) for i in range(500)],
+        )
+        conn.executemany(
+            "INSERT INTO barcodes (barcode, item_id) VALUES (?,?)",
+            [(f"BC-{i:04d}", f"SKU-{i:04d}") for i in range(500)],
+        )
+        conn.commit()
+        conn.close()
+        self.bmap = ps.BarcodeMap()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_lookups_stay_consistent_during_rebuilds_and_patches(self):
+        stop = threading.Event()
+        errors = []
+
+        def scanner(offset):
+            conn = ps.connect(self.db_path)
+            try:
+                n = offset
+                while not stop.is_set():
+                    i = n % 500
+                    row = self.bmap.lookup(conn, f"BC-{i:04d}")
+                    if row is None or row[0] != f"SKU-{i:04d}":
+                        errors.append((f"BC-{i:04d}", row and row[0]))
+                    n += 7
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                conn.close()
+
+        conn = ps.connect(self.db_path)
+        self.bmap.ensure_loaded(conn)
+        # Switch threads far more often than usual to widen any torn-read window
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+        threads = [threading.Thread(target=scanner, args=(k,)) for k in range(4)]
+        for t in threads:
+            t.start()
+        try:
+            for round_no in range(100):
+                # Re-inserting a low item moves it to the end, shifting every later offset
+                # in the next full rebuild
+                moved = f"SKU-{round_no % 50:04d}"
+                conn.execute("DELETE FROM barcodes WHERE item_id=?", (moved,))
+                conn.execute("DELETE FROM items WHERE item_id=?", (moved,))
+                conn.execute(
+                    "INSERT INTO items (item_id, name, is_template, active, modified_utc) VALUES (?,?,0,1,?)",
+                    (moved, "Moved", ps.iso_now()),
+                )
+                conn.execute("INSERT INTO barcodes (barcode, item_id) VALUES (?,?)", ("BC" + moved[3:], moved))
+                conn.commit()
+                self.bmap.invalidate_all()
+                self.bmap.ensure_loaded(conn)
+                self.bmap.invalidate([moved, f"SKU-{round_no + 100:04d}"])
+                self.bmap.ensure_loaded(conn)
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+            conn.close()
+        self.assertEqual(errors, [])
+
+    def test_patch_does_not_mutate_published_snapshot(self):
+        conn = ps.connect(self.db_path)
+        try:
+            self.bmap.ensure_loaded(conn)
+            rows, by_barcode, by_item = self.bmap._snap
+            conn.execute("UPDATE barcodes SET item_id='SKU-0002' WHERE barcode='BC-0001'")
+            conn.commit()
+            self.bmap.invalidate(["SKU-0001", "SKU-0002"])
+            self.assertEqual(self.bmap.lookup(conn, "BC-0001")[0], "SKU-0002")
+            self.assertEqual(rows[by_barcode["BC-0001"]][0], "SKU-0001")
+            self.assertIsNot(self.bmap._snap[1], by_barcode)
+        finally:
+            conn.close()
+
+    def test_stock_only_change_leaves_snapshot_untouched(self):
+        saved = ps.BARCODE_MAP
+        ps.BARCODE_MAP = self.bmap
+        self.addCleanup(setattr, ps, "BARCODE_MAP", saved)
+        conn = ps.connect(self.db_path)
+        try:
+            self.bmap.ensure_loaded(conn)
+            snap = self.bmap._snap
+            ps.drain_catalog_changes()  # whatever earlier tests left on this thread
+            # What a sale does to its basket items
+            ps.refresh_catalog_tile_stock(conn, ["SKU-0001", "SKU-0002"])
+            conn.commit()
+            changes = ps.drain_catalog_changes()
+            self.assertEqual(changes["items"], {"SKU-0001", "SKU-0002"})
+            self.assertEqual(changes["rows"], set())
+            self.assertEqual(self.bmap.stats()["dirty"], 0)
+            self.assertEqual(self.bmap.lookup(conn, "BC-0001")[0], "SKU-0001")
+            self.assertIs(self.bmap._snap, snap)
+            # A price change still reloads the row
+            ps.refresh_catalog_tiles_for_items(conn, ["SKU-0001"], structural=False)
+            self.assertEqual(ps.drain_catalog_changes()["rows"], {"SKU-0001"})
+            self.assertEqual(self.bmap.stats()["dirty"], 1)
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
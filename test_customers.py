@@ -0,0 +1,108 @@
+import json
+import sqlite3
+import unittest
+
+import pos_service as ps
+
+
+class _FakeErpCustomers:
+    """Answers /api/resource/Customer list calls the way ERPNext applies filters and order_by."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = 0
+
+    def __call__(self, path, params):
+        self.calls += 1
+        rows = list(self.rows)
+        for field, op, value in json.loads(params["filters"]):
+            if op == "=":
+                rows = [r for r in rows if r[field] == value]
+            elif op == ">":
+                rows = [r for r in rows if r[field] > value]
+        if params["order_by"] == "name asc":
+            rows.sort(key=lambda r: r["name"])
+        else:
+            rows.sort(key=lambda r: (r["modified"], r["name"]))
+        return {"data": [dict(r) for r in rows[:int(params["limit_page_length"])]]}
+
+
+class CustomerDirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        with open("schema.sql", "r", encoding="utf-8") as f:
+            self.conn.executescript(f.read())
+        self.conn.commit()
+        self._original_get = ps._erp_get
+
+    def tearDown(self):
+        ps._erp_get = self._original_get
+        self.conn.close()
+
+    def test_etag_is_stable_until_a_customer_changes(self):
+        self.assertIsNone(ps.customers_etag(self.conn, "", 50, 0))
+        ps.upsert_customers(self.conn, [{"name": "C1", "customer_name": "Anna", "modified": "2024-01-01 10:00:00"}])
+        etag = ps.customers_etag(self.conn, "an", 50, 0)
+        # Unchanged directory: the same ETag, so the endpoint answers 304
+        self.assertEqual(ps.customers_etag(self.conn, "an", 50, 0), etag)
+        self.assertNotEqual(ps.customers_etag(self.conn, "an", 50, 50), etag)
+        ps.upsert_customers(self.conn, [{"name": "C1", "customer_name": "Anna B", "modified": "2024-01-02 10:00:00"}])
+        self.assertNotEqual(ps.customers_etag(self.conn, "an", 50, 0), etag)
+
+    def test_etag_changes_on_migrated_table_with_mixed_timestamps(self):
+        self.conn.execute("DROP TABLE customers")
+        self.conn.execute("""
+            CREATE TABLE customers (name TEXT PRIMARY KEY, customer_name TEXT, email TEXT, phone TEXT,
+                                    disabled INTEGER NOT NULL DEFAULT 0, modified_utc TEXT)
+        """)
+        # Rows cached by the old code carry iso_now() stamps, which sort above ERP's format
+        self.conn.executemany(
+            "INSERT INTO customers (name, customer_name, modified_utc) VALUES (?,?,?)",
+            [("C1", "Anna", "2025-06-01T09:00:00Z"), ("C2", "Bob", "2025-06-01T09:00:00Z")],
+        )
+        ps._ensure_customer_table(self.conn)
+        etag = ps.customers_etag(self.conn, "", 50, 0)
+        self.assertIsNotNone(etag)
+        ps.upsert_customers(self.conn, [{"name": "C2", "customer_name": "Bob", "disabled": 1,
+                                         "modified": "2025-06-02 08:00:00"}])
+        self.assertNotEqual(ps.customers_etag(self.conn, "", 50, 0), etag)
+        rows, _ = ps.search_customers(self.conn, "", limit=50)
+        self.assertEqual([r["name"] for r in rows], ["C1"])
+
+    def test_keyset_pull_pages_through_shared_modified_stamps(self):
+        # A bulk import: many customers share one modified stamp, and pages split inside it
+        erp_rows = [{"name": f"C{i:02d}", "customer_name": f"Cust {i}", "email_id": None, "mobile_no": None,
+                     "disabled": 0, "modified": "2024-01-01 00:00:00"} for i in range(7)]
+        erp_rows += [{"name": "D01", "customer_name": "Later", "email_id": None, "mobile_no": None,
+                      "disabled": 0, "modified": "2024-01-02 00:00:00"}]
+        fake = _FakeErpCustomers(erp_rows)
+        ps._erp_get = fake
+        pulled = ps.pull_customers_incremental(self.conn, limit=3)
+        self.assertEqual(pulled, 8)
+        names = [r["name"] for r in self.conn.execute("SELECT name FROM customers ORDER BY name")]
+        self.assertEqual(names, [r["name"] for r in erp_rows])
+        self.assertEqual(ps._cursor_get(self.conn, "Customer"), ("2024-01-02 00:00:00", "D01"))
+
+        version = ps.customers_version(self.conn)
+        self.assertEqual(ps.pull_customers_incremental(self.conn, limit=3), 0)
+        self.assertEqual(ps.customers_version(self.conn), version)
+
+        erp_rows[2] = dict(erp_rows[2], customer_name="Renamed", modified="2024-01-03 00:00:00")
+        self.assertEqual(ps.pull_customers_incremental(self.conn, limit=3), 1)
+        row = self.conn.execute("SELECT customer_name FROM customers WHERE name='C02'").fetchone()
+        self.assertEqual(row["customer_name"], "Renamed")
+        self.assertGreater(ps.customers_version(self.conn), version)
+
+    def test_search_pages_with_has_more(self):
+        ps.upsert_customers(self.conn, [{"name": f"C{i:03d}", "customer_name": f"Sam {i:03d}"} for i in range(25)])
+        first, more = ps.search_customers(self.conn, "sam", limit=10, offset=0)
+        last, last_more = ps.search_customers(self.conn, "SAM", limit=10, offset=20)
+        self.assertTrue(more)
+        self.assertFalse(last_more)
+        self.assertEqual(first[0]["name"], "C000")
+        self.assertEqual(len(last), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import pos_service as ps
+
+
+class InvoiceJournalArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="invoice_journal_")
+        self.inv_dir = os.path.join(self.tmpdir, "invoices")
+        os.makedirs(self.inv_dir)
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        with open("schema.sql", "r", encoding="utf-8") as f:
+            self.conn.executescript(f.read())
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _receipt(self, sale_id, day="2024-01-05", total=10.0):
+        with open(os.path.join(self.inv_dir, f"{sale_id}.json"), "w", encoding="utf-8") as f:
+            json.dump({"sale_id": sale_id, "created_at": f"{day}T10:00:00", "total": total, "mode": "local"}, f)
+        self.conn.execute(
+            "INSERT INTO sales (sale_id, created_utc, cashier, customer_id, subtotal, tax, total, "
+            "pay_status, queue_status, payload_json) VALUES (?,?,?,?,?,0,?,'paid','posted','{}')",
+            (sale_id, f"{day}T10:00:00Z", "demo", "Walk-in Customer", total, total),
+        )
+        self.conn.commit()
+
+    def _segment_files(self, segment="archive/2024-01.ndjson.gz"):
+        with gzip.open(os.path.join(self.inv_dir, segment), "rt", encoding="utf-8") as seg:
+            return [json.loads(line)["file"] for line in seg]
+
+    def test_archive_moves_settled_receipts(self):
+        self._receipt("S-1")
+        self._receipt("S-2")
+        ps.invoice_journal_pending(self.conn, self.inv_dir)
+        self.assertEqual(ps.invoice_journal_archive(self.conn, self.inv_dir, older_than_days=1), 2)
+        self.assertEqual(sorted(self._segment_files()), ["S-1.json", "S-2.json"])
+        self.assertFalse(os.path.exists(os.path.join(self.inv_dir, "S-1.json")))
+        self.assertEqual(ps.invoice_journal_load(self.conn, "S-2", self.inv_dir)["total"], 10.0)
+
+    def test_archive_after_crash_does_not_duplicate_records(self):
+        self._receipt("S-1")
+        self._receipt("S-2")
+        ps.invoice_journal_pending(self.conn, self.inv_dir)
+        # A previous run appended S-1 and died before recording or unlinking it
+        os.makedirs(os.path.join(self.inv_dir, "archive"))
+        with gzip.open(os.path.join(self.inv_dir, "archive/2024-01.ndjson.gz"), "at", encoding="utf-8") as seg:
+            seg.write(json.dumps({"file": "S-1.json", "record": {"sale_id": "S-1"}}) + "\n")
+        self.assertEqual(ps.invoice_journal_archive(self.conn, self.inv_dir, older_than_days=1), 2)
+        self.assertEqual(sorted(self._segment_files()), ["S-1.json", "S-2.json"])
+        locations = {r["file_name"]: r["location"] for r in self.conn.execute(
+            "SELECT file_name, location FROM invoice_journal")}
+        self.assertEqual(locations, {"S-1.json": "archive/2024-01.ndjson.gz",
+                                     "S-2.json": "archive/2024-01.ndjson.gz"})
+        self.assertEqual(sorted(os.listdir(self.inv_dir)), ["archive"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+import json
+import sqlite3
+import unittest
+
+import pos_service as ps
+
+
+class OutboxOrderingTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with open("schema.sql", "r", encoding="utf-8") as f:
+            self.conn.executescript(f.read())
+        self.conn.commit()
+        self.conn.isolation_level = None
+        self._originals = (ps.post_sale_to_erpnext, ps._apply_voucher_redemptions_to_erp,
+                           ps._post_voucher_issue_to_erp, ps._post_voucher_event)
+        self.posted = []
+        self.applied = []
+        self.apply_failures = 0
+        ps.post_sale_to_erpnext = self._fake_post_sale
+        ps._apply_voucher_redemptions_to_erp = self._fake_apply
+        ps._post_voucher_issue_to_erp = lambda voucher: {"name": voucher.get("code")}
+        ps._post_voucher_event = lambda payload: {"name": "EV"}
+
+    def tearDown(self):
+        (ps.post_sale_to_erpnext, ps._apply_voucher_redemptions_to_erp,
+         ps._post_voucher_issue_to_erp, ps._post_voucher_event) = self._originals
+        self.conn.close()
+
+    def _fake_post_sale(self, payload):
+        self.posted.append(payload["sale_id"])
+        return {"name": f"INV-{len(self.posted)}"}
+
+    def _fake_apply(self, vouchers, docname, sale_payload):
+        if self.apply_failures:
+            self.apply_failures -= 1
+            raise ValueError("voucher doc locked")
+        self.applied.append((vouchers[0]["code"], docname))
+
+    def _issue_voucher(self, code, value=50.0):
+        ps.upsert_voucher_head(self.conn, code, "2025-01-01", value, 1, {"source": "test"})
+        ps.voucher_ledger_add(self.conn, code, value, "issue", sale_id=None, note="seed value")
+        self.conn.execute(
+            "INSERT INTO outbox (kind, ref_id, created_utc, payload_json) VALUES ('voucher',?,?,?)",
+            (code, ps.iso_now(), json.dumps({"voucher": {"code": code, "amount": value}})),
+        )
+
+    def _sale(self, sale_id, redeem):
+        return ps.record_sale(self.conn, {
+            "sale_id": sale_id,
+            "cashier": "demo",
+            "customer_id": "Walk-in Customer",
+            "warehouse": "Shop",
+            "lines": [{"item_id": "SKU-001", "item_name": "Test Item", "qty": 1, "rate": 40.0}],
+            "payments": [{"method": "Card", "amount": 40.0 - sum(v["amount"] for v in redeem)}],
+            "voucher_redeem": redeem,
+        })
+
+    def _make_due(self):
+        self.conn.execute("UPDATE outbox SET next_attempt_utc=NULL")
+
+    def test_sale_waits_for_pending_voucher_issue(self):
+        self._issue_voucher("GV-NEW")
+        self._sale("SALE-1", [{"code": "GV-NEW", "amount": 10.0}])
+        self.assertEqual(ps._outbox_claim(self.conn, "sale", "t1", 10), [])
+        self.conn.execute("DELETE FROM outbox WHERE kind='voucher'")
+        claimed = ps._outbox_claim(self.conn, "sale", "t2", 10)
+        self.assertEqual([row["ref_id"] for row in claimed], ["SALE-1"])
+
+    def test_sale_without_vouchers_is_not_blocked(self):
+        self._issue_voucher("GV-OTHER")
+        self._sale("SALE-2", [])
+        claimed = ps._outbox_claim(self.conn, "sale", "t1", 10)
+        self.assertEqual([row["ref_id"] for row in claimed], ["SALE-2"])
+
+    def test_push_posts_voucher_before_sale(self):
+        self._issue_voucher("GV-NEW")
+        self._sale("SALE-3", [{"code": "GV-NEW", "amount": 10.0}])
+        first = ps.push_outbox(self.conn)
+        self.assertEqual(self.posted, [])
+        self.assertGreaterEqual(first["posted"], 1)
+        ps.push_outbox(self.conn)
+        self.assertEqual(self.posted, ["SALE-3"])
+        self.assertEqual(self.applied, [("GV-NEW", "INV-1")])
+
+    def test_retry_after_voucher_failure_does_not_repost_invoice(self):
+        self._issue_voucher("GV-A")
+        self._issue_voucher("GV-B")
+        self.conn.execute("DELETE FROM outbox WHERE kind='voucher'")
+        self._sale("SALE-4", [{"code": "GV-A", "amount": 5.0}, {"code": "GV-B", "amount": 5.0}])
+        self.apply_failures = 1
+        ps.push_outbox(self.conn)
+        row = self.conn.execute("SELECT progress_json FROM outbox WHERE kind='sale'").fetchone()
+        self.assertEqual(json.loads(row["progress_json"])["sale_docname"], "INV-1")
+        sale = self.conn.execute("SELECT queue_status, erp_docname FROM sales WHERE sale_id='SALE-4'").fetchone()
+        self.assertEqual((sale["queue_status"], sale["erp_docname"]), ("failed", "INV-1"))
+
+        self._make_due()
+        ps.push_outbox(self.conn)
+        self.assertEqual(self.posted, ["SALE-4"])
+        self.assertEqual(self.applied, [("GV-A", "INV-1"), ("GV-B", "INV-1")])
+        self.assertIsNone(self.conn.execute("SELECT 1 FROM outbox WHERE kind='sale'").fetchone())
+
+    def test_retry_skips_vouchers_already_applied(self):
+        self._issue_voucher("GV-A")
+        self._issue_voucher("GV-B")
+        self.conn.execute("DELETE FROM outbox WHERE kind='voucher'")
+        self._sale("SALE-5", [{"code": "GV-A", "amount": 5.0}, {"code": "GV-B", "amount": 5.0}])
+        original = self._fake_apply
+        failed = []
+
+        def fail_gv_b_once(vouchers, docname, sale_payload):
+            if vouchers[0]["code"] == "GV-B" and not failed:
+                failed.append(True)
+                raise ValueError("timeout")
+            original(vouchers, docname, sale_payload)
+
+        ps._apply_voucher_redemptions_to_erp = fail_gv_b_once
+        ps.push_outbox(self.conn)
+        self._make_due()
+        ps.push_outbox(self.conn)
+        self.assertEqual(self.posted, ["SALE-5"])
+        self.assertEqual([code for code, _ in self.applied], ["GV-A", "GV-B"])
+
+    def test_failed_write_back_keeps_progress_and_does_not_repost(self):
+        self._sale("SALE-6", [])
+        self._sale("SALE-7", [])
+        original = ps._outbox_apply_success
+        broken = []
+
+        def fail_first_write_back(conn, row, payload, result):
+            if row["ref_id"] == "SALE-6" and not broken:
+                broken.append(True)
+                raise sqlite3.OperationalError("database is locked")
+            original(conn, row, payload, result)
+
+        ps._outbox_apply_success = fail_first_write_back
+        try:
+            ps.push_outbox(self.conn)
+        finally:
+            ps._outbox_apply_success = original
+        # The other completion is still recorded
+        remaining = self.conn.execute("SELECT ref_id, progress_json, lease_owner FROM outbox WHERE kind='sale'").fetchall()
+        self.assertEqual([row["ref_id"] for row in remaining], ["SALE-6"])
+        self.assertIsNone(remaining[0]["lease_owner"])
+        self.assertTrue(json.loads(remaining[0]["progress_json"])["sale_posted"])
+
+        self._make_due()
+        ps.push_outbox(self.conn)
+        self.assertEqual(sorted(self.posted), ["SALE-6", "SALE-7"])
+        self.assertIsNone(self.conn.execute("SELECT 1 FROM outbox WHERE kind='sale'").fetchone())
+        sale = self.conn.execute("SELECT queue_status, erp_docname FROM sales WHERE sale_id='SALE-6'").fetchone()
+        self.assertEqual(sale["queue_status"], "posted")
+        self.assertIn(sale["erp_docname"], ("INV-1", "INV-2"))
+
+    def test_voucher_issue_is_not_reposted_after_failed_write_back(self):
+        issued = []
+        ps._post_voucher_issue_to_erp = lambda voucher: issued.append(voucher["code"]) or {"name": "GV-DOC"}
+        self._issue_voucher("GV-W")
+        original = ps._outbox_apply_success
+
+        def fail_write_back(conn, row, payload, result):
+            raise sqlite3.OperationalError("database is locked")
+
+        ps._outbox_apply_success = fail_write_back
+        try:
+            ps.push_outbox(self.conn)
+        finally:
+            ps._outbox_apply_success = original
+        self._make_due()
+        ps.push_outbox(self.conn)
+        self.assertEqual(issued, ["GV-W"])
+        self.assertIsNone(self.conn.execute("SELECT 1 FROM outbox WHERE kind='voucher'").fetchone())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import http.client
+import socket
+import struct
+import threading
+import unittest
+
+import pos_http
+
+
+class _DroppingServer:
+    """Keep-alive HTTP server that resets the connection after reading request number `drop_on`."""
+
+    def __init__(self, drop_on):
+        self.drop_on = drop_on
+        self.bodies = []
+        self._lock = threading.Lock()
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(5)
+        self.url = "http://127.0.0.1:%d" % self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client):
+        reader = client.makefile("rb")
+        try:
+            while True:
+                line = reader.readline()
+                if not line:
+                    return
+                length = 0
+                while True:
+                    header = reader.readline()
+                    if header in (b"\r\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                body = reader.read(length) if length else b""
+                with self._lock:
+                    self.bodies.append(body)
+                    count = len(self.bodies)
+                if count == self.drop_on:
+                    # Request fully received, then the connection is reset before any reply
+                    client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    return
+                client.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                               b"Content-Length: 11\r\n\r\n{\"ok\":true}")
+        finally:
+            reader.close()
+            client.close()
+
+
+class ConnectionPoolRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.server = _DroppingServer(drop_on=2)
+
+    def tearDown(self):
+        self.server.close()
+        pos_http.pool_for(self.server.url).close()
+
+    def test_post_is_not_resent_after_server_received_it(self):
+        first = pos_http.request("POST", self.server.url + "/sale", json_body={"sale": "S0"}, retries=1)
+        self.assertEqual(first.status, 200)
+        with self.assertRaises((OSError, http.client.HTTPException)):
+            pos_http.request("POST", self.server.url + "/sale", json_body={"sale": "S1"}, retries=1)
+        self.assertEqual(self.server.bodies.count(b'{"sale": "S1"}'), 1)
+
+    def test_get_is_retried_on_a_fresh_connection(self):
+        self.assertEqual(pos_http.request("GET", self.server.url + "/a", retries=1).status, 200)
+        resp = pos_http.request("GET", self.server.url + "/b", retries=1)
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(len(self.server.bodies), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
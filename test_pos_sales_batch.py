@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+try:
+    import pos_server
+except ImportError:  # Flask and the other web dependencies are not installed
+    pos_server = None
+
+
+def _receipt(name, total=10.0, items=None):
+    return {
+        "invoice_name": name,
+        "customer": "Walk-in Customer",
+        "total": total,
+        "items": items if items is not None else [{"item_code": "SKU-001", "qty": 1, "rate": total}],
+    }
+
+
+@unittest.skipIf(pos_server is None, "pos_server dependencies not installed")
+class PosSalesBatchIngestTest(unittest.TestCase):
+    _PATCHED = ("POS_QUEUE_DB_PATH", "POS_QUEUE_DIR", "_POS_QUEUE_DIR_STATES",
+                "_QUEUE_DB_INITIALIZED", "POS_RECEIPT_KEY", "_write_queue_file",
+                "_BACKGROUND_SERVICES_STARTED")
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="pos_sales_batch_")
+        self._saved = {name: getattr(pos_server, name) for name in self._PATCHED}
+        queue_dir = Path(self.tmpdir) / "queue"
+        pos_server.POS_QUEUE_DB_PATH = os.path.join(self.tmpdir, "queue.sqlite3")
+        pos_server.POS_QUEUE_DIR = queue_dir
+        pos_server._POS_QUEUE_DIR_STATES = {state: queue_dir / state
+                                            for state in ("pending", "ready", "failed", "confirmed")}
+        pos_server._QUEUE_DB_INITIALIZED = False
+        pos_server.POS_RECEIPT_KEY = "till-key"
+        # Keep the first request from starting the scheduler and currency threads
+        pos_server._BACKGROUND_SERVICES_STARTED = True
+        self.mirrored = []
+        pos_server._write_queue_file = lambda name, payload, status: self.mirrored.append((name, status))
+        self.client = pos_server.app.test_client()
+
+    def tearDown(self):
+        for name, value in self._saved.items():
+            setattr(pos_server, name, value)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _post(self, receipts):
+        resp = self.client.post("/api/pos/sales/batch", json={"receipts": receipts},
+                                headers={"X-POS-KEY": "till-key"})
+        return resp.status_code, resp.get_json()
+
+    def _queue_rows(self):
+        conn = pos_server._queue_db_connect()
+        try:
+            return {row["invoice_name"]: row for row in conn.execute(
+                "SELECT id, invoice_name, sale_id, status, payload_json FROM pos_sales_queue")}
+        finally:
+            conn.close()
+
+    def test_mixed_batch_reports_each_receipt(self):
+        status, first = self._post([_receipt("R-2")])
+        self.assertEqual((status, first["status"]), (200, "received"))
+        r2_id = first["results"][0]["queue_id"]
+        self.mirrored.clear()
+
+        status, body = self._post([
+            _receipt("R-1", 10.0),
+            _receipt("R-2"),                  # resent by the till, unchanged
+            _receipt("R-1", 12.5),            # same receipt again in this batch, edited
+            _receipt("R-BAD", items=[]),
+            _receipt("R-3"),
+        ])
+        self.assertEqual(status, 200)
+        self.assertEqual((body["status"], body["received"]), ("partial", 4))
+        results = body["results"]
+        self.assertEqual([r["status"] for r in results],
+                         ["received", "received", "received", "error", "received"])
+        self.assertEqual([r.get("invoice_name") for r in results], ["R-1", "R-2", "R-1", None, "R-3"])
+        self.assertEqual(results[3]["message"], "Items array is required")
+        self.assertEqual(results[0]["queue_id"], results[2]["queue_id"])
+        self.assertEqual(results[1]["queue_id"], r2_id)
+
+        rows = self._queue_rows()
+        self.assertEqual(sorted(rows), ["R-1", "R-2", "R-3"])
+        self.assertEqual({name: row["status"] for name, row in rows.items()},
+                         {"R-1": "received", "R-2": "received", "R-3": "received"})
+        self.assertEqual(rows["R-1"]["id"], results[0]["queue_id"])
+        self.assertEqual(rows["R-3"]["id"], results[4]["queue_id"])
+        payload = json.loads(rows["R-1"]["payload_json"])
+        self.assertEqual((payload["total"], payload["sale_id"]), (12.5, "R-1"))
+        # The unchanged resend keeps its mirror file; the bad row never reaches the queue
+        self.assertEqual(sorted(self.mirrored), [("R-1", "received"), ("R-3", "received")])
+
+    def test_batch_with_wrong_key_writes_nothing(self):
+        resp = self.client.post("/api/pos/sales/batch", json={"receipts": [_receipt("R-1")]},
+                                headers={"X-POS-KEY": "wrong"})
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(self._queue_rows(), {})
+        self.assertEqual(self.mirrored, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
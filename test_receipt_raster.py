@@ -0,0 +1,70 @@
+import unittest
+
+try:
+    import receipt_agent
+except ImportError:  # Flask is not installed
+    receipt_agent = None
+
+
+@unittest.skipUnless(receipt_agent is not None and receipt_agent._PIL_AVAILABLE,
+                     "receipt_agent dependencies (Flask, Pillow) not installed")
+class RasterBandTest(unittest.TestCase):
+    def _image(self):
+        # 10 x 3, white background: row 0 has only x=0 black, row 1 is all black,
+        # row 2 has only x=9 black (the second byte, past the 8-dot boundary)
+        img = receipt_agent._PILImage.new("1", (10, 3), 1)
+        img.putpixel((0, 0), 0)
+        for x in range(10):
+            img.putpixel((x, 1), 0)
+        img.putpixel((9, 2), 0)
+        return img
+
+    def test_bands_pack_black_dots_and_pad_rows_with_white(self):
+        bands = receipt_agent._escpos_raster_bands(self._image(), band_rows=2)
+        self.assertEqual(bands, (
+            # GS v 0, m=0, 2 bytes wide, 2 rows
+            bytes([0x1D, 0x76, 0x30, 0x00, 0x02, 0x00, 0x02, 0x00, 0x80, 0x00, 0xFF, 0xC0]),
+            # the last band carries the single remaining row
+            bytes([0x1D, 0x76, 0x30, 0x00, 0x02, 0x00, 0x01, 0x00, 0x00, 0x40]),
+        ))
+
+    def test_one_band_when_image_fits(self):
+        bands = receipt_agent._escpos_raster_bands(self._image(), band_rows=128)
+        self.assertEqual(len(bands), 1)
+        self.assertEqual(bands[0][:8], bytes([0x1D, 0x76, 0x30, 0x00, 0x02, 0x00, 0x03, 0x00]))
+        self.assertEqual(bands[0][8:], bytes([0x80, 0x00, 0xFF, 0xC0, 0x00, 0x40]))
+
+
+class _FakeSerial:
+    def __init__(self, *args, **kwargs):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@unittest.skipIf(receipt_agent is None, "receipt_agent dependencies (Flask) not installed")
+class PrinterPortChunkTest(unittest.TestCase):
+    def setUp(self):
+        self._saved = (receipt_agent.Serial, receipt_agent.PRINTER_NAME, receipt_agent.WRITE_CHUNK)
+        receipt_agent.Serial = _FakeSerial
+        receipt_agent.PRINTER_NAME = ""
+        receipt_agent.WRITE_CHUNK = 4
+
+    def tearDown(self):
+        receipt_agent.Serial, receipt_agent.PRINTER_NAME, receipt_agent.WRITE_CHUNK = self._saved
+
+    def test_serial_job_is_written_in_slices(self):
+        port = receipt_agent._PrinterPort()
+        port.send(b"0123456789")
+        self.assertEqual(port._serial.writes, [b"0123", b"4567", b"89"])
+
+
+if __name__ == "__main__":
+    unittest.main()
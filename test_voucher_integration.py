@@ -116,6 +116,43 @@ class VoucherIntegrationTest(unittest.TestCase):
             [{"code": "GV-Z99", "amount": 15.0}],
         )
 
+    def test_issue_redeem_refund_keep_balance_in_step_with_ledger(self):
+        ps.queue_voucher_issue(self.conn, {"voucher_code": "GV-LIFE", "amount": 50.0})
+        self.assertEqual(ps.voucher_balance(self.conn, "GV-LIFE"), 50.0)
+        ps.record_sale(
+            self.conn,
+            self._basic_sale(
+                {
+                    "sale_id": "SALE-V3",
+                    "payments": [{"method": "Card", "amount": 20.0}],
+                    "voucher_redeem": [{"code": "GV-LIFE", "amount": 20.0}],
+                }
+            ),
+        )
+        self.assertEqual(ps.voucher_balance(self.conn, "GV-LIFE"), 30.0)
+        ps.voucher_ledger_add(self.conn, "GV-LIFE", 5.0, "refund", sale_id="SALE-V3", note="return")
+        self.assertEqual(ps.voucher_balance(self.conn, "GV-LIFE"), 35.0)
+        report = ps.verify_voucher_balances(self.conn)
+        self.assertEqual((report["checked"], report["drift"], report["repaired"]), (1, [], 0))
+
+    def test_verify_reports_drift_and_repairs_only_on_request(self):
+        self._seed_voucher("GV-DRIFT", 40.0)
+        ps.voucher_ledger_add(self.conn, "GV-DRIFT", -15.0, "redeem", sale_id="SALE-X")
+        # A balance written outside the ledger, e.g. by a hand edit or an old import
+        self.conn.execute("UPDATE vouchers SET balance=99 WHERE voucher_code='GV-DRIFT'")
+        report = ps.verify_voucher_balances(self.conn)
+        self.assertEqual(
+            report["drift"],
+            [{"voucher_code": "GV-DRIFT", "stored": 99.0, "ledger": 25.0}],
+        )
+        self.assertEqual(report["repaired"], 0)
+        self.assertEqual(ps.voucher_balance(self.conn, "GV-DRIFT"), 99.0)
+
+        report = ps.verify_voucher_balances(self.conn, repair=True)
+        self.assertEqual(report["repaired"], 1)
+        self.assertEqual(ps.voucher_balance(self.conn, "GV-DRIFT"), 25.0)
+        self.assertEqual(ps.verify_voucher_balances(self.conn)["drift"], [])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -2,30 +2,60 @@
 """
 Till posting agent: pushes invoice JSON files to the central POS queue.
 
+New files are picked up from filesystem notifications (watchdog: inotify on Linux,
+ReadDirectoryChangesW on Windows) and sent in batches over one keep-alive session;
+without watchdog the folder is polled every TILL_AGENT_INTERVAL seconds. A file that
+fails is retried with per-file exponential backoff, so a down server is not hammered.
+
 Environment:
   INVOICES_DIR          Base folder containing *.json sale files (default: invoices)
   TILL_POST_URL         Endpoint to receive receipts (default: http://frontend:5000/api/pos/sales)
+  TILL_BATCH_URL        Batch endpoint (default: TILL_POST_URL + /batch; falls back to
+                        single posts if the server does not have it)
   POS_RECEIPT_KEY       Shared secret for X-POS-KEY header (default: SUPERSECRET123)
-  TILL_AGENT_INTERVAL   Seconds to sleep between scans (default: 5)
+  TILL_AGENT_INTERVAL   Seconds between scans when polling (default: 5)
+  TILL_AGENT_RESCAN     Seconds between safety rescans when watching (default: 60)
+  TILL_AGENT_BATCH      Max receipts per batch request (default: 100)
+  TILL_AGENT_BACKOFF_MAX  Longest retry delay for a failing file in seconds (default: 300)
 """
 import json
 import logging
 import os
+import threading
 import time
 from pathlib import Path
-from typing import Iterable, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import requests
 
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    _WATCHDOG_AVAILABLE = True
+except ImportError:
+    FileSystemEventHandler = object
+    _WATCHDOG_AVAILABLE = False
+
 logging.basicConfig(level=logging.INFO, format='[till-agent] %(asctime)s %(levelname)s %(message)s')
 
 INVOICES_DIR = Path(os.environ.get('INVOICES_DIR', 'invoices'))
 FAILED_DIR = INVOICES_DIR / 'post_failed'
 SENT_DIR = INVOICES_DIR / 'posted_remote'
 POST_URL = os.environ.get('TILL_POST_URL', 'http://frontend:5000/api/pos/sales')
+BATCH_URL = os.environ.get('TILL_BATCH_URL') or POST_URL.rstrip('/') + '/batch'
 POS_KEY = os.environ.get('POS_RECEIPT_KEY', 'SUPERSECRET123')
 TRY_INTERVAL = float(os.environ.get('TILL_AGENT_INTERVAL', '5'))
+RESCAN_INTERVAL = float(os.environ.get('TILL_AGENT_RESCAN', '60'))
 REQUEST_TIMEOUT = float(os.environ.get('TILL_AGENT_TIMEOUT', '15'))
+BATCH_SIZE = max(1, int(os.environ.get('TILL_AGENT_BATCH', '100')))
+BACKOFF_MAX = max(TRY_INTERVAL, float(os.environ.get('TILL_AGENT_BACKOFF_MAX', '300')))
+# A file this fresh that does not parse is probably still being written
+SETTLE_SECONDS = 2.0
+
+_session = requests.Session()
+# file name -> (consecutive failures, monotonic time of next attempt)
+_backoff: Dict[str, Tuple[int, float]] = {}
+_batch_supported = True
 
 
 def ensure_dirs() -> None:
@@ -66,18 +96,36 @@ def move_file(path: Path, target_dir: Path) -> None:
         logging.warning("Failed to move %s to %s: %s", path, target_dir, exc)
 
 
-def post_invoice(path: Path) -> bool:
-    try:
-        raw = path.read_text(encoding='utf-8')
-    except Exception as exc:
-        logging.error("Failed to read %s: %s", path, exc)
-        return False
-    headers = {
+def _headers() -> Dict[str, str]:
+    return {
         'Content-Type': 'application/json',
         'X-POS-KEY': POS_KEY or '',
     }
+
+
+def _mark_sent(path: Path) -> None:
+    _backoff.pop(path.name, None)
+    move_file(path, SENT_DIR)
+
+
+def _mark_failed(path: Path) -> None:
+    failures = _backoff.get(path.name, (0, 0.0))[0] + 1
+    delay = min(BACKOFF_MAX, TRY_INTERVAL * (2 ** (failures - 1)))
+    _backoff[path.name] = (failures, time.monotonic() + delay)
+    move_file(path, FAILED_DIR)
+    if failures > 1:
+        logging.info("%s failed %d times; next attempt in %.0fs", path.name, failures, delay)
+
+
+def post_invoice(path: Path, raw: Optional[str] = None) -> bool:
+    if raw is None:
+        try:
+            raw = path.read_text(encoding='utf-8')
+        except Exception as exc:
+            logging.error("Failed to read %s: %s", path, exc)
+            return False
     try:
-        resp = requests.post(POST_URL, data=raw.encode('utf-8'), headers=headers, timeout=REQUEST_TIMEOUT)
+        resp = _session.post(POST_URL, data=raw.encode('utf-8'), headers=_headers(), timeout=REQUEST_TIMEOUT)
     except requests.RequestException as exc:
         logging.warning("HTTP error posting %s: %s", path.name, exc)
         return False
@@ -96,22 +144,148 @@ def post_invoice(path: Path) -> bool:
     return True
 
 
+def post_batch(batch: List[Tuple[Path, dict]]) -> Optional[List[bool]]:
+    """POST receipts to the batch endpoint; returns per-file success, or None if unsupported."""
+    global _batch_supported
+    body = json.dumps({'receipts': [payload for _, payload in batch]}, ensure_ascii=False).encode('utf-8')
+    try:
+        resp = _session.post(BATCH_URL, data=body, headers=_headers(), timeout=REQUEST_TIMEOUT * 4)
+    except requests.RequestException as exc:
+        logging.warning("HTTP error posting batch of %d: %s", len(batch), exc)
+        return [False] * len(batch)
+    if resp.status_code in (404, 405):
+        logging.info("Batch endpoint %s not available; posting receipts one by one", BATCH_URL)
+        _batch_supported = False
+        return None
+    try:
+        results = resp.json().get('results')
+    except (ValueError, AttributeError):
+        results = None
+    if not isinstance(results, list) or len(results) != len(batch):
+        logging.warning("Server rejected batch: status=%s body=%s", resp.status_code, resp.text[:200])
+        return [False] * len(batch)
+    outcome = []
+    for (path, _), result in zip(batch, results):
+        ok = isinstance(result, dict) and result.get('status') == 'received'
+        if not ok:
+            logging.warning("Server rejected %s: %s", path.name, result)
+        outcome.append(ok)
+    logging.info("Posted batch: %d/%d received", sum(outcome), len(batch))
+    return outcome
+
+
+def _due_files() -> Tuple[List[Path], Optional[float]]:
+    """Files ready to send now, and seconds until the next backed-off file is due."""
+    now = time.monotonic()
+    due: List[Path] = []
+    next_due: Optional[float] = None
+    for path, _label in iter_invoice_files():
+        state = _backoff.get(path.name)
+        if state and state[1] > now:
+            wait = state[1] - now
+            next_due = wait if next_due is None else min(next_due, wait)
+            continue
+        due.append(path)
+    return due, next_due
+
+
+def drain_once() -> Optional[float]:
+    """Send every due file; returns seconds until the next backed-off file is due."""
+    due, next_due = _due_files()
+    for start in range(0, len(due), BATCH_SIZE):
+        batch: List[Tuple[Path, dict]] = []
+        for path in due[start:start + BATCH_SIZE]:
+            try:
+                payload = json.loads(path.read_text(encoding='utf-8'))
+            except FileNotFoundError:
+                continue
+            except Exception as exc:
+                try:
+                    fresh = time.time() - path.stat().st_mtime < SETTLE_SECONDS
+                except OSError:
+                    fresh = False
+                if fresh:
+                    next_due = SETTLE_SECONDS if next_due is None else min(next_due, SETTLE_SECONDS)
+                    continue
+                logging.error("Failed to read %s: %s", path, exc)
+                _mark_failed(path)
+                continue
+            batch.append((path, payload))
+        if not batch:
+            continue
+        outcome = post_batch(batch) if _batch_supported else None
+        if outcome is None:
+            outcome = [post_invoice(path, json.dumps(payload, ensure_ascii=False)) for path, payload in batch]
+        for (path, _), ok in zip(batch, outcome):
+            if ok:
+                _mark_sent(path)
+            else:
+                _mark_failed(path)
+        if not any(outcome):
+            # Server down or rejecting everything: leave the rest for their next attempt
+            break
+    if _backoff:
+        now = time.monotonic()
+        waits = [at - now for _, at in _backoff.values() if at > now]
+        if waits:
+            next_due = min(waits) if next_due is None else min(next_due, min(waits))
+    return next_due
+
+
+class _InvoiceEventHandler(FileSystemEventHandler):
+    """Wakes the main loop when a *.json file appears in INVOICES_DIR."""
+
+    def __init__(self, wake: threading.Event, root: Path):
+        super().__init__()
+        self._wake = wake
+        self._root = root
+
+    def _maybe_wake(self, path: str) -> None:
+        if path.endswith('.json') and Path(path).parent == self._root:
+            self._wake.set()
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._maybe_wake(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._maybe_wake(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._maybe_wake(event.dest_path)
+
+
+def _start_watcher(wake: threading.Event):
+    if not _WATCHDOG_AVAILABLE:
+        logging.info("watchdog not installed; polling every %.0fs", TRY_INTERVAL)
+        return None
+    try:
+        root = INVOICES_DIR.resolve()
+        observer = Observer()
+        observer.schedule(_InvoiceEventHandler(wake, root), str(root), recursive=False)
+        observer.daemon = True
+        observer.start()
+    except Exception as exc:
+        logging.warning("File watcher unavailable (%s); polling every %.0fs", exc, TRY_INTERVAL)
+        return None
+    return observer
+
+
 def main() -> None:
     ensure_dirs()
     logging.info("Posting agent watching %s -> %s", INVOICES_DIR, POST_URL)
     if not POS_KEY:
         logging.warning("POS_RECEIPT_KEY is empty; server will reject requests.")
+    wake = threading.Event()
+    observer = _start_watcher(wake)
+    idle_wait = RESCAN_INTERVAL if observer is not None else TRY_INTERVAL
     while True:
-        processed_any = False
-        for path, label in iter_invoice_files():
-            processed_any = True
-            success = post_invoice(path)
-            if success:
-                move_file(path, SENT_DIR)
-            else:
-                move_file(path, FAILED_DIR)
-        if not processed_any:
-            time.sleep(TRY_INTERVAL)
+        wake.clear()
+        next_due = drain_once()
+        timeout = idle_wait if next_due is None else max(0.1, min(idle_wait, next_due))
+        wake.wait(timeout)
 
 
 if __name__ == '__main__':